@@ -1,109 +1,122 @@
-import serial
-import serial.tools.list_ports
-import win32print
-import win32api
+import threading
+import re
 import time
 import logging
-from typing import Optional, List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Union
+
+import backends
+from connections import (STATUS_REQUEST, STATUS_TERMINATOR, ConnectionPool,
+                         SocketConnection, SpoolerConnection, read_serial_response)
+from discovery import PrinterDiscovery, list_serial_ports, probe_serial_port
+from graphics import CodeRasterizer, epl_graphic
+from metrics import Counter, Histogram
+from printer_status import (JOB_STATUS_BLOCKED_DEVQ, JOB_STATUS_ERROR, JOB_STATUS_OFFLINE,
+                            JOB_STATUS_PAPEROUT, JOB_STATUS_USER_INTERVENTION, PrinterStatus,
+                            decode_godex_status, decode_job_status, decode_spooler_status)
+from stored_forms import FormRegistry, StoredForm
+from template_registry import LabelTemplate, TemplateRegistry
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SEND_SECONDS = Histogram("godex_send_seconds", "Tiempo de envío de un comando EPL", ["printer"])
+SEND_BYTES = Counter("godex_bytes_total", "Bytes EPL enviados", ["printer"])
+SEND_ERRORS = Counter("godex_send_errors_total", "Envíos EPL fallidos", ["printer"])
+
+# Banderas de un trabajo del spooler que indican un problema
+JOB_ERROR_FLAGS = (JOB_STATUS_ERROR | JOB_STATUS_PAPEROUT | JOB_STATUS_OFFLINE
+                   | JOB_STATUS_BLOCKED_DEVQ | JOB_STATUS_USER_INTERVENTION)
+
+# Los layouts EPL de 57x70mm (456 x 560 dots a 203 DPI, gap de 24 dots) son
+# las plantillas templates/57x70_<estilo>.epl, con su formulario almacenado
+LAYOUT_57X70_PREFIX = "57x70_"
+
+
+# B<x>,<y>,<rotación>,1 (Code 128),<barra estrecha>,<ancha>,<alto>,<B|N>,"<datos>"
+_CODE128_LINE = re.compile(r'^B(\d+),(\d+),0,1,(\d+),\d+,(\d+),([BN]),"(.*)"\r?$', re.MULTILINE)
+# Comando de impresión de una copia en su propia línea (el de los layouts 57x70)
+_PRINT_ONE = re.compile(r'^P1,1(?=\r?$)', re.MULTILINE)
+_PRINT_ONE_BYTES = re.compile(_PRINT_ONE.pattern.encode('ascii'), re.MULTILINE)
+
+
+def _57x70_values(product_data: Dict) -> Dict[str, str]:
+    return {
+        "name": product_data.get('name', 'PRODUCTO')[:18],
+        "price": product_data.get('price', '0.00'),
+        "barcode": product_data.get('barcode', '000000000000'),
+        "sku": product_data.get('sku', 'N/A'),
+        "date": product_data.get('date', time.strftime('%d/%m/%Y')),
+    }
+
+
+
 class GodexPrinterManager:
-    def __init__(self):
+    def __init__(self, verify_status: bool = True, async_verify: bool = True,
+                 status_timeout: float = 2.0, discovery: Optional[PrinterDiscovery] = None,
+                 stored_forms: bool = False, raster_codes: bool = False,
+                 templates: Optional[TemplateRegistry] = None):
+        """
+        Args:
+            verify_status: consultar el estado de la impresora tras cada trabajo
+            async_verify: hacer esa consulta en segundo plano sin bloquear el siguiente trabajo
+            status_timeout: tiempo máximo de espera de una respuesta de status
+            discovery: registro de impresoras compartido; si no se da, se crea uno propio
+            stored_forms: descargar cada layout una vez a la impresora y enviar solo los valores
+            raster_codes: enviar los códigos de barras como gráfico GW generado aquí
+            templates: plantillas de los layouts; si no se da, se cargan de templates/
+        """
+        # win32print (solo Windows) y pyserial se importan al usarse (ver backends.py)
+        self.discovery = discovery or PrinterDiscovery(lambda: backends.load("spooler"))
+        self.verify_status = verify_status
+        self.async_verify = async_verify
+        self.status_timeout = status_timeout
+        # Serializa las escrituras al puerto serial (trabajos y STX) y, por
+        # separado, las lecturas de status, para que un trabajo nuevo no espere
+        # a que llegue la respuesta del anterior
+        self._serial_lock = threading.Lock()
+        self._status_lock = threading.Lock()
+        self._verifier: Optional[ThreadPoolExecutor] = None
+        self._verify_pending = False
         self.serial_connection = None
         self.printer_port = None
         self.printer_name = None
-
-    def find_godex_printers(self) -> Dict:
-        """Busca impresoras Godex disponibles por puerto serial y drivers de Windows"""
-        found_printers = {
-            'serial_ports': [],
-            'windows_printers': [],
-            'usb_printers': []
-        }
-
-        # Buscar por puertos seriales
-        logger.info("Buscando impresoras por puertos seriales...")
-        ports = serial.tools.list_ports.comports()
-
-        for port in ports:
-            logger.info(f"Puerto encontrado: {port.device} - {port.description}")
-            # Godex suele aparecer con estas descripciones
-            if any(keyword in port.description.lower() for keyword in 
-                   ['godex', 'usb serial', 'usb-serial', 'prolific', 'ftdi']):
-                found_printers['serial_ports'].append({
-                    'port': port.device,
-                    'description': port.description,
-                    'hwid': port.hwid
-                })
-
-        # Buscar por drivers de Windows
-        logger.info("Buscando impresoras por drivers de Windows...")
-        try:
-            printers = win32print.EnumPrinters(
-                win32print.PRINTER_ENUM_LOCAL | win32print.PRINTER_ENUM_CONNECTIONS
-            )
-            for printer in printers:
-                printer_name = printer[2]
-                logger.info(f"Impresora Windows encontrada: {printer_name}")
-
-                # Buscar impresoras Godex, BP500, o con puerto USB
-                if any(keyword in printer_name.lower() for keyword in 
-                       ['godex', 'bp500', 'bp-500']):
-                    try:
-                        hprinter = win32print.OpenPrinter(printer_name)
-                        printer_info = win32print.GetPrinter(hprinter, 2)
-                        win32print.ClosePrinter(hprinter)
-                        port_name = printer_info.get('pPortName', 'Unknown')
-
-                        found_printers['windows_printers'].append({
-                            'name': printer_name,
-                            'port': port_name,
-                            'status': printer[0],
-                            'driver': printer_info.get('pDriverName', 'Unknown')
-                        })
-
-                        # Si es puerto USB, agregarlo también a la lista USB
-                        if 'usb' in port_name.lower():
-                            found_printers['usb_printers'].append({
-                                'name': printer_name,
-                                'port': port_name,
-                                'driver': printer_info.get('pDriverName', 'Unknown')
-                            })
-                    except Exception as e:
-                        logger.warning(f"Error obteniendo info de {printer_name}: {e}")
-                        found_printers['windows_printers'].append({
-                            'name': printer_name,
-                            'port': 'Unknown',
-                            'status': printer[0],
-                            'driver': 'Unknown'
-                        })
-        except Exception as e:
-            logger.warning(f"Error buscando impresoras Windows: {e}")
-
-        return found_printers
+        self.network_address = None
+        # ID que el spooler dio al último trabajo enviado
+        self.last_job_id: Optional[int] = None
+        # Handles del spooler abiertos y reutilizados entre trabajos
+        self.connections = ConnectionPool(
+            lambda name: SpoolerConnection(name, backends.load("spooler"),
+                                           doc_name="Etiqueta EPL")
+        )
+        self.network_connections = ConnectionPool(self._open_network)
+        self.stored_forms = stored_forms
+        self.forms = FormRegistry(enabled=stored_forms)
+        if templates is None:
+            templates = TemplateRegistry()
+            templates.reload()
+        self.templates = templates
+        self._forms_lock = threading.Lock()
+        self.raster_codes = raster_codes
+        self.rasterizer = CodeRasterizer()
+
+    @staticmethod
+    def _open_network(address: str) -> SocketConnection:
+        host, _, port = address.rpartition(":")
+        return SocketConnection(host, int(port))
+
+    def find_godex_printers(self, refresh: bool = False) -> Dict:
+        """Busca impresoras Godex disponibles por puerto serial y drivers de Windows.
+
+        Usa el registro de descubrimiento, que escanea una vez y cachea;
+        `refresh=True` fuerza un escaneo completo.
+        """
+        return self.discovery.printers(refresh=refresh)
 
     def test_serial_connection(self, port: str, baudrate: int = 9600) -> bool:
         """Prueba la conexión serial con la impresora"""
         try:
-            test_connection = serial.Serial(
-                port=port,
-                baudrate=baudrate,
-                timeout=2,
-                bytesize=serial.EIGHTBITS,
-                parity=serial.PARITY_NONE,
-                stopbits=serial.STOPBITS_ONE
-            )
-
-            # Enviar comando de status EPL
-            test_connection.write(b'\x02')  # STX - comando de status
-            time.sleep(0.5)
-
-            # Leer respuesta
-            response = test_connection.read(100)
-            test_connection.close()
+            # Enviar comando de status EPL y leer la respuesta en cuanto llegue
+            response = probe_serial_port(port, baudrate, timeout=2)
 
             if response:
                 logger.info(f"Respuesta de {port}: {response.hex()}")
@@ -114,28 +127,31 @@ class GodexPrinterManager:
             logger.error(f"Error probando puerto {port}: {e}")
             return False
 
-    def connect_serial(self, port: str = None, baudrate: int = 9600) -> bool:
-        """Conecta por puerto serial"""
+    def connect_serial(self, port: str = None, baudrate: int = 9600,
+                       flow_control: str = "none") -> bool:
+        """Conecta por puerto serial; flow_control puede ser none, rtscts o xonxoff"""
         if port is None:
-            # Auto-detectar puerto
-            printers = self.find_godex_printers()
-            for printer_info in printers['serial_ports']:
-                if self.test_serial_connection(printer_info['port'], baudrate):
-                    port = printer_info['port']
-                    break
+            # Auto-detectar puerto: los candidatos ya se sondearon en paralelo
+            responding = self.discovery.responding_serial_ports()
+            if responding:
+                port = responding[0]
 
             if port is None:
                 logger.error("No se pudo detectar automáticamente la impresora por serial")
                 return False
 
         try:
+            serial = backends.require("serial")
             self.serial_connection = serial.Serial(
                 port=port,
                 baudrate=baudrate,
                 timeout=5,
                 bytesize=serial.EIGHTBITS,
                 parity=serial.PARITY_NONE,
-                stopbits=serial.STOPBITS_ONE
+                stopbits=serial.STOPBITS_ONE,
+                # La escritura espera mientras la impresora tiene el búfer lleno
+                rtscts=flow_control == "rtscts",
+                xonxoff=flow_control == "xonxoff"
             )
             self.printer_port = port
             logger.info(f"Conectado exitosamente al puerto serial {port}")
@@ -145,6 +161,20 @@ class GodexPrinterManager:
             logger.error(f"Error conectando al puerto {port}: {e}")
             return False
 
+    def connect_network(self, host: str, port: int = 9100) -> bool:
+        """Conecta a una impresora de red por el puerto RAW (JetDirect 9100)"""
+        address = f"{host}:{port}"
+        try:
+            with self.network_connections.connection(address):
+                pass
+            self.network_address = address
+            logger.info(f"Conectado exitosamente a la impresora de red {address}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Error conectando a impresora de red {address}: {e}")
+            return False
+
     def connect_windows_printer(self, printer_name: str = None) -> bool:
         """Conecta usando el driver de Windows (para puertos USB)"""
         if printer_name is None:
@@ -159,8 +189,9 @@ class GodexPrinterManager:
                 return False
 
         try:
-            # Verificar que la impresora existe
-            win32print.OpenPrinter(printer_name)
+            # Verificar que la impresora existe; el handle queda en el pool
+            with self.connections.connection(printer_name):
+                pass
             self.printer_name = printer_name
             logger.info(f"Conectado exitosamente a la impresora Windows: {printer_name}")
             return True
@@ -172,107 +203,177 @@ class GodexPrinterManager:
     def get_windows_printer_status(self) -> str:
         """Obtiene el estado de la impresora Windows conectada"""
         try:
-            hprinter = win32print.OpenPrinter(self.printer_name)
-            printer_info = win32print.GetPrinter(hprinter, 2)
-            win32print.ClosePrinter(hprinter)
-
-            status_flags = printer_info['Status']
-            if status_flags == 0:
+            status = self.get_windows_status()
+            if status.ready:
                 return "✅ Impresora lista"
             else:
-                status_messages = []
-                if status_flags & win32print.PRINTER_STATUS_PAUSED:
-                    status_messages.append("Pausada")
-                if status_flags & win32print.PRINTER_STATUS_ERROR:
-                    status_messages.append("Error genérico")
-                if status_flags & win32print.PRINTER_STATUS_PENDING_DELETION:
-                    status_messages.append("Eliminando")
-                if status_flags & win32print.PRINTER_STATUS_PAPER_JAM:
-                    status_messages.append("Atasco papel")
-                if status_flags & win32print.PRINTER_STATUS_PAPER_OUT:
-                    status_messages.append("Sin papel")
-                if status_flags & win32print.PRINTER_STATUS_OFFLINE:
-                    status_messages.append("Offline")
-                return f"⚠️ Estado actual: {', '.join(status_messages)}"
+                return f"⚠️ Estado actual: {status.message}"
         except Exception as e:
             return f"❌ Error obteniendo estado: {e}"
 
-    def check_last_job(self) -> None:
-        """Revisa el estado del último trabajo en cola para la impresora Windows"""
-        try:
-            hprinter = win32print.OpenPrinter(self.printer_name)
-            # Enumera hasta 10 trabajos (nivel 1: JOB_INFO_1)
-            jobs = win32print.EnumJobs(hprinter, 0, 10, 1)
-            win32print.ClosePrinter(hprinter)
-
-            if not jobs:
-                logger.info("No hay trabajos en la cola.")
-                return
+    def get_windows_status(self) -> PrinterStatus:
+        """Estado estructurado de la impresora Windows conectada"""
+        win32print = backends.require("spooler")
+        with self.connections.connection(self.printer_name) as conn:
+            printer_info = win32print.GetPrinter(conn.handle, 2)
+        return decode_spooler_status(self.printer_name, printer_info['Status'],
+                                     printer_info.get('cJobs'))
 
-            ultimo = jobs[-1]
-            estado = ultimo['Status']
-            nombre = ultimo['pDocument']
+    def check_last_job(self, job_id: Optional[int] = None) -> None:
+        """Revisa en el spooler un trabajo de la impresora Windows (por defecto el último).
 
-            if estado == 0:
-                logger.info(f"El trabajo '{nombre}' se imprimió sin errores.")
+        Se consulta ese trabajo por su ID (GetJob): con la cola ocupada, el
+        último de una enumeración puede ser cualquier otro trabajo.
+        """
+        job_id = job_id if job_id is not None else self.last_job_id
+        if job_id is None:
+            logger.info("No se ha enviado ningún trabajo.")
+            return
+        try:
+            win32print = backends.require("spooler")
+            with self.connections.connection(self.printer_name) as conn:
+                try:
+                    info = win32print.GetJob(conn.handle, job_id, 1)
+                except Exception:
+                    info = None  # Ya no está en la cola
+
+            if info is None:
+                logger.info(f"El trabajo {job_id} salió de la cola (impreso).")
+                return
+            estado = info['Status']
+            nombre = info['pDocument']
+            if estado & JOB_ERROR_FLAGS:
+                logger.warning(f"Trabajo {job_id} '{nombre}' con estado: "
+                               f"{decode_job_status(estado)}")
             else:
-                detalles = []
-                if estado & win32print.JOB_STATUS_BLOCKED:
-                    detalles.append("Bloqueado")
-                if estado & win32print.JOB_STATUS_ERROR:
-                    detalles.append("Error en trabajo")
-                if estado & win32print.JOB_STATUS_PAPEROUT:
-                    detalles.append("Sin papel")
-                if estado & win32print.JOB_STATUS_OFFLINE:
-                    detalles.append("Impresora offline")
-                logger.warning(f"Trabajo '{nombre}' terminó con estado: {', '.join(detalles)}")
+                logger.info(f"Trabajo {job_id} '{nombre}' sigue en cola "
+                            f"(posición {info.get('Position')}): {decode_job_status(estado)}")
         except Exception as e:
             logger.error(f"❌ Error consultando trabajos: {e}")
 
-    def send_epl_to_windows_printer(self, epl_command: str) -> bool:
+    def send_epl_to_windows_printer(self, epl_command: Union[str, bytes]) -> bool:
         """Envía comando EPL usando el driver de Windows y luego verifica estado"""
         if not self.printer_name:
             logger.error("No hay impresora Windows conectada")
             return False
 
         try:
-            hprinter = win32print.OpenPrinter(self.printer_name)
-            try:
-                # Crear trabajo de impresión
-                job_info = ("Etiqueta EPL", None, "RAW")
-                job_id = win32print.StartDocPrinter(hprinter, 1, job_info)
-                win32print.StartPagePrinter(hprinter)
+            # Enviar datos EPL en formato RAW por el handle del pool
+            epl_bytes = _epl_bytes(epl_command)
+            with self.connections.connection(self.printer_name) as conn:
+                conn.write(epl_bytes)
+                job_id = conn.last_job_id
+            self.last_job_id = job_id
 
-                # Enviar datos EPL en formato RAW
-                epl_bytes = epl_command.encode('ascii')
-                win32print.WritePrinter(hprinter, epl_bytes)
+            logger.info(f"Comando EPL enviado exitosamente (Job ID: {job_id})")
 
-                win32print.EndPagePrinter(hprinter)
-                win32print.EndDocPrinter(hprinter)
+            if self.verify_status:
+                self._run_verification(self._verify_windows_job, job_id)
 
-                logger.info(f"Comando EPL enviado exitosamente (Job ID: {job_id})")
+            return True
 
-                # Esperar un momento para que el trabajo llegue a la impresora física
-                time.sleep(0.5)
+        except Exception as e:
+            logger.error(f"Error enviando EPL a impresora Windows: {e}")
+            return False
 
-                # Obtener estado desde el driver Windows
-                status_windows = self.get_windows_printer_status()
-                logger.info(f"Estado tras impresión (Windows): {status_windows}")
+    def _run_verification(self, check, *args) -> None:
+        """Ejecuta la verificación posterior al trabajo, en segundo plano si se pidió.
 
-                # Revisar el último trabajo en cola
-                self.check_last_job()
+        En segundo plano, si ya hay una verificación esperando turno no se
+        encola otra: basta con que la pendiente vea el estado más reciente.
+        """
+        if not self.async_verify:
+            check(*args)
+            return
+        if self._verify_pending:
+            return
+        if self._verifier is None:
+            self._verifier = ThreadPoolExecutor(max_workers=1, thread_name_prefix="godex-verify")
+        self._verify_pending = True
+
+        def run():
+            self._verify_pending = False
+            check(*args)
+
+        self._verifier.submit(run)
+
+    def _wait_for_windows_job(self, job_id: Optional[int]) -> None:
+        """Sondea el trabajo con intervalos crecientes hasta que sale de la cola"""
+        if job_id is None:
+            return
+        win32print = backends.require("spooler")
+        deadline = time.monotonic() + self.status_timeout
+        interval = 0.02
+        while time.monotonic() < deadline:
+            try:
+                with self.connections.connection(self.printer_name) as conn:
+                    win32print.GetJob(conn.handle, job_id, 1)
+            except Exception:
+                return  # El trabajo ya no está en la cola
+            time.sleep(interval)
+            interval = min(interval * 2, 0.25)
+
+    def _verify_windows_job(self, job_id: Optional[int]) -> None:
+        try:
+            self._wait_for_windows_job(job_id)
 
-                return True
+            # Obtener estado desde el driver Windows
+            status_windows = self.get_windows_printer_status()
+            logger.info(f"Estado tras impresión (Windows): {status_windows}")
 
-            finally:
-                win32print.ClosePrinter(hprinter)
+            # Revisar ese trabajo en la cola
+            self.check_last_job(job_id)
+        except Exception as e:
+            logger.error(f"Error verificando trabajo {job_id}: {e}")
+
+    def _request_serial_status(self, max_bytes: int) -> bytes:
+        """Pide el status por serial (STX) y devuelve la respuesta en cuanto llega"""
+        with self._status_lock:
+            self.serial_connection.reset_input_buffer()
+            with self._serial_lock:
+                self.serial_connection.write(STATUS_REQUEST)
+            return read_serial_response(self.serial_connection, max_bytes, self.status_timeout,
+                                        terminator=STATUS_TERMINATOR)
+
+    def _verify_serial_status(self) -> None:
+        try:
+            status_bytes = self._request_serial_status(32)
+            if status_bytes:
+                hexstr = status_bytes.hex()
+                logger.info(f"Respuesta de status por serial (hex): {hexstr}")
+                # Aquí podrías interpretar los bits según el manual de Godex EPL
+            else:
+                logger.warning("No se recibió respuesta de status por serial")
+        except Exception as e:
+            logger.error(f"Error consultando status por serial: {e}")
+
+    def send_epl_to_network_printer(self, epl_command: Union[str, bytes]) -> bool:
+        """Envía comando EPL directamente por socket RAW, sin pasar por el spooler"""
+        try:
+            self.network_connections.write(self.network_address, _epl_bytes(epl_command))
+            logger.info(f"Comando EPL enviado a {self.network_address}")
+            return True
 
         except Exception as e:
-            logger.error(f"Error enviando EPL a impresora Windows: {e}")
+            logger.error(f"Error enviando EPL a impresora de red {self.network_address}: {e}")
             return False
 
-    def send_epl_command(self, epl_command: str) -> bool:
-        """Envía comando EPL a la impresora (serial o Windows) y obtiene status"""
+    def send_epl_command(self, epl_command: Union[str, bytes]) -> bool:
+        """Envía comando EPL a la impresora (red, Windows o serial) y obtiene status"""
+        device = self._device()
+        started = time.perf_counter()
+        sent = self._send_epl(epl_command)
+        if sent:
+            SEND_SECONDS.labels(device).observe(time.perf_counter() - started)
+            SEND_BYTES.labels(device).inc(len(epl_command))
+        else:
+            SEND_ERRORS.labels(device).inc()
+        return sent
+
+    def _send_epl(self, epl_command: Union[str, bytes]) -> bool:
+        if self.network_address:
+            return self.send_epl_to_network_printer(epl_command)
+
         # Intentar primero por Windows si hay impresora conectada
         if self.printer_name:
             return self.send_epl_to_windows_printer(epl_command)
@@ -284,27 +385,20 @@ class GodexPrinterManager:
 
         try:
             # Asegurar que el comando termine con \n
-            if not epl_command.endswith('\n'):
-                epl_command += '\n'
+            epl_bytes = _epl_bytes(epl_command)
+            if not epl_bytes.endswith(b'\n'):
+                epl_bytes += b'\n'
 
-            logger.info(f"Enviando comando EPL por serial:\n{epl_command}")
-            self.serial_connection.write(epl_command.encode('ascii'))
-            self.serial_connection.flush()
-
-            # Esperar a que la impresora procese el comando
-            time.sleep(0.5)
+            # El payload completo solo en debug: formatearlo en cada envío cuesta
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Enviando comando EPL por serial:\n{epl_command}")
+            with self._serial_lock:
+                self.serial_connection.write(epl_bytes)
+                self.serial_connection.flush()
 
             # Solicitar estado por serial (STX = 0x02)
-            self.serial_connection.write(b'\x02')
-            time.sleep(0.5)
-            status_bytes = self.serial_connection.read(32)  # lee hasta 32 bytes de respuesta
-
-            if status_bytes:
-                hexstr = status_bytes.hex()
-                logger.info(f"Respuesta de status por serial (hex): {hexstr}")
-                # Aquí podrías interpretar los bits según el manual de Godex EPL
-            else:
-                logger.warning("No se recibió respuesta de status por serial")
+            if self.verify_status:
+                self._run_verification(self._verify_serial_status)
 
             return True
 
@@ -344,6 +438,14 @@ P1,1
 """
         return self.send_epl_command(epl_command)
 
+    def get_status(self) -> PrinterStatus:
+        """Estado estructurado de la impresora (red, serial o Windows)"""
+        if self.printer_name:
+            return self.get_windows_status()
+        if self.serial_connection and self.serial_connection.is_open:
+            return decode_godex_status(self.printer_port, self._request_serial_status(100))
+        raise RuntimeError("No conectado")
+
     def get_printer_status(self) -> str:
         """Obtiene el estado de la impresora (serial o Windows)"""
         if self.printer_name:
@@ -353,9 +455,7 @@ P1,1
         elif self.serial_connection and self.serial_connection.is_open:
             try:
                 # Enviar comando de status EPL
-                self.serial_connection.write(b'\x02')
-                time.sleep(0.5)
-                response = self.serial_connection.read(100)
+                response = self._request_serial_status(100)
                 return f"Status response: {response.hex()}" if response else "Sin respuesta"
             except Exception as e:
                 return f"Error: {e}"
@@ -364,10 +464,23 @@ P1,1
 
     def disconnect(self):
         """Cierra la conexión"""
+        if self._verifier is not None:
+            # Deja terminar las verificaciones pendientes antes de cerrar los puertos
+            self._verifier.shutdown(wait=True)
+            self._verifier = None
+
         if self.serial_connection and self.serial_connection.is_open:
             self.serial_connection.close()
             logger.info("Conexión serial cerrada")
 
+        self.connections.close()
+        self.network_connections.close()
+        self.forms.invalidate()
+
+        if self.network_address:
+            logger.info(f"Desconectado de impresora de red: {self.network_address}")
+            self.network_address = None
+
         if self.printer_name:
             logger.info(f"Desconectado de impresora Windows: {self.printer_name}")
             self.printer_name = None
@@ -378,81 +491,104 @@ P1,1
         
         Args:
             product_data: Diccionario con datos del producto
-            layout_style: 'standard', 'compact', 'barcode_top', 'minimal'
+            layout_style: plantilla templates/57x70_<estilo>.epl: 'standard', 'compact',
+                'barcode_top', 'minimal'...
         
         Returns:
             Comando EPL formateado
+
+        Raises:
+            ValueError: si no hay plantilla para ese estilo
         """
-        width_dots = 456
-        height_dots = 560
-        gap_dots = 24
-
-        name = product_data.get('name', 'PRODUCTO')[:18]
-        price = product_data.get('price', '0.00')
-        barcode = product_data.get('barcode', '000000000000')
-        sku = product_data.get('sku', 'N/A')
-        date = product_data.get('date', time.strftime('%d/%m/%Y'))
-
-        if layout_style == "standard":
-            return f"""
-N
-q{width_dots}
-Q{height_dots},{gap_dots}
-A30,20,0,2,1,1,N,"{name}"
-A30,50,0,1,1,1,N,"Precio: ${price}"
-B30,80,0,1,2,3,80,B,"{barcode}"
-A30,170,0,1,1,1,N,"SKU: {sku}"
-A30,195,0,1,1,1,N,"{date}"
-P1,1
-"""
+        template = self._57x70_template(layout_style)
+        return template.render(_57x70_values(product_data)).decode('ascii')
+
+    def _57x70_template(self, layout_style: str) -> LabelTemplate:
+        """Plantilla del estilo; ValueError si no existe"""
+        template = self.templates.get(LAYOUT_57X70_PREFIX + layout_style)
+        if template is None:
+            styles = [name[len(LAYOUT_57X70_PREFIX):] for name in self.templates.names()
+                      if name.startswith(LAYOUT_57X70_PREFIX)]
+            raise ValueError(f"Layout desconocido: {layout_style} (disponibles: {', '.join(styles)})")
+        return template
+
+    def print_57x70_ticket(self, product_data: Dict, layout_style: str = "standard",
+                           copies: int = 1) -> bool:
+        """Imprime ticket con layout específico para 57x70mm; las copias las hace la impresora"""
+        if self.raster_codes:
+            layout = self.create_57x70_raster_layout(product_data, layout_style)
+            return self.send_epl_command(_with_copies(layout, copies))
+        if self.stored_forms:
+            form = self._57x70_template(layout_style).form
+            values = _57x70_values(product_data)
+            if form is not None and form.fits(values):
+                return self._print_form(form, values, copies)
+        epl_command = self.create_57x70_ticket_layout(product_data, layout_style)
+        return self.send_epl_command(_with_copies(epl_command, copies))
+
+    def create_57x70_raster_layout(self, product_data: Dict, layout_style: str = "standard") -> bytes:
+        """Como create_57x70_ticket_layout, con el Code 128 como gráfico GW y el texto debajo"""
+        epl = self.create_57x70_ticket_layout(product_data, layout_style)
+        parts: List[bytes] = []
+        start = 0
+        for match in _CODE128_LINE.finditer(epl):
+            x, y, narrow, height, readable, data = match.groups()
+            x, y, height = int(x), int(y), int(height)
+            bitmap = self.rasterizer.barcode(data, "code128", int(narrow), height)
+            parts.append(epl[start:match.start()].encode('ascii'))
+            parts.append(epl_graphic(x, y, bitmap))
+            if readable == "B":
+                # Fuente 1 de EPL (8x12 dots) justo debajo de las barras
+                parts.append(f'A{x},{y + height + 4},0,1,1,1,N,"{data}"'.encode('ascii'))
+            else:
+                # El salto de línea de la B lo pone ya el gráfico
+                parts[-1] = parts[-1][:-1]
+            start = match.end()
+        parts.append(epl[start:].encode('ascii'))
+        return b"".join(parts)
+
+    def _print_form(self, form: StoredForm, values: Dict, copies: int = 1) -> bool:
+        """Envía solo los valores; el layout se descarga antes si la impresora no lo tiene"""
+        with self._forms_lock:
+            # La versión actual de la plantilla; si cambió, se vuelve a descargar
+            self.forms.register(form)
+            payload = self.forms.prepare(self._device(), form.recall(values, copies=copies))
+            sent = self.send_epl_command(payload.decode("ascii"))
+            if sent:
+                self.forms.mark_loaded(self._device(), form)
+            else:
+                self.forms.invalidate()
+            return sent
 
-        elif layout_style == "compact":
-            return f"""
-N
-q{width_dots}
-Q{height_dots},{gap_dots}
-A25,15,0,1,1,1,N,"{name}"
-A25,35,0,1,1,1,N,"${price}"
-B25,55,0,1,1,2,60,B,"{barcode}"
-A25,125,0,1,1,1,N,"{sku} - {date}"
-P1,1
-"""
+    def _device(self) -> str:
+        return self.network_address or self.printer_name or self.printer_port or ""
 
-        elif layout_style == "barcode_top":
-            return f"""
-N
-q{width_dots}
-Q{height_dots},{gap_dots}
-B30,20,0,1,2,3,80,B,"{barcode}"
-A30,110,0,2,1,1,N,"{name}"
-A30,140,0,1,1,1,N,"Precio: ${price}"
-A30,165,0,1,1,1,N,"SKU: {sku}"
-A30,190,0,1,1,1,N,"{date}"
-P1,1
-"""
 
-        elif layout_style == "minimal":
-            return f"""
-N
-q{width_dots}
-Q{height_dots},{gap_dots}
-A30,30,0,2,1,1,N,"{name}"
-A30,60,0,2,1,1,N,"${price}"
-B30,90,0,1,2,2,70,B,"{barcode}"
-P1,1
-"""
+def _with_copies(epl_command: Union[str, bytes], copies: int) -> Union[str, bytes]:
+    """Cambia el `P1,1` final del layout por `P1,<copias>`; ValueError si no lo tiene"""
+    if copies == 1:
+        return epl_command
+    if isinstance(epl_command, bytes):
+        matches = list(_PRINT_ONE_BYTES.finditer(epl_command))
+        copies_command = b"P1,%d" % copies
+    else:
+        matches = list(_PRINT_ONE.finditer(epl_command))
+        copies_command = f"P1,{copies}"
+    if not matches:
+        # Añadir otro P imprimiría el layout una vez más además de las copias
+        raise ValueError("El layout no tiene un comando P1,1 para pedir copias")
+    last = matches[-1]
+    return epl_command[:last.start()] + copies_command + epl_command[last.end():]
 
-        else:
-            return self.create_57x70_ticket_layout(product_data, "standard")
 
-    def print_57x70_ticket(self, product_data: Dict, layout_style: str = "standard") -> bool:
-        """Imprime ticket con layout específico para 57x70mm"""
-        epl_command = self.create_57x70_ticket_layout(product_data, layout_style)
-        return self.send_epl_command(epl_command)
+def _epl_bytes(epl_command: Union[str, bytes]) -> bytes:
+    """Los layouts con gráficos ya vienen en bytes; el resto es texto ASCII"""
+    return epl_command if isinstance(epl_command, bytes) else epl_command.encode('ascii')
 
 
 # Función principal de ejemplo
 def main():
+    logging.basicConfig(level=logging.INFO)
     printer = GodexPrinterManager()
 
     # Buscar impresoras disponibles
@@ -546,8 +682,7 @@ def main():
                 print(f"  - {p['port']}: {p['description']}")
         else:
             print("Puertos disponibles para prueba manual:")
-            ports = serial.tools.list_ports.comports()
-            for port in ports:
+            for port in list_serial_ports():
                 print(f"  - {port.device}: {port.description}")
 
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+"""Control de admisión según el ritmo real de cada impresora.
+
+Cada impresora (o grupo) lleva la cuenta de las etiquetas aceptadas que aún
+no terminaron de enviarse y de su ritmo medido en etiquetas por segundo. Un
+trabajo nuevo se admite si el tiempo estimado para terminar todo lo pendiente
+más ese trabajo no supera el SLA; si no, se rechaza con `Overloaded` y el
+tiempo tras el que conviene reintentar (Retry-After), o se espera hasta
+`max_delay` segundos a que haya sitio.
+
+El ritmo es el cociente de dos sumas con decaimiento exponencial en el tiempo
+(etiquetas y segundos de envío con la impresora ocupada, con memoria de unos
+`window` segundos) que parten de `default_rate`. Las ráfagas de envíos que
+terminan casi a la vez porque solo llenan búferes (el de la impresora, el del
+sistema operativo) apenas mueven el ritmo frente al sostenido que impone el
+control de flujo. Con la impresora ociosa siempre se admite un trabajo,
+aunque él solo supere el SLA.
+"""
+import asyncio
+import math
+import time
+from typing import Dict, Optional
+
+from metrics import Counter
+
+REJECTED_TOTAL = Counter("print_rejected_total", "Trabajos rechazados por sobrecarga",
+                         ["printer"])
+
+
+class Overloaded(RuntimeError):
+    """La impresora no terminaría el trabajo dentro del SLA"""
+
+    def __init__(self, printer_name: str, estimated: float, retry_after: float):
+        super().__init__(f"Impresora {printer_name} saturada: terminaría en {estimated:.0f} s")
+        self.printer_name = printer_name
+        self.estimated = estimated
+        self.retry_after = retry_after
+
+
+class PrinterLoad:
+    __slots__ = ("name", "backlog", "labels", "seconds", "last_done", "samples")
+
+    def __init__(self, name: str, default_rate: float, window: float):
+        self.name = name
+        self.backlog = 0
+        # Una ventana a `default_rate` como punto de partida
+        self.labels = default_rate * window
+        self.seconds = window
+        self.last_done = 0.0
+        self.samples = 0
+
+    def rate(self) -> float:
+        return self.labels / self.seconds
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "backlog_labels": self.backlog,
+                "labels_per_second": self.rate(), "samples": self.samples}
+
+
+class AdmissionController:
+    """`sla` en segundos; `default_rate` en etiquetas/s hasta tener mediciones"""
+
+    def __init__(self, sla: float, default_rate: float = 1.0, max_delay: float = 0.0,
+                 window: float = 5.0):
+        self.sla = sla
+        self.default_rate = default_rate
+        self.max_delay = max_delay
+        self.window = window
+        self._printers: Dict[str, PrinterLoad] = {}
+
+    def load(self, printer_name: str) -> PrinterLoad:
+        load = self._printers.get(printer_name)
+        if load is None:
+            load = PrinterLoad(printer_name, self.default_rate, self.window)
+            self._printers[printer_name] = load
+        return load
+
+    def all_loads(self):
+        return list(self._printers.values())
+
+    def estimate(self, printer_name: str, labels: int = 0) -> float:
+        """Segundos para terminar lo pendiente más `labels` etiquetas"""
+        load = self.load(printer_name)
+        return (load.backlog + labels) / load.rate()
+
+    async def admit(self, printer_name: str, labels: int = 1,
+                    max_delay: Optional[float] = None) -> None:
+        """Reserva sitio para el trabajo o lanza Overloaded"""
+        load = self.load(printer_name)
+        deadline = time.monotonic() + (self.max_delay if max_delay is None else max_delay)
+        while True:
+            rate = load.rate()
+            estimated = (load.backlog + labels) / rate
+            if load.backlog == 0 or estimated <= self.sla:
+                load.backlog += labels
+                return
+            # Hasta que lo pendiente baje lo suficiente (o la impresora quede libre)
+            retry_after = min(estimated - self.sla, load.backlog / rate)
+            remaining = deadline - time.monotonic()
+            if retry_after > remaining:
+                REJECTED_TOTAL.labels(printer_name).inc()
+                raise Overloaded(printer_name, estimated, retry_after)
+            await asyncio.sleep(min(retry_after, 1.0))
+
+    def reserve(self, printer_name: str, labels: int = 1) -> None:
+        """Cuenta un trabajo que no pasa por la admisión (recuperado del diario, etc.)"""
+        self.load(printer_name).backlog += labels
+
+    def release(self, printer_name: str, labels: int = 1) -> None:
+        """Devuelve la reserva de un trabajo que al final no se encoló"""
+        load = self.load(printer_name)
+        load.backlog = max(0, load.backlog - labels)
+
+    def finished(self, printer_name: str, labels: int, started: float, ok: bool = True) -> None:
+        """Un trabajo terminó de enviarse; `started` es su time.monotonic() inicial"""
+        load = self.load(printer_name)
+        load.backlog = max(0, load.backlog - labels)
+        now = time.monotonic()
+        if ok and labels:
+            # Con varios trabajos en vuelo, solo cuenta el tiempo desde el anterior
+            busy = now - max(started, load.last_done)
+            if busy > 0:
+                decay = math.exp(-busy / self.window)
+                load.labels = load.labels * decay + labels
+                load.seconds = load.seconds * decay + busy
+                load.samples += 1
+        load.last_done = now
+
+
+def retry_after_header(e: Overloaded) -> str:
+    return str(max(1, math.ceil(e.retry_after)))
@@ -1,16 +1,68 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import (Depends, FastAPI, HTTPException, Path, Query, Request, Response, WebSocket,
+                     WebSocketDisconnect)
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
 from typing import Dict, List, Optional
-import platform
+import os
+import re
+import time
 
-# Import win32print only on Windows
-if platform.system() == "Windows":
-    import win32print
-else:
-    win32print = None  # type: ignore
+import backends
+from admission import AdmissionController, Overloaded, retry_after_header
+from connections import ConnectionPool, SpoolerConnection
+from discovery import PrinterDiscovery
+from dispatcher import DispatcherClient
+from events import EventBus, PrintEvents
+from graphics import (DITHERS, MAX_IMAGE_PIXELS, CodeRasterizer, ImageTooLarge, InvalidImage,
+                      ezpl_download_graphic, ezpl_graphic, image_bitmap, rotated_origin)
+from item_store import MAX_ID, MIN_ID, InvalidCursor, ItemExists, ItemStore
+from job_journal import JobJournal
+from job_tracker import STATES as JOB_STATES
+from job_tracker import JobNotCancellable, JobNotFound, JobTracker
+from metrics import CONTENT_TYPE, REGISTRY, Counter, Gauge, Histogram
+from metrics import merge as merge_metrics
+from ndjson_import import NdjsonImport, NdjsonStreamingResponse
+from preview import LabelRenderer, TemplatePreview
+from print_queue import PrintQueue, UnknownPrinter, current_job
+from printer_status import PrinterStatus, StatusMonitor, decode_spooler_status
+from scheduler import PrinterScheduler
+from stored_forms import EZPL, FormRegistry
+from template_registry import DEFAULT_DIRECTORY as DEFAULT_TEMPLATES_DIR
+from template_registry import SEAT_DIGITS, LabelTemplate, TemplateRegistry
+from ticket_template import CompiledTemplate
+from transports import BlockingTransport, TransportRegistry
 
-app = FastAPI(title="Dummy CRUD API with Printer", version="0.3.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tickets are rendered in this process in both modes
+    await ticket_templates.start()
+    if dispatcher is not None:
+        # Queue, journal, status poller and printers live in the dispatcher
+        await dispatcher.start()
+        await dispatcher.forward_events(event_bus)
+        yield
+        await dispatcher.stop()
+        await ticket_templates.stop()
+        item_store.close()
+        return
+    await print_queue.start()
+    await printer_status.start()
+    # Warm the discovery cache without delaying startup.
+    if DISCOVERY_WARMUP:
+        asyncio.get_running_loop().run_in_executor(None, printer_discovery.printers)
+    yield
+    await printer_status.stop()
+    await ticket_templates.stop()
+    await print_queue.stop()
+    await printer_transports.close()
+    printer_connections.close()
+    item_store.close()
+
+
+app = FastAPI(title="Dummy CRUD API with Printer", version="0.3.0", lifespan=lifespan)
 
 # ----------------------
 # CORS CONFIGURATION
@@ -30,146 +82,897 @@ app.add_middleware(
 # ------------------------------------------
 
 class Item(BaseModel):
-    id: int
+    # Stored as a 64-bit integer; anything wider is a 422, not a driver error
+    id: int = Field(ge=MIN_ID, le=MAX_ID)
     name: str
     description: Optional[str] = None
 
-fake_db: Dict[int, Item] = {}
+# Rows validated and written per chunk by the NDJSON import endpoints.
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+
+# Items live in ITEMS_DB (sqlite:///items.db by default, or a postgresql:// or
+# mysql:// URL). Store calls block, so they run on executor threads.
+item_store = ItemStore(os.getenv("ITEMS_DB", "sqlite:///items.db"),
+                       pool_size=int(os.getenv("ITEMS_DB_POOL", "8")))
+
+
+async def _in_store(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
 
 
 @app.post("/items", response_model=Item, status_code=201)
 async def create_item(item: Item):
-    if item.id in fake_db:
+    try:
+        return await _in_store(item_store.create, item.model_dump())
+    except ItemExists:
         raise HTTPException(status_code=400, detail="Item already exists")
-    fake_db[item.id] = item
-    return item
 
 
 @app.get("/items", response_model=List[Item])
-async def read_items():
-    return list(fake_db.values())
+async def read_items(response: Response, limit: int = Query(100, ge=1, le=1000),
+                     cursor: Optional[str] = None, prefix: Optional[str] = None):
+    """One page of items; the next page's cursor is in the X-Next-Cursor header."""
+    try:
+        items, next_cursor = await _in_store(item_store.list, limit, cursor, prefix)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+
+@app.post("/items/bulk", status_code=201)
+async def create_items(items: List[Item]):
+    """Insert all items in one transaction; nothing is inserted if any id exists."""
+    try:
+        inserted = await _in_store(item_store.insert_many, [i.model_dump() for i in items])
+    except ItemExists:
+        raise HTTPException(status_code=400, detail="Item already exists")
+    return {"inserted": inserted}
+
+
+@app.put("/items/bulk")
+async def upsert_items(items: List[Item]):
+    upserted = await _in_store(item_store.upsert_many, [i.model_dump() for i in items])
+    return {"upserted": upserted}
+
+
+@app.post("/items/import")
+async def import_items(request: Request):
+    """Upsert items from an NDJSON body, streaming back one result per line."""
+    async def write(items: List[Item]) -> List[Dict]:
+        await _in_store(item_store.upsert_many, [i.model_dump() for i in items])
+        return [{"id": i.id} for i in items]
+
+    importer = NdjsonImport(Item.model_validate_json, write, chunk_size=IMPORT_CHUNK_SIZE)
+    return NdjsonStreamingResponse(importer.run(request.stream()))
 
 
 @app.get("/items/{item_id}", response_model=Item)
-async def read_item(item_id: int):
-    if item_id not in fake_db:
+async def read_item(item_id: int = Path(ge=MIN_ID, le=MAX_ID)):
+    item = await _in_store(item_store.get, item_id)
+    if item is None:
         raise HTTPException(status_code=404, detail="Item not found")
-    return fake_db[item_id]
+    return item
 
 
 @app.put("/items/{item_id}", response_model=Item)
-async def update_item(item_id: int, item: Item):
+async def update_item(item: Item, item_id: int = Path(ge=MIN_ID, le=MAX_ID)):
     if item_id != item.id:
         raise HTTPException(status_code=400, detail="ID mismatch between path and body")
-    if item_id not in fake_db:
+    if not await _in_store(item_store.update, item.model_dump()):
         raise HTTPException(status_code=404, detail="Item not found")
-    fake_db[item_id] = item
     return item
 
 
 @app.delete("/items/{item_id}", status_code=204)
-async def delete_item(item_id: int):
-    if item_id not in fake_db:
+async def delete_item(item_id: int = Path(ge=MIN_ID, le=MAX_ID)):
+    if not await _in_store(item_store.delete, item_id):
         raise HTTPException(status_code=404, detail="Item not found")
-    del fake_db[item_id]
+
 
 # ------------------------------------------
 # PRINTING LOGIC
 # ------------------------------------------
 
-class PrintRequest(BaseModel):
-    seccion: str
-    orden: str
-    precio: str
-    tipo: str
-    fila: str
-    asiento: str
+# Seat numbers printed by the printer's counter have at most this many digits
+# (the counter of the templates' seats_form, see template_registry.py)
+_SEAT_DIGITS = SEAT_DIGITS
+
+
+# Longest per-ticket QR: 213 bytes is a version 10 code at the stock layout's
+# level M, 57 modules or 285 dots wide at module 5 on the 456-dot label.
+# Stricter levels only need a larger version, so nothing accepted overflows
+# the QR encoder.
+QR_MAX_LENGTH = 213
+
+# Field values go into the printer stream as they are: a CR/LF (or any other
+# control character) would start a printer command of the client's choosing.
+_CONTROL_CHARS = re.compile(r"[\x00-\x1f\x7f]")
+
+
+class TicketFields(BaseModel):
+    seccion: str = Field(max_length=40)
+    orden: str = Field(max_length=40)
+    precio: str = Field(max_length=16)
+    tipo: str = Field(max_length=40)
+    fila: str = Field(max_length=16)
+    asiento: str = Field(max_length=16)
+    # Per-ticket QR contents; defaults to the event check-in URL
+    qr: Optional[str] = Field(None, max_length=QR_MAX_LENGTH)
+    # Done by the printer: `copies` of each label, and `seats` consecutive
+    # seats of the row starting at `asiento`, numbered by a printer counter
+    copies: int = Field(1, ge=1, le=999)
+    seats: int = Field(1, ge=1, le=10 ** _SEAT_DIGITS - 1)
+    # Layout file in TEMPLATES_DIR
+    template: str = Field("ticket", max_length=64)
+
+    @field_validator("seccion", "orden", "precio", "tipo", "fila", "asiento", "qr", "template")
+    @classmethod
+    def _check_printable(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None and _CONTROL_CHARS.search(value):
+            raise ValueError("control characters (CR, LF, tab, ...) are not allowed")
+        return value
+
+    @field_validator("template")
+    @classmethod
+    def _check_template(cls, name: str) -> str:
+        _ticket_layout(name)
+        return name
+
+    @model_validator(mode="after")
+    def _check_seat_run(self):
+        if self.seats > 1 and not (self.asiento.isdigit()
+                                   and int(self.asiento) + self.seats <= 10 ** _SEAT_DIGITS):
+            raise ValueError(f"seats needs a numeric asiento and the last seat must have at "
+                             f"most {_SEAT_DIGITS} digits")
+        return self
+
+    @property
+    def labels(self) -> int:
+        return self.copies * self.seats
+
+
+class PrintRequest(TicketFields):
+    printer_name: Optional[str] = "BP500"
+    # A retried request with the same key returns the original job
+    idempotency_key: Optional[str] = None
+
+
+class BatchPrintRequest(BaseModel):
+    tickets: List[TicketFields]
     printer_name: Optional[str] = "BP500"
+    idempotency_key: Optional[str] = None
+
+
+# With PRINTER_STORED_FORMS=1 the layout (and the setup header) is downloaded
+# once to each printer and tickets only carry the field values. Values that
+# don't fit a form variable fall back to the full layout. A new version of a
+# template is downloaded again the next time it's used.
+printer_forms = FormRegistry(enabled=os.getenv("PRINTER_STORED_FORMS", "0") == "1")
+
+# Ticket layouts are files in TEMPLATES_DIR (templates/ next to this module by
+# default, see template_registry.py): the label, its setup header and the
+# stored-form names. Edits are picked up every TEMPLATE_RELOAD_INTERVAL
+# seconds without a restart; jobs already queued keep the bytes they were
+# rendered with. Loading registers the forms in printer_forms, so the process
+# that sends the jobs knows them even if it never renders a ticket.
+ticket_templates = TemplateRegistry(
+    os.getenv("TEMPLATES_DIR", DEFAULT_TEMPLATES_DIR),
+    reload_interval=float(os.getenv("TEMPLATE_RELOAD_INTERVAL", "2")),
+    forms=printer_forms,
+)
+ticket_templates.reload()
+printer_forms.refresh = ticket_templates.reload
+
+_DEFAULT_QR = "https://eventonist.com/checkin/?id=MTMzNS0xMzIxLTUxN1Qw"
+# The stock layout declares a length of 55 for the 52-character check-in URL;
+# per-ticket contents keep the same offset.
+_QR_LEN_OFFSET = 55 - len(_DEFAULT_QR)
+# Fields a ticket template can use
+_TICKET_VALUES = frozenset(TicketFields.model_fields) - {"copies", "seats", "template"} | {"qr_len"}
+
+# With PRINTER_RASTER_CODES=1 the QR is drawn here and sent as a 1-bit Q
+# graphic instead of the printer's W command, so every ticket can carry its
+# own code. Bitmaps are cached by content (RASTER_CACHE_SIZE entries).
+RASTER_CODES = os.getenv("PRINTER_RASTER_CODES", "0") == "1"
+code_rasterizer = CodeRasterizer(int(os.getenv("RASTER_CACHE_SIZE", "4096")))
+# W<x>,<y>,<mode>,<type>,<error correction>,<mask>,<module>,<length>,<rotation> + data line
+_QR_COMMAND = re.compile(r"^W(\d+),(\d+),\d+,\d+,([LMQH]),\d+,(\d+),\{qr_len\},(\d)\n\{qr\}\n",
+                         re.MULTILINE)
+
+# GET /print/preview draws the ticket without a printer (preview.py): the
+# fixed lines once, the fields per request, PNGs cached by field values.
+_preview_renderer = LabelRenderer()
+PREVIEW_CACHE_SIZE = int(os.getenv("PREVIEW_CACHE_SIZE", "256"))
+
+
+class _TicketLayout:
+    """What printing derives from one version of a ticket template"""
+
+    def __init__(self, template: LabelTemplate):
+        if template.dialect is not EZPL:
+            raise ValueError(f"template {template.name} is not EZPL")
+        unknown = set(template.fields) - _TICKET_VALUES
+        if unknown:
+            raise ValueError(f"template {template.name} uses unknown fields {sorted(unknown)}")
+        self.template = template
+        self.label = template.compiled
+        self.header = template.header
+        self.form = template.form
+        # A run of seats is one recall of the form whose asiento is a printer
+        # counter, so it's downloaded the first time a printer gets a run even
+        # without PRINTER_STORED_FORMS. The QR is the printer's W command
+        # there, also with PRINTER_RASTER_CODES.
+        self.seats_form = template.seats_form
+        self.qr = None
+        match = _QR_COMMAND.search(template.source)
+        if match:
+            x, y, error_correction, module, rotation = match.groups()
+            self.qr = (int(x), int(y), error_correction, int(module), int(rotation))
+            self.before_qr = CompiledTemplate(template.source[:match.start()])
+            self.after_qr = CompiledTemplate(template.source[match.end():])
+        self._preview: Optional[TemplatePreview] = None
+
+    @property
+    def preview(self) -> TemplatePreview:
+        if self._preview is None:
+            self._preview = TemplatePreview(self.template.source, self.template.setup_source,
+                                            renderer=_preview_renderer,
+                                            max_entries=PREVIEW_CACHE_SIZE)
+        return self._preview
+
+
+# Template name -> layout derived from its current version
+_layouts: Dict[str, _TicketLayout] = {}
+
+
+def _ticket_layout(name: str) -> _TicketLayout:
+    template = ticket_templates.get(name)
+    if template is None:
+        raise ValueError(f"unknown template {name!r} (available: {', '.join(ticket_templates.names())})")
+    layout = _layouts.get(name)
+    if layout is None or layout.template is not template:
+        layout = _layouts[name] = _TicketLayout(template)
+    return layout
+
+
+def _ticket_values(pr: TicketFields) -> Dict[str, str]:
+    values = dict(pr)
+    del values["copies"], values["seats"], values["template"]
+    if values["qr"] is None:
+        values["qr"] = _DEFAULT_QR
+    values["qr_len"] = str(len(values["qr"]) + _QR_LEN_OFFSET)
+    return values
+
+
+def _build_label(pr: TicketFields) -> bytes:
+    layout = _ticket_layout(pr.template)
+    values = _ticket_values(pr)
+    if RASTER_CODES and layout.qr is not None:
+        # Same position, module size and rotation as the W command it replaces
+        x, y, error_correction, module, rotation = layout.qr
+        qr = code_rasterizer.qr(values["qr"], module=module, error_correction=error_correction,
+                                rotation=rotation)
+        return (layout.before_qr.render(values)
+                + ezpl_graphic(*rotated_origin(x, y, qr.width, qr.height, rotation), qr)
+                + layout.after_qr.render(values))
+    return layout.label.render(values)
+
+
+def _use_form(tickets: List[TicketFields]) -> bool:
+    # Raster QR codes change per ticket; a stored form can't hold them
+    if not printer_forms.enabled or RASTER_CODES:
+        return False
+    for t in tickets:
+        form = _ticket_layout(t.template).form
+        if form is None or not form.fits(_ticket_values(t)):
+            return False
+    return True
+
+
+RENDER_SECONDS = Histogram("print_render_seconds", "Tiempo de generar el payload de un trabajo")
+
+
+def _expand_seats(pr: TicketFields) -> List[TicketFields]:
+    """One single-seat ticket per seat of the run"""
+    first = int(pr.asiento)
+    return [pr.model_copy(update={"asiento": str(first + i), "seats": 1})
+            for i in range(pr.seats)]
+
+
+def _ticket_commands(pr: TicketFields, use_form: bool) -> bytes:
+    layout = _ticket_layout(pr.template)
+    if pr.seats > 1:
+        values = _ticket_values(pr)
+        if layout.seats_form is not None and layout.seats_form.fits(values):
+            return layout.seats_form.recall(values, labels=pr.seats, copies=pr.copies)
+        return b"".join(_ticket_commands(t, use_form) for t in _expand_seats(pr))
+    if use_form:
+        return layout.form.recall(_ticket_values(pr), copies=pr.copies)
+    if pr.copies == 1:
+        return _build_label(pr)
+    # ^C stays set on the printer, so it's put back for the next job
+    return b"^C%d\r\n" % pr.copies + _build_label(pr) + b"^C1\r\n"
+
+
+def _render(tickets: List[TicketFields]) -> bytes:
+    if _use_form(tickets):
+        return b"".join(_ticket_commands(t, True) for t in tickets)
+    # Each template's setup goes before its first ticket (once per job when
+    # the whole batch uses one template)
+    parts = []
+    header = None
+    for t in tickets:
+        layout_header = _ticket_layout(t.template).header
+        if layout_header != header:
+            parts.append(layout_header)
+            header = layout_header
+        parts.append(_ticket_commands(t, False))
+    return b"".join(parts)
+
+
+def _build_ticket(pr: TicketFields) -> bytes:
+    started = time.perf_counter()
+    data = _render([pr])
+    RENDER_SECONDS.observe(time.perf_counter() - started)
+    return data
+
+
+def _build_batch(tickets: List[TicketFields]) -> bytes:
+    started = time.perf_counter()
+    data = _render(tickets)
+    RENDER_SECONDS.observe(time.perf_counter() - started)
+    return data
+
+
+# Spooler handles stay open between jobs; one writer per printer at a time.
+# win32print (and pyserial for serial transports) is only imported when a
+# printer of that kind is first used, see backends.py.
+printer_connections = ConnectionPool(
+    lambda printer_name: SpoolerConnection(printer_name, backends.load("spooler")),
+    max_writers=int(os.getenv("PRINTER_MAX_WRITERS", "1")),
+)
+
+
+def _send_to_printer(data_bytes: bytes, printer_name: str):
+    backends.require("spooler")
+    with printer_connections.connection(printer_name) as conn:
+        conn.write(data_bytes)
+        spool_id = conn.last_job_id
+    # Spooler job ID -> our job, so it can be listed and deleted later
+    job = current_job.get()
+    if job is not None and spool_id is not None:
+        job_tracker.spooled(job.job_id, printer_name, spool_id)
+
+
+def _spooler_status(printer_name: str) -> PrinterStatus:
+    win32print = backends.require("spooler")
+    jobs = None
+    with printer_connections.connection(printer_name) as conn:
+        info = win32print.GetPrinter(conn.handle, 2)
+        # One enumeration per poll, and only while some of our jobs are there
+        if job_tracker.tracking(printer_name):
+            listed_at = time.monotonic()
+            count = info.get("cJobs", 0xFFFF)
+            jobs = win32print.EnumJobs(conn.handle, 0, count, 1) if count else []
+    if jobs is not None:
+        job_tracker.refresh(printer_name, jobs, listed_at)
+    return decode_spooler_status(printer_name, info["Status"], info.get("cJobs"))
+
+
+def _delete_spooled(printer_name: str, spool_ids: List[int]):
+    win32print = backends.require("spooler")
+    with printer_connections.connection(printer_name) as conn:
+        for spool_id in spool_ids:
+            win32print.SetJob(conn.handle, spool_id, 0, None, win32print.JOB_CONTROL_DELETE)
+    # A deleted job may have been a stored-form download
+    printer_forms.invalidate(printer_name)
+
+
+# Printers default to the Windows spooler; PRINTER_TRANSPORTS maps names to
+# other transports, e.g. "gate-1=tcp://10.0.0.21:9100,caja=serial:COM3".
+# The spooler calls block, so they run on executor threads and never on the
+# event loop. _send_to_printer is looked up at call time so it can be swapped.
+printer_transports = TransportRegistry(
+    lambda printer_name: BlockingTransport(
+        lambda data: _send_to_printer(data, printer_name),
+        lambda name: _spooler_status(printer_name),
+    )
+)
+printer_transports.load(os.getenv("PRINTER_TRANSPORTS", ""))
+
+
+WRITE_SECONDS = Histogram("print_write_seconds",
+                          "Tiempo de escritura en el spooler, socket o puerto serie",
+                          ["printer"])
+WRITE_ERRORS = Counter("print_write_errors_total", "Escrituras fallidas", ["printer"])
+
+
+async def _send_to_transport(data_bytes: bytes, printer_name: str):
+    transport = printer_transports.get(printer_name)
+    started = time.perf_counter()
+    try:
+        await printer_forms.send(printer_name, data_bytes, transport.send)
+    except Exception:
+        WRITE_ERRORS.labels(printer_name).inc()
+        raise
+    WRITE_SECONDS.labels(printer_name).observe(time.perf_counter() - started)
+
+
+# printer_name may name a group from PRINTER_GROUPS, e.g.
+# "gate-A=BP500-1,BP500-2;gate-B=BP500-3"; each job goes to the group's
+# least-loaded healthy printer and fails over to the next one on error.
+printer_scheduler = PrinterScheduler(
+    _send_to_transport, retry_after=float(os.getenv("PRINTER_RETRY_AFTER", "30"))
+)
+printer_scheduler.load(os.getenv("PRINTER_GROUPS", ""))
+
 
+# Hardware status is only read by this background poller; the API serves the
+# cached copy. Printers that report a fault are taken out of their groups.
+async def _probe_printer(printer_name: str) -> PrinterStatus:
+    return await printer_transports.get(printer_name).probe(printer_name)
 
-def _adaptar_codigo(codigo_original: str) -> str:
-    lineas = codigo_original.strip().split("\n")
-    return "".join(f"{ln.strip()}\r\n" for ln in lineas if ln.strip())
-
-
-def _build_ticket(pr: PrintRequest) -> str:
-    return f"""
-^Q140,0,0
-^W57
-^H5
-^P1
-^S2
-^AD
-^C1
-^R0
-~Q+0
-^O0
-^D0
-^E12
-~R255
-^XSET,ROTATION,0
-^L
-Dy2-me-dd
-Th:m:s
-Y192,464,WindowText25-14
-Y46,286,WindowText22-5
-Y143,315,WindowText20-33
-Y210,264,WindowText18-68
-Y267,335,WindowText16-10
-Y334,269,WindowText14-76
-Y69,466,WindowText12-94
-Y166,489,WindowText11-37
-Y45,934,WindowText10-2
-Y142,963,WindowText9-96
-Y209,912,WindowText8-9
-Y266,983,WindowText7-8
-Y333,917,WindowText6-7
-W213,212,5,2,M,8,5,55,3
-https://eventonist.com/checkin/?id=MTMzNS0xMzIxLTUxN1Qw
-VD,67,376,1,1,0,3E,{pr.precio}
-VD,169,396,1,1,0,3E,{pr.orden}
-VD,234,397,1,1,0,3E,{pr.seccion}
-VD,291,397,1,1,0,3E,{pr.fila}
-VD,358,397,1,1,0,3E,{pr.asiento}
-VD,66,1024,1,1,0,3E,{pr.precio}
-VD,168,1044,1,1,0,3E,{pr.orden}
-VD,233,1045,1,1,0,3E,{pr.seccion}
-VD,290,1045,1,1,0,3E,{pr.fila}
-VD,357,1045,1,1,0,3E,{pr.asiento}
-Lo,4,864,452,875
-E
-"""
-
-
-def _send_to_printer(raw_code: str, printer_name: str):
+
+printer_status = StatusMonitor(
+    _probe_printer,
+    interval=float(os.getenv("STATUS_POLL_INTERVAL", "2")),
+    ttl=float(os.getenv("STATUS_TTL", "10")),
+)
+printer_status.watch(printer_transports.printers())
+for _members in printer_scheduler.groups.values():
+    printer_status.watch(_members)
+
+
+def _apply_status(previous: Optional[PrinterStatus], status: PrinterStatus):
+    if not status.usable:
+        # An offline or faulted printer may come back without its stored forms
+        printer_forms.invalidate(status.printer_name)
+        printer_scheduler.mark_down(status.printer_name, status.message,
+                                    retry_after=printer_status.ttl)
+    elif status.ready:
+        printer_scheduler.mark_up(status.printer_name)
+
+
+printer_status.add_listener(_apply_status)
+
+
+# Jobs only go to printers this process knows: groups and their members,
+# PRINTER_TRANSPORTS entries and printers that exist in the Windows spooler.
+# Anything else is refused with 404 before it is queued, so a client's typo
+# never adds a printer to the status poller, the transports or admission.
+_grouped_printers = {member for members in printer_scheduler.groups.values()
+                     for member in members}
+_spooler_printers = set()
+
+
+def _spooler_has(printer_name: str) -> bool:
+    win32print = backends.load("spooler")
     if win32print is None:
-        raise RuntimeError("win32print solo está disponible en Windows")
-    data_bytes = _adaptar_codigo(raw_code).encode("ascii", errors="ignore")
-    handle = win32print.OpenPrinter(printer_name)
+        return False
     try:
-        win32print.StartDocPrinter(handle, 1, ("Etiqueta", None, "RAW"))
-        win32print.StartPagePrinter(handle)
-        win32print.WritePrinter(handle, data_bytes)
-        win32print.EndPagePrinter(handle)
-        win32print.EndDocPrinter(handle)
-    finally:
-        win32print.ClosePrinter(handle)
+        handle = win32print.OpenPrinter(printer_name)
+    except Exception:
+        return False
+    win32print.ClosePrinter(handle)
+    return True
+
+
+async def _known_printer(printer_name: str) -> bool:
+    if (printer_name in printer_scheduler.groups or printer_name in _grouped_printers
+            or printer_name in _spooler_printers
+            or printer_name in printer_transports.printers()):
+        return True
+    loop = asyncio.get_running_loop()
+    if await loop.run_in_executor(None, _spooler_has, printer_name):
+        _spooler_printers.add(printer_name)
+        return True
+    return False
+
+
+async def _dispatch(data_bytes: bytes, printer_name: str) -> str:
+    if printer_name not in printer_scheduler.groups:
+        printer_status.watch([printer_name])
+    return await printer_scheduler.send(data_bytes, printer_name)
+
+
+# Jobs are journaled to disk before the 202 and replayed on startup if they
+# were never confirmed. Set JOB_JOURNAL="" to run without the journal.
+_journal_path = os.getenv("JOB_JOURNAL", "print_jobs.db")
+job_journal = JobJournal(_journal_path) if _journal_path else None
+
+# With PRINT_SLA_SECONDS set, a job is refused with 429 + Retry-After when its
+# printer (at its measured labels/s) wouldn't finish it within that time.
+# The rate starts at ADMISSION_DEFAULT_RATE labels/s and follows what each
+# printer actually sustains; ADMISSION_MAX_DELAY seconds of waiting for room
+# are allowed before refusing.
+_sla = float(os.getenv("PRINT_SLA_SECONDS", "0"))
+admission = AdmissionController(
+    _sla,
+    default_rate=float(os.getenv("ADMISSION_DEFAULT_RATE", "1")),
+    max_delay=float(os.getenv("ADMISSION_MAX_DELAY", "0")),
+) if _sla > 0 else None
+
+# At least one worker per grouped printer so every device can be kept busy.
+# PRINT_TRACE=1 records per-stage timings in each job (see GET /jobs/{id}).
+print_queue = PrintQueue(
+    _dispatch,
+    workers=max(int(os.getenv("PRINT_WORKERS", "2")), printer_scheduler.printer_count()),
+    journal=job_journal,
+    trace=os.getenv("PRINT_TRACE", "0") == "1",
+    admission=admission,
+    printers=_known_printer,
+)
+
+# Pending jobs (in the queue or in a Windows spooler) are indexed as they
+# change, for GET/DELETE /api/printer/jobs; see job_tracker.py.
+job_tracker = JobTracker(print_queue, _delete_spooled)
+print_queue.add_listener(job_tracker.job)
+
+# Under serve.py there are several API worker processes: PRINT_DISPATCHER is
+# the address of the single dispatcher process that owns the queue, journal
+# and printer connections. Workers render tickets and hand them over; without
+# it this process is its own dispatcher.
+_dispatcher_address = os.getenv("PRINT_DISPATCHER", "")
+dispatcher = DispatcherClient(_dispatcher_address) if _dispatcher_address else None
 
 
-@app.post("/print")
+def _jobs():
+    return dispatcher or print_queue
+
+
+# Job lifecycle and printer status changes are pushed to GET /events (SSE) and
+# /ws/events subscribers from one bus (events.py). Each subscriber buffers at
+# most EVENTS_BUFFER events; a slow one loses its oldest and is told how many.
+# The last EVENTS_HISTORY events are kept for clients that reconnect. Under
+# serve.py the dispatcher publishes and each API worker relays its events.
+event_bus = EventBus(max_buffered=int(os.getenv("EVENTS_BUFFER", "256")),
+                     history=int(os.getenv("EVENTS_HISTORY", "1000")))
+print_events = PrintEvents(event_bus)
+print_queue.add_listener(print_events.job)
+printer_status.add_listener(print_events.status)
+Gauge("event_subscribers", "Clientes SSE/WebSocket suscritos a los eventos",
+      function=lambda: len(event_bus))
+# SSE comment sent when there's nothing to say, so proxies keep the stream open
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+
+
+if dispatcher is None:
+    # Gauges read at scrape time; under serve.py only the dispatcher has them
+    Gauge("print_queue_depth", "Trabajos encolados esperando un worker",
+          function=lambda: print_queue.depth())
+    Gauge("print_pending_jobs", "Trabajos en cola, enviándose o en el spooler",
+          function=lambda: len(job_tracker))
+    Gauge("printer_outstanding_jobs", "Trabajos en curso por impresora", ["printer"],
+          function=lambda: {s.name: s.outstanding for s in printer_scheduler.all_stats()})
+    Gauge("printer_up", "1 si la impresora está disponible para el planificador", ["printer"],
+          function=lambda: {s.name: int(s.is_up(time.monotonic()))
+                            for s in printer_scheduler.all_stats()})
+    if admission is not None:
+        Gauge("print_backlog_labels", "Etiquetas aceptadas pendientes de enviar", ["printer"],
+              function=lambda: {p.name: p.backlog for p in admission.all_loads()})
+        Gauge("printer_labels_per_second", "Ritmo medido de cada impresora", ["printer"],
+              function=lambda: {p.name: p.rate() for p in admission.all_loads()})
+
+
+def _unknown_printer(e: UnknownPrinter) -> HTTPException:
+    return HTTPException(status_code=404, detail=str(e))
+
+
+def _overloaded(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e),
+                         headers={"Retry-After": retry_after_header(e)})
+
+
+@app.post("/print", status_code=202)
 async def print_ticket(req: PrintRequest):
     try:
         raw = _build_ticket(req)
-        _send_to_printer(raw, req.printer_name)
-        return {"status": "ok", "message": "Ticket enviado"}
+        job, new = await _jobs().accept(raw, req.printer_name, req.idempotency_key, req.labels)
+        if not new:
+            return {"status": "duplicate", "job_id": job.job_id, "message": "Ticket ya encolado"}
+        return {"status": "queued", "job_id": job.job_id, "message": "Ticket encolado"}
+    except UnknownPrinter as e:
+        raise _unknown_printer(e)
+    except Overloaded as e:
+        raise _overloaded(e)
     except RuntimeError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al imprimir: {e}")
 
+
+@app.post("/print/batch", status_code=202)
+async def print_batch(req: BatchPrintRequest):
+    if not req.tickets:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one ticket")
+    try:
+        raw = _build_batch(req.tickets)
+        job, new = await _jobs().accept(raw, req.printer_name, req.idempotency_key,
+                                        sum(t.labels for t in req.tickets))
+        if not new:
+            return {"status": "duplicate", "job_id": job.job_id, "tickets": len(req.tickets),
+                    "message": "Tickets ya encolados"}
+        return {"status": "queued", "job_id": job.job_id, "tickets": len(req.tickets),
+                "message": "Tickets encolados"}
+    except UnknownPrinter as e:
+        raise _unknown_printer(e)
+    except Overloaded as e:
+        raise _overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al imprimir: {e}")
+
+
+# Imports wait while the queue is this deep, so a huge upload is throttled to
+# the printers' pace instead of piling every payload up in memory.
+IMPORT_MAX_QUEUED = int(os.getenv("IMPORT_MAX_QUEUED", "10000"))
+
+
+@app.post("/print/import")
+async def import_print_jobs(request: Request):
+    """Queue one print job per NDJSON line (PrintRequest), streaming back the job IDs."""
+    async def accept(req: PrintRequest) -> Dict:
+        payload = _build_ticket(req)
+        while True:
+            try:
+                job, new = await _jobs().accept(payload, req.printer_name, req.idempotency_key,
+                                                req.labels)
+                return {"job_id": job.job_id, "status": "queued" if new else "duplicate"}
+            except Overloaded as e:
+                # An import waits for the printer instead of failing its rows
+                await asyncio.sleep(min(e.retry_after, 1.0))
+
+    async def write(reqs: List[PrintRequest]) -> List:
+        await _jobs().wait_for_room(IMPORT_MAX_QUEUED)
+        # Accepted together so the journal commits the whole chunk at once
+        return await asyncio.gather(*(accept(r) for r in reqs), return_exceptions=True)
+
+    importer = NdjsonImport(PrintRequest.model_validate_json, write,
+                            chunk_size=IMPORT_CHUNK_SIZE)
+    return NdjsonStreamingResponse(importer.run(request.stream()))
+
+
+# Uploaded images are stored on the printer as graphics that templates recall
+# with Y<x>,<y>,<name>, like the label's own WindowText objects.
+_GRAPHIC_NAME = re.compile(r"^[A-Za-z0-9_-]{1,16}$")
+GRAPHIC_MAX_BYTES = int(os.getenv("GRAPHIC_MAX_BYTES", str(8 * 1024 * 1024)))
+# Checked against the image header before decoding (413 above it)
+GRAPHIC_MAX_PIXELS = int(os.getenv("GRAPHIC_MAX_PIXELS", str(MAX_IMAGE_PIXELS)))
+# 57 x 140 mm at 203 dpi (^W57, ^Q140)
+_LABEL_DOTS = (456, 1120)
+
+
+@app.put("/printers/{printer_name}/graphics/{name}", status_code=202)
+async def upload_graphic(printer_name: str, name: str, request: Request,
+                         width: int = Query(0, ge=0, le=_LABEL_DOTS[0]),
+                         height: int = Query(0, ge=0, le=_LABEL_DOTS[1]),
+                         dither: str = Query("diffusion", pattern="^(" + "|".join(DITHERS) + ")$"),
+                         threshold: int = Query(128, ge=0, le=255)):
+    """Convert a PNG/JPEG body to a 1-bit 203 dpi bitmap and download it to the printer."""
+    if not _GRAPHIC_NAME.match(name):
+        raise HTTPException(status_code=400, detail="Graphic name must be 1-16 letters, digits, _ or -")
+    data = await request.body()
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty image")
+    if len(data) > GRAPHIC_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Image too large")
+    loop = asyncio.get_running_loop()
+    try:
+        bitmap = await loop.run_in_executor(None, image_bitmap, data, width, height, dither,
+                                            threshold, _LABEL_DOTS, GRAPHIC_MAX_PIXELS)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImage as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    payload = ezpl_download_graphic(name, bitmap)
+    # Any printer of a group may get the tickets, so each one needs the graphic
+    targets = printer_scheduler.groups.get(printer_name, [printer_name])
+    try:
+        jobs = {target: (await _jobs().accept(payload, target, labels=0))[0].job_id
+                for target in targets}
+    except UnknownPrinter as e:
+        raise _unknown_printer(e)
+    except Overloaded as e:
+        raise _overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al enviar el gráfico: {e}")
+    # Previews from this process show the uploaded graphic from now on
+    _preview_renderer.store_graphic(name, bitmap)
+    for layout in list(_layouts.values()):
+        if layout._preview is not None:
+            layout._preview.invalidate()
+    return {"status": "queued", "jobs": jobs, "graphic": name, "width": bitmap.width,
+            "height": bitmap.height, "recall": f"Y<x>,<y>,{name}"}
+
+
+@app.exception_handler(ValidationError)
+async def model_validation_error(request: Request, exc: ValidationError):
+    # Query models built with Depends() (the preview) raise pydantic's error
+    # instead of FastAPI's, which would otherwise be a 500.
+    return JSONResponse(status_code=422,
+                        content={"detail": exc.errors(include_url=False, include_context=False)})
+
+
+@app.get("/print/preview")
+async def preview_ticket(fields: TicketFields = Depends()):
+    """PNG of the ticket at printer resolution (203 dpi), without printing it."""
+    loop = asyncio.get_running_loop()
+    preview = _ticket_layout(fields.template).preview
+    try:
+        png = await loop.run_in_executor(None, preview.render, _ticket_values(fields))
+    except ValueError as e:
+        # InvalidCommand from the renderer, or a value the template refuses
+        raise HTTPException(status_code=422, detail=str(e))
+    return Response(png, media_type="image/png")
+
+
+@app.get("/print/templates")
+async def list_templates():
+    """Ticket templates currently loaded, and files that failed to load."""
+    templates = [ticket_templates.get(name) for name in ticket_templates.names()]
+    return {
+        "templates": [{"name": t.name, "fields": list(t.fields), "version": t.version,
+                       "form": t.meta.get("form")}
+                      for t in templates if t is not None and t.dialect is EZPL],
+        "errors": ticket_templates.errors,
+    }
+
+
+printer_discovery = PrinterDiscovery(
+    lambda: backends.load("spooler"),
+    rescan_interval=float(os.getenv("DISCOVERY_RESCAN_INTERVAL", "300")),
+)
+# The startup scan probes every serial port; DISCOVERY_WARMUP=0 skips it (and
+# the pyserial import) where all printers are listed in PRINTER_TRANSPORTS.
+DISCOVERY_WARMUP = os.getenv("DISCOVERY_WARMUP", "1") == "1"
+
+
+@app.get("/printers")
+async def list_printers(refresh: bool = False):
+    if dispatcher is not None:
+        return await dispatcher.printers(refresh)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, printer_discovery.printers, refresh)
+
+
+@app.get("/printers/{printer_name}/status")
+async def read_printer_status(printer_name: str):
+    if dispatcher is not None:
+        status = await dispatcher.printer_status(printer_name)
+    else:
+        status = printer_status.get(printer_name)
+        if status is not None:
+            status = {**status.to_dict(), "stale": printer_status.is_stale(status)}
+    if status is None:
+        raise HTTPException(status_code=404, detail="Printer status not available")
+    return status
+
+
+@app.get("/metrics")
+async def read_metrics():
+    """Prometheus text format: render, queue, write and job latencies, per-printer counters."""
+    text = REGISTRY.render()
+    if dispatcher is not None:
+        # This worker's own series (ticket rendering) are told apart by pid
+        text = merge_metrics(await dispatcher.metrics(),
+                             REGISTRY.render({"worker": str(os.getpid())}))
+    return Response(text, media_type=CONTENT_TYPE)
+
+
+@app.get("/jobs/{job_id}")
+async def read_job(job_id: str):
+    job = await dispatcher.get(job_id) if dispatcher is not None else print_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.get("/api/printer/jobs")
+async def list_pending_jobs(printer: Optional[str] = None,
+                            state: Optional[str] = None,
+                            limit: int = Query(100, ge=1, le=1000),
+                            cursor: Optional[str] = None):
+    """Pending jobs (queued, sending or waiting in the spooler) in arrival order.
+
+    One page per call; the next page's cursor is in the X-Next-Cursor header."""
+    if state is not None and state not in JOB_STATES:
+        raise HTTPException(status_code=400,
+                            detail=f"state must be one of {', '.join(JOB_STATES)}")
+    if cursor is not None and not cursor.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    after = int(cursor) if cursor is not None else None
+    if dispatcher is not None:
+        jobs, next_cursor = await dispatcher.pending_jobs(printer, state, after, limit)
+    else:
+        jobs, next_cursor = job_tracker.list(printer, state, after, limit)
+    # Plain JSON values already: skip jsonable_encoder, which costs more than the lookup
+    headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else None
+    return JSONResponse(jobs, headers=headers)
+
+
+@app.delete("/api/printer/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a job still in the queue, or delete it from the Windows spooler."""
+    try:
+        job = await (dispatcher or job_tracker).cancel(job_id)
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail="Job not found")
+    except JobNotCancellable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return job.to_dict()
+
+
+def _subscribe(printer: Optional[List[str]], job_id: Optional[List[str]],
+               type: Optional[List[str]], after: Optional[int]):
+    return event_bus.subscribe(printers=printer, jobs=job_id, types=type, after=after)
+
+
+@app.get("/events")
+async def stream_events(request: Request,
+                        printer: Optional[List[str]] = Query(None),
+                        job_id: Optional[List[str]] = Query(None),
+                        type: Optional[List[str]] = Query(None),
+                        after: Optional[int] = None):
+    """Server-Sent Events: job lifecycle (queued, sending, sent, printed, failed) and
+    printer status changes, optionally only for some printers, jobs or event types."""
+    last_event_id = request.headers.get("last-event-id", "")
+    if after is None and last_event_id.isdigit():
+        after = int(last_event_id)
+    subscription = _subscribe(printer, job_id, type, after)
+
+    async def stream():
+        try:
+            while True:
+                events = await subscription.get(EVENTS_HEARTBEAT)
+                if events is None:
+                    return
+                yield b"".join(event.sse() for event in events) if events else b": ping\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.websocket("/ws/events")
+async def websocket_events(websocket: WebSocket,
+                           printer: Optional[List[str]] = Query(None),
+                           job_id: Optional[List[str]] = Query(None),
+                           type: Optional[List[str]] = Query(None),
+                           after: Optional[int] = None):
+    """Same events as GET /events, one JSON text message each."""
+    await websocket.accept()
+    subscription = _subscribe(printer, job_id, type, after)
+
+    async def until_closed():
+        # Nothing is expected from the client; this only notices it leaving
+        try:
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        finally:
+            subscription.close()
+
+    watcher = asyncio.create_task(until_closed())
+    try:
+        while True:
+            events = await subscription.get()
+            if events is None:
+                break
+            for event in events:
+                await websocket.send_text(event.data.decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        watcher.cancel()
+        subscription.close()
+
 # -------------
 # UVICORN ENTRY
 # -------------
+# Development server; for several worker processes run serve.py instead.
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
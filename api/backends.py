@@ -0,0 +1,95 @@
+"""Backends de impresora que dependen de la plataforma, importados bajo demanda.
+
+Cada tipo de impresora tiene su propia dependencia opcional:
+
+    spooler   win32print (pywin32, solo Windows)
+    serial    serial (pyserial)
+
+El módulo se importa la primera vez que se usa una impresora de ese tipo, así
+que arrancar la API o importar GodexPrinter no paga por backends que no se
+usan ni falla en una plataforma donde no existen. `register` añade otros
+tipos sin tocar este archivo e `install` sustituye el módulo de un tipo (los
+simuladores de bench.py).
+
+    win32print = backends.load("spooler")      # None fuera de Windows
+    serial = backends.require("serial")        # RuntimeError si falta pyserial
+"""
+import importlib
+import logging
+import platform
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Backend:
+    __slots__ = ("kind", "module_name", "system", "module", "loaded", "error")
+
+    def __init__(self, kind: str, module_name: str, system: Optional[str] = None):
+        self.kind = kind
+        self.module_name = module_name
+        self.system = system
+        self.module: Any = None
+        self.loaded = False
+        self.error: Optional[str] = None
+
+
+_BACKENDS: Dict[str, Backend] = {}
+_lock = threading.Lock()
+
+
+def register(kind: str, module_name: str, system: Optional[str] = None) -> None:
+    """Declara el tipo `kind`, implementado por `module_name` (solo en `system` si se da)"""
+    _BACKENDS[kind] = Backend(kind, module_name, system)
+
+
+def _backend(kind: str) -> Backend:
+    backend = _BACKENDS.get(kind)
+    if backend is None:
+        raise ValueError(f"Backend de impresora desconocido: {kind}")
+    return backend
+
+
+def load(kind: str) -> Any:
+    """Módulo del backend, o None si no existe en esta plataforma o no está instalado"""
+    backend = _backend(kind)
+    if not backend.loaded:
+        with _lock:
+            if not backend.loaded:
+                if backend.system is not None and platform.system() != backend.system:
+                    backend.error = f"solo está disponible en {backend.system}"
+                else:
+                    try:
+                        backend.module = importlib.import_module(backend.module_name)
+                    except ImportError as e:
+                        backend.error = f"no se pudo importar {backend.module_name}: {e}"
+                        logger.warning(f"Backend {kind} no disponible: {backend.error}")
+                backend.loaded = True
+    return backend.module
+
+
+def require(kind: str) -> Any:
+    """Como `load`, pero lanza RuntimeError si el backend no está disponible"""
+    module = load(kind)
+    if module is None:
+        raise RuntimeError(f"{_backend(kind).module_name} {_backend(kind).error}")
+    return module
+
+
+def install(kind: str, module: Any) -> None:
+    """Usa `module` como backend de `kind` (None lo deshabilita)"""
+    backend = _backend(kind)
+    with _lock:
+        backend.module = module
+        backend.loaded = True
+        backend.error = None if module is not None else "deshabilitado"
+
+
+def loaded() -> List[str]:
+    """Tipos cuyo módulo ya está importado"""
+    return [kind for kind, backend in _BACKENDS.items() if backend.module is not None]
+
+
+register("spooler", "win32print", system="Windows")
+register("serial", "serial")
@@ -0,0 +1,1894 @@
+"""Benchmarks del servicio de impresión contra backends simulados.
+
+Uso (desde el directorio api/):
+    python bench.py queue --requests 500 --delay 0.2
+    python bench.py batch --sizes 1 10 100 1000
+    python bench.py template --iterations 100000 --reload-renders 200000
+    python bench.py pool --tickets 200 --open-cost 0.02
+    python bench.py scheduler --printers 1 2 4 6 --jobs 600
+    python bench.py serial --labels 50 --reply-delay 0.02
+    python bench.py discovery --ports 8 --silent 4 --timeout 1
+    python bench.py load --requests 1000 --concurrency 50 --transport tcp
+    python bench.py forms --labels 50 --baudrate 9600
+    python bench.py journal --jobs 5000 --concurrency 200
+    python bench.py items --sizes 10000 100000 1000000
+    python bench.py import --lines 1000000
+    python bench.py workers --workers 1 2 4 --requests 5000
+    python bench.py metrics --jobs 100000
+    python bench.py codes --tickets 2000
+    python bench.py graphics --iterations 50
+    python bench.py preview --previews 200
+    python bench.py overload --speed 20 --overload 10 --seconds 5 --sla 2
+    python bench.py startup --runs 5 --import-budget 1.0 --cold-start-budget 2.0
+    python bench.py seats --seats 500 --speed 200
+    python bench.py spool --jobs 5000 --limit 100 --cancels 200
+    python bench.py events --subscribers 1000 --slow 10 --jobs 500 --rate 50
+
+Los resultados se imprimen en JSON; con --output se guardan además en un
+archivo para comparar ejecuciones entre versiones.
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+import app as app_module
+import backends
+import metrics
+import print_queue
+from connections import NotSent
+from emulator import FakeWin32Print, PrinterEngine, SerialPrinterEmulator, TcpPrinterEmulator
+from item_store import ItemStore, _encode_cursor
+from job_journal import JobJournal
+from print_queue import JOB_DONE, PrintQueue
+from scheduler import PrinterScheduler
+from template_registry import TemplateRegistry
+from ticket_template import CompiledTemplate, adaptar_codigo
+
+# Each run gets its own journal so jobs left by a previous run aren't replayed
+if app_module.job_journal is not None:
+    app_module.job_journal.path = os.path.join(tempfile.mkdtemp(), "bench_jobs.db")
+
+TICKET = {
+    "seccion": "GENERAL",
+    "orden": "1A2B3C4D",
+    "precio": "300",
+    "tipo": "PREVENTA",
+    "fila": "1",
+    "asiento": "1",
+}
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    def pct(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    return {
+        "p50_ms": pct(50) * 1000,
+        "p95_ms": pct(95) * 1000,
+        "p99_ms": pct(99) * 1000,
+        "mean_ms": statistics.mean(ordered) * 1000,
+    }
+
+
+def _slow_printer(delay: float):
+    def send(raw, printer_name):
+        time.sleep(delay)
+    return send
+
+
+async def bench_queue(requests: int, delay: float) -> Dict:
+    """Latencia de POST /print con `requests` peticiones concurrentes y una impresora lenta"""
+    app_module._send_to_printer = _slow_printer(delay)
+    # Sin spooler la API no conoce BP500: se declara en lugar de descubrirla
+    app_module.printer_transports.configure("BP500", "spooler:BP500")
+    await app_module.print_queue.start()
+    transport = httpx.ASGITransport(app=app_module.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def one() -> float:
+                t0 = time.perf_counter()
+                r = await client.post("/print", json=TICKET)
+                r.raise_for_status()
+                return time.perf_counter() - t0
+
+            latencies = await asyncio.gather(*(one() for _ in range(requests)))
+    finally:
+        await app_module.print_queue.stop()
+    return {"benchmark": "queue", "requests": requests, "printer_delay_s": delay,
+            **_percentiles(latencies)}
+
+
+def bench_batch(sizes: List[int]) -> List[Dict]:
+    """Tickets/segundo por ticket individual frente a un único trabajo por lote"""
+    tickets = [app_module.TicketFields(**{**TICKET, "asiento": str(i)}) for i in range(max(sizes))]
+    results = []
+    for n in sizes:
+        batch = tickets[:n]
+        row = {"benchmark": "batch", "tickets": n}
+        for mode in ("per_ticket", "batch"):
+            fake = FakeWin32Print()
+            backends.install("spooler", fake)
+            app_module.printer_connections.close()
+            t0 = time.perf_counter()
+            if mode == "per_ticket":
+                for t in batch:
+                    app_module._send_to_printer(app_module._build_ticket(t), "BP500")
+            else:
+                app_module._send_to_printer(app_module._build_batch(batch), "BP500")
+            elapsed = time.perf_counter() - t0
+            row[f"{mode}_tickets_per_s"] = n / elapsed
+            row[f"{mode}_bytes"] = fake.bytes
+            row[f"{mode}_jobs"] = fake.jobs
+        results.append(row)
+    return results
+
+
+def _send_open_close(data: bytes, printer_name: str) -> None:
+    """Ruta anterior al pool: abre y cierra el handle en cada ticket"""
+    wp = backends.require("spooler")
+    handle = wp.OpenPrinter(printer_name)
+    try:
+        wp.StartDocPrinter(handle, 1, ("Etiqueta", None, "RAW"))
+        wp.StartPagePrinter(handle)
+        wp.WritePrinter(handle, data)
+        wp.EndPagePrinter(handle)
+        wp.EndDocPrinter(handle)
+    finally:
+        wp.ClosePrinter(handle)
+
+
+def bench_pool(tickets: int, open_cost: float) -> Dict:
+    """Tickets/segundo abriendo el handle por ticket frente al pool de conexiones"""
+    data = app_module._build_ticket(app_module.TicketFields(**TICKET))
+    result = {"benchmark": "pool", "tickets": tickets, "open_cost_s": open_cost}
+    for mode, send in (("open_close", _send_open_close), ("pooled", app_module._send_to_printer)):
+        backends.install("spooler", FakeWin32Print(open_cost=open_cost, job_cost=0.001))
+        app_module.printer_connections.close()
+        t0 = time.perf_counter()
+        for _ in range(tickets):
+            send(data, "BP500")
+        result[f"{mode}_tickets_per_s"] = tickets / (time.perf_counter() - t0)
+    app_module.printer_connections.close()
+    return result
+
+
+class FakeNetworkPrinter:
+    """Impresora asíncrona que imprime una etiqueta cada `seconds_per_label`"""
+
+    def __init__(self, seconds_per_label: float, fail: bool = False):
+        self.seconds_per_label = seconds_per_label
+        self.fail = fail
+        self.labels = 0
+        self._lock = None
+
+    async def send(self, data: bytes) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.fail:
+                raise NotSent("Sin conexión")
+            await asyncio.sleep(self.seconds_per_label)
+            self.labels += 1
+
+
+async def bench_scheduler(printer_counts: List[int], jobs: int) -> List[Dict]:
+    """Etiquetas/segundo de un grupo de impresoras de velocidades mixtas"""
+    speeds = [0.01, 0.02, 0.04]
+    results = []
+    for count in printer_counts:
+        printers = {f"p{i}": FakeNetworkPrinter(speeds[i % len(speeds)]) for i in range(count)}
+        # Una impresora extra nunca conecta para forzar el failover
+        printers["broken"] = FakeNetworkPrinter(0.0, fail=True)
+
+        async def send(data, name):
+            await printers[name].send(data)
+
+        scheduler = PrinterScheduler(send, retry_after=3600)
+        scheduler.configure_group("gate-A", list(printers))
+        queue = PrintQueue(scheduler.send, workers=len(printers))
+        await queue.start()
+        t0 = time.perf_counter()
+        submitted = [queue.submit(b"label", "gate-A") for _ in range(jobs)]
+        await queue.join()
+        elapsed = time.perf_counter() - t0
+        await queue.stop()
+        results.append({
+            "benchmark": "scheduler",
+            "printers": count,
+            "jobs": jobs,
+            "done": sum(1 for j in submitted if j.status == JOB_DONE),
+            "labels_per_s": jobs / elapsed,
+            "ideal_labels_per_s": sum(1 / p.seconds_per_label
+                                      for n, p in printers.items() if n != "broken"),
+            "per_printer": {n: p.labels for n, p in printers.items()},
+        })
+    return results
+
+
+def bench_serial(labels: int, reply_delay: float) -> List[Dict]:
+    """Etiquetas/segundo por serial con verificación de status síncrona, asíncrona o sin ella"""
+    import GodexPrinter
+
+    logging.getLogger("GodexPrinter").setLevel(logging.WARNING)
+    product = {"name": "PRODUCTO DEMO", "price": "25.50", "barcode": "7501234567890"}
+    results = []
+    for mode, verify, async_verify in (("sync", True, False), ("async", True, True),
+                                       ("off", False, False)):
+        fake = SerialPrinterEmulator(PrinterEngine(labels_per_second=1000,
+                                                   reply_delay=reply_delay))
+        manager = GodexPrinter.GodexPrinterManager(verify_status=verify, async_verify=async_verify)
+        manager.connect_serial(fake.port)
+        t0 = time.perf_counter()
+        for _ in range(labels):
+            manager.print_57x70_ticket(product)
+        send_elapsed = time.perf_counter() - t0
+        t1 = time.perf_counter()
+        status = manager.get_printer_status()
+        status_s = time.perf_counter() - t1
+        manager.disconnect()
+        fake.close()
+        results.append({"benchmark": "serial", "verify": mode, "labels": labels,
+                        "reply_delay_s": reply_delay, "labels_per_s": labels / send_elapsed,
+                        "status_latency_ms": status_s * 1000, "status": status})
+    return results
+
+
+def bench_discovery(ports: int, silent: int, timeout: float) -> Dict:
+    """Sondeo secuencial de puertos (test_serial_connection) frente al descubrimiento paralelo"""
+    import GodexPrinter
+    from discovery import PrinterDiscovery
+
+    logging.getLogger("GodexPrinter").setLevel(logging.CRITICAL)
+    logging.getLogger("discovery").setLevel(logging.CRITICAL)
+    fakes = [SerialPrinterEmulator(PrinterEngine(reply_delay=0.01,
+                                                 status_code=None if i < silent else "00"))
+             for i in range(ports)]
+    infos = [SimpleNamespace(device=f.port, description="USB Serial Port", hwid=f"PTY{i}")
+             for i, f in enumerate(fakes)]
+    discovery = PrinterDiscovery(probe_timeout=timeout, list_ports=lambda: infos)
+    manager = GodexPrinter.GodexPrinterManager(discovery=discovery)
+    try:
+        t0 = time.perf_counter()
+        sequential = [i.device for i in infos if manager.test_serial_connection(i.device)]
+        sequential_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        parallel = discovery.responding_serial_ports()
+        parallel_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        discovery.printers()
+        cached_s = time.perf_counter() - t0
+    finally:
+        for f in fakes:
+            f.close()
+    return {"benchmark": "discovery", "ports": ports, "silent": silent,
+            "probe_timeout_s": timeout, "sequential_s": sequential_s,
+            "parallel_s": parallel_s, "cached_ms": cached_s * 1000,
+            "found": len(parallel), "same_result": sorted(sequential) == sorted(parallel)}
+
+
+async def _run_concurrently(count: int, concurrency: int,
+                            call: Callable[[int], Awaitable[None]]) -> List[float]:
+    """Ejecuta `call(i)` `count` veces con a lo sumo `concurrency` en vuelo; devuelve latencias"""
+    latencies: List[float] = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        async with limit:
+            t0 = time.perf_counter()
+            await call(i)
+            latencies.append(time.perf_counter() - t0)
+
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return latencies
+
+
+def _emulated_printer(speed: float, baudrate: Optional[int] = None) -> PrinterEngine:
+    # 8N1: 10 bits por byte en el cable
+    return PrinterEngine(labels_per_second=speed,
+                         wire_bytes_per_second=baudrate / 10 if baudrate else None)
+
+
+def _start_emulator(transport: str, engine: PrinterEngine):
+    if transport == "tcp":
+        return TcpPrinterEmulator(engine)
+    return SerialPrinterEmulator(engine)
+
+
+async def _load_print(client: httpx.AsyncClient, requests: int, concurrency: int,
+                      transport: str, speed: float, baudrate: Optional[int]) -> Dict:
+    """POST /print hasta que el emulador imprime la última etiqueta"""
+    emulator = _start_emulator(transport, _emulated_printer(speed, baudrate))
+    app_module.printer_transports.configure("EMU", emulator.uri)
+    queue = app_module.print_queue
+    await queue.start()
+    job_ids = []
+    try:
+        async def call(i: int) -> None:
+            r = await client.post("/print", json={**TICKET, "asiento": str(i),
+                                                  "printer_name": "EMU"})
+            r.raise_for_status()
+            job_ids.append(r.json()["job_id"])
+
+        t0 = time.perf_counter()
+        latencies = await _run_concurrently(requests, concurrency, call)
+        accepted_s = time.perf_counter() - t0
+        await queue.join()
+        printed = await asyncio.get_running_loop().run_in_executor(
+            None, emulator.engine.wait_printed, requests, 60 + requests / speed)
+        elapsed = time.perf_counter() - t0
+    finally:
+        await queue.stop()
+        await app_module.printer_transports.close()
+        emulator.close()
+    jobs = [queue.get(job_id) for job_id in job_ids]
+    stats = emulator.engine.stats()
+    return {
+        "requests": requests,
+        "requests_per_s": requests / accepted_s,
+        "labels_per_s": stats["labels_printed"] / elapsed,
+        "all_printed": printed,
+        "failed_jobs": sum(1 for j in jobs if j is None or j.status != JOB_DONE),
+        "request": _percentiles(latencies),
+        "job": _percentiles([j.finished_at - j.created_at for j in jobs
+                             if j is not None and j.finished_at]),
+        "bytes_on_wire": stats["bytes_received"],
+        "bytes_per_label": stats["bytes_received"] / max(stats["labels_received"], 1),
+        "printer": stats,
+    }
+
+
+def _temp_item_store() -> ItemStore:
+    return ItemStore("sqlite:///" + os.path.join(tempfile.mkdtemp(), "items.db"))
+
+
+async def _load_items(client: httpx.AsyncClient, requests: int, concurrency: int) -> Dict:
+    """Ciclo completo crear/leer/actualizar/listar/borrar por cada item"""
+    app_module.item_store = _temp_item_store()
+    by_route: Dict[str, List[float]] = {"create": [], "read": [], "update": [],
+                                        "list": [], "delete": []}
+
+    async def timed(route: str, request: Awaitable[httpx.Response]) -> None:
+        t0 = time.perf_counter()
+        r = await request
+        by_route[route].append(time.perf_counter() - t0)
+        r.raise_for_status()
+
+    async def call(i: int) -> None:
+        item = {"id": i, "name": f"item-{i}", "description": "bench"}
+        await timed("create", client.post("/items", json=item))
+        await timed("read", client.get(f"/items/{i}"))
+        await timed("update", client.put(f"/items/{i}", json={**item, "name": f"upd-{i}"}))
+        if i % 10 == 0:
+            await timed("list", client.get("/items"))
+        await timed("delete", client.delete(f"/items/{i}"))
+
+    t0 = time.perf_counter()
+    await _run_concurrently(requests, concurrency, call)
+    elapsed = time.perf_counter() - t0
+    operations = sum(len(v) for v in by_route.values())
+    return {"items": requests, "operations": operations, "operations_per_s": operations / elapsed,
+            **{route: _percentiles(samples) for route, samples in by_route.items() if samples}}
+
+
+def _load_manager(requests: int, concurrency: int, transport: str, speed: float,
+                  baudrate: Optional[int], stored_forms: bool = False) -> Dict:
+    """GodexPrinterManager.print_57x70_ticket desde `concurrency` hilos"""
+    import GodexPrinter
+
+    logging.getLogger("GodexPrinter").setLevel(logging.WARNING)
+    emulator = _start_emulator(transport, _emulated_printer(speed, baudrate))
+    manager = GodexPrinter.GodexPrinterManager(verify_status=False, stored_forms=stored_forms)
+    if transport == "tcp":
+        connected = manager.connect_network(emulator.host, emulator.port)
+    else:
+        connected = manager.connect_serial(emulator.port)
+    if not connected:
+        raise RuntimeError(f"No se pudo conectar al emulador {emulator.uri}")
+    product = {"name": "PRODUCTO DEMO", "price": "25.50", "barcode": "7501234567890"}
+
+    def call(_) -> float:
+        t0 = time.perf_counter()
+        if not manager.print_57x70_ticket(product):
+            raise RuntimeError("print_57x70_ticket devolvió False")
+        return time.perf_counter() - t0
+
+    try:
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(call, range(requests)))
+        sent_s = time.perf_counter() - t0
+        printed = emulator.engine.wait_printed(requests, 60 + requests / speed)
+        elapsed = time.perf_counter() - t0
+    finally:
+        manager.disconnect()
+        emulator.close()
+    stats = emulator.engine.stats()
+    return {
+        "requests": requests,
+        "calls_per_s": requests / sent_s,
+        "labels_per_s": stats["labels_printed"] / elapsed,
+        "all_printed": printed,
+        "call": _percentiles(latencies),
+        "bytes_on_wire": stats["bytes_received"],
+        "bytes_per_label": stats["bytes_received"] / max(stats["labels_received"], 1),
+        "printer": stats,
+    }
+
+
+async def bench_load(requests: int, concurrency: int, transport: str, speed: float,
+                     scenarios: List[str], baudrate: Optional[int] = None) -> Dict:
+    """Carga sobre la app en proceso con impresoras Godex emuladas (TCP RAW o pty serial)"""
+    logging.getLogger("print_queue").setLevel(logging.WARNING)
+    result = {"benchmark": "load", "transport": transport, "concurrency": concurrency,
+              "printer_labels_per_s": speed, "baudrate": baudrate, "scenarios": {}}
+    transport_ = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport_, base_url="http://bench") as client:
+        if "print" in scenarios:
+            result["scenarios"]["print"] = await _load_print(client, requests, concurrency,
+                                                             transport, speed, baudrate)
+        if "items" in scenarios:
+            result["scenarios"]["items"] = await _load_items(client, requests, concurrency)
+    if "manager" in scenarios:
+        loop = asyncio.get_running_loop()
+        result["scenarios"]["manager"] = await loop.run_in_executor(
+            None, _load_manager, requests, concurrency, transport, speed, baudrate)
+    return result
+
+
+async def bench_forms(labels: int, baudrate: int, speed: float) -> List[Dict]:
+    """Bytes por etiqueta y etiquetas/s con el layout completo frente a formularios guardados"""
+    logging.getLogger("print_queue").setLevel(logging.WARNING)
+    forms = app_module.printer_forms
+    results = []
+
+    def row(path: str, stored_forms: bool, run: Dict) -> Dict:
+        return {"benchmark": "forms", "path": path, "stored_forms": stored_forms,
+                "labels": labels, "baudrate": baudrate, "labels_per_s": run["labels_per_s"],
+                "bytes_per_label": run["bytes_per_label"], "all_printed": run["all_printed"]}
+
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for enabled in (False, True):
+            forms.enabled = enabled
+            forms.invalidate()
+            run = await _load_print(client, labels, 10, "serial", speed, baudrate)
+            results.append(row("print", enabled, run))
+    forms.enabled = False
+
+    loop = asyncio.get_running_loop()
+    for enabled in (False, True):
+        run = await loop.run_in_executor(None, _load_manager, labels, 1, "serial", speed,
+                                         baudrate, enabled)
+        results.append(row("print_57x70_ticket", enabled, run))
+    return results
+
+
+async def bench_journal(jobs: int, concurrency: int) -> List[Dict]:
+    """Escrituras/s del diario con group commit frente a un commit por escritura"""
+    results = []
+    for mode, max_batch in (("commit_per_write", 1), ("group_commit", 5000)):
+        path = os.path.join(tempfile.mkdtemp(), "journal.db")
+        journal = JobJournal(path, max_batch=max_batch)
+        journal.open()
+        payload = app_module._build_ticket(app_module.TicketFields(**TICKET))
+
+        async def one(i: int) -> None:
+            job_id = f"job-{i}"
+            await journal.accepted(job_id, "BP500", payload, idempotency_key=job_id)
+            await journal.sent(job_id)
+            journal.confirmed(job_id)
+
+        t0 = time.perf_counter()
+        latencies = await _run_concurrently(jobs, concurrency, one)
+        journal.close()
+        elapsed = time.perf_counter() - t0
+        results.append({"benchmark": "journal", "mode": mode, "jobs": jobs,
+                        "concurrency": concurrency, "writes": journal.writes,
+                        "commits": journal.commits, "writes_per_s": journal.writes / elapsed,
+                        "jobs_per_s": jobs / elapsed, "job": _percentiles(latencies)})
+    return results
+
+
+async def bench_items(sizes: List[int], samples: int) -> List[Dict]:
+    """Latencia de lectura y listado de /items con catálogos de distintos tamaños"""
+    results = []
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for size in sizes:
+            store = app_module.item_store = _temp_item_store()
+            t0 = time.perf_counter()
+            chunk = 10000
+            for start in range(0, size, chunk):
+                store.upsert_many({"id": i, "name": f"item-{i:07d}", "description": "bench"}
+                                  for i in range(start, min(start + chunk, size)))
+            load_s = time.perf_counter() - t0
+
+            async def timed(path: str, **params) -> float:
+                t = time.perf_counter()
+                r = await client.get(path, params=params)
+                r.raise_for_status()
+                return time.perf_counter() - t
+
+            row = {"benchmark": "items", "items": size, "insert_rows_per_s": size / load_s}
+            ids = [random.randrange(size) for _ in range(samples)]
+            row["read"] = _percentiles([await timed(f"/items/{i}") for i in ids])
+            row["list_first_page"] = _percentiles(
+                [await timed("/items", limit=100) for _ in range(samples)])
+            row["list_deep_page"] = _percentiles(
+                [await timed("/items", limit=100, cursor=_encode_cursor(i)) for i in ids])
+            prefixes = [f"item-{i:07d}"[:-2] for i in ids]
+            row["list_prefix"] = _percentiles(
+                [await timed("/items", limit=100, prefix=p) for p in prefixes])
+            results.append(row)
+            store.close()
+    return results
+
+
+def _rss_bytes() -> int:
+    """RSS actual del proceso (pico histórico si no hay /proc)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _RssSampler:
+    """Pico de RSS durante un bloque `with`, muestreado en un hilo"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self) -> "_RssSampler":
+        self.baseline = self.peak = _rss_bytes()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+
+def _serve_app() -> Tuple:
+    """Levanta la app en uvicorn en un hilo; ASGITransport acumula el cuerpo entero"""
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(app_module.app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+async def _ndjson_lines(lines: int, line: Callable[[int], Dict]):
+    batch = []
+    for i in range(lines):
+        batch.append(json.dumps(line(i)))
+        if len(batch) == 1000:
+            yield ("\n".join(batch) + "\n").encode()
+            batch = []
+    if batch:
+        yield ("\n".join(batch) + "\n").encode()
+
+
+async def bench_import(lines: int, scenarios: List[str]) -> List[Dict]:
+    """Filas/s y pico de RSS de /items/import y /print/import con `lines` líneas"""
+    async def discard(data, printer_name):
+        return None
+
+    generators = {
+        "items": ("/items/import",
+                  lambda i: {"id": i, "name": f"item-{i:07d}", "description": "bench"}),
+        "print": ("/print/import",
+                  lambda i: {**TICKET, "asiento": str(i), "printer_name": "BP500"}),
+    }
+    app_module.item_store = _temp_item_store()
+    app_module.print_queue = PrintQueue(discard, workers=4, journal=JobJournal(
+        os.path.join(tempfile.mkdtemp(), "print_jobs.db")))
+    server, thread, base_url = _serve_app()
+    results = []
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+            for scenario in scenarios:
+                path, line = generators[scenario]
+                ok = errors = 0
+                with _RssSampler() as rss:
+                    t0 = time.perf_counter()
+                    async with client.stream("POST", path, content=_ndjson_lines(lines, line),
+                                             headers={"Content-Type": "application/x-ndjson"}) as r:
+                        r.raise_for_status()
+                        async for text in r.aiter_lines():
+                            if text.startswith('{"summary"'):
+                                summary = json.loads(text)["summary"]
+                                ok, errors = summary["ok"], summary["errors"]
+                    elapsed = time.perf_counter() - t0
+                results.append({"benchmark": "import", "endpoint": path, "lines": lines,
+                                "ok": ok, "errors": errors, "rows_per_s": lines / elapsed,
+                                "elapsed_s": elapsed, "rss_before_mb": rss.baseline / 2 ** 20,
+                                "rss_peak_mb": rss.peak / 2 ** 20,
+                                "rss_growth_mb": (rss.peak - rss.baseline) / 2 ** 20})
+    finally:
+        server.should_exit = True
+        thread.join()
+        app_module.item_store.close()
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_http(base_url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(base_url + "/docs")
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"El servidor no respondió en {base_url}")
+
+
+async def _keepalive_posts(host: str, port: int, path: str, bodies: List[bytes],
+                           at: Optional[List[float]] = None) -> List[float]:
+    """POSTs secuenciales por una conexión keep-alive, sin el coste de un cliente completo.
+
+    Con `at`, cada POST espera a su instante (`time.perf_counter()`) antes de enviarse.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    latencies = []
+    try:
+        for i, body in enumerate(bodies):
+            if at is not None:
+                await asyncio.sleep(at[i] - time.perf_counter())
+            t0 = time.perf_counter()
+            writer.write(f"POST {path} HTTP/1.1\r\nHost: {host}\r\n"
+                         f"Content-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            status = int(head.split(b" ", 2)[1])
+            length = next(int(line.split(b":", 1)[1]) for line in head.split(b"\r\n")
+                          if line.lower().startswith(b"content-length:"))
+            await reader.readexactly(length)
+            if status >= 300:
+                raise RuntimeError(f"POST {path}: HTTP {status}")
+            latencies.append(time.perf_counter() - t0)
+    finally:
+        writer.close()
+    return latencies
+
+
+def _post_prints(args) -> List[float]:
+    """Proceso generador de carga: `concurrency` conexiones haciendo POST /print"""
+    port, requests, concurrency, offset = args
+    bodies = [json.dumps({**TICKET, "asiento": str(offset + i), "printer_name": "EMU"}).encode()
+              for i in range(requests)]
+
+    async def run() -> List[float]:
+        runs = await asyncio.gather(*(
+            _keepalive_posts("127.0.0.1", port, "/print", bodies[c::concurrency])
+            for c in range(concurrency)))
+        return [latency for run in runs for latency in run]
+
+    return asyncio.run(run())
+
+
+def bench_workers(worker_counts: List[int], requests: int, concurrency: int,
+                  clients: int, speed: float) -> List[Dict]:
+    """POST /print/s con N workers de la API y un despachador, contra una impresora TCP emulada
+
+    `single` es `uvicorn app:app` en un solo proceso, sin despachador.
+    """
+    import multiprocessing
+
+    results = []
+    for workers in ["single"] + worker_counts:
+        emulator = TcpPrinterEmulator(_emulated_printer(speed))
+        workdir = tempfile.mkdtemp()
+        port = _free_port()
+        env = {**os.environ, "PRINTER_TRANSPORTS": f"EMU={emulator.uri}",
+               "JOB_JOURNAL": os.path.join(workdir, "print_jobs.db"),
+               "ITEMS_DB": "sqlite:///" + os.path.join(workdir, "items.db")}
+        if workers == "single":
+            command = [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port),
+                       "--log-level", "warning"]
+        else:
+            env["PRINT_DISPATCHER_ADDRESS"] = "tcp://127.0.0.1:%d" % _free_port()
+            command = [sys.executable, "serve.py", "--workers", str(workers),
+                       "--host", "127.0.0.1", "--port", str(port)]
+        server = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            _wait_http(base_url)
+            per_client = requests // clients
+            t0 = time.perf_counter()
+            with multiprocessing.Pool(clients) as pool:
+                latencies = [latency for chunk in pool.map(
+                    _post_prints, [(port, per_client, concurrency, c * per_client)
+                                   for c in range(clients)]) for latency in chunk]
+            accepted_s = time.perf_counter() - t0
+            printed = emulator.engine.wait_printed(per_client * clients, 60 + requests / speed)
+            elapsed = time.perf_counter() - t0
+        finally:
+            server.terminate()
+            server.wait(60)
+            emulator.close()
+        stats = emulator.engine.stats()
+        results.append({"benchmark": "workers", "workers": workers, "cpus": os.cpu_count(),
+                        "requests": per_client * clients, "clients": clients,
+                        "concurrency": concurrency, "requests_per_s": len(latencies) / accepted_s,
+                        "labels_per_s": stats["labels_printed"] / elapsed,
+                        "all_printed": printed, "request": _percentiles(latencies)})
+    return results
+
+
+def _server_cpu_seconds(pid: int) -> Optional[float]:
+    """CPU de usuario + sistema de un proceso (solo Linux)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def _open_sse(port: int, receive_buffer: Optional[int] = None):
+    """Conexión a GET /events ya con la cabecera de la respuesta leída"""
+    sock = None
+    if receive_buffer:
+        # Un búfer pequeño hace que el servidor note pronto al cliente que no lee
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock, ("127.0.0.1", port))
+        reader, writer = await asyncio.open_connection(sock=sock)
+    else:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /events HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n")
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    if not head.startswith(b"HTTP/1.1 200"):
+        status = head.split(b"\r\n", 1)[0].decode()
+        raise RuntimeError(f"GET /events: {status}")
+    return reader, writer
+
+
+async def _sse_subscriber(port: int, jobs: int, deadline: float, sample: int) -> Dict:
+    """Lee eventos hasta ver `jobs` trabajos impresos o hasta `deadline` (time.time()).
+
+    Solo se decodifica uno de cada `sample` eventos para medir la latencia de
+    entrega (recepción menos el `time` del evento); el resto se cuenta.
+    """
+    reader, writer = await _open_sse(port)
+    received = printed = dropped = 0
+    latencies = []
+    pending = b""
+    try:
+        while printed < jobs:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                data = await asyncio.wait_for(reader.read(65536), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not data:
+                break
+            now = time.time()
+            *frames, pending = (pending + data).split(b"\n\n")
+            for frame in frames:
+                # Las líneas de tamaño del chunked encoding no empiezan por "data: "
+                start = frame.find(b"data: ")
+                if start < 0:
+                    continue
+                line = frame[start + 6:]
+                received += 1
+                if b'"type": "dropped"' in line:
+                    dropped += json.loads(line)["count"]
+                elif b'"event": "printed"' in line:
+                    printed += 1
+                if received % sample == 0:
+                    latencies.append(now - json.loads(line)["time"])
+    finally:
+        writer.close()
+    return {"received": received, "printed": printed, "dropped": dropped,
+            "latencies": latencies}
+
+
+def _sse_subscribers(args) -> List[Dict]:
+    """Proceso con `count` suscriptores SSE"""
+    port, count, jobs, deadline, sample = args
+
+    async def run() -> List[Dict]:
+        return await asyncio.gather(*(_sse_subscriber(port, jobs, deadline, sample)
+                                      for _ in range(count)))
+
+    return asyncio.run(run())
+
+
+def _gauge_value(base_url: str, name: str) -> float:
+    for line in httpx.get(base_url + "/metrics").text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[1])
+    raise RuntimeError(f"/metrics no tiene {name}")
+
+
+def bench_events(subscribers: int, slow: int, jobs: int, rate: float, speed: float,
+                 clients: int, sample: int, buffer: int) -> List[Dict]:
+    """Eventos SSE a `subscribers` clientes mientras se imprimen `jobs` trabajos a `rate`/s
+
+    Primero sin suscriptores (línea base) y después con ellos y con `slow`
+    clientes que no leen hasta el final, cuando recogen el aviso de
+    descartados. Se mide la latencia de entrega, si cada cliente recibió la
+    impresión de todos los trabajos, la latencia de POST /print, la CPU del
+    servidor y los eventos descartados. Antes de descartar nada, el servidor
+    llena los búferes del socket de un cliente lento (cientos de KB en
+    loopback); `buffer` es EVENTS_BUFFER. La API corre con uvicorn en un
+    proceso aparte contra un emulador TCP.
+    """
+    import multiprocessing
+
+    # Cada suscriptor es un descriptor en el servidor y otro en los clientes
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = subscribers + slow + 1024
+    if soft < needed and (hard == resource.RLIM_INFINITY or hard > soft):
+        resource.setrlimit(resource.RLIMIT_NOFILE,
+                           (needed if hard == resource.RLIM_INFINITY else min(needed, hard), hard))
+
+    results = []
+    for count, slow_count in ((0, 0), (subscribers, slow)):
+        emulator = TcpPrinterEmulator(_emulated_printer(speed))
+        workdir = tempfile.mkdtemp()
+        port = _free_port()
+        env = {**os.environ, "PRINTER_TRANSPORTS": f"EMU={emulator.uri}",
+               "STATUS_POLL_INTERVAL": "0.5", "DISCOVERY_WARMUP": "0",
+               "EVENTS_BUFFER": str(buffer),
+               "JOB_JOURNAL": os.path.join(workdir, "print_jobs.db"),
+               "ITEMS_DB": "sqlite:///" + os.path.join(workdir, "items.db")}
+        command = [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port),
+                   "--log-level", "warning"]
+        server = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base_url = f"http://127.0.0.1:{port}"
+        bodies = [json.dumps({**TICKET, "asiento": str(i), "printer_name": "EMU"}).encode()
+                  for i in range(jobs)]
+        connections = max(1, min(20, int(rate)))
+        try:
+            _wait_http(base_url)
+            deadline = time.time() + jobs / rate + jobs / speed + 300
+            with multiprocessing.Pool(clients) as pool:
+                shares = [count // clients + (c < count % clients) for c in range(clients)]
+                pending = pool.map_async(_sse_subscribers,
+                                         [(port, share, jobs, deadline, sample)
+                                          for share in shares if share])
+
+                async def traffic() -> Tuple[List[float], float, List[int]]:
+                    stalled = [await _open_sse(port, receive_buffer=4096)
+                               for _ in range(slow_count)]
+                    wait_until = time.monotonic() + 60
+                    while _gauge_value(base_url, "event_subscribers") < count + slow_count:
+                        if time.monotonic() > wait_until:
+                            raise RuntimeError("Los suscriptores no llegaron a conectarse")
+                        await asyncio.sleep(0.2)
+                    cpu0 = _server_cpu_seconds(server.pid)
+                    start = time.perf_counter() + 0.1
+                    at = [start + i / rate for i in range(jobs)]
+                    runs = await asyncio.gather(*(
+                        _keepalive_posts("127.0.0.1", port, "/print",
+                                         bodies[c::connections], at[c::connections])
+                        for c in range(connections)))
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(None, emulator.engine.wait_printed,
+                                               jobs, 60 + jobs / speed)
+                    # Tiempo para que el sondeo vea la impresora en reposo
+                    await asyncio.sleep(1.5)
+                    cpu = _server_cpu_seconds(server.pid)
+                    # Los lentos leen por fin lo que les quedó: el aviso de descartados
+                    notified = []
+                    for reader, writer in stalled:
+                        data = b""
+                        try:
+                            while True:
+                                data += await asyncio.wait_for(reader.read(1 << 20), 0.5)
+                        except asyncio.TimeoutError:
+                            pass
+                        writer.close()
+                        notified.append((len(data), sum(
+                            json.loads(line[6:])["count"] for line in data.split(b"\n")
+                            if line.startswith(b'data: {"type": "dropped"'))))
+                    cpu_s = cpu - cpu0 if cpu is not None and cpu0 is not None else None
+                    return [lat for run in runs for lat in run], cpu_s, notified
+
+                latencies, cpu_s, notified = asyncio.run(traffic())
+                stats = pending.get(deadline - time.time() + 30) if count else []
+        finally:
+            server.terminate()
+            server.wait(60)
+            emulator.close()
+        subs = [s for chunk in stats for s in chunk]
+        delivered = sum(s["received"] for s in subs)
+        results.append({
+            "benchmark": "events", "subscribers": count, "slow_subscribers": slow_count,
+            "jobs": jobs, "rate": rate, "buffer": buffer,
+            "request": _percentiles(latencies),
+            "server_cpu_s": cpu_s,
+            "events_delivered": delivered,
+            "events_per_s": delivered / (jobs / rate) if count else 0,
+            "complete_subscribers": sum(1 for s in subs if s["printed"] >= jobs and not s["dropped"]),
+            "printed_seen_min": min((s["printed"] for s in subs), default=0),
+            "subscribers_with_drops": sum(1 for s in subs if s["dropped"]),
+            "subscriber_dropped": sum(s["dropped"] for s in subs),
+            "delivery": _percentiles([lat for s in subs for lat in s["latencies"]])
+            if count else None,
+            # Lo que absorben los búferes del socket no cuenta como descartado
+            "slow_buffered_bytes": max((n for n, _ in notified), default=0),
+            "slow_dropped": sum(d for _, d in notified),
+            "slow_notified": sum(1 for _, d in notified if d),
+        })
+    return results
+
+
+def _enumerated_page(limit: int) -> List[Dict]:
+    """Línea base: enumerar el spooler entero en cada petición y quedarse con una página"""
+    win32print = backends.require("spooler")
+    with app_module.printer_connections.connection("BP500") as conn:
+        count = win32print.GetPrinter(conn.handle, 2)["cJobs"]
+        jobs = win32print.EnumJobs(conn.handle, 0, count, 1)
+    return sorted(jobs, key=lambda job: job["Position"])[:limit]
+
+
+async def bench_spool(jobs: int, limit: int, cancels: int, print_cost: float) -> Dict:
+    """GET/DELETE /api/printer/jobs con miles de trabajos pendientes en un spooler simulado.
+
+    Los trabajos pasan enseguida de la cola al spooler, que imprime uno cada
+    `print_cost` s, así que casi todos esperan ahí. La página del índice se
+    compara con enumerar el spooler en cada petición. Después se cancelan
+    `cancels` trabajos del spooler y otros tantos que siguen en la cola, y
+    se espera a que el sondeo vacíe el índice al terminar de imprimir.
+    """
+    logging.getLogger("print_queue").setLevel(logging.WARNING)
+    logging.getLogger("job_tracker").setLevel(logging.WARNING)
+    fake = FakeWin32Print(open_cost=0, job_cost=0, bytes_per_sec=1e12, print_cost=print_cost)
+    backends.install("spooler", fake)
+    app_module.printer_connections.close()
+    app_module.printer_status.interval = 0.5
+    tracker = app_module.job_tracker
+    queue = app_module.print_queue
+    loop = asyncio.get_running_loop()
+    result: Dict = {"benchmark": "spool", "jobs": jobs, "limit": limit,
+                    "print_cost_s": print_cost}
+    await queue.start()
+    await app_module.printer_status.start()
+    transport = httpx.ASGITransport(app=app_module.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def post(i: int) -> None:
+                r = await client.post("/print", json={**TICKET, "asiento": str(i)})
+                r.raise_for_status()
+
+            await _run_concurrently(jobs, 50, post)
+            await queue.join()
+            result["pending_in_spooler"] = len(fake.queue)
+            result["tracked"] = len(tracker)
+
+            # Sin el sondeo, cualquier enumeración sería de los listados
+            await app_module.printer_status.stop()
+            enumerations = fake.enumerations
+            latencies = []
+            for _ in range(200):
+                t0 = time.perf_counter()
+                r = await client.get("/api/printer/jobs", params={"limit": limit})
+                r.raise_for_status()
+                latencies.append(time.perf_counter() - t0)
+            result["first_page"] = _percentiles(latencies)
+
+            # Todas las páginas, siguiendo X-Next-Cursor
+            t0 = time.perf_counter()
+            listed, pages, cursor = 0, 0, None
+            while True:
+                params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+                r = await client.get("/api/printer/jobs", params=params)
+                r.raise_for_status()
+                listed += len(r.json())
+                pages += 1
+                cursor = r.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    break
+            result["full_walk"] = {"pages": pages, "jobs": listed,
+                                   "ms": (time.perf_counter() - t0) * 1000}
+            result["enumerations_by_listing"] = fake.enumerations - enumerations
+            await app_module.printer_status.start()
+
+            # Misma página sin HTTP: el índice frente a enumerar el spooler
+            latencies = []
+            for _ in range(200):
+                t0 = time.perf_counter()
+                tracker.list(limit=limit)
+                latencies.append(time.perf_counter() - t0)
+            result["index_page"] = _percentiles(latencies)
+            latencies = []
+            for _ in range(50):
+                t0 = time.perf_counter()
+                await loop.run_in_executor(None, _enumerated_page, limit)
+                latencies.append(time.perf_counter() - t0)
+            result["enumerate_per_request"] = _percentiles(latencies)
+
+            t0 = time.perf_counter()
+            await loop.run_in_executor(None, app_module._spooler_status, "BP500")
+            result["poll_refresh_ms"] = (time.perf_counter() - t0) * 1000
+
+            # Cancelar los últimos del spooler (aún no impresos)
+            spooled, _ = tracker.list(state="spooled", limit=len(tracker))
+            targets = [job["job_id"] for job in spooled[-cancels:]]
+            spool_ids = {i for job in spooled[-cancels:] for i in job["spool_job_ids"]}
+            latencies = []
+            for job_id in targets:
+                t0 = time.perf_counter()
+                r = await client.delete(f"/api/printer/jobs/{job_id}")
+                r.raise_for_status()
+                latencies.append(time.perf_counter() - t0)
+            result["cancel_spooled"] = {**_percentiles(latencies),
+                                        "left_in_spooler": len(spool_ids & set(fake.queue))}
+
+            # Cancelar trabajos que siguen en nuestra cola: un envío lento los retiene
+            fake.job_cost = 0.01
+            sent_before = fake.jobs
+            accepted = []
+            for i in range(cancels * 2):
+                r = await client.post("/print", json={**TICKET, "asiento": str(jobs + i)})
+                accepted.append(r.json()["job_id"])
+            latencies, refused = [], 0
+            for job_id in accepted[-cancels:]:
+                t0 = time.perf_counter()
+                r = await client.delete(f"/api/printer/jobs/{job_id}")
+                latencies.append(time.perf_counter() - t0)
+                refused += r.status_code == 409
+            await queue.join()
+            result["cancel_queued"] = {**_percentiles(latencies), "refused": refused,
+                                       "sent_to_spooler": fake.jobs - sent_before}
+            r = await client.delete(f"/api/printer/jobs/{accepted[-1]}")
+            result["cancel_again_status"] = r.status_code
+
+            # Al imprimirse todo, el sondeo vacía el índice
+            t0 = time.perf_counter()
+            deadline = t0 + jobs * print_cost + 10
+            while len(tracker) and time.perf_counter() < deadline:
+                await asyncio.sleep(0.1)
+            result["tracked_after_printing"] = len(tracker)
+            result["printed"] = fake.printed
+            result["deleted"] = fake.deleted
+    finally:
+        await app_module.printer_status.stop()
+        await queue.stop()
+        app_module.printer_connections.close()
+    return result
+
+
+class _NoMetric:
+    """Sustituto sin coste de una métrica, para medir la instrumentación por diferencia"""
+
+    def labels(self, *values):
+        return self
+
+    def observe(self, value: float) -> None:
+        pass
+
+    def inc(self, amount: float = 1.0) -> None:
+        pass
+
+
+def _instrumented_job(registry: metrics.Registry, printer: str, spans: bool) -> Callable[[], None]:
+    """Las mismas llamadas de métricas que hace un trabajo de /print de principio a fin"""
+    render = metrics.Histogram("render", "", registry=registry)
+    wait = metrics.Histogram("wait", "", registry=registry)
+    write = metrics.Histogram("write", "", ["printer"], registry=registry)
+    job = metrics.Histogram("job", "", ["status"], registry=registry)
+    labels = metrics.Counter("labels", "", ["printer"], registry=registry)
+    size = metrics.Counter("bytes", "", ["printer"], registry=registry)
+    clock = time.perf_counter
+
+    def run() -> None:
+        trace = {} if spans else None
+        started = clock()
+        render.observe(clock() - started)
+        wait.observe(0.002)
+        if trace is not None:
+            trace["queue_wait"] = 0.002
+        started = clock()
+        write.labels(printer).observe(clock() - started)
+        if trace is not None:
+            trace["send"] = clock() - started
+        labels.labels(printer).inc(1)
+        size.labels(printer).inc(700)
+        job.labels("done").observe(0.01)
+
+    return run
+
+
+async def bench_metrics(jobs: int, printers: int) -> Dict:
+    """Coste de la instrumentación por trabajo y de exportar /metrics"""
+    result: Dict = {"benchmark": "metrics", "jobs": jobs}
+    for name, spans in (("per_job_us", False), ("per_job_traced_us", True)):
+        run = _instrumented_job(metrics.Registry(), "BP500", spans)
+        t0 = time.perf_counter()
+        for _ in range(jobs):
+            run()
+        result[name] = (time.perf_counter() - t0) / jobs * 1e6
+
+    registry = metrics.Registry()
+    run = _instrumented_job(registry, "BP500", False)
+    for i in range(printers):
+        registry.get("write").labels(f"printer-{i}").observe(0.01)
+        registry.get("labels").labels(f"printer-{i}").inc()
+    run()
+    t0 = time.perf_counter()
+    text = registry.render()
+    result["render_ms"] = (time.perf_counter() - t0) * 1000
+    result["render_bytes"] = len(text)
+    result["render_printers"] = printers
+
+    # Cola real con un envío vacío, con métricas y con las métricas sustituidas
+    async def discard(data, printer_name):
+        return None
+
+    names = ("QUEUE_WAIT", "JOB_SECONDS", "LABELS_TOTAL", "BYTES_TOTAL", "ERRORS_TOTAL")
+    originals = {name: getattr(print_queue, name) for name in names}
+    for mode in ("without_metrics", "with_metrics"):
+        for name in names:
+            setattr(print_queue, name, _NoMetric() if mode == "without_metrics"
+                    else originals[name])
+        queue = PrintQueue(discard, workers=2)
+        await queue.start()
+        t0 = time.perf_counter()
+        for _ in range(jobs):
+            queue.submit(b"label", "BP500")
+        await queue.join()
+        elapsed = time.perf_counter() - t0
+        await queue.stop()
+        result[f"queue_{mode}_us_per_job"] = elapsed / jobs * 1e6
+    result["queue_overhead_us_per_job"] = (result["queue_with_metrics_us_per_job"]
+                                           - result["queue_without_metrics_us_per_job"])
+    return result
+
+
+def bench_codes(tickets: int) -> Dict:
+    """Tickets/s con el QR dibujado por la impresora o enviado como gráfico"""
+    import GodexPrinter
+    from graphics import CodeRasterizer
+
+    result: Dict = {"benchmark": "codes", "tickets": tickets}
+    unique = [app_module.TicketFields(**{**TICKET, "asiento": str(i), "qr": f"SEAT-{i:06d}"})
+              for i in range(tickets)]
+    # Mismo evento en todos los tickets: tras el primero, todo son aciertos de caché
+    repeated = [app_module.TicketFields(**{**TICKET, "asiento": str(i)}) for i in range(tickets)]
+    scenarios = (("printer_qr", False, unique), ("raster_unique", True, unique),
+                 ("raster_repeated", True, repeated))
+    original = app_module.RASTER_CODES, app_module.code_rasterizer
+    try:
+        for name, raster, batch in scenarios:
+            app_module.RASTER_CODES = raster
+            app_module.code_rasterizer = CodeRasterizer()
+            t0 = time.perf_counter()
+            size = sum(len(app_module._build_label(t)) for t in batch)
+            elapsed = time.perf_counter() - t0
+            result[name] = {"tickets_per_s": tickets / elapsed,
+                            "us_per_ticket": elapsed / tickets * 1e6,
+                            "bytes_per_ticket": size / tickets,
+                            "cache_hits": app_module.code_rasterizer.hits}
+    finally:
+        app_module.RASTER_CODES, app_module.code_rasterizer = original
+
+    manager = GodexPrinter.GodexPrinterManager(verify_status=False, raster_codes=True)
+    products = [{"name": "PRODUCTO", "price": "10.00", "barcode": f"{i:012d}"}
+                for i in range(tickets)]
+    for name, render in (("epl_printer_barcode", manager.create_57x70_ticket_layout),
+                         ("epl_raster_barcode", manager.create_57x70_raster_layout)):
+        t0 = time.perf_counter()
+        for product in products:
+            render(product)
+        result[name] = {"tickets_per_s": tickets / (time.perf_counter() - t0)}
+    return result
+
+
+def _label_image(fmt: str) -> bytes:
+    """Imagen de etiqueta completa (456x560) con degradados, texto y formas"""
+    from PIL import Image, ImageDraw
+
+    image = Image.linear_gradient("L").resize((456, 560)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for x in range(0, 456, 12):
+        draw.line((x, 0, 456 - x, 560), fill=(x % 256, 90, 200), width=3)
+    draw.ellipse((60, 80, 396, 480), fill=(128, 128, 128))
+    draw.text((40, 20), "GODEX BP500 - 57x70", fill="black")
+    out = io.BytesIO()
+    image.save(out, fmt)
+    return out.getvalue()
+
+
+def _python_bitmap(data: bytes, dither: str, threshold: int = 128) -> bytes:
+    """Línea base: misma conversión, píxel a píxel en Python puro"""
+    from PIL import Image
+    from graphics import _BAYER_8
+
+    image = Image.open(io.BytesIO(data)).convert("L")
+    width, height = image.size
+    pixels = image.tobytes()
+    black = [False] * len(pixels)
+    if dither == "diffusion":
+        values = [float(p) for p in pixels]
+        for y in range(height):
+            for x in range(width):
+                i = y * width + x
+                old = values[i]
+                new = 0.0 if old < 128 else 255.0
+                black[i] = new == 0.0
+                error = old - new
+                if x + 1 < width:
+                    values[i + 1] += error * 7 / 16
+                if y + 1 < height:
+                    if x > 0:
+                        values[i + width - 1] += error * 3 / 16
+                    values[i + width] += error * 5 / 16
+                    if x + 1 < width:
+                        values[i + width + 1] += error / 16
+    else:
+        for y in range(height):
+            for x in range(width):
+                limit = _BAYER_8[y % 8][x % 8] * 4 + 2 if dither == "ordered" else threshold
+                black[y * width + x] = pixels[y * width + x] < limit
+    out = bytearray()
+    for y in range(height):
+        for x in range(0, width, 8):
+            byte = 0
+            for bit in range(8):
+                byte <<= 1
+                if x + bit < width and black[y * width + x + bit]:
+                    byte |= 1
+            out.append(byte)
+    return bytes(out)
+
+
+def bench_graphics(iterations: int) -> Dict:
+    """PNG/JPEG a 1 bit: NumPy frente a un bucle por píxel en Python"""
+    from graphics import DITHERS, ezpl_download_graphic, image_bitmap
+
+    result: Dict = {"benchmark": "graphics", "size": "456x560", "iterations": iterations}
+    for fmt in ("PNG", "JPEG"):
+        data = _label_image(fmt)
+        for dither in DITHERS:
+            bitmap = image_bitmap(data, dither=dither)
+            t0 = time.perf_counter()
+            for _ in range(iterations):
+                ezpl_download_graphic("LOGO", image_bitmap(data, dither=dither))
+            numpy_ms = (time.perf_counter() - t0) / iterations * 1000
+            t0 = time.perf_counter()
+            baseline = _python_bitmap(data, dither)
+            python_ms = (time.perf_counter() - t0) * 1000
+            if dither != "diffusion" and baseline != bitmap.data:
+                raise AssertionError(f"Conversión distinta de la línea base ({fmt}, {dither})")
+            result[f"{fmt.lower()}_{dither}"] = {"input_bytes": len(data),
+                                                 "numpy_ms": numpy_ms, "python_ms": python_ms,
+                                                 "speedup": python_ms / numpy_ms}
+    return result
+
+
+def bench_preview(previews: int) -> Dict:
+    """GET /print/preview: render completo, con la base cacheada y PNG cacheado"""
+    from preview import LabelRenderer, TemplatePreview, render_png, to_png
+
+    tickets = [app_module._ticket_values(app_module.TicketFields(**{**TICKET, "asiento": str(i)}))
+               for i in range(previews)]
+    result: Dict = {"benchmark": "preview", "previews": previews}
+
+    ticket = app_module.ticket_templates["ticket"]
+    t0 = time.perf_counter()
+    for values in tickets:
+        render_png(ticket.header + ticket.render(values))
+    result["full_render_ms"] = (time.perf_counter() - t0) / previews * 1000
+
+    cache = TemplatePreview(ticket.source, ticket.setup_source, max_entries=previews)
+    t0 = time.perf_counter()
+    cache.render(tickets[0])
+    result["first_preview_ms"] = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    for values in tickets[1:]:
+        cache.render(values)
+    result["cached_base_ms"] = (time.perf_counter() - t0) / max(previews - 1, 1) * 1000
+    t0 = time.perf_counter()
+    for values in tickets:
+        cache.render(values)
+    result["cached_png_ms"] = (time.perf_counter() - t0) / previews * 1000
+
+    # El emulador, con lo capturado, dibuja exactamente la misma etiqueta
+    engine = PrinterEngine(labels_per_second=1000, capture=True)
+    try:
+        engine.feed(app_module._build_ticket(app_module.TicketFields(**TICKET)))
+        (image, _), = engine.render_labels()
+    finally:
+        engine.stop()
+    direct = LabelRenderer().render(app_module._build_ticket(app_module.TicketFields(**TICKET)))
+    result["emulator_matches"] = to_png(image) == to_png(direct[0][0])
+    return result
+
+
+# Valores con blancos, saltos de línea y no-ASCII en los bordes de las líneas
+_TRICKY_VALUES = ["", " ", "  300 ", "\t1A\t", "é", " ñ ", "a\nb", "x\r", "{}", "\n"]
+
+
+async def _overload_scenario(client: httpx.AsyncClient, scenario: str, speed: float,
+                             overload: float, seconds: float, sla: float,
+                             buffer_size: int) -> Dict:
+    """POST /print a `overload` veces el ritmo de la impresora durante `seconds`"""
+    from admission import AdmissionController
+
+    flow = "none" if scenario == "unlimited" else scenario
+    engine = PrinterEngine(labels_per_second=speed, buffer_size=buffer_size)
+    emulator = SerialPrinterEmulator(engine, flow_control=flow)
+    app_module.printer_transports.configure("EMU", f"{emulator.uri}?flow={flow}&write_timeout=120")
+    queue = app_module.print_queue
+    queue.admission = (None if scenario == "unlimited"
+                       else AdmissionController(sla, default_rate=speed))
+    await queue.start()
+    accepted, rejected, retry_after = [], 0, []
+    max_depth = max_backlog = 0
+    interval = 1 / (speed * overload)
+    try:
+        with _RssSampler() as rss:
+            t0 = time.perf_counter()
+            i = 0
+            while time.perf_counter() - t0 < seconds:
+                r = await client.post("/print", json={**TICKET, "asiento": str(i),
+                                                      "printer_name": "EMU"})
+                if r.status_code == 429:
+                    rejected += 1
+                    retry_after.append(int(r.headers["Retry-After"]))
+                else:
+                    r.raise_for_status()
+                    accepted.append(r.json()["job_id"])
+                max_depth = max(max_depth, queue.depth())
+                if queue.admission is not None:
+                    max_backlog = max(max_backlog, queue.admission.load("EMU").backlog)
+                i += 1
+                await asyncio.sleep(max(0.0, t0 + i * interval - time.perf_counter()))
+            offered_s = time.perf_counter() - t0
+            await queue.join()
+            # Hasta imprimir lo aceptado o dejar de avanzar (bytes perdidos)
+            printed, last = False, -1
+            while not printed and engine.stats()["labels_printed"] > last:
+                last = engine.stats()["labels_printed"]
+                printed = await asyncio.get_running_loop().run_in_executor(
+                    None, engine.wait_printed, len(accepted), 1 + 2 / speed)
+            elapsed = time.perf_counter() - t0
+    finally:
+        await queue.stop()
+        await app_module.printer_transports.close()
+        emulator.close()
+        queue.admission = None
+    stats = engine.stats()
+    jobs = [queue.get(job_id) for job_id in accepted]
+    return {
+        "scenario": scenario,
+        "offered": i,
+        "offered_per_s": i / offered_s,
+        "accepted": len(accepted),
+        "rejected_429": rejected,
+        "retry_after_s": sorted(set(retry_after)),
+        "max_queue_depth": max_depth,
+        "max_backlog_labels": max_backlog,
+        "failed_jobs": sum(1 for j in jobs if j is None or j.status != JOB_DONE),
+        "all_accepted_printed": printed and stats["labels_printed"] >= len(accepted),
+        "labels_printed": stats["labels_printed"],
+        "bytes_received": stats["bytes_received"],
+        "bytes_dropped": stats["bytes_dropped"],
+        "xoff_sent": emulator.xoff_sent,
+        "max_printer_buffer_bytes": stats["max_buffered_bytes"],
+        "rss_growth_mb": (rss.peak - rss.baseline) / 2**20,
+        "elapsed_s": elapsed,
+    }
+
+
+async def bench_overload(speed: float, overload: float, seconds: float, sla: float,
+                         buffer_size: int, scenarios: List[str]) -> List[Dict]:
+    """Sobrecarga sostenida contra una impresora serial emulada con búfer pequeño.
+
+    `unlimited` es el comportamiento sin control de admisión ni de flujo; en
+    `xonxoff` y `rtscts` la admisión rechaza con 429 lo que no terminaría
+    dentro del SLA y el control de flujo evita desbordar el búfer.
+    """
+    logging.getLogger("print_queue").setLevel(logging.CRITICAL)
+    transport = httpx.ASGITransport(app=app_module.app)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                 timeout=120) as client:
+        for scenario in scenarios:
+            results.append(await _overload_scenario(client, scenario, speed, overload,
+                                                    seconds, sla, buffer_size))
+    return results
+
+
+# Módulos que el arranque no debería importar: backends de impresora y
+# dependencias que solo usan algunos endpoints
+_LAZY_MODULES = ("serial", "win32print", "numpy", "PIL", "qrcode", "barcode")
+
+_IMPORT_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+lazy = {lazy!r}
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in lazy if m in sys.modules]}}))
+"""
+
+
+def _import_probe(module: str) -> Dict:
+    """Importa `module` en un intérprete nuevo con -X importtime"""
+    api_dir = os.path.dirname(os.path.abspath(__file__))
+    t0 = time.perf_counter()
+    run = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                          _IMPORT_PROBE.format(module=module, lazy=_LAZY_MODULES)],
+                         cwd=api_dir, capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - t0
+    # "import time: self | cumulative | nombre", los hijos antes que el padre
+    own = {}
+    for line in run.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        if os.path.exists(os.path.join(api_dir, name + ".py")):
+            own[name] = int(parts[1]) / 1e6
+    probe = json.loads(run.stdout)
+    return {"process_s": wall, "import_s": probe["seconds"], "loaded": probe["loaded"],
+            "own_modules": own}
+
+
+def _first_response(port: int, env: Dict, timeout: float = 60.0) -> float:
+    """Segundos desde lanzar uvicorn hasta la primera respuesta HTTP"""
+    command = [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port),
+               "--log-level", "warning"]
+    t0 = time.perf_counter()
+    server = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - t0 < timeout:
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=1) as sock:
+                    sock.sendall(b"GET /openapi.json HTTP/1.1\r\nHost: bench\r\n\r\n")
+                    if sock.recv(12).startswith(b"HTTP/1.1 200"):
+                        return time.perf_counter() - t0
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError("La API no respondió")
+    finally:
+        server.terminate()
+        server.wait(60)
+
+
+def bench_startup(runs: int, import_budget: float, cold_start_budget: float) -> Dict:
+    """Tiempo de importar app/GodexPrinter y de arrancar la API hasta la primera respuesta.
+
+    Cada medida es un proceso nuevo (la caché de bytecode ya está caliente).
+    `within_budget` es falso si la mediana supera algún presupuesto o si el
+    arranque importó un backend de impresora.
+    """
+    app_runs = [_import_probe("app") for _ in range(runs)]
+    godex_runs = [_import_probe("GodexPrinter") for _ in range(runs)]
+    workdir = tempfile.mkdtemp()
+    env = {**os.environ, "DISCOVERY_WARMUP": "0",
+           "JOB_JOURNAL": os.path.join(workdir, "print_jobs.db"),
+           "ITEMS_DB": "sqlite:///" + os.path.join(workdir, "items.db")}
+    cold = [_first_response(_free_port(), env) for _ in range(runs)]
+    slowest_own = max(app_runs, key=lambda r: r["import_s"])["own_modules"]
+    result = {
+        "benchmark": "startup",
+        "runs": runs,
+        "import_app_s": statistics.median(r["import_s"] for r in app_runs),
+        "import_app_process_s": statistics.median(r["process_s"] for r in app_runs),
+        "import_godex_s": statistics.median(r["import_s"] for r in godex_runs),
+        "cold_start_s": statistics.median(cold),
+        "cold_start_max_s": max(cold),
+        "own_modules_s": dict(sorted(slowest_own.items(), key=lambda kv: -kv[1])[:8]),
+        "lazy_loaded_by_app": sorted({m for r in app_runs for m in r["loaded"]}),
+        "lazy_loaded_by_godex": sorted({m for r in godex_runs for m in r["loaded"]}),
+        "import_budget_s": import_budget,
+        "cold_start_budget_s": cold_start_budget,
+    }
+    result["within_budget"] = (result["import_app_s"] <= import_budget
+                               and result["cold_start_s"] <= cold_start_budget
+                               and not result["lazy_loaded_by_app"]
+                               and not result["lazy_loaded_by_godex"])
+    return result
+
+
+async def _seats_scenario(client: httpx.AsyncClient, scenario: str, seats: int,
+                          concurrency: int, speed: float) -> Dict:
+    """Una fila de `seats` asientos: un POST por asiento o un solo POST con `seats`"""
+    emulator = TcpPrinterEmulator(_emulated_printer(speed))
+    app_module.printer_transports.configure("EMU", emulator.uri)
+    app_module.printer_forms.invalidate()
+    queue = app_module.print_queue
+    await queue.start()
+    row = {**TICKET, "fila": "12", "printer_name": "EMU"}
+    try:
+        t0 = time.perf_counter()
+        if scenario == "per_seat":
+            async def call(i: int) -> None:
+                r = await client.post("/print", json={**row, "asiento": str(i + 1)})
+                r.raise_for_status()
+
+            await _run_concurrently(seats, concurrency, call)
+            requests = seats
+        else:
+            # `run_warm` repite la fila con el formulario ya descargado
+            for requests_sent in range(2 if scenario == "run_warm" else 1):
+                if scenario == "run_warm" and requests_sent:
+                    await queue.join()
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, emulator.engine.wait_printed, seats, 60 + seats / speed)
+                    emulator.engine.bytes_received = 0
+                    t0 = time.perf_counter()
+                r = await client.post("/print", json={**row, "asiento": "1", "seats": seats})
+                r.raise_for_status()
+            requests = 1
+        accepted_s = time.perf_counter() - t0
+        await queue.join()
+        sent_s = time.perf_counter() - t0
+        expected = seats * (2 if scenario == "run_warm" else 1)
+        printed = await asyncio.get_running_loop().run_in_executor(
+            None, emulator.engine.wait_printed, expected, 60 + expected / speed)
+        elapsed = time.perf_counter() - t0
+    finally:
+        await queue.stop()
+        await app_module.printer_transports.close()
+        emulator.close()
+    stats = emulator.engine.stats()
+    return {
+        "scenario": scenario,
+        "requests": requests,
+        "accepted_s": accepted_s,
+        "sent_s": sent_s,
+        "printed_s": elapsed,
+        "all_printed": printed,
+        "bytes_sent": stats["bytes_received"],
+        "wire_s_at_9600_baud": stats["bytes_received"] * 10 / 9600,
+        "labels_received": stats["labels_received"],
+        "missing_forms": stats["missing_forms"],
+    }
+
+
+async def bench_seats(seats: int, concurrency: int, speed: float) -> List[Dict]:
+    """Fila de asientos consecutivos: un trabajo por asiento frente al contador de la impresora.
+
+    `run_cold` incluye la descarga del formulario SEATS; `run_warm` es una
+    segunda fila con el formulario ya en la impresora.
+    """
+    logging.getLogger("print_queue").setLevel(logging.WARNING)
+    transport = httpx.ASGITransport(app=app_module.app)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for scenario in ("per_seat", "run_cold", "run_warm"):
+            results.append(await _seats_scenario(client, scenario, seats, concurrency, speed))
+    return results
+
+
+def _template_reload(renders: int) -> Dict:
+    """Renders desde el registro mientras otro hilo reescribe la plantilla y la recarga"""
+    ticket = app_module._ticket_values(app_module.TicketFields(**TICKET))
+    with tempfile.TemporaryDirectory() as directory:
+        shutil.copytree(app_module.ticket_templates.directory, directory, dirs_exist_ok=True)
+        registry = TemplateRegistry(directory)
+        registry.reload()
+        path = registry["ticket"].path
+        with open(path) as f:
+            original = f.read()
+        stop = threading.Event()
+        reload_seconds: List[float] = []
+
+        def edit() -> None:
+            i = 0
+            while not stop.is_set():
+                i += 1
+                # Alterna entre dos versiones de la línea de corte
+                with open(path, "w") as f:
+                    f.write(original.replace("Lo,4,864,452,875", f"Lo,4,864,452,{875 + i % 2}"))
+                t0 = time.perf_counter()
+                registry.reload()
+                reload_seconds.append(time.perf_counter() - t0)
+                time.sleep(0.005)
+
+        editor = threading.Thread(target=edit, daemon=True)
+        versions = set()
+        errors = 0
+        editor.start()
+        t0 = time.perf_counter()
+        for _ in range(renders):
+            template = registry.get("ticket")
+            if template is None or not template.render(ticket).endswith(b"E\r\n"):
+                errors += 1
+                continue
+            versions.add(template.version)
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        editor.join()
+    return {
+        "renders_per_s": renders / elapsed,
+        "reloads": len(reload_seconds),
+        "reload": _percentiles(reload_seconds),
+        "versions_seen": len(versions),
+        "failed_renders": errors,
+    }
+
+
+def bench_template(iterations: int, reload_renders: int) -> Dict:
+    """Render precompilado frente a f-string + adaptar_codigo + encode, y el
+    camino completo de una petición desde el registro de plantillas"""
+    ticket_template = app_module.ticket_templates["ticket"]
+    source = ticket_template.setup_source + ticket_template.source
+    compiled = CompiledTemplate(source)
+    ticket = app_module._ticket_values(app_module.TicketFields(**TICKET))
+
+    def legacy(values):
+        return adaptar_codigo(source.format_map(values)).encode("ascii", errors="ignore")
+
+    checked = 0
+    for value in _TRICKY_VALUES:
+        for field in compiled.fields:
+            values = {**ticket, field: value}
+            if compiled.render(values) != legacy(values):
+                raise AssertionError(f"Render distinto para {field}={value!r}")
+            checked += 1
+
+    def registry_render(values):
+        # Lo que hace cada ticket: buscar la plantilla por nombre y renderizarla
+        return app_module.ticket_templates.get("ticket").render(values)
+
+    request = app_module.PrintRequest(**TICKET)
+    result = {"benchmark": "template", "iterations": iterations, "equality_cases": checked}
+    for name, render, arg in (("legacy", legacy, ticket), ("compiled", compiled.render, ticket),
+                              ("registry", registry_render, ticket),
+                              ("build_ticket", app_module._build_ticket, request)):
+        t0 = time.perf_counter()
+        for _ in range(iterations):
+            render(arg)
+        result[f"{name}_renders_per_s"] = iterations / (time.perf_counter() - t0)
+    if reload_renders:
+        result["hot_reload"] = _template_reload(reload_renders)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="guarda también el resultado JSON en este archivo")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_queue = sub.add_parser("queue", help="latencia de POST /print bajo concurrencia")
+    p_queue.add_argument("--requests", type=int, default=500)
+    p_queue.add_argument("--delay", type=float, default=0.2)
+
+    p_batch = sub.add_parser("batch", help="tickets/s por ticket frente a POST /print/batch")
+    p_batch.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+
+    p_template = sub.add_parser("template", help="render precompilado frente al f-string")
+    p_template.add_argument("--iterations", type=int, default=100000)
+    p_template.add_argument("--reload-renders", type=int, default=200000,
+                            help="renders mientras se reescribe la plantilla (0 = no medir)")
+
+    p_pool = sub.add_parser("pool", help="handle por ticket frente al pool de conexiones")
+    p_pool.add_argument("--tickets", type=int, default=200)
+    p_pool.add_argument("--open-cost", type=float, default=0.02)
+
+    p_sched = sub.add_parser("scheduler", help="escalado de un grupo de impresoras simuladas")
+    p_sched.add_argument("--printers", type=int, nargs="+", default=[1, 2, 4, 6])
+    p_sched.add_argument("--jobs", type=int, default=600)
+
+    p_serial = sub.add_parser("serial", help="envío serial contra una impresora pty simulada")
+    p_serial.add_argument("--labels", type=int, default=50)
+    p_serial.add_argument("--reply-delay", type=float, default=0.02)
+
+    p_disc = sub.add_parser("discovery", help="sondeo secuencial frente a paralelo de puertos")
+    p_disc.add_argument("--ports", type=int, default=8)
+    p_disc.add_argument("--silent", type=int, default=4)
+    p_disc.add_argument("--timeout", type=float, default=1.0)
+
+    p_load = sub.add_parser("load", help="carga sobre /print, /items y GodexPrinterManager "
+                                         "contra impresoras emuladas")
+    p_load.add_argument("--requests", type=int, default=500)
+    p_load.add_argument("--concurrency", type=int, default=50)
+    p_load.add_argument("--transport", choices=["tcp", "serial"], default="tcp")
+    p_load.add_argument("--speed", type=float, default=200.0,
+                        help="etiquetas por segundo de la impresora emulada")
+    p_load.add_argument("--baudrate", type=int,
+                        help="limita el enlace a esta velocidad (p. ej. 9600 en serial)")
+    p_load.add_argument("--scenarios", nargs="+", choices=["print", "items", "manager"],
+                        default=["print", "items", "manager"])
+
+    p_forms = sub.add_parser("forms", help="layout completo frente a formularios guardados "
+                                           "en una impresora serial emulada")
+    p_forms.add_argument("--labels", type=int, default=50)
+    p_forms.add_argument("--baudrate", type=int, default=9600)
+    p_forms.add_argument("--speed", type=float, default=5.0,
+                         help="etiquetas por segundo de la impresora emulada")
+
+    p_journal = sub.add_parser("journal", help="escrituras/s del diario de trabajos")
+    p_journal.add_argument("--jobs", type=int, default=5000)
+    p_journal.add_argument("--concurrency", type=int, default=200)
+
+    p_items = sub.add_parser("items", help="latencia de /items según el tamaño del catálogo")
+    p_items.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    p_items.add_argument("--samples", type=int, default=500)
+
+    p_import = sub.add_parser("import", help="importación NDJSON en streaming: filas/s y RSS")
+    p_import.add_argument("--lines", type=int, default=1000000)
+    p_import.add_argument("--scenarios", nargs="+", choices=["items", "print"],
+                          default=["items", "print"])
+
+    p_workers = sub.add_parser("workers", help="POST /print/s según el número de workers "
+                                               "de serve.py")
+    p_workers.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p_workers.add_argument("--requests", type=int, default=5000)
+    p_workers.add_argument("--concurrency", type=int, default=50,
+                           help="peticiones en vuelo por proceso cliente")
+    p_workers.add_argument("--clients", type=int, default=2, help="procesos generadores de carga")
+    p_workers.add_argument("--speed", type=float, default=5000.0,
+                           help="etiquetas por segundo de la impresora emulada")
+
+    p_metrics = sub.add_parser("metrics", help="coste de la instrumentación por trabajo")
+    p_metrics.add_argument("--jobs", type=int, default=100000)
+    p_metrics.add_argument("--printers", type=int, default=50,
+                           help="series por impresora al medir el export de /metrics")
+
+    p_codes = sub.add_parser("codes", help="QR/Code 128 de la impresora frente a gráficos "
+                                           "generados en el servidor")
+    p_codes.add_argument("--tickets", type=int, default=2000)
+
+    p_graphics = sub.add_parser("graphics", help="conversión de imágenes a 1 bit: NumPy frente "
+                                                 "a Python por píxel")
+    p_graphics.add_argument("--iterations", type=int, default=50)
+
+    p_preview = sub.add_parser("preview", help="vista previa: render completo frente a cachés")
+    p_preview.add_argument("--previews", type=int, default=200)
+
+    p_overload = sub.add_parser("overload", help="admisión y control de flujo con la impresora "
+                                                 "sobrecargada")
+    p_overload.add_argument("--speed", type=float, default=20.0, help="etiquetas/s")
+    p_overload.add_argument("--overload", type=float, default=10.0,
+                            help="peticiones por etiqueta que la impresora puede emitir")
+    p_overload.add_argument("--seconds", type=float, default=5.0)
+    p_overload.add_argument("--sla", type=float, default=2.0)
+    p_overload.add_argument("--buffer", type=int, default=16 * 1024,
+                            help="búfer de recepción de la impresora en bytes")
+    p_overload.add_argument("--scenarios", nargs="+", default=["unlimited", "xonxoff", "rtscts"],
+                            choices=["unlimited", "xonxoff", "rtscts"])
+
+    p_startup = sub.add_parser("startup", help="importación y arranque en frío frente a un "
+                                               "presupuesto (sale con 1 si se supera)")
+    p_startup.add_argument("--runs", type=int, default=5)
+    p_startup.add_argument("--import-budget", type=float, default=1.0,
+                           help="segundos máximos para importar app")
+    p_startup.add_argument("--cold-start-budget", type=float, default=2.0,
+                           help="segundos máximos hasta la primera respuesta HTTP")
+
+    p_seats = sub.add_parser("seats", help="fila de asientos: un POST por asiento frente a "
+                                           "contador en la impresora")
+    p_seats.add_argument("--seats", type=int, default=500)
+    p_seats.add_argument("--concurrency", type=int, default=10)
+    p_seats.add_argument("--speed", type=float, default=200.0, help="etiquetas/s del emulador")
+
+    p_events = sub.add_parser("events", help="eventos SSE a muchos suscriptores mientras se "
+                                             "imprime")
+    p_events.add_argument("--subscribers", type=int, default=1000)
+    p_events.add_argument("--slow", type=int, default=10, help="suscriptores que no leen")
+    p_events.add_argument("--jobs", type=int, default=500)
+    p_events.add_argument("--rate", type=float, default=50.0, help="POST /print por segundo")
+    p_events.add_argument("--speed", type=float, default=200.0, help="etiquetas/s del emulador")
+    p_events.add_argument("--clients", type=int, default=4,
+                          help="procesos que reparten los suscriptores")
+    p_events.add_argument("--sample", type=int, default=10,
+                          help="medir la latencia de uno de cada N eventos")
+    p_events.add_argument("--buffer", type=int, default=256,
+                          help="eventos pendientes por suscriptor (EVENTS_BUFFER)")
+
+    p_spool = sub.add_parser("spool", help="listar y cancelar trabajos pendientes en un "
+                                           "spooler simulado")
+    p_spool.add_argument("--jobs", type=int, default=5000)
+    p_spool.add_argument("--limit", type=int, default=100, help="trabajos por página")
+    p_spool.add_argument("--cancels", type=int, default=200)
+    p_spool.add_argument("--print-cost", type=float, default=0.005,
+                         help="segundos que el spooler simulado tarda por trabajo")
+
+    args = parser.parse_args()
+    if args.command == "queue":
+        result = asyncio.run(bench_queue(args.requests, args.delay))
+    elif args.command == "batch":
+        result = bench_batch(args.sizes)
+    elif args.command == "template":
+        result = bench_template(args.iterations, args.reload_renders)
+    elif args.command == "pool":
+        result = bench_pool(args.tickets, args.open_cost)
+    elif args.command == "scheduler":
+        result = asyncio.run(bench_scheduler(args.printers, args.jobs))
+    elif args.command == "serial":
+        result = bench_serial(args.labels, args.reply_delay)
+    elif args.command == "discovery":
+        result = bench_discovery(args.ports, args.silent, args.timeout)
+    elif args.command == "load":
+        result = asyncio.run(bench_load(args.requests, args.concurrency, args.transport,
+                                        args.speed, args.scenarios, args.baudrate))
+    elif args.command == "forms":
+        result = asyncio.run(bench_forms(args.labels, args.baudrate, args.speed))
+    elif args.command == "journal":
+        result = asyncio.run(bench_journal(args.jobs, args.concurrency))
+    elif args.command == "items":
+        result = asyncio.run(bench_items(args.sizes, args.samples))
+    elif args.command == "import":
+        result = asyncio.run(bench_import(args.lines, args.scenarios))
+    elif args.command == "metrics":
+        result = asyncio.run(bench_metrics(args.jobs, args.printers))
+    elif args.command == "codes":
+        result = bench_codes(args.tickets)
+    elif args.command == "graphics":
+        result = bench_graphics(args.iterations)
+    elif args.command == "preview":
+        result = bench_preview(args.previews)
+    elif args.command == "overload":
+        result = asyncio.run(bench_overload(args.speed, args.overload, args.seconds, args.sla,
+                                            args.buffer, args.scenarios))
+    elif args.command == "startup":
+        result = bench_startup(args.runs, args.import_budget, args.cold_start_budget)
+    elif args.command == "seats":
+        result = asyncio.run(bench_seats(args.seats, args.concurrency, args.speed))
+    elif args.command == "spool":
+        result = asyncio.run(bench_spool(args.jobs, args.limit, args.cancels, args.print_cost))
+    elif args.command == "events":
+        result = bench_events(args.subscribers, args.slow, args.jobs, args.rate, args.speed,
+                              args.clients, args.sample, args.buffer)
+    elif args.command == "workers":
+        result = bench_workers(args.workers, args.requests, args.concurrency, args.clients,
+                               args.speed)
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    if isinstance(result, dict) and result.get("within_budget") is False:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
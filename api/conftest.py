@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+# app.py abre sus bases de datos y lee la configuración al importarse: las
+# pruebas usan archivos temporales y no tocan los de este directorio
+_data = tempfile.mkdtemp(prefix="api-tests-")
+os.environ.setdefault("ITEMS_DB", f"sqlite:///{_data}/items.db")
+os.environ.setdefault("JOB_JOURNAL", os.path.join(_data, "print_jobs.db"))
+os.environ.setdefault("DISCOVERY_WARMUP", "0")
+os.environ.setdefault("TEMPLATE_RELOAD_INTERVAL", "0")
+os.environ.pop("PRINT_DISPATCHER", None)
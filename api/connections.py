@@ -0,0 +1,299 @@
+"""Pool de conexiones persistentes a impresoras.
+
+Mantiene abiertos los handles del spooler de Windows, los puertos seriales y
+los sockets TCP en lugar de abrir y cerrar uno por etiqueta. Cada dispositivo
+tiene un límite de escritores concurrentes; las conexiones ociosas se
+verifican antes de reutilizarse y se reabren si fallan.
+"""
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+import backends
+
+logger = logging.getLogger(__name__)
+
+STATUS_REQUEST = b'\x02'  # STX - comando de status
+STATUS_TERMINATOR = b'\r\n'
+
+
+class NotSent(ConnectionError):
+    """El envío falló antes de escribir nada (p. ej. al conectar).
+
+    Es el único fallo tras el que un trabajo puede reintentarse en otra
+    impresora: si la escritura empezó, parte pudo imprimirse ya.
+    """
+
+
+def read_serial_response(connection, max_bytes: int, timeout: float,
+                         gap: float = 0.02, terminator: Optional[bytes] = None) -> bytes:
+    """Lee una respuesta serial en cuanto empiezan a llegar bytes.
+
+    Espera como mucho `timeout` al primer byte y da la respuesta por terminada
+    al recibir `terminator` o cuando pasan `gap` segundos sin recibir más, en
+    lugar de dormir un tiempo fijo.
+    """
+    previous_timeout = connection.timeout
+    try:
+        connection.timeout = timeout
+        data = connection.read(1)
+        if not data:
+            return b''
+        connection.timeout = gap
+        while len(data) < max_bytes:
+            if terminator and data.endswith(terminator):
+                break
+            chunk = connection.read(min(max(connection.in_waiting, 1), max_bytes - len(data)))
+            if not chunk:
+                break
+            data += chunk
+        return data
+    finally:
+        connection.timeout = previous_timeout
+
+
+class PrinterConnection:
+    """Conexión abierta a un dispositivo; las subclases implementan el transporte"""
+
+    def __init__(self):
+        self.last_used = 0.0
+
+    def open(self) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def write(self, data: bytes) -> None:
+        raise NotImplementedError
+
+    def is_healthy(self) -> bool:
+        return True
+
+
+class SpoolerConnection(PrinterConnection):
+    """Handle de win32print reutilizado; cada escritura es un trabajo RAW"""
+
+    def __init__(self, printer_name: str, win32print, doc_name: str = "Etiqueta"):
+        super().__init__()
+        self.printer_name = printer_name
+        self.win32print = win32print
+        self.doc_name = doc_name
+        self.handle = None
+        self.last_job_id: Optional[int] = None
+
+    def open(self) -> None:
+        if self.win32print is None:
+            raise RuntimeError("win32print solo está disponible en Windows")
+        self.handle = self.win32print.OpenPrinter(self.printer_name)
+
+    def close(self) -> None:
+        if self.handle is not None:
+            try:
+                self.win32print.ClosePrinter(self.handle)
+            finally:
+                self.handle = None
+
+    def write(self, data: bytes) -> None:
+        """Envía `data` como un trabajo; si falla a medias el trabajo se descarta
+
+        EndDocPrinter mandaría a imprimir lo que ya estuviera en el spool (una
+        etiqueta cortada); AbortPrinter borra el trabajo entero.
+        """
+        wp = self.win32print
+        self.last_job_id = wp.StartDocPrinter(self.handle, 1, (self.doc_name, None, "RAW"))
+        try:
+            wp.StartPagePrinter(self.handle)
+            wp.WritePrinter(self.handle, data)
+            wp.EndPagePrinter(self.handle)
+        except BaseException:
+            try:
+                wp.AbortPrinter(self.handle)
+            except Exception as e:
+                logger.error(f"No se pudo descartar el trabajo {self.last_job_id} "
+                             f"en {self.printer_name}: {e}")
+            raise
+        wp.EndDocPrinter(self.handle)
+
+    def is_healthy(self) -> bool:
+        try:
+            self.win32print.GetPrinter(self.handle, 2)
+            return True
+        except Exception:
+            return False
+
+
+FLOW_CONTROLS = ("none", "rtscts", "xonxoff")
+
+
+class SerialConnection(PrinterConnection):
+    """Puerto serial; con control de flujo la escritura espera a la impresora.
+
+    Con `flow_control` "rtscts" (CTS) o "xonxoff" (XOFF/XON) la escritura se
+    detiene mientras la impresora avisa de que su búfer está lleno, en lugar
+    de desbordarlo; `write_timeout` limita esa espera.
+    """
+
+    def __init__(self, port: str, baudrate: int = 9600, timeout: float = 5,
+                 flow_control: str = "none", write_timeout: Optional[float] = None):
+        super().__init__()
+        if flow_control not in FLOW_CONTROLS:
+            raise ValueError(f"Control de flujo desconocido: {flow_control}")
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.flow_control = flow_control
+        self.write_timeout = write_timeout
+        self.serial = None
+
+    def open(self) -> None:
+        serial = backends.require("serial")
+        self.serial = serial.Serial(
+            port=self.port,
+            baudrate=self.baudrate,
+            timeout=self.timeout,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            rtscts=self.flow_control == "rtscts",
+            xonxoff=self.flow_control == "xonxoff",
+            write_timeout=self.write_timeout,
+        )
+
+    def close(self) -> None:
+        if self.serial is not None:
+            self.serial.close()
+            self.serial = None
+
+    def write(self, data: bytes) -> None:
+        self.serial.write(data)
+        self.serial.flush()
+
+    def request_status(self, timeout: float = 2.0) -> bytes:
+        self.serial.reset_input_buffer()
+        self.serial.write(STATUS_REQUEST)
+        return read_serial_response(self.serial, 100, timeout, terminator=STATUS_TERMINATOR)
+
+    def is_healthy(self) -> bool:
+        return self.serial is not None and self.serial.is_open
+
+
+class SocketConnection(PrinterConnection):
+    """Socket TCP bloqueante al puerto RAW (9100) de una impresora de red"""
+
+    def __init__(self, host: str, port: int = 9100, timeout: float = 5):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock: Optional[socket.socket] = None
+
+    def open(self) -> None:
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def write(self, data: bytes) -> None:
+        self.sock.sendall(data)
+
+    def is_healthy(self) -> bool:
+        # Un socket cerrado por la impresora es legible y devuelve b""
+        if self.sock is None:
+            return False
+        try:
+            self.sock.setblocking(False)
+            try:
+                return self.sock.recv(1, socket.MSG_PEEK) != b""
+            finally:
+                self.sock.settimeout(self.timeout)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+
+class _Device:
+    def __init__(self, max_writers: int):
+        self.writers = threading.BoundedSemaphore(max_writers)
+        self.idle: List[PrinterConnection] = []
+
+
+class ConnectionPool:
+    """Conexiones abiertas por clave de dispositivo (nombre de impresora o puerto)"""
+
+    def __init__(self, factory: Callable[[str], PrinterConnection], max_writers: int = 1,
+                 health_interval: float = 30.0):
+        self._factory = factory
+        self._max_writers = max_writers
+        self._health_interval = health_interval
+        self._devices: Dict[str, _Device] = {}
+        self._lock = threading.Lock()
+
+    def _device(self, key: str) -> _Device:
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None:
+                device = self._devices[key] = _Device(self._max_writers)
+            return device
+
+    def _checkout(self, key: str, device: _Device) -> PrinterConnection:
+        with self._lock:
+            conn = device.idle.pop() if device.idle else None
+        if conn is not None:
+            idle_for = time.monotonic() - conn.last_used
+            if idle_for < self._health_interval or conn.is_healthy():
+                return conn
+            logger.warning(f"Conexión a {key} no responde, reconectando")
+            self._discard(conn)
+        conn = self._factory(key)
+        try:
+            conn.open()
+        except Exception as e:
+            raise NotSent(f"No se pudo abrir {key}: {e}") from e
+        return conn
+
+    @staticmethod
+    def _discard(conn: PrinterConnection) -> None:
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Error cerrando conexión: {e}")
+
+    @contextmanager
+    def connection(self, key: str) -> Iterator[PrinterConnection]:
+        """Presta una conexión al dispositivo; si el bloque falla, se descarta"""
+        device = self._device(key)
+        with device.writers:
+            conn = self._checkout(key, device)
+            try:
+                yield conn
+            except BaseException:
+                self._discard(conn)
+                raise
+            conn.last_used = time.monotonic()
+            with self._lock:
+                device.idle.append(conn)
+
+    def write(self, key: str, data: bytes) -> None:
+        with self.connection(key) as conn:
+            conn.write(data)
+
+    def close(self, key: Optional[str] = None) -> None:
+        """Cierra las conexiones ociosas de un dispositivo, o de todos"""
+        with self._lock:
+            keys = [key] if key is not None else list(self._devices)
+            conns = []
+            for k in keys:
+                device = self._devices.get(k)
+                if device is not None:
+                    conns.extend(device.idle)
+                    device.idle.clear()
+        for conn in conns:
+            self._discard(conn)
@@ -0,0 +1,197 @@
+"""Registro de impresoras descubiertas.
+
+Enumera puertos seriales y drivers de Windows una sola vez y cachea el
+resultado. Los puertos seriales candidatos se sondean en paralelo, así que el
+escaneo tarda un timeout de sondeo y no uno por puerto. La caché se
+invalida por tiempo (`rescan_interval`) o cuando cambia la lista de puertos
+(conexión o desconexión de un dispositivo); en ese caso solo se sondean los
+puertos nuevos.
+"""
+import copy
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import backends
+from connections import STATUS_REQUEST, STATUS_TERMINATOR, read_serial_response
+
+logger = logging.getLogger(__name__)
+
+# Godex suele aparecer con estas descripciones
+SERIAL_KEYWORDS = ['godex', 'usb serial', 'usb-serial', 'prolific', 'ftdi']
+WINDOWS_KEYWORDS = ['godex', 'bp500', 'bp-500']
+
+
+def list_serial_ports() -> List:
+    """Puertos seriales del sistema; ninguno si pyserial no está instalado"""
+    if backends.load("serial") is None:
+        return []
+    import serial.tools.list_ports
+
+    return serial.tools.list_ports.comports()
+
+
+def probe_serial_port(port: str, baudrate: int = 9600, timeout: float = 2.0) -> bytes:
+    """Abre el puerto, pide el status (STX) y devuelve la respuesta (b'' si no hay)"""
+    serial = backends.require("serial")
+    connection = serial.Serial(
+        port=port,
+        baudrate=baudrate,
+        timeout=timeout,
+        bytesize=serial.EIGHTBITS,
+        parity=serial.PARITY_NONE,
+        stopbits=serial.STOPBITS_ONE
+    )
+    try:
+        connection.write(STATUS_REQUEST)
+        return read_serial_response(connection, 100, timeout, terminator=STATUS_TERMINATOR)
+    finally:
+        connection.close()
+
+
+class PrinterDiscovery:
+    def __init__(self, win32print: Union[Any, Callable[[], Any]] = None, baudrate: int = 9600, probe_timeout: float = 2.0,
+                 rescan_interval: float = 300.0, max_workers: int = 16,
+                 list_ports: Callable[[], List] = list_serial_ports):
+        self.win32print = win32print
+        self.baudrate = baudrate
+        self.probe_timeout = probe_timeout
+        self.rescan_interval = rescan_interval
+        self.max_workers = max_workers
+        self._list_ports = list_ports
+        self._lock = threading.Lock()
+        self._cache: Optional[Dict] = None
+        self._scanned_at = 0.0
+        self._port_fingerprint: frozenset = frozenset()
+        # Respuesta de status de cada puerto candidato ya sondeado
+        self._probes: Dict[str, bytes] = {}
+
+    def printers(self, refresh: bool = False) -> Dict:
+        """Impresoras encontradas; solo reescanea si la caché caducó o cambiaron los puertos"""
+        with self._lock:
+            expired = time.monotonic() - self._scanned_at > self.rescan_interval
+            if refresh or expired or self._cache is None:
+                self._scan(full=True)
+            else:
+                ports = self._list_ports()
+                if self._fingerprint(ports) != self._port_fingerprint:
+                    logger.info("Cambio en los puertos seriales, actualizando impresoras")
+                    self._scan(full=False, ports=ports)
+            return copy.deepcopy(self._cache)
+
+    def scan(self) -> Dict:
+        return self.printers(refresh=True)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._cache = None
+
+    def responding_serial_ports(self) -> List[str]:
+        return [p['port'] for p in self.printers()['serial_ports'] if p['responding']]
+
+    @staticmethod
+    def _fingerprint(ports: List) -> frozenset:
+        return frozenset((p.device, p.hwid) for p in ports)
+
+    def _scan(self, full: bool, ports: Optional[List] = None) -> None:
+        started = time.monotonic()
+        if ports is None:
+            ports = self._list_ports()
+        candidates = []
+        for port in ports:
+            logger.info(f"Puerto encontrado: {port.device} - {port.description}")
+            if any(keyword in (port.description or '').lower() for keyword in SERIAL_KEYWORDS):
+                candidates.append(port)
+
+        if full:
+            self._probes = {}
+        current = {p.device for p in candidates}
+        self._probes = {k: v for k, v in self._probes.items() if k in current}
+        self._probe_ports([p.device for p in candidates if p.device not in self._probes])
+
+        found = {
+            'serial_ports': [{
+                'port': port.device,
+                'description': port.description,
+                'hwid': port.hwid,
+                'responding': bool(self._probes.get(port.device)),
+                'response': self._probes.get(port.device, b'').hex(),
+            } for port in candidates],
+            'windows_printers': [],
+            'usb_printers': [],
+        }
+        if full or self._cache is None:
+            self._enumerate_windows(found)
+        else:
+            found['windows_printers'] = self._cache['windows_printers']
+            found['usb_printers'] = self._cache['usb_printers']
+
+        self._cache = found
+        self._port_fingerprint = self._fingerprint(ports)
+        if full:
+            self._scanned_at = time.monotonic()
+        logger.info(f"Descubrimiento completado en {time.monotonic() - started:.2f}s")
+
+    def _probe_ports(self, ports: List[str]) -> None:
+        if not ports:
+            return
+
+        def probe(port: str) -> bytes:
+            try:
+                return probe_serial_port(port, self.baudrate, self.probe_timeout)
+            except Exception as e:
+                logger.error(f"Error probando puerto {port}: {e}")
+                return b''
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(ports))) as pool:
+            for port, response in zip(ports, pool.map(probe, ports)):
+                if response:
+                    logger.info(f"Respuesta de {port}: {response.hex()}")
+                self._probes[port] = response
+
+    def _enumerate_windows(self, found: Dict) -> None:
+        # Puede ser el módulo o la función que lo importa al escanear
+        win32print = self.win32print() if callable(self.win32print) else self.win32print
+        if win32print is None:
+            return
+
+        logger.info("Buscando impresoras por drivers de Windows...")
+        try:
+            printers = win32print.EnumPrinters(
+                win32print.PRINTER_ENUM_LOCAL | win32print.PRINTER_ENUM_CONNECTIONS
+            )
+        except Exception as e:
+            logger.warning(f"Error buscando impresoras Windows: {e}")
+            return
+
+        for printer in printers:
+            printer_name = printer[2]
+            if not any(keyword in printer_name.lower() for keyword in WINDOWS_KEYWORDS):
+                continue
+            try:
+                hprinter = win32print.OpenPrinter(printer_name)
+                try:
+                    printer_info = win32print.GetPrinter(hprinter, 2)
+                finally:
+                    win32print.ClosePrinter(hprinter)
+                port_name = printer_info.get('pPortName', 'Unknown')
+                driver = printer_info.get('pDriverName', 'Unknown')
+            except Exception as e:
+                logger.warning(f"Error obteniendo info de {printer_name}: {e}")
+                port_name = driver = 'Unknown'
+
+            found['windows_printers'].append({
+                'name': printer_name,
+                'port': port_name,
+                'status': printer[0],
+                'driver': driver
+            })
+            # Si es puerto USB, agregarlo también a la lista USB
+            if 'usb' in port_name.lower():
+                found['usb_printers'].append({
+                    'name': printer_name,
+                    'port': port_name,
+                    'driver': driver
+                })
@@ -0,0 +1,378 @@
+"""Despachador de trabajos compartido por varios procesos de la API.
+
+Con varios workers de uvicorn, cada proceso tendría su propia cola, su propio
+diario y sus propias conexiones a las mismas impresoras. En su lugar, un único
+proceso despachador es dueño de la cola, del diario, de los transportes y del
+sondeo de estado, y los workers de la API le pasan los trabajos por IPC:
+
+    unix:/tmp/godex-dispatcher.sock   socket Unix (por defecto fuera de Windows)
+    tcp://127.0.0.1:8765              TCP local (Windows)
+
+Cada mensaje es una trama `longitud de cabecera, longitud de cuerpo` (dos
+enteros de 32 bits), una cabecera JSON con `id` y `op` y el cuerpo en bruto
+(el payload del ticket, sin codificar). Un cliente usa una sola conexión con
+las peticiones multiplexadas por `id`, así que no espera a una respuesta para
+mandar la siguiente.
+
+Con `op: events` el despachador envía por esa conexión cada evento de su
+`EventBus` (cabecera con `event`, cuerpo con el JSON ya serializado); el
+worker los vuelve a publicar en su propio bus, del que leen sus clientes
+SSE/WebSocket. Así cada evento cruza el IPC una vez por worker y no una vez
+por cliente.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from admission import Overloaded
+from events import Event, EventBus
+from job_tracker import JobNotCancellable, JobNotFound
+from metrics import REGISTRY
+from print_queue import UnknownPrinter
+
+logger = logging.getLogger(__name__)
+
+_FRAME = struct.Struct("!II")
+# Errores que el worker vuelve a lanzar con su tipo (para responder 404/409)
+_JOB_ERRORS = {cls.__name__: cls
+               for cls in (JobNotFound, JobNotCancellable, UnknownPrinter)}
+_MAX_FRAME = 64 * 1024 * 1024
+
+
+def default_address() -> str:
+    if platform.system() == "Windows":
+        return "tcp://127.0.0.1:8765"
+    return f"unix:{os.path.join(os.getenv('TMPDIR', '/tmp'), 'godex-dispatcher.sock')}"
+
+
+class DispatcherError(RuntimeError):
+    """El despachador rechazó la operación o no está disponible"""
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Tuple[Dict, bytes]:
+    header_len, body_len = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+    if header_len + body_len > _MAX_FRAME:
+        raise DispatcherError(f"Trama demasiado grande: {header_len + body_len} bytes")
+    header = json.loads(await reader.readexactly(header_len))
+    body = await reader.readexactly(body_len) if body_len else b""
+    return header, body
+
+
+def _frame(header: Dict, body: bytes = b"") -> bytes:
+    encoded = json.dumps(header).encode()
+    return _FRAME.pack(len(encoded), len(body)) + encoded + body
+
+
+class RemoteJob:
+    """Trabajo visto desde un worker de la API (copia del estado en el despachador)"""
+
+    __slots__ = ("job_id", "_data")
+
+    def __init__(self, job_id: str, data: Optional[Dict] = None):
+        self.job_id = job_id
+        self._data = data or {"job_id": job_id}
+
+    def to_dict(self) -> Dict:
+        return dict(self._data)
+
+
+class DispatcherServer:
+    """Atiende a los workers de la API; corre en el proceso que tiene las impresoras
+
+    `queue` es la PrintQueue, `status` el StatusMonitor y `discover(refresh)`
+    la función bloqueante que lista las impresoras. Con `events` (el EventBus
+    del proceso), los workers pueden suscribirse a sus eventos, y con
+    `tracker` (el JobTracker) listar y cancelar los trabajos pendientes.
+    """
+
+    # Eventos que un worker lento puede tener pendientes antes de perder los antiguos
+    EVENTS_BUFFER = 10000
+
+    def __init__(self, queue, status, discover, address: Optional[str] = None,
+                 events: Optional[EventBus] = None, tracker=None):
+        self.address = address or default_address()
+        self._queue = queue
+        self._status = status
+        self._discover = discover
+        self._events = events
+        self._tracker = tracker
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        parts = urlsplit(self.address)
+        if parts.scheme == "unix":
+            path = self.address[len("unix:"):]
+            if os.path.exists(path):
+                os.unlink(path)
+            self._server = await asyncio.start_unix_server(self._serve, path)
+        elif parts.scheme == "tcp":
+            self._server = await asyncio.start_server(self._serve, parts.hostname, parts.port)
+        else:
+            raise ValueError(f"Dirección de despachador no soportada: {self.address}")
+        logger.info(f"Despachador escuchando en {self.address}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        tasks = set()
+        try:
+            while True:
+                try:
+                    header, body = await _read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                if header["op"] == "events":
+                    task = asyncio.create_task(self._stream_events(header, writer))
+                else:
+                    task = asyncio.create_task(self._answer(header, body, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _answer(self, header: Dict, body: bytes, writer: asyncio.StreamWriter) -> None:
+        try:
+            reply = {"id": header["id"], "ok": True,
+                     "result": await self._handle(header["op"], header, body)}
+        except Overloaded as e:
+            reply = {"id": header["id"], "ok": False, "error": str(e),
+                     "overloaded": [e.printer_name, e.estimated, e.retry_after]}
+        except (JobNotFound, JobNotCancellable, UnknownPrinter) as e:
+            reply = {"id": header["id"], "ok": False, "error": str(e),
+                     "job_error": type(e).__name__}
+        except Exception as e:
+            reply = {"id": header["id"], "ok": False, "error": str(e)}
+        writer.write(_frame(reply))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _stream_events(self, header: Dict, writer: asyncio.StreamWriter) -> None:
+        if self._events is None:
+            writer.write(_frame({"id": header["id"], "ok": False,
+                                 "error": "El despachador no publica eventos"}))
+            return
+        subscription = self._events.subscribe(after=header.get("after"),
+                                              max_buffered=self.EVENTS_BUFFER)
+        try:
+            while True:
+                events = await subscription.get()
+                if events is None:
+                    return
+                for event in events:
+                    writer.write(_frame({"event": event.type, "seq": event.seq,
+                                         "printers": event.printers, "job_id": event.job_id},
+                                        event.data))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            subscription.close()
+
+    async def _handle(self, op: str, header: Dict, body: bytes) -> Any:
+        if op == "accept":
+            job, new = await self._queue.accept(body, header["printer_name"],
+                                                header.get("idempotency_key"),
+                                                header.get("labels", 1))
+            return {"job_id": job.job_id, "new": new}
+        if op == "job":
+            job = self._queue.get(header["job_id"])
+            return job.to_dict() if job is not None else None
+        if op == "depth":
+            return self._queue.depth()
+        if op == "status":
+            status = self._status.get(header["printer_name"])
+            if status is None:
+                return None
+            return {**status.to_dict(), "stale": self._status.is_stale(status)}
+        if op == "pending_jobs":
+            if self._tracker is None:
+                return [[], None]
+            return self._tracker.list(header.get("printer"), header.get("state"),
+                                      header.get("after"), header.get("limit", 100))
+        if op == "cancel":
+            if self._tracker is None:
+                raise JobNotCancellable("El despachador no cancela trabajos")
+            return (await self._tracker.cancel(header["job_id"])).to_dict()
+        if op == "metrics":
+            return REGISTRY.render()
+        if op == "printers":
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._discover, header.get("refresh", False))
+        raise DispatcherError(f"Operación desconocida: {op}")
+
+
+class DispatcherClient:
+    """Lado del worker de la API; misma interfaz asíncrona que PrintQueue para encolar"""
+
+    def __init__(self, address: str, timeout: float = 30.0):
+        self.address = address
+        self.timeout = timeout
+        self._ids = itertools.count()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._events: Optional[EventBus] = None
+        self._last_event: Optional[int] = None
+        self._resubscribe: Optional[asyncio.Task] = None
+        self._stopped = False
+
+    async def start(self) -> None:
+        await self._connection()
+
+    async def stop(self) -> None:
+        self._stopped = True
+        if self._resubscribe is not None:
+            self._resubscribe.cancel()
+            self._resubscribe = None
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _connection(self) -> asyncio.StreamWriter:
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                parts = urlsplit(self.address)
+                try:
+                    if parts.scheme == "unix":
+                        reader, writer = await asyncio.open_unix_connection(
+                            self.address[len("unix:"):])
+                    else:
+                        reader, writer = await asyncio.open_connection(parts.hostname, parts.port)
+                except OSError as e:
+                    raise DispatcherError(f"Despachador no disponible en {self.address}: {e}")
+                self._writer = writer
+                self._reader_task = asyncio.create_task(self._read_replies(reader))
+                if self._events is not None:
+                    # Tras reconectar se piden los eventos que siguen al último recibido
+                    writer.write(_frame({"id": next(self._ids), "op": "events",
+                                         "after": self._last_event}))
+            return self._writer
+
+    async def _read_replies(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                header, body = await _read_frame(reader)
+                if "event" in header:
+                    self._publish(header, body)
+                    continue
+                future = self._pending.pop(header["id"], None)
+                if future is None or future.done():
+                    continue
+                if header["ok"]:
+                    future.set_result(header["result"])
+                elif "overloaded" in header:
+                    future.set_exception(Overloaded(*header["overloaded"]))
+                elif header.get("job_error") in _JOB_ERRORS:
+                    future.set_exception(_JOB_ERRORS[header["job_error"]](header["error"]))
+                else:
+                    future.set_exception(DispatcherError(header["error"]))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.error(f"Conexión con el despachador perdida: {e}")
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(DispatcherError("Conexión con el despachador perdida"))
+            self._pending.clear()
+            if self._events is not None and not self._stopped:
+                # Los eventos no esperan a la próxima petición para volver
+                self._resubscribe = asyncio.create_task(self._reconnect())
+
+    def _publish(self, header: Dict, body: bytes) -> None:
+        if header["seq"] is not None:
+            self._last_event = header["seq"]
+        if self._events is not None:
+            self._events.publish_event(Event(header["seq"], header["event"], body,
+                                             tuple(header["printers"]), header["job_id"]))
+
+    async def forward_events(self, bus: EventBus) -> None:
+        """Publica en `bus` los eventos del despachador (también tras reconectar)"""
+        connected = self._writer is not None and not self._writer.is_closing()
+        self._events = bus
+        writer = await self._connection()
+        if connected:
+            writer.write(_frame({"id": next(self._ids), "op": "events",
+                                 "after": self._last_event}))
+            await writer.drain()
+
+    async def _reconnect(self, retry: float = 1.0) -> None:
+        while not self._stopped:
+            try:
+                await self._connection()
+                return
+            except DispatcherError as e:
+                logger.warning(f"{e}; reintento en {retry} s")
+                await asyncio.sleep(retry)
+
+    async def _call(self, op: str, body: bytes = b"", **args) -> Any:
+        writer = await self._connection()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        writer.write(_frame({"id": request_id, "op": op, **args}, body))
+        try:
+            await writer.drain()
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def accept(self, payload: bytes, printer_name: str,
+                     idempotency_key: Optional[str] = None,
+                     labels: int = 1) -> Tuple[RemoteJob, bool]:
+        result = await self._call("accept", payload, printer_name=printer_name,
+                                  idempotency_key=idempotency_key, labels=labels)
+        return RemoteJob(result["job_id"]), result["new"]
+
+    async def get(self, job_id: str) -> Optional[RemoteJob]:
+        data = await self._call("job", job_id=job_id)
+        return RemoteJob(job_id, data) if data is not None else None
+
+    async def pending_jobs(self, printer: Optional[str] = None, state: Optional[str] = None,
+                           after: Optional[int] = None,
+                           limit: int = 100) -> Tuple[List[Dict], Optional[int]]:
+        """Como JobTracker.list, en el despachador"""
+        jobs, next_cursor = await self._call("pending_jobs", printer=printer, state=state,
+                                             after=after, limit=limit)
+        return jobs, next_cursor
+
+    async def cancel(self, job_id: str) -> RemoteJob:
+        """Como JobTracker.cancel (JobNotFound, JobNotCancellable), en el despachador"""
+        return RemoteJob(job_id, await self._call("cancel", job_id=job_id))
+
+    async def depth(self) -> int:
+        return await self._call("depth")
+
+    async def wait_for_room(self, max_depth: int, poll: float = 0.01) -> None:
+        while await self.depth() >= max_depth:
+            await asyncio.sleep(poll)
+
+    async def printer_status(self, printer_name: str) -> Optional[Dict]:
+        return await self._call("status", printer_name=printer_name)
+
+    async def printers(self, refresh: bool = False) -> Dict:
+        return await self._call("printers", refresh=refresh)
+
+    async def metrics(self) -> str:
+        """Métricas del despachador en formato de texto de Prometheus"""
+        return await self._call("metrics")
@@ -0,0 +1,582 @@
+"""Emulador de impresora Godex para benchmarks y pruebas sin hardware.
+
+`PrinterEngine` interpreta el flujo EZPL/EPL que recibe: cuenta etiquetas
+(`^L`...`E` con la cantidad de `^P` por las copias de `^C`, que se quedan
+configuradas hasta el siguiente `^P`/`^C`, o `P<n>[,<m>]` en EPL), responde al
+pedido de status (STX o `~S,STATUS`; "50", imprimiendo, mientras le quedan
+etiquetas) y las "imprime" a `labels_per_second`.
+Si los bytes pendientes de imprimir superan `buffer_size`, deja de leer, de
+modo que el emisor ve la misma contrapresión que con una impresora real.
+`wire_bytes_per_second` simula la velocidad del enlace (p. ej. 960 B/s a
+9600 baudios).
+
+También guarda formularios (`FS`...`FE` en EPL, `~MSAVEF`...`~MEND` en EZPL;
+ver stored_forms.py), con sus variables y contadores, y los imprime al
+invocarlos con sus valores. Invocar un
+formulario que no existe descarta la etiqueta y el siguiente status responde
+"07" (archivo no encontrado); `reboot()` borra los formularios.
+
+Los datos binarios de los gráficos (`Q` y `~EB` en EZPL, `GW` en EPL) se
+consumen por su longitud sin interpretarlos; los descargados con `~EB` se
+guardan en `graphics` hasta `~MDELG`. Con `capture=True` se guarda todo lo
+recibido y `render_labels()` lo dibuja con preview.py para comprobar qué se
+habría impreso.
+
+Se expone por socket RAW (`TcpPrinterEmulator`) o por un pty que se abre como
+puerto serial (`SerialPrinterEmulator`). `FakeWin32Print` hace de win32print
+(instalado con `backends.install("spooler", ...)`) con la cola del spooler. En serial, `flow_control` elige cómo
+se protege el búfer: "rtscts" deja de leer (como bajar CTS), "xonxoff" envía
+XOFF/XON y "none" no avisa. Sin control de flujo que el emisor respete, lo
+que llega con el búfer lleno se pierde y se cuenta en `bytes_dropped`.
+
+Uso independiente:
+    python emulator.py tcp --port 9100 --speed 2
+"""
+import argparse
+import itertools
+import os
+import re
+import select
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from connections import STATUS_REQUEST
+
+_EPL_PRINT = re.compile(rb"^P(\d+)(?:,(\d+))?$")
+_FORM_COMMAND = re.compile(rb'^(?:(FS|FK|FR)"([^"]*)"|(~MSAVEF|~MDELF|~MRUNF),(\S+))$')
+# Variables (Vnn) y contadores (Cn): cada uno recibe un valor al invocar el formulario
+_FORM_VARIABLE = re.compile(rb"^(?:V\d\d|C\d),")
+# Comandos seguidos de datos binarios: Q<x>,<y>,<bytes/fila>,<alto> y ~EB,<nombre>,<tamaño>
+_EZPL_GRAPHIC = re.compile(rb"^Q\d+,\d+,(\d+),(\d+)$")
+_GRAPHIC_DOWNLOAD = re.compile(rb"^~EB,([^,]+),(\d+)$")
+_GRAPHIC_DELETE = re.compile(rb"^~MDELG,(.+)$")
+# En EPL los datos empiezan justo tras la última coma de GW<x>,<y>,<bytes/fila>,<alto>,
+_EPL_GRAPHIC = re.compile(rb"^GW\d+,\d+,(\d+),(\d+),$")
+
+
+class PrinterEngine:
+    def __init__(self, labels_per_second: float = 50.0, buffer_size: int = 64 * 1024,
+                 wire_bytes_per_second: Optional[float] = None,
+                 status_code: Optional[str] = "00",
+                 reply_delay: float = 0.0, capture: bool = False):
+        self.labels_per_second = labels_per_second
+        self.buffer_size = buffer_size
+        self.wire_bytes_per_second = wire_bytes_per_second
+        self.status_code = status_code
+        self.reply_delay = reply_delay
+
+        self.bytes_received = 0
+        self.labels_received = 0
+        self.labels_printed = 0
+        self.status_requests = 0
+        self.max_buffered = 0
+        self.missing_forms = 0
+        self.bytes_dropped = 0
+        self.lines: Deque[bytes] = deque(maxlen=1000)
+        self.captured: Optional[bytearray] = bytearray() if capture else None
+        # Formularios guardados: nombre -> número de variables
+        self.forms: Dict[bytes, int] = {}
+        # Gráficos descargados con ~EB: nombre -> archivo (BMP)
+        self.graphics: Dict[bytes, bytes] = {}
+
+        self._line = bytearray()
+        self._label_bytes = 0
+        self._copies = 1
+        self._label_copies = 1
+        self._storing: Optional[bytes] = None
+        self._stored_vars = 0
+        self._recalled_vars = 0
+        self._data_lines = 0
+        self._discard = False
+        self._binary = 0
+        self._graphic: Optional[Tuple[bytes, bytearray]] = None
+        self._fault: Optional[str] = None
+        self._buffered = 0
+        self._pending: Deque[Tuple[int, int]] = deque()  # (etiquetas, bytes)
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._print_loop, daemon=True)
+        self._thread.start()
+
+    # -- recepción -------------------------------------------------------
+    def feed(self, data: bytes) -> List[bytes]:
+        """Procesa bytes recibidos y devuelve las respuestas a enviar"""
+        if self.wire_bytes_per_second:
+            time.sleep(len(data) / self.wire_bytes_per_second)
+        replies = []
+        with self._cond:
+            self.bytes_received += len(data)
+            if self.captured is not None:
+                self.captured += data
+            i = 0
+            while i < len(data):
+                if self._binary:
+                    chunk = data[i:i + self._binary]
+                    i += len(chunk)
+                    self._binary_data(chunk)
+                    continue
+                byte = data[i]
+                i += 1
+                if byte == STATUS_REQUEST[0]:
+                    self._status_reply(replies)
+                elif byte == 0x0A:
+                    if self._handle_line(bytes(self._line).strip()):
+                        self._status_reply(replies)
+                    self._line.clear()
+                else:
+                    self._line.append(byte)
+                    self._label_bytes += 1
+                    if byte == 0x2C and self._line.startswith(b"GW"):
+                        graphic = _EPL_GRAPHIC.match(self._line)
+                        if graphic:
+                            self._binary = int(graphic.group(1)) * int(graphic.group(2))
+            self.max_buffered = max(self.max_buffered, self._buffered)
+            self._cond.notify_all()
+        if replies and self.reply_delay:
+            time.sleep(self.reply_delay)
+        return replies
+
+    def buffered(self) -> int:
+        with self._cond:
+            return self._buffered
+
+    def overflow(self, data: bytes) -> bool:
+        """Con el búfer lleno, descarta `data` como una impresora desbordada"""
+        with self._cond:
+            if self._buffered < self.buffer_size:
+                return False
+            self.bytes_dropped += len(data)
+            return True
+
+    def wait_for_space(self, timeout: Optional[float] = None) -> bool:
+        """Bloquea mientras el búfer de recepción está lleno"""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._buffered < self.buffer_size or not self._running, timeout
+            )
+
+    def _binary_data(self, chunk: bytes) -> None:
+        self._binary -= len(chunk)
+        self._label_bytes += len(chunk)
+        if self._graphic is not None:
+            self._graphic[1].extend(chunk)
+            if not self._binary:
+                self.graphics[self._graphic[0]] = bytes(self._graphic[1])
+                self._graphic = None
+
+    def _status_reply(self, replies: List[bytes]) -> None:
+        # status_code=None simula un dispositivo que no contesta
+        self.status_requests += 1
+        code, self._fault = self._fault or self.status_code, None
+        if code == "00" and self._pending:
+            code = "50"  # Imprimiendo
+        if code is not None:
+            replies.append(f"{code}\r\n".encode("ascii"))
+
+    def _handle_line(self, line: bytes) -> bool:
+        """Interpreta un comando; devuelve True si pide el status"""
+        self._label_bytes += 1
+        if not line:
+            return False
+        self.lines.append(line)
+        if self._data_lines:
+            # Valor de una variable del formulario invocado
+            self._data_lines -= 1
+            return False
+        if line == b"~S,STATUS":
+            return True
+        if self._storing is not None:
+            if line in (b"FE", b"~MEND"):
+                self.forms[self._storing] = self._stored_vars
+                self._storing = None
+            elif _FORM_VARIABLE.match(line):
+                self._stored_vars += 1
+            return False
+        graphic = _EZPL_GRAPHIC.match(line)
+        if graphic:
+            self._binary = int(graphic.group(1)) * int(graphic.group(2))
+            return False
+        download = _GRAPHIC_DOWNLOAD.match(line)
+        if download:
+            self._binary = int(download.group(2))
+            self._graphic = (download.group(1), bytearray())
+            return False
+        delete = _GRAPHIC_DELETE.match(line)
+        if delete:
+            self.graphics.pop(delete.group(1), None)
+            return False
+        form = _FORM_COMMAND.match(line)
+        if form:
+            self._handle_form(form.group(1) or form.group(3), form.group(2) or form.group(4))
+        elif line == b"?":
+            self._data_lines = self._recalled_vars
+        elif line == b"^L" or line == b"N":
+            self._label_bytes = len(line) + 1
+        elif line.startswith(b"^P") and line[2:].isdigit():
+            self._copies = int(line[2:]) or 1
+        elif line.startswith(b"^C") and line[2:].isdigit():
+            self._label_copies = int(line[2:]) or 1
+        elif line == b"E":
+            self._queue_labels(self._copies * self._label_copies)
+        else:
+            match = _EPL_PRINT.match(line)
+            if match:
+                count = int(match.group(1)) * max(int(match.group(2) or 1), 1)
+                self._queue_labels(count)
+        return False
+
+    def _handle_form(self, command: bytes, name: bytes) -> None:
+        if command in (b"FS", b"~MSAVEF"):
+            self._storing, self._stored_vars = name, 0
+        elif command in (b"FK", b"~MDELF"):
+            self.forms.pop(name, None)
+        elif name in self.forms:
+            self._recalled_vars = self.forms[name]
+            if command == b"~MRUNF":
+                # En EZPL los valores siguen directamente a la invocación
+                self._data_lines = self._recalled_vars
+        else:
+            self.missing_forms += 1
+            self._fault = "07"
+            self._discard = True
+
+    def _queue_labels(self, count: int) -> None:
+        if self._discard:
+            self._discard = False
+            self._label_bytes = 0
+            return
+        self.labels_received += count
+        self._pending.append((count, self._label_bytes))
+        self._buffered += self._label_bytes
+        self._label_bytes = 0
+
+    # -- impresión -------------------------------------------------------
+    def _print_loop(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or not self._running)
+                if not self._running:
+                    return
+                count, size = self._pending[0]
+            time.sleep(1 / self.labels_per_second)
+            with self._cond:
+                self.labels_printed += 1
+                if count > 1:
+                    self._pending[0] = (count - 1, size)
+                else:
+                    self._pending.popleft()
+                    self._buffered -= size
+                self._cond.notify_all()
+
+    def render_labels(self) -> List:
+        """Etiquetas recibidas hasta ahora como `(imagen, copias)` (requiere capture=True)"""
+        from preview import LabelRenderer
+
+        with self._cond:
+            data = bytes(self.captured or b"")
+        return LabelRenderer().render(data)
+
+    def reboot(self) -> None:
+        """Simula un reinicio: se pierden los formularios guardados"""
+        with self._cond:
+            self.forms.clear()
+            self._storing = None
+            self._data_lines = 0
+
+    def wait_printed(self, labels: int, timeout: float = 30.0) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.labels_printed >= labels, timeout)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "bytes_received": self.bytes_received,
+                "labels_received": self.labels_received,
+                "labels_printed": self.labels_printed,
+                "status_requests": self.status_requests,
+                "max_buffered_bytes": self.max_buffered,
+                "forms_stored": len(self.forms),
+                "missing_forms": self.missing_forms,
+                "bytes_dropped": self.bytes_dropped,
+            }
+
+    def stop(self) -> None:
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+
+class TcpPrinterEmulator:
+    """Impresora de red en 127.0.0.1 que acepta el flujo RAW del puerto 9100"""
+
+    def __init__(self, engine: Optional[PrinterEngine] = None, host: str = "127.0.0.1",
+                 port: int = 0):
+        self.engine = engine or PrinterEngine()
+        self._server = socket.create_server((host, port))
+        self.host, self.port = self._server.getsockname()[:2]
+        self.uri = f"tcp://{self.host}:{self.port}"
+        self._clients: List[socket.socket] = []
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self) -> None:
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            self._clients.append(client)
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client: socket.socket) -> None:
+        with client:
+            while self.engine.wait_for_space():
+                try:
+                    data = client.recv(4096)
+                except OSError:
+                    return
+                if not data:
+                    return
+                try:
+                    for reply in self.engine.feed(data):
+                        client.sendall(reply)
+                except OSError:
+                    # El cliente se fue sin esperar la respuesta
+                    return
+
+    def close(self) -> None:
+        self.engine.stop()
+        self._server.close()
+        for client in self._clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+XON = b"\x11"
+XOFF = b"\x13"
+
+
+class SerialPrinterEmulator:
+    """Impresora serial sobre un pty; `port` se abre con pyserial como un COM"""
+
+    def __init__(self, engine: Optional[PrinterEngine] = None, flow_control: str = "rtscts"):
+        import pty
+        import tty
+
+        if flow_control not in ("none", "rtscts", "xonxoff"):
+            raise ValueError(f"Control de flujo desconocido: {flow_control}")
+        self.engine = engine or PrinterEngine()
+        self.flow_control = flow_control
+        self.xoff_sent = 0
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self.uri = f"serial://{self.port}"
+        serve = self._serve if flow_control == "rtscts" else self._serve_unblocked
+        threading.Thread(target=serve, daemon=True).start()
+
+    def _serve(self) -> None:
+        while self.engine.wait_for_space():
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                return
+            for reply in self.engine.feed(data):
+                os.write(self._master, reply)
+
+    def _pending(self) -> int:
+        """Bytes escritos en el pty que aún no se leyeron"""
+        import fcntl
+        import termios
+
+        return struct.unpack("i", fcntl.ioctl(self._master, termios.FIONREAD, b"\0" * 4))[0]
+
+    def _serve_unblocked(self) -> None:
+        # Se sigue leyendo con el búfer lleno; XOFF a la mitad del búfer, XON
+        # al bajar de un cuarto. Lo que ya estaba en el pty al mandar XOFF
+        # hace de búfer de salida del emisor y no se lee hasta el XON; lo que
+        # llegue después es un emisor que no respeta XOFF.
+        engine = self.engine
+        paused = False
+        held = 0
+        try:
+            while engine._running:
+                if self.flow_control == "xonxoff":
+                    buffered = engine.buffered()
+                    if not paused and buffered >= engine.buffer_size // 2:
+                        os.write(self._master, XOFF)
+                        self.xoff_sent += 1
+                        paused, held = True, self._pending()
+                    elif paused and buffered <= engine.buffer_size // 4:
+                        os.write(self._master, XON)
+                        paused = False
+                if paused:
+                    time.sleep(0.005)
+                    extra = self._pending() - held
+                    if extra <= 0:
+                        continue
+                    data = os.read(self._master, extra)
+                else:
+                    readable, _, _ = select.select([self._master], [], [], 0.02)
+                    if not readable:
+                        continue
+                    data = os.read(self._master, 4096)
+                if engine.overflow(data):
+                    continue
+                for reply in engine.feed(data):
+                    os.write(self._master, reply)
+        except OSError:
+            return
+
+    def close(self) -> None:
+        self.engine.stop()
+        os.close(self._slave)
+        os.close(self._master)
+
+
+class FakeWin32Print:
+    """Sustituto de win32print que cobra un coste fijo por trabajo y por byte.
+
+    También simula la cola del spooler: cada trabajo espera a los anteriores
+    y tarda `print_cost` segundos en imprimirse (0: sale en la siguiente
+    llamada). GetPrinter (cJobs), EnumJobs, GetJob y SetJob ven esa cola.
+    """
+
+    JOB_CONTROL_DELETE = 5
+    JOB_STATUS_PRINTING = 0x10
+
+    def __init__(self, open_cost: float = 0.005, job_cost: float = 0.010,
+                 bytes_per_sec: float = 1_000_000, print_cost: float = 0.0):
+        self.open_cost = open_cost
+        self.job_cost = job_cost
+        self.bytes_per_sec = bytes_per_sec
+        self.print_cost = print_cost
+        self.jobs = 0
+        self.bytes = 0
+        self.printed = 0
+        self.deleted = 0
+        self.aborted = 0
+        self.enumerations = 0
+        # JobId -> documento, en orden de impresión
+        self.queue: "OrderedDict[int, str]" = OrderedDict()
+        self._head_started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _drain(self) -> None:
+        """Saca de la cola lo que ya se imprimió (con el lock tomado)"""
+        now = time.monotonic()
+        if self.print_cost <= 0:
+            self.printed += len(self.queue)
+            self.queue.clear()
+        while self.queue and self._head_started + self.print_cost <= now:
+            self.queue.popitem(last=False)
+            self.printed += 1
+            self._head_started += self.print_cost
+        if not self.queue:
+            self._head_started = now
+
+    def OpenPrinter(self, name):
+        time.sleep(self.open_cost)
+        return name
+
+    def ClosePrinter(self, handle):
+        time.sleep(self.open_cost)
+
+    def StartDocPrinter(self, handle, level, info):
+        with self._lock:
+            self._drain()
+            self.jobs += 1
+            job_id = self.jobs
+            self.queue[job_id] = info[0]
+        time.sleep(self.job_cost)
+        return job_id
+
+    def StartPagePrinter(self, handle):
+        pass
+
+    def WritePrinter(self, handle, data):
+        self.bytes += len(data)
+        time.sleep(len(data) / self.bytes_per_sec)
+        return len(data)
+
+    def EndPagePrinter(self, handle):
+        pass
+
+    def EndDocPrinter(self, handle):
+        pass
+
+    def AbortPrinter(self, handle):
+        # Descarta el último trabajo abierto (el que se estaba escribiendo)
+        with self._lock:
+            self.queue.pop(self.jobs, None)
+            self.aborted += 1
+
+    def GetPrinter(self, handle, level):
+        with self._lock:
+            self._drain()
+            return {"Status": 0, "cJobs": len(self.queue)}
+
+    def _job_info(self, position: int, job_id: int, document: str) -> Dict:
+        printing = position == 1 and self.print_cost > 0
+        return {"JobId": job_id, "pDocument": document, "Position": position,
+                "Status": self.JOB_STATUS_PRINTING if printing else 0}
+
+    def EnumJobs(self, handle, first, count, level):
+        with self._lock:
+            self._drain()
+            self.enumerations += 1
+            jobs = itertools.islice(self.queue.items(), first, first + count)
+            return [self._job_info(first + i + 1, job_id, document)
+                    for i, (job_id, document) in enumerate(jobs)]
+
+    def GetJob(self, handle, job_id, level):
+        with self._lock:
+            self._drain()
+            if job_id not in self.queue:
+                raise RuntimeError(f"El trabajo {job_id} no existe")
+            position = list(self.queue).index(job_id) + 1
+            return self._job_info(position, job_id, self.queue[job_id])
+
+    def SetJob(self, handle, job_id, level, info, command):
+        with self._lock:
+            self._drain()
+            if command != self.JOB_CONTROL_DELETE:
+                return
+            if job_id not in self.queue:
+                raise RuntimeError(f"El trabajo {job_id} no existe")
+            head = next(iter(self.queue)) == job_id
+            del self.queue[job_id]
+            self.deleted += 1
+            if head:
+                self._head_started = time.monotonic()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulador de impresora Godex")
+    parser.add_argument("transport", choices=["tcp", "serial"])
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--speed", type=float, default=2.0, help="etiquetas por segundo")
+    parser.add_argument("--buffer", type=int, default=64 * 1024, help="bytes de búfer")
+    args = parser.parse_args()
+
+    engine = PrinterEngine(labels_per_second=args.speed, buffer_size=args.buffer)
+    if args.transport == "tcp":
+        emulator = TcpPrinterEmulator(engine, host="0.0.0.0", port=args.port)
+    else:
+        emulator = SerialPrinterEmulator(engine)
+    print(f"Emulador escuchando en {emulator.uri}")
+    try:
+        while True:
+            time.sleep(5)
+            print(engine.stats())
+    except KeyboardInterrupt:
+        emulator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""Eventos de trabajos e impresoras para los clientes (SSE y WebSocket).
+
+Un único `EventBus` por proceso recibe los avisos de la cola de impresión y
+del sondeo de estado y los reparte a los suscriptores. Cada evento se
+serializa a JSON una sola vez; publicarlo solo lo añade al búfer de cada
+suscriptor que lo quiere y despierta a los que esperan, sin esperar nunca
+a un cliente. Se publica desde el event loop (los workers de la cola y los
+listeners del sondeo ya corren ahí).
+
+El búfer de cada suscriptor está acotado: si un cliente lento lo llena se
+descartan sus eventos más antiguos, y lo siguiente que recibe es un evento
+`dropped` con cuántos perdió. El bus guarda los últimos `history` eventos
+para que un cliente que se reconecta pida los que siguen a su último `seq`.
+
+    {"seq": 41, "time": ..., "type": "job", "event": "sent", "job_id": ..., ...}
+    {"seq": 42, "time": ..., "type": "printer", "printer_name": "BP500", "ready": true, ...}
+    {"type": "dropped", "count": 17}
+
+Eventos de trabajo: queued, sending, sent, failed, cancelled y printed.
+`sent` es que el transporte aceptó los bytes; ninguna impresora confirma cada
+trabajo, así que `printed` se emite cuando, después del envío, la impresora informa estar
+en reposo (lista, sin imprimir ni trabajos en el spooler). Con una impresora
+sin status (transportes sin sondeo) no llega nunca.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from metrics import Counter
+from printer_status import PrinterStatus
+
+logger = logging.getLogger(__name__)
+
+JOB_EVENT = "job"
+PRINTER_EVENT = "printer"
+DROPPED_EVENT = "dropped"
+
+EVENTS_PUBLISHED = Counter("events_published_total", "Eventos publicados en el bus", ["type"])
+EVENTS_DROPPED = Counter("events_dropped_total",
+                         "Eventos descartados por suscriptores con el búfer lleno")
+
+# Campos del estado que cuentan como cambio (no la hora ni la respuesta en bruto)
+_STATUS_FIELDS = tuple(f for f in PrinterStatus.__slots__ if f not in ("updated_at", "raw"))
+
+
+class Event:
+    """Evento ya serializado; `printers` y `job_id` sirven para filtrar"""
+
+    __slots__ = ("seq", "type", "printers", "job_id", "data")
+
+    def __init__(self, seq: Optional[int], type: str, data: bytes,
+                 printers: Tuple[str, ...] = (), job_id: Optional[str] = None):
+        self.seq = seq
+        self.type = type
+        self.data = data
+        self.printers = printers
+        self.job_id = job_id
+
+    def sse(self) -> bytes:
+        """Trama de Server-Sent Events (`id` permite reanudar con Last-Event-ID)"""
+        head = b"id: %d\n" % self.seq if self.seq is not None else b""
+        return head + b"event: " + self.type.encode() + b"\ndata: " + self.data + b"\n\n"
+
+
+class Subscription:
+    def __init__(self, bus: "EventBus", max_buffered: int,
+                 printers: Optional[Set[str]] = None, jobs: Optional[Set[str]] = None,
+                 types: Optional[Set[str]] = None):
+        self._bus = bus
+        self.max_buffered = max_buffered
+        self.printers = printers
+        self.jobs = jobs
+        self.types = types
+        self.dropped_total = 0
+        self.closed = False
+        self._buffer: Deque[Event] = deque()
+        self._dropped = 0
+        self._waiter: Optional[asyncio.Future] = None
+
+    def wants(self, event: Event) -> bool:
+        if self.types is not None and event.type not in self.types:
+            return False
+        if self.jobs is not None and event.job_id not in self.jobs:
+            return False
+        if self.printers is not None and self.printers.isdisjoint(event.printers):
+            return False
+        return True
+
+    def put(self, event: Event) -> None:
+        if len(self._buffer) >= self.max_buffered:
+            self._buffer.popleft()
+            self._dropped += 1
+            self.dropped_total += 1
+            EVENTS_DROPPED.inc()
+        self._buffer.append(event)
+        self._wake()
+
+    def _wake(self) -> None:
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[List[Event]]:
+        """Todos los eventos pendientes, esperando hasta `timeout` a que llegue
+        alguno ([] si vence). None cuando la suscripción está cerrada."""
+        if not self._buffer and not self._dropped and not self.closed:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait((self._waiter,), timeout=timeout)
+            finally:
+                self._waiter = None
+        if self.closed:
+            return None
+        events = []
+        if self._dropped:
+            count, self._dropped = self._dropped, 0
+            events.append(Event(None, DROPPED_EVENT,
+                                json.dumps({"type": DROPPED_EVENT, "count": count}).encode()))
+        events.extend(self._buffer)
+        self._buffer.clear()
+        return events
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self._bus._subscribers.discard(self)
+            self._buffer.clear()
+            self._wake()
+
+
+class EventBus:
+    def __init__(self, max_buffered: int = 256, history: int = 1000):
+        self.max_buffered = max_buffered
+        self.published = 0
+        self._subscribers: Set[Subscription] = set()
+        self._history: Deque[Event] = deque(maxlen=history)
+        self._seq = itertools.count(1)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self, printers: Optional[Iterable[str]] = None,
+                  jobs: Optional[Iterable[str]] = None, types: Optional[Iterable[str]] = None,
+                  after: Optional[int] = None,
+                  max_buffered: Optional[int] = None) -> Subscription:
+        """Suscripción filtrada por impresora, trabajo y tipo (None = todos).
+
+        Con `after`, empieza por los eventos guardados con `seq` mayor.
+        """
+        subscription = Subscription(self, max_buffered or self.max_buffered,
+                                    set(printers) if printers else None,
+                                    set(jobs) if jobs else None,
+                                    set(types) if types else None)
+        if after is not None:
+            for event in self._history:
+                if event.seq > after and subscription.wants(event):
+                    subscription.put(event)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def publish(self, type: str, data: Dict, printers: Tuple[str, ...] = (),
+                job_id: Optional[str] = None) -> Event:
+        seq = next(self._seq)
+        encoded = json.dumps({"seq": seq, "time": time.time(), "type": type, **data}).encode()
+        event = Event(seq, type, encoded, printers, job_id)
+        self.publish_event(event)
+        return event
+
+    def publish_event(self, event: Event) -> None:
+        """Reparte un evento ya serializado (p. ej. reenviado por el despachador)"""
+        self.published += 1
+        EVENTS_PUBLISHED.labels(event.type).inc()
+        if event.seq is not None:
+            self._history.append(event)
+        for subscription in self._subscribers:
+            if subscription.wants(event):
+                subscription.put(event)
+
+
+class PrintEvents:
+    """Convierte los avisos de PrintQueue y StatusMonitor en eventos del bus"""
+
+    def __init__(self, bus: EventBus, max_unconfirmed: int = 10000):
+        self.bus = bus
+        self.max_unconfirmed = max_unconfirmed
+        # Impresora -> trabajos enviados aún sin ver la impresora en reposo
+        self._unconfirmed: Dict[str, Deque[Tuple[float, object]]] = {}
+
+    def _publish_job(self, event: str, job) -> None:
+        printers = (job.printer_name,) if job.device in (None, job.printer_name) \
+            else (job.printer_name, job.device)
+        self.bus.publish(JOB_EVENT, {"event": event, **job.to_dict()}, printers, job.job_id)
+
+    def job(self, event: str, job) -> None:
+        """Listener de PrintQueue"""
+        self._publish_job(event, job)
+        if event == "sent":
+            sent = self._unconfirmed.get(job.device)
+            if sent is None:
+                sent = self._unconfirmed[job.device] = deque(maxlen=self.max_unconfirmed)
+            sent.append((time.time(), job))
+
+    def status(self, previous: Optional[PrinterStatus], status: PrinterStatus) -> None:
+        """Listener de StatusMonitor"""
+        if previous is None or any(getattr(previous, f) != getattr(status, f)
+                                   for f in _STATUS_FIELDS):
+            self.bus.publish(PRINTER_EVENT, status.to_dict(), (status.printer_name,))
+        sent = self._unconfirmed.get(status.printer_name)
+        if not sent or not (status.ready and not status.printing and not status.queue_depth):
+            return
+        # Solo cuentan los trabajos enviados antes de esta lectura del estado
+        while sent and sent[0][0] < status.updated_at:
+            _, job = sent.popleft()
+            job.printed_at = status.updated_at
+            self._publish_job("printed", job)
@@ -0,0 +1,281 @@
+"""Códigos QR y de barras generados en el servidor como gráficos de 1 bit.
+
+En lugar de pedirle a la impresora que dibuje el código (comando `W` de EZPL
+o `B` de EPL), el código se genera aquí y se envía como mapa de bits:
+
+    Q<x>,<y>,<bytes por fila>,<alto>      EZPL, 1 = punto negro
+    GW<x>,<y>,<bytes por fila>,<alto>,    EPL, 0 = punto negro
+
+seguido de los datos binarios, fila a fila y de izquierda a derecha (el bit
+más significativo primero). Así cada ticket puede llevar su propio QR y se
+pueden usar simbologías que el firmware no tenga.
+
+Los mapas de bits ya empaquetados se guardan en una LRU por contenido y
+tamaño: repetir un código (el mismo evento, el mismo producto) no vuelve a
+generarlo. `qrcode` y `python-barcode` se importan solo al usarse.
+
+`image_bitmap` convierte un PNG/JPEG cualquiera a 1 bit a 203 dpi (umbral,
+tramado ordenado o difusión de error) con NumPy, y `ezpl_download_graphic`
+lo guarda en la impresora con un nombre que las plantillas recuperan con
+`Y<x>,<y>,<nombre>`. NumPy y Pillow también se importan solo al usarse.
+"""
+import io
+import struct
+import threading
+from collections import OrderedDict
+from typing import Hashable, List, NamedTuple, Optional, Sequence, Tuple
+
+_INVERT = bytes(255 - i for i in range(256))
+# Píxeles máximos de una imagen subida, antes de escalarla: una foto de 16 MP
+# entra; un PNG de pocos KB que declara 100000 x 100000 no llega a decodificarse
+MAX_IMAGE_PIXELS = 4096 * 4096
+
+
+class InvalidImage(ValueError):
+    """Los datos no son una imagen que Pillow pueda leer"""
+
+
+class ImageTooLarge(InvalidImage):
+    """La imagen tiene más píxeles que el máximo permitido"""
+
+
+class Bitmap(NamedTuple):
+    """Mapa de bits empaquetado, 1 = punto negro"""
+
+    width: int
+    height: int
+    data: bytes
+
+    @property
+    def row_bytes(self) -> int:
+        return (self.width + 7) // 8
+
+
+def pack_modules(rows: Sequence[Sequence[bool]], module: int, height: int = 0) -> Bitmap:
+    """Escala una matriz de módulos (True = negro) a `module` puntos por módulo.
+
+    Con `height`, la matriz es una sola fila (código de barras) que se repite
+    `height` veces.
+    """
+    width = len(rows[0]) * module
+    padding = -width % 8
+    on, off = "1" * module, "0" * module
+    row_bytes = (width + padding) // 8
+    packed: List[bytes] = []
+    for row in rows:
+        bits = "".join(on if dark else off for dark in row) + "0" * padding
+        line = int(bits, 2).to_bytes(row_bytes, "big")
+        packed.append(line * (height or module))
+    return Bitmap(width, height or len(rows) * module, b"".join(packed))
+
+
+def rotate_bitmap(bitmap: Bitmap, rotation: int) -> Bitmap:
+    """Gira el mapa de bits `rotation` cuartos de vuelta en sentido horario"""
+    import numpy as np
+
+    if rotation % 4 == 0:
+        return bitmap
+    bits = np.unpackbits(np.frombuffer(bitmap.data, dtype=np.uint8).reshape(
+        bitmap.height, bitmap.row_bytes), axis=1)[:, :bitmap.width]
+    bits = np.rot90(bits, -(rotation % 4))
+    height, width = bits.shape
+    return Bitmap(width, height, np.packbits(bits, axis=1).tobytes())
+
+
+def rotated_origin(x: int, y: int, width: int, height: int, rotation: int) -> Tuple[int, int]:
+    """Esquina superior izquierda de un objeto ya girado de `width`x`height`.
+
+    Las impresoras giran los objetos en sentido horario alrededor de su punto
+    de origen `x`,`y`.
+    """
+    return {0: (x, y), 1: (x - width, y), 2: (x - width, y - height),
+            3: (x, y - height)}[rotation % 4]
+
+
+def qr_modules(data: str, error_correction: str = "M") -> List[List[bool]]:
+    import qrcode
+
+    levels = {"L": qrcode.constants.ERROR_CORRECT_L, "M": qrcode.constants.ERROR_CORRECT_M,
+              "Q": qrcode.constants.ERROR_CORRECT_Q, "H": qrcode.constants.ERROR_CORRECT_H}
+    qr = qrcode.QRCode(error_correction=levels[error_correction], border=0, box_size=1)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def barcode_modules(data: str, symbology: str = "code128") -> List[bool]:
+    import barcode
+
+    bars = barcode.get_barcode_class(symbology)(data).build()[0]
+    return [bar == "1" for bar in bars]
+
+
+DPI = 203
+
+# Matriz de Bayer 8x8 normalizada a umbrales de 0 a 255
+_BAYER_8 = (
+    (0, 32, 8, 40, 2, 34, 10, 42), (48, 16, 56, 24, 50, 18, 58, 26),
+    (12, 44, 4, 36, 14, 46, 6, 38), (60, 28, 52, 20, 62, 30, 54, 22),
+    (3, 35, 11, 43, 1, 33, 9, 41), (51, 19, 59, 27, 49, 17, 57, 25),
+    (15, 47, 7, 39, 13, 45, 5, 37), (63, 31, 55, 23, 61, 29, 53, 21),
+)
+DITHERS = ("threshold", "ordered", "diffusion")
+
+
+def _target_size(size: Tuple[int, int], dpi: Optional[Tuple[float, float]], width: int,
+                 height: int, max_size: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+    """Tamaño en puntos: el pedido, o el de la imagen a 203 dpi, sin pasar de `max_size`"""
+    w, h = size
+    if width or height:
+        scale = min(width / w if width else height / h, height / h if height else width / w)
+    elif dpi and dpi[0] > 0 and dpi[1] > 0:
+        scale = DPI / dpi[0]
+        h = h * dpi[0] / dpi[1]
+    else:
+        scale = 1.0
+    if max_size:
+        scale = min(scale, max_size[0] / w, max_size[1] / h)
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def image_bitmap(data: bytes, width: int = 0, height: int = 0, dither: str = "diffusion",
+                 threshold: int = 128, max_size: Optional[Tuple[int, int]] = None,
+                 max_pixels: int = MAX_IMAGE_PIXELS) -> Bitmap:
+    """Convierte una imagen (PNG, JPEG, ...) a un mapa de bits de 1 bit.
+
+    Con `width` y/o `height` la imagen se ajusta a ese recuadro conservando la
+    proporción; sin ellos se escala de su resolución a 203 dpi. La
+    transparencia se compone sobre blanco. Lanza ImageTooLarge si la imagen
+    pasa de `max_pixels` (se mira la cabecera, antes de decodificarla),
+    InvalidImage si no se puede leer y ValueError si `dither` no está en DITHERS.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    if dither not in DITHERS:
+        raise ValueError(f"Tramado desconocido: {dither}")
+    try:
+        image = Image.open(io.BytesIO(data))
+        w, h = image.size
+        if w * h > max_pixels:
+            raise ImageTooLarge(f"Imagen de {w}x{h} píxeles: el máximo es {max_pixels}")
+        image.load()
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    except (UnidentifiedImageError, OSError, SyntaxError, EOFError, struct.error) as e:
+        raise InvalidImage(f"Imagen no válida: {e}")
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, "white")
+        image = Image.alpha_composite(background, image)
+    image = image.convert("L")
+    size = _target_size(image.size, image.info.get("dpi"), width, height, max_size)
+    if size != image.size:
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    if dither == "diffusion":
+        # Floyd-Steinberg es secuencial por naturaleza; Pillow lo hace en C
+        image = image.convert("1")
+    return pack_gray(image, dither, threshold)
+
+
+def pack_gray(image, dither: str = "threshold", threshold: int = 128) -> Bitmap:
+    """Umbraliza y empaqueta una imagen en escala de grises (Pillow o array de NumPy)"""
+    import numpy as np
+
+    gray = np.asarray(image)
+    if gray.dtype == bool:
+        # Modo "1" de Pillow: True = blanco
+        black = ~gray
+    elif dither == "ordered":
+        h, w = gray.shape
+        bayer = (np.array(_BAYER_8, dtype=np.uint16) * 4 + 2)
+        black = gray < np.tile(bayer, (h // 8 + 1, w // 8 + 1))[:h, :w]
+    else:
+        black = gray < threshold
+    height, width = black.shape
+    return Bitmap(width, height, np.packbits(black, axis=1).tobytes())
+
+
+def bmp_1bit(bitmap: Bitmap) -> bytes:
+    """Archivo BMP monocromo (paleta negro/blanco, filas de abajo arriba)"""
+    stride = (bitmap.row_bytes + 3) & ~3
+    padding = b"\x00" * (stride - bitmap.row_bytes)
+    rb = bitmap.row_bytes
+    # En la paleta el índice 0 es negro: los bits van invertidos
+    data = bitmap.data.translate(_INVERT)
+    rows = [data[y * rb:(y + 1) * rb] + padding for y in range(bitmap.height - 1, -1, -1)]
+    pixels = b"".join(rows)
+    offset = 14 + 40 + 8
+    header = struct.pack("<2sIHHI", b"BM", offset + len(pixels), 0, 0, offset)
+    info = struct.pack("<IiiHHIIiiII", 40, bitmap.width, bitmap.height, 1, 1, 0,
+                       len(pixels), 7992, 7992, 2, 2)
+    palette = b"\x00\x00\x00\x00\xff\xff\xff\x00"
+    return header + info + palette + pixels
+
+
+def ezpl_download_graphic(name: str, bitmap: Bitmap) -> bytes:
+    """Borra y vuelve a descargar el gráfico `name` (BMP, comando `~EB`)"""
+    bmp = bmp_1bit(bitmap)
+    header = f"~MDELG,{name}\r\n~EB,{name},{len(bmp)}\r\n".encode("ascii")
+    return header + bmp + b"\r\n"
+
+
+def ezpl_graphic(x: int, y: int, bitmap: Bitmap) -> bytes:
+    """Comando `Q` de EZPL con el mapa de bits"""
+    header = f"Q{x},{y},{bitmap.row_bytes},{bitmap.height}\r\n".encode("ascii")
+    return header + bitmap.data + b"\r\n"
+
+
+def epl_graphic(x: int, y: int, bitmap: Bitmap) -> bytes:
+    """Comando `GW` de EPL; EPL imprime los bits a 0, así que se invierten"""
+    header = f"GW{x},{y},{bitmap.row_bytes},{bitmap.height},".encode("ascii")
+    return header + bitmap.data.translate(_INVERT) + b"\n"
+
+
+class CodeRasterizer:
+    """Genera y cachea los mapas de bits de QR y códigos de barras"""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[Hashable, Bitmap]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def qr(self, data: str, module: int = 5, error_correction: str = "M",
+           rotation: int = 0) -> Bitmap:
+        key = ("qr", data, module, error_correction, rotation % 4)
+        bitmap = self._cached(key)
+        if bitmap is None:
+            bitmap = pack_modules(qr_modules(data, error_correction), module)
+            bitmap = self._store(key, rotate_bitmap(bitmap, rotation))
+        return bitmap
+
+    def barcode(self, data: str, symbology: str = "code128", module: int = 2,
+                height: int = 80) -> Bitmap:
+        key = ("barcode", data, symbology, module, height)
+        bitmap = self._cached(key)
+        if bitmap is None:
+            bitmap = self._store(key, pack_modules([barcode_modules(data, symbology)],
+                                                   module, height))
+        return bitmap
+
+    def _cached(self, key: Hashable):
+        with self._lock:
+            bitmap = self._cache.get(key)
+            if bitmap is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return bitmap
+
+    def _store(self, key: Hashable, bitmap: Bitmap) -> Bitmap:
+        with self._lock:
+            self._cache[key] = bitmap
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return bitmap
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
@@ -0,0 +1,247 @@
+"""Diario durable de trabajos de impresión.
+
+Cada trabajo queda registrado en SQLite (modo WAL) con su estado:
+
+    accepted   aceptado por la API (se confirma en disco antes de responder 202)
+    sent       a punto de escribirse en la impresora
+    confirmed  la impresora (o el spooler) recibió el trabajo completo
+    failed     error definitivo
+
+Al arrancar se reencolan los trabajos que no llegaron a `confirmed`. Un
+trabajo en `accepted` seguro que no se imprimió; uno en `sent` pudo haberse
+impreso justo antes de la caída, así que se avisa al reenviarlo.
+
+Las escrituras las hace un único hilo que agrupa todo lo pendiente en una
+sola transacción (group commit): con muchos trabajos concurrentes se paga un
+fsync por lote y no uno por trabajo. Ese hilo también borra, como mucho una
+vez cada `prune_interval`, los trabajos terminados hace más de `retention`
+junto con sus claves de idempotencia en memoria.
+"""
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STATE_ACCEPTED = "accepted"
+STATE_SENT = "sent"
+STATE_CONFIRMED = "confirmed"
+STATE_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    idempotency_key TEXT UNIQUE,
+    printer_name TEXT NOT NULL,
+    payload BLOB,
+    labels INTEGER NOT NULL DEFAULT 1,
+    state TEXT NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+"""
+
+_INSERT = ("INSERT INTO jobs (job_id, idempotency_key, printer_name, payload, labels, state, "
+           "created_at, updated_at) VALUES (?, ?, ?, ?, ?, 'accepted', ?, ?)")
+# El payload ya no hace falta una vez terminado el trabajo
+_FINISH = "UPDATE jobs SET state = ?, error = ?, payload = NULL, updated_at = ? WHERE job_id = ?"
+_SENT = "UPDATE jobs SET state = 'sent', updated_at = ? WHERE job_id = ?"
+_EXPIRED = ("SELECT job_id, idempotency_key FROM jobs "
+            "WHERE state IN ('confirmed', 'failed') AND updated_at < ?")
+_PRUNE = "DELETE FROM jobs WHERE state IN ('confirmed', 'failed') AND updated_at < ?"
+
+_STOP = object()
+
+
+def _resolve(future: Future, error: Optional[BaseException] = None) -> None:
+    # La corrutina que esperaba pudo cancelarse (p. ej. al parar la cola); la
+    # escritura ya está hecha igualmente. Comprobarlo con cancelled() no basta:
+    # la cancelación llega desde el hilo del bucle y puede colarse antes del
+    # set_*, que lanzaría InvalidStateError y mataría este hilo. Pasar el
+    # futuro a "running" lo hace atómicamente y ya no se puede cancelar.
+    if not future.set_running_or_notify_cancel():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+class JournalEntry(NamedTuple):
+    job_id: str
+    idempotency_key: Optional[str]
+    printer_name: str
+    payload: bytes
+    state: str
+    created_at: float
+    # Etiquetas que imprime el trabajo (para la admisión al reencolarlo)
+    labels: int = 1
+
+
+class JobJournal:
+    def __init__(self, path: str, retention: float = 7 * 24 * 3600, max_batch: int = 5000,
+                 prune_interval: float = 3600):
+        """
+        Args:
+            path: archivo SQLite
+            retention: segundos que se conservan los trabajos terminados (y sus
+                claves de idempotencia)
+            max_batch: escrituras máximas por transacción
+            prune_interval: segundos mínimos entre dos limpiezas de lo caducado
+        """
+        self.path = path
+        self.retention = retention
+        self.max_batch = max_batch
+        self.prune_interval = prune_interval
+        self._pruned_at = 0.0
+        self.commits = 0
+        self.writes = 0
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._keys: Dict[str, str] = {}
+
+    def open(self) -> List[JournalEntry]:
+        """Abre el diario y devuelve los trabajos sin confirmar, en orden de llegada"""
+        if self._thread is not None:
+            return []
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.executescript(_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "labels" not in columns:
+            # Diarios creados antes de guardar las etiquetas
+            conn.execute("ALTER TABLE jobs ADD COLUMN labels INTEGER NOT NULL DEFAULT 1")
+        self._prune(conn)
+        self._keys = dict(conn.execute(
+            "SELECT idempotency_key, job_id FROM jobs WHERE idempotency_key IS NOT NULL"
+        ))
+        unconfirmed = [JournalEntry(*row) for row in conn.execute(
+            "SELECT job_id, idempotency_key, printer_name, payload, state, created_at, labels "
+            "FROM jobs WHERE state IN ('accepted', 'sent') ORDER BY created_at"
+        )]
+        self._thread = threading.Thread(target=self._run, args=(conn,), daemon=True,
+                                        name="job-journal")
+        self._thread.start()
+        if unconfirmed:
+            logger.warning(f"{len(unconfirmed)} trabajo(s) sin confirmar en el diario")
+        return unconfirmed
+
+    def close(self) -> None:
+        """Escribe lo pendiente y cierra"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def lookup(self, idempotency_key: str) -> Optional[str]:
+        """job_id ya registrado con esa clave de idempotencia"""
+        return self._keys.get(idempotency_key)
+
+    def reserve(self, idempotency_key: str, job_id: str) -> Optional[str]:
+        """Asocia la clave al trabajo; si ya estaba asociada devuelve el job_id existente"""
+        existing = self._keys.get(idempotency_key)
+        if existing is not None:
+            return existing
+        self._keys[idempotency_key] = job_id
+        return None
+
+    async def accepted(self, job_id: str, printer_name: str, payload: bytes,
+                       idempotency_key: Optional[str] = None, labels: int = 1) -> None:
+        """Registra el trabajo y espera a que esté en disco"""
+        now = time.time()
+        try:
+            await self._write(_INSERT, (job_id, idempotency_key, printer_name, payload, labels,
+                                        now, now))
+        except BaseException:
+            if idempotency_key is not None and self._keys.get(idempotency_key) == job_id:
+                del self._keys[idempotency_key]
+            raise
+
+    async def sent(self, job_id: str) -> None:
+        """Marca el trabajo como enviado y espera a que esté en disco"""
+        await self._write(_SENT, (time.time(), job_id))
+
+    def confirmed(self, job_id: str) -> None:
+        self._submit(_FINISH, (STATE_CONFIRMED, None, time.time(), job_id))
+
+    def failed(self, job_id: str, error: str) -> None:
+        self._submit(_FINISH, (STATE_FAILED, error, time.time(), job_id))
+
+    async def _write(self, sql: str, params: Tuple) -> None:
+        await asyncio.wrap_future(self._submit(sql, params))
+
+    def _submit(self, sql: str, params: Tuple) -> Future:
+        if self._thread is None:
+            raise RuntimeError("El diario de trabajos no está abierto")
+        future: Future = Future()
+        self._queue.put((sql, params, future))
+        return future
+
+    def _run(self, conn: sqlite3.Connection) -> None:
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stop = True
+                batch = [op for op in batch if op is not _STOP]
+            if time.monotonic() - self._pruned_at >= self.prune_interval:
+                self._prune(conn)
+            if batch:
+                self._commit(conn, batch)
+        conn.close()
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        """Borra los trabajos terminados hace más de `retention` y olvida sus claves"""
+        self._pruned_at = time.monotonic()
+        cutoff = time.time() - self.retention
+        try:
+            conn.execute("BEGIN")
+            expired = conn.execute(_EXPIRED, (cutoff,)).fetchall()
+            conn.execute(_PRUNE, (cutoff,))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logger.error(f"Error limpiando el diario: {e}")
+            return
+        for job_id, key in expired:
+            # La clave pudo volver a usarse para otro trabajo después
+            if key is not None and self._keys.get(key) == job_id:
+                self._keys.pop(key, None)
+
+    def _commit(self, conn: sqlite3.Connection, batch: List) -> None:
+        try:
+            conn.execute("BEGIN")
+            for sql, params, _ in batch:
+                conn.execute(sql, params)
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logger.error(f"Error escribiendo lote del diario: {e}")
+            # Se reintenta una a una para que un fallo no arrastre a todo el lote
+            for sql, params, future in batch:
+                try:
+                    conn.execute(sql, params)
+                    _resolve(future)
+                except Exception as single:
+                    _resolve(future, single)
+        else:
+            for _, _, future in batch:
+                _resolve(future)
+        self.commits += 1
+        self.writes += len(batch)
@@ -0,0 +1,253 @@
+"""Índice en memoria de los trabajos pendientes, para listarlos y cancelarlos.
+
+Un trabajo está pendiente desde que se encola hasta que sale de nuestra cola
+o, si fue al spooler de Windows, hasta que sale del spooler. `JobTracker`
+escucha a la PrintQueue (queued, sending, sent, failed, cancelled) y el envío
+al spooler le dice qué ID le dio Windows a cada trabajo (`spooled`), así que
+el índice se actualiza con cada cambio y listar no enumera nada: una página
+es una búsqueda binaria por `seq` y `limit` lecturas.
+
+El estado de lo que espera en el spooler (posición, banderas) llega con
+`refresh`, que el sondeo de estado llama con una sola enumeración por
+impresora y por intervalo, y solo si hay trabajos nuestros en ese spooler.
+Un ID que ya no aparece es un trabajo que salió (impreso o borrado).
+
+    queued    en nuestra cola; cancelarlo es quitarlo de ella
+    sending   un worker lo está enviando; no se puede cancelar
+    spooled   en el spooler de Windows; cancelarlo lo borra de ahí
+"""
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from print_queue import PrintJob, PrintQueue
+from printer_status import decode_job_status
+
+logger = logging.getLogger(__name__)
+
+STATE_QUEUED = "queued"
+STATE_SENDING = "sending"
+STATE_SPOOLED = "spooled"
+STATES = (STATE_QUEUED, STATE_SENDING, STATE_SPOOLED)
+
+
+class JobNotFound(LookupError):
+    """No hay ningún trabajo con ese ID"""
+
+
+class JobNotCancellable(RuntimeError):
+    """El trabajo existe pero ya no espera: se está enviando, terminó o falló"""
+
+
+class TrackedJob:
+    __slots__ = ("job", "seq", "state", "device", "spool_ids", "spool_status", "position")
+
+    def __init__(self, job: PrintJob, seq: int):
+        self.job = job
+        self.seq = seq
+        self.state = STATE_QUEUED
+        self.device: Optional[str] = None
+        # ID del spooler -> cuándo se registró (time.monotonic())
+        self.spool_ids: Dict[int, float] = {}
+        self.spool_status: Optional[int] = None
+        self.position: Optional[int] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            **self.job.to_dict(),
+            "state": self.state,
+            "device": self.device or self.job.device,
+            "spool_job_ids": sorted(self.spool_ids),
+            "spool_status": decode_job_status(self.spool_status)
+            if self.spool_status is not None else None,
+            "position": self.position,
+        }
+
+
+class _Order:
+    """`seq` de los trabajos pendientes en orden de llegada.
+
+    Las bajas dejan huecos que se saltan al recorrer y que se compactan al
+    pasar de la mitad, así que alta y baja son O(1) amortizado.
+    """
+
+    __slots__ = ("seqs", "live")
+
+    def __init__(self):
+        self.seqs: List[int] = []
+        self.live = 0
+
+    def add(self, seq: int) -> None:
+        self.seqs.append(seq)
+        self.live += 1
+
+    def discard(self, entries: Mapping[int, TrackedJob]) -> None:
+        self.live -= 1
+        if len(self.seqs) > 64 and self.live * 2 < len(self.seqs):
+            self.seqs = [seq for seq in self.seqs if seq in entries]
+
+
+class JobTracker:
+    """Trabajos pendientes de `queue`; `delete(impresora, ids)` los borra del spooler"""
+
+    def __init__(self, queue: PrintQueue,
+                 delete: Optional[Callable[[str, List[int]], None]] = None):
+        self._queue = queue
+        self._delete = delete
+        # Lo tocan el event loop (listener, listado) y los hilos del spooler
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._by_id: Dict[str, TrackedJob] = {}
+        self._by_seq: Dict[int, TrackedJob] = {}
+        self._all = _Order()
+        self._printers: Dict[str, _Order] = {}
+        # Impresora -> ID del spooler -> trabajo
+        self._spooled: Dict[str, Dict[int, TrackedJob]] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def job(self, event: str, job: PrintJob) -> None:
+        """Listener de PrintQueue"""
+        with self._lock:
+            if event == "queued":
+                self._add(job)
+                return
+            entry = self._by_id.get(job.job_id)
+            if entry is None:
+                return
+            if event == "sending":
+                entry.state = STATE_SENDING
+            elif event == "sent" and entry.spool_ids:
+                entry.state = STATE_SPOOLED
+            else:
+                # Enviado a un dispositivo sin cola consultable, fallido o cancelado
+                self._remove(entry)
+
+    def _add(self, job: PrintJob) -> None:
+        if job.job_id in self._by_id:
+            return
+        self._seq += 1
+        entry = TrackedJob(job, self._seq)
+        self._by_id[job.job_id] = entry
+        self._by_seq[entry.seq] = entry
+        self._all.add(entry.seq)
+        order = self._printers.get(job.printer_name)
+        if order is None:
+            order = self._printers[job.printer_name] = _Order()
+        order.add(entry.seq)
+
+    def _remove(self, entry: TrackedJob) -> None:
+        del self._by_id[entry.job.job_id]
+        del self._by_seq[entry.seq]
+        self._all.discard(self._by_seq)
+        order = self._printers[entry.job.printer_name]
+        order.discard(self._by_seq)
+        if not order.live:
+            del self._printers[entry.job.printer_name]
+        spooled = self._spooled.get(entry.device)
+        if spooled is not None:
+            for spool_id in entry.spool_ids:
+                spooled.pop(spool_id, None)
+
+    def spooled(self, job_id: str, printer_name: str, spool_id: int) -> None:
+        """El spooler de `printer_name` aceptó (parte de) el trabajo con ese ID"""
+        with self._lock:
+            entry = self._by_id.get(job_id)
+            if entry is None:
+                return
+            entry.device = printer_name
+            entry.spool_ids[spool_id] = time.monotonic()
+            self._spooled.setdefault(printer_name, {})[spool_id] = entry
+
+    def tracking(self, printer_name: str) -> bool:
+        """Si hay trabajos nuestros en el spooler de esa impresora"""
+        return bool(self._spooled.get(printer_name))
+
+    def refresh(self, printer_name: str, jobs: Iterable[Mapping], listed_at: float) -> None:
+        """Actualiza con la enumeración del spooler (JOB_INFO_1) hecha en `listed_at`.
+
+        Solo se dan por terminados los IDs registrados antes de enumerar; uno
+        más nuevo pudo entrar en el spooler después.
+        """
+        listed = {info["JobId"]: info for info in jobs}
+        with self._lock:
+            spooled = self._spooled.get(printer_name)
+            if not spooled:
+                return
+            for spool_id, entry in list(spooled.items()):
+                info = listed.get(spool_id)
+                if info is not None:
+                    entry.spool_status = info.get("Status", 0)
+                    entry.position = info.get("Position")
+                elif entry.spool_ids[spool_id] < listed_at:
+                    del spooled[spool_id]
+                    del entry.spool_ids[spool_id]
+                    if not entry.spool_ids and entry.state == STATE_SPOOLED:
+                        self._remove(entry)
+
+    def list(self, printer: Optional[str] = None, state: Optional[str] = None,
+             after: Optional[int] = None, limit: int = 100) -> Tuple[List[Dict], Optional[int]]:
+        """Una página de pendientes en orden de llegada y el cursor de la siguiente.
+
+        `after` es el cursor devuelto por la página anterior.
+        """
+        with self._lock:
+            order = self._all if printer is None else self._printers.get(printer)
+            if order is None:
+                return [], None
+            seqs = order.seqs
+            i = bisect.bisect_right(seqs, after) if after is not None else 0
+            page: List[TrackedJob] = []
+            while i < len(seqs):
+                entry = self._by_seq.get(seqs[i])
+                i += 1
+                if entry is None or (state is not None and entry.state != state):
+                    continue
+                if len(page) == limit:
+                    return [e.to_dict() for e in page], page[-1].seq
+                page.append(entry)
+            return [e.to_dict() for e in page], None
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._by_id.get(job_id)
+            return entry.to_dict() if entry is not None else None
+
+    async def cancel(self, job_id: str) -> PrintJob:
+        """Quita el trabajo de nuestra cola o del spooler.
+
+        JobNotFound si no existe y JobNotCancellable si ya no está esperando.
+        """
+        with self._lock:
+            entry = self._by_id.get(job_id)
+            state = entry.state if entry is not None else None
+            device = entry.device if entry is not None else None
+            spool_ids = list(entry.spool_ids) if entry is not None else []
+        if entry is None:
+            job = self._queue.get(job_id)
+            if job is None:
+                raise JobNotFound(f"Trabajo desconocido: {job_id}")
+            raise JobNotCancellable(f"El trabajo {job_id} ya no está en cola ({job.status})")
+        if state == STATE_SENDING:
+            raise JobNotCancellable(f"El trabajo {job_id} se está enviando")
+        if state == STATE_SPOOLED:
+            if self._delete is None:
+                raise JobNotCancellable(f"No se pueden borrar trabajos del spooler de {device}")
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._delete, device, spool_ids)
+            except Exception as e:
+                raise JobNotCancellable(
+                    f"No se pudo borrar el trabajo {job_id} del spooler de {device}: {e}")
+            logger.info(f"Trabajo {job_id} borrado del spooler de {device} "
+                        f"(IDs {', '.join(map(str, spool_ids))})")
+            return self._queue.cancel(entry.job, "Cancelado en el spooler")
+        try:
+            return self._queue.cancel(entry.job)
+        except ValueError as e:
+            # Un worker lo tomó mientras tanto
+            raise JobNotCancellable(str(e))
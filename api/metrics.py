@@ -0,0 +1,279 @@
+"""Métricas del servicio en el formato de texto de Prometheus.
+
+Implementación mínima sin dependencias: contadores, gauges e histogramas con
+etiquetas, registrados en `REGISTRY` y expuestos en GET /metrics. Están
+pensados para el camino caliente de la impresión: `labels()` es una búsqueda
+en un dict y `observe()` un bisect y dos sumas, unos pocos microsegundos por
+trabajo en total (ver `python bench.py metrics`).
+
+Cada serie tiene su propio lock: `valor += n` no es atómico (el GIL puede
+soltarse entre la lectura y la escritura) y los hilos del executor actualizan
+las mismas series. Sin contención tomarlo cuesta decenas de nanosegundos.
+
+    RENDER = Histogram("print_render_seconds", "Tiempo de generar el payload")
+    with RENDER.time():
+        ...
+    BYTES = Counter("print_bytes_total", "Bytes enviados", ["printer"])
+    BYTES.labels("BP500").inc(len(data))
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Latencias de impresión: de 100 µs (render) a un minuto (cola con la impresora parada)
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_help(value: str) -> str:
+    # En HELP solo se escapan la barra invertida y el salto de línea
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape(value: str) -> str:
+    return _escape_help(value).replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Serie con esos valores de etiqueta (se crea la primera vez)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} espera las etiquetas {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self) -> List[Tuple[str, Sequence[str], Sequence[str], float]]:
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._children[()].inc(amount)
+
+    def samples(self):
+        return [(self.name, self.labelnames, key, child.value)
+                for key, child in list(self._children.items())]
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Gauge(_Metric):
+    """Valor instantáneo; con `function` se lee al exportar.
+
+    `function` devuelve un número o, si el gauge tiene etiquetas, un dict
+    `{valores de etiqueta: número}` (una cadena si hay una sola etiqueta).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], Union[float, Dict]]] = None,
+                 registry: Optional["Registry"] = None):
+        self._function = function
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._children[()].set(value)
+
+    def samples(self):
+        if self._function is None:
+            return [(self.name, self.labelnames, key, child.value)
+                    for key, child in list(self._children.items())]
+        value = self._function()
+        if not self.labelnames:
+            return [(self.name, (), (), value)]
+        return [(self.name, self.labelnames, key if isinstance(key, tuple) else (key,), v)
+                for key, v in value.items()]
+
+
+class _HistogramChild:
+    __slots__ = ("_upper", "counts", "sum", "_lock")
+
+    def __init__(self, upper: Tuple[float, ...]):
+        self._upper = upper
+        self.counts = [0] * (len(upper) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self._upper, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        """Cuentas y suma de un mismo instante (que `_count` cuadre con los buckets)"""
+        with self._lock:
+            return list(self.counts), self.sum
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 registry: Optional["Registry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+    def samples(self):
+        out = []
+        names = self.labelnames + ("le",)
+        for key, child in list(self._children.items()):
+            counts, total = child.snapshot()
+            if not any(counts):
+                continue
+            cumulative = 0
+            for upper, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                out.append((self.name + "_bucket", names, key + (_format_value(upper),),
+                            cumulative))
+            out.append((self.name + "_sum", self.labelnames, key, total))
+            out.append((self.name + "_count", self.labelnames, key, cumulative))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrica duplicada: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def unregister(self, name: str) -> None:
+        self._metrics.pop(name, None)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self, extra_labels: Optional[Dict[str, str]] = None) -> str:
+        """Texto de exposición de Prometheus; omite las métricas sin muestras"""
+        extra_names = tuple(extra_labels or ())
+        extra_values = tuple((extra_labels or {}).values())
+        lines = []
+        for metric in list(self._metrics.values()):
+            samples = metric.samples()
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labelnames, values, value in samples:
+                labels = _format_labels(extra_names + tuple(labelnames),
+                                        extra_values + tuple(values))
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+def merge(*texts: str) -> str:
+    """Une varias exposiciones en una, con cada familia una sola vez.
+
+    Dos procesos con las mismas métricas (el despachador y un worker) darían
+    dos `# TYPE` para el mismo nombre, que Prometheus rechaza; aquí las
+    muestras de todos se agrupan bajo el primer HELP/TYPE de su familia.
+    """
+    # Nombre -> (comentarios HELP/TYPE, muestras), en orden de aparición
+    families: Dict[str, Tuple[Dict[str, str], List[str]]] = {}
+    for text in texts:
+        samples: Optional[List[str]] = None
+        for line in text.splitlines():
+            if line.startswith(("# HELP ", "# TYPE ")):
+                kind, name = line.split(" ", 3)[1:3]
+                comments, samples = families.setdefault(name, ({}, []))
+                comments.setdefault(kind, line)
+            elif line and samples is not None:
+                samples.append(line)
+    lines: List[str] = []
+    for comments, samples in families.values():
+        lines += [comments[kind] for kind in ("HELP", "TYPE") if kind in comments]
+        lines += samples
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,192 @@
+"""Importación en streaming de cuerpos NDJSON (un objeto JSON por línea).
+
+El cuerpo se lee por fragmentos a medida que llega: cada línea se valida por
+separado, las válidas se escriben en bloques de `chunk_size` y el resultado
+de cada línea se devuelve, también en NDJSON, en cuanto su bloque está
+escrito. En memoria solo hay un bloque y la línea en curso, así que el
+consumo no depende del tamaño del archivo.
+
+Cada línea de respuesta es `{"line": n, "ok": true, ...}` o
+`{"line": n, "ok": false, "error": "..."}`, y la última es un resumen
+`{"summary": {"lines": ..., "ok": ..., "errors": ...}}`.
+"""
+import asyncio
+import json
+import logging
+import tempfile
+from typing import (Any, AsyncIterator, Awaitable, Callable, Dict, Generic, List, Optional,
+                    Tuple, TypeVar)
+
+from pydantic import ValidationError
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+T = TypeVar("T")
+
+
+class NdjsonStreamingResponse(StreamingResponse):
+    """Respuesta que se escribe mientras el generador sigue leyendo el cuerpo.
+
+    StreamingResponse escucha `receive` en paralelo para detectar la
+    desconexión del cliente, lo que se comería los fragmentos del cuerpo que
+    el generador todavía no leyó; aquí el propio generador lee `receive` y
+    detecta la desconexión (ClientDisconnect).
+
+    Muchos clientes no leen la respuesta hasta terminar de enviar el cuerpo.
+    Para no bloquearse esperándolos, los resultados se acumulan en un archivo
+    temporal (en memoria hasta `spool_size` bytes, después en disco) y se
+    envían desde ahí al ritmo que el cliente los lea.
+    """
+
+    def __init__(self, content: AsyncIterator[bytes], spool_size: int = 1 << 20):
+        super().__init__(content, media_type=NDJSON_MEDIA_TYPE)
+        self.spool_size = spool_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+
+    async def stream_response(self, send: Send) -> None:
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        written = read = 0
+        done = False
+        ready = asyncio.Event()
+
+        async def produce() -> None:
+            nonlocal written, done
+            try:
+                async for chunk in self.body_iterator:
+                    spool.seek(written)
+                    written += spool.write(chunk)
+                    ready.set()
+            finally:
+                done = True
+                ready.set()
+
+        producer = asyncio.create_task(produce())
+        try:
+            await send({"type": "http.response.start", "status": self.status_code,
+                        "headers": self.raw_headers})
+            while True:
+                await ready.wait()
+                ready.clear()
+                if read < written:
+                    spool.seek(read)
+                    chunk = spool.read(min(written - read, 1 << 16))
+                    read += len(chunk)
+                    await send({"type": "http.response.body", "body": chunk,
+                                "more_body": True})
+                    # Lo que se escribió mientras send() esperaba al cliente
+                    ready.set()
+                elif done:
+                    break
+            await producer
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            producer.cancel()
+            spool.close()
+
+
+async def iter_lines(chunks: AsyncIterator[bytes],
+                     max_line: int = 1 << 20) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """Produce `(número, línea)` sin las vacías; `línea` es None si supera `max_line`"""
+    buffer = bytearray()
+    number = 0
+    skipping = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end < 0:
+                if not skipping:
+                    buffer += chunk[start:]
+                    if len(buffer) > max_line:
+                        buffer.clear()
+                        skipping = True
+                break
+            number += 1
+            if skipping:
+                skipping = False
+                yield number, None
+            else:
+                buffer += chunk[start:end]
+                line = bytes(buffer).strip()
+                buffer.clear()
+                if len(line) > max_line:
+                    yield number, None
+                elif line:
+                    yield number, line
+            start = end + 1
+    if skipping:
+        yield number + 1, None
+    elif buffer.strip():
+        yield number + 1, bytes(buffer).strip()
+
+
+def _validation_message(e: ValidationError) -> str:
+    error = e.errors()[0]
+    location = ".".join(str(part) for part in error.get("loc", ()))
+    return f"{location}: {error['msg']}" if location else error["msg"]
+
+
+class NdjsonImport(Generic[T]):
+    """Valida líneas con `parse` y las escribe por bloques con `write`.
+
+    `write(filas)` devuelve, en el mismo orden, un dict con datos extra para la
+    respuesta de cada fila o una excepción si esa fila falló.
+    """
+
+    def __init__(self, parse: Callable[[bytes], T],
+                 write: Callable[[List[T]], Awaitable[List[Any]]],
+                 chunk_size: int = 1000, max_line: int = 1 << 20):
+        self._parse = parse
+        self._write = write
+        self.chunk_size = chunk_size
+        self.max_line = max_line
+
+    async def run(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        lines = ok = errors = 0
+        # (número de línea, fila válida o None, error de validación); los
+        # resultados salen en el orden de las líneas
+        pending: List[Tuple[int, Optional[T], Optional[str]]] = []
+
+        async def flush() -> bytes:
+            nonlocal ok, errors
+            rows = [row for _, row, error in pending if error is None]
+            try:
+                results = iter(await self._write(rows) if rows else [])
+            except Exception as e:
+                logger.error(f"Error escribiendo bloque de importación: {e}")
+                results = iter([e] * len(rows))
+            out = []
+            for number, _, error in pending:
+                result = error if error is not None else next(results)
+                if isinstance(result, (str, Exception)):
+                    errors += 1
+                    out.append(_dump({"line": number, "ok": False, "error": str(result)}))
+                else:
+                    ok += 1
+                    out.append(_dump({"line": number, "ok": True, **(result or {})}))
+            pending.clear()
+            return b"".join(out)
+
+        async for number, raw in iter_lines(chunks, self.max_line):
+            lines += 1
+            if raw is None:
+                pending.append((number, None, f"Línea de más de {self.max_line} bytes"))
+            else:
+                try:
+                    pending.append((number, self._parse(raw), None))
+                except ValidationError as e:
+                    pending.append((number, None, _validation_message(e)))
+            if len(pending) >= self.chunk_size:
+                yield await flush()
+        tail = await flush() if pending else b""
+        yield tail + _dump({"summary": {"lines": lines, "ok": ok, "errors": errors}})
+
+
+def _dump(obj: Dict) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode() + b"\n"
@@ -0,0 +1,442 @@
+"""Vista previa de etiquetas EZPL/EPL sin impresora.
+
+Interpreta el subconjunto de comandos que genera este proyecto y dibuja cada
+etiqueta en una imagen de 1 bit a la resolución de la impresora (203 dpi):
+
+    EZPL  ^Q ^W (tamaño en mm)  ^L ... E  A?/V? (texto)  W (QR)  Lo (línea/caja)
+          Y (gráfico guardado)  Q (gráfico en línea)  ~EB / ~MDELG
+    EPL   q Q (tamaño en puntos)  N ... P  A (texto)  B (Code 128)  LO  GW
+
+El resto de comandos (configuración, fecha, formularios guardados) se ignora.
+Las fuentes se aproximan escalando la fuente por defecto de Pillow al tamaño
+de celda de cada fuente de la impresora: la vista previa sirve para revisar
+la composición, no la tipografía. Los gráficos `Y` que no se descargaron en
+el mismo flujo ni están en `graphics` se dibujan como un recuadro con su
+nombre.
+
+Los tamaños que vienen del flujo (etiqueta, gráficos, textos, códigos) se
+limitan a MAX_DOTS puntos por lado: un comando mal formado o desmedido lanza
+InvalidCommand (un ValueError) en lugar de reservar una imagen enorme.
+
+`TemplatePreview` separa una plantilla en las líneas sin campos, que se
+dibujan una sola vez en una imagen base, y las líneas con campos, que se
+dibujan sobre una copia de esa base en cada vista previa; los PNG generados
+se guardan en una LRU por valores.
+
+Uso independiente (por ejemplo, con lo capturado por el emulador):
+    python preview.py etiqueta.prn salida.png
+"""
+import argparse
+import io
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+from graphics import Bitmap, CodeRasterizer, rotated_origin
+from ticket_template import CompiledTemplate
+
+DOTS_PER_MM = 8
+DEFAULT_SIZE = (456, 560)
+# Lado máximo de una etiqueta o de lo que se dibuja en ella (512 mm a 203 dpi)
+MAX_DOTS = 4096
+# Módulo máximo de un QR o barra estrecha de un código de barras
+MAX_MODULE = 16
+
+# Celda de carácter (ancho, alto) en puntos. EPL: fuentes 1-5; EZPL: A-H
+_EPL_FONTS = {"1": (8, 12), "2": (10, 16), "3": (12, 20), "4": (14, 24), "5": (32, 48)}
+_EZPL_FONTS = {"A": (9, 12), "B": (11, 20), "C": (13, 24), "D": (15, 32), "E": (19, 40),
+               "F": (27, 56), "G": (23, 48), "H": (14, 24)}
+
+_EZPL_TEXT = re.compile(r"^[AV]([A-Z]),")
+_EPL_LABEL_SIZE = re.compile(r"^Q(\d+),")
+_EZPL_GRAPHIC = re.compile(rb"^Q\d+,\d+,(\d+),(\d+)$")
+_GRAPHIC_DOWNLOAD = re.compile(rb"^~EB,([^,]+),(\d+)$")
+_EPL_GRAPHIC = re.compile(rb"^GW\d+,\d+,(\d+),(\d+),")
+_QUOTED = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+
+class InvalidCommand(ValueError):
+    """Comando que la vista previa no puede dibujar (mal formado o desmedido)"""
+
+
+def _check_size(width: int, height: int, what: str) -> None:
+    if not (0 < width <= MAX_DOTS and 0 < height <= MAX_DOTS):
+        raise InvalidCommand(f"{what} de {width}x{height} puntos: el máximo es "
+                             f"{MAX_DOTS}x{MAX_DOTS}")
+
+
+def _check_module(module: int) -> None:
+    if not 1 <= module <= MAX_MODULE:
+        raise InvalidCommand(f"Módulo de {module} puntos: debe ir de 1 a {MAX_MODULE}")
+
+
+def _commands(payload: bytes) -> Iterator[Tuple[str, bytes]]:
+    """Produce `(línea, datos binarios)`; los datos solo en Q, GW y ~EB"""
+    pos = 0
+    end = len(payload)
+    while pos < end:
+        newline = payload.find(b"\n", pos)
+        if newline < 0:
+            newline = end
+        raw = payload[pos:newline]
+        graphic = _EPL_GRAPHIC.match(raw)
+        if graphic:
+            # Los datos de GW siguen a la última coma, en la misma línea
+            start = pos + graphic.end()
+            size = int(graphic.group(1)) * int(graphic.group(2))
+            yield raw[:graphic.end()].decode("ascii"), payload[start:start + size]
+            pos = start + size
+            continue
+        line = raw.strip()
+        pos = newline + 1
+        size = 0
+        match = _EZPL_GRAPHIC.match(line)
+        if match:
+            size = int(match.group(1)) * int(match.group(2))
+        else:
+            match = _GRAPHIC_DOWNLOAD.match(line)
+            if match:
+                size = int(match.group(2))
+        if size:
+            yield line.decode("ascii"), payload[pos:pos + size]
+            pos += size
+        elif line:
+            yield line.decode("ascii", errors="replace"), b""
+
+
+def _bitmap_mask(bitmap: Bitmap):
+    """Máscara de Pillow (1 = tinta) de un mapa de bits empaquetado"""
+    from PIL import Image
+
+    image = Image.frombytes("1", (bitmap.row_bytes * 8, bitmap.height), bitmap.data)
+    return image.crop((0, 0, bitmap.width, bitmap.height))
+
+
+def _rotate(mask, rotation: int):
+    # En sentido horario, como la impresora (ver graphics.rotated_origin)
+    return mask.rotate(-90 * rotation, expand=True) if rotation % 4 else mask
+
+
+class LabelRenderer:
+    """Dibuja flujos EZPL/EPL en imágenes de Pillow (modo "1", blanco = 1)
+
+    `graphics` son los gráficos que ya están en la impresora (nombre ->
+    máscara de Pillow, 1 = tinta); los `~EB` del propio flujo se añaden
+    mientras se interpreta.
+    """
+
+    def __init__(self, graphics: Optional[Dict[str, object]] = None,
+                 rasterizer: Optional[CodeRasterizer] = None):
+        self.graphics = graphics if graphics is not None else {}
+        self.rasterizer = rasterizer or CodeRasterizer()
+        self._font = None
+
+    def store_graphic(self, name: str, bitmap: Bitmap) -> None:
+        self.graphics[name] = _bitmap_mask(bitmap)
+
+    def render(self, payload: bytes) -> List[Tuple[object, int]]:
+        """Etiquetas impresas por el flujo, como `(imagen, copias)`.
+
+        Lanza InvalidCommand si algún comando no se puede dibujar.
+        """
+        from PIL import Image
+
+        labels: List[Tuple[object, int]] = []
+        size = list(DEFAULT_SIZE)
+        # ^P (cantidad) y ^C (copias) de EZPL siguen vigentes hasta que se cambian
+        quantity = label_copies = 1
+        image = None
+        commands = _commands(payload)
+        for line, data in commands:
+            if line in ("^L", "N"):
+                _check_size(size[0], size[1], "Etiqueta")
+                image = Image.new("1", tuple(size), 1)
+            elif line == "E" or re.match(r"^P\d", line):
+                if image is not None:
+                    if line != "E":
+                        counts = [int(n) for n in line[1:].split(",") if n.isdigit()]
+                        copies = counts[0] * (counts[1] if len(counts) > 1 else 1)
+                    else:
+                        copies = quantity * label_copies
+                    labels.append((image, max(copies, 1)))
+                    image = None
+            elif line.startswith("^W") and line[2:].isdigit():
+                size[0] = int(line[2:]) * DOTS_PER_MM
+            elif line.startswith("^Q"):
+                size[1] = int(line[2:].split(",")[0]) * DOTS_PER_MM
+            elif line.startswith("^P") and line[2:].isdigit():
+                quantity = int(line[2:])
+            elif line.startswith("^C") and line[2:].isdigit():
+                label_copies = int(line[2:])
+            elif line.startswith("q") and line[1:].isdigit():
+                size[0] = int(line[1:])
+            elif _EPL_LABEL_SIZE.match(line) and not data:
+                size[1] = int(_EPL_LABEL_SIZE.match(line).group(1))
+            elif line.startswith("W") and line[1:2].isdigit():
+                # La línea siguiente son los datos del QR
+                text, _ = next(commands, ("", b""))
+                if image is not None:
+                    self._qr(image, line, text)
+            else:
+                self._draw(image, line, data)
+        return labels
+
+    def draw(self, image, payload: bytes):
+        """Dibuja los comandos de `payload` sobre `image`, sin inicio ni fin de etiqueta;
+        InvalidCommand si alguno no se puede dibujar"""
+        commands = _commands(payload)
+        for line, data in commands:
+            if line.startswith("W") and line[1:2].isdigit():
+                self._qr(image, line, next(commands, ("", b""))[0])
+            else:
+                self._draw(image, line, data)
+        return image
+
+    def _draw(self, image, line: str, data: bytes) -> None:
+        try:
+            self._draw_command(image, line, data)
+        except InvalidCommand:
+            raise
+        except (ValueError, IndexError, OSError) as e:
+            raise InvalidCommand(f"Comando no válido {line[:40]!r}: {e}")
+
+    def _draw_command(self, image, line: str, data: bytes) -> None:
+        if line.startswith("~EB,"):
+            from PIL import Image, ImageChops
+
+            name = line.split(",")[1]
+            downloaded = Image.open(io.BytesIO(data))
+            _check_size(*downloaded.size, f"Gráfico {name}")
+            self.graphics[name] = ImageChops.invert(downloaded.convert("1"))
+            return
+        if line.startswith("~MDELG,"):
+            self.graphics.pop(line[len("~MDELG,"):], None)
+            return
+        if image is None:
+            return
+        if _EZPL_TEXT.match(line):
+            self._ezpl_text(image, line)
+        elif line[:1] == "A" and line[1:2].isdigit():
+            self._epl_text(image, line)
+        elif line[:1] == "B" and line[1:2].isdigit():
+            self._epl_barcode(image, line)
+        elif line.startswith("Lo,"):
+            x1, y1, x2, y2 = (int(v) for v in line[3:].split(",")[:4])
+            self._box(image, min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        elif line.startswith("LO") and line[2:3].isdigit():
+            x, y, w, h = (int(v) for v in line[2:].split(",")[:4])
+            self._box(image, x, y, x + w, y + h)
+        elif line.startswith("Y") and line[1:2].isdigit():
+            x, y, name = line[1:].split(",", 2)
+            self._recall(image, int(x), int(y), name)
+        elif data and line.startswith("GW"):
+            x, y, rb, h = (int(v) for v in line[2:].rstrip(",").split(","))
+            _check_size(rb * 8, h, "Gráfico")
+            # En EPL los bits a 0 son los negros
+            inverted = bytes(255 - b for b in data)
+            self._paste(image, _bitmap_mask(Bitmap(rb * 8, h, inverted)), x, y)
+        elif data and line.startswith("Q"):
+            x, y, rb, h = (int(v) for v in line[1:].split(","))
+            _check_size(rb * 8, h, "Gráfico")
+            self._paste(image, _bitmap_mask(Bitmap(rb * 8, h, data)), x, y)
+
+    @staticmethod
+    def _paste(image, mask, x: int, y: int, color: int = 0) -> None:
+        image.paste(color, (x, y, x + mask.width, y + mask.height), mask)
+
+    @staticmethod
+    def _box(image, x1: int, y1: int, x2: int, y2: int) -> None:
+        from PIL import ImageDraw
+
+        ImageDraw.Draw(image).rectangle((x1, y1, max(x1, x2 - 1), max(y1, y2 - 1)), fill=0)
+
+    def _text_mask(self, text: str, cell: Tuple[int, int], mul_x: int, mul_y: int):
+        """Texto con la fuente de Pillow escalado a `len(text)` celdas de `cell` puntos"""
+        from PIL import Image, ImageDraw, ImageFont
+
+        if self._font is None:
+            self._font = ImageFont.load_default()
+        left, top, right, bottom = self._font.getbbox(text or " ")
+        size = (max(len(text), 1) * cell[0] * mul_x, cell[1] * mul_y)
+        _check_size(*size, "Texto")
+        glyphs = Image.new("1", (max(right - left, 1), max(bottom - top, 1)), 0)
+        ImageDraw.Draw(glyphs).text((-left, -top), text, font=self._font, fill=1)
+        return glyphs.resize(size, Image.NEAREST)
+
+    def _place(self, image, mask, x: int, y: int, rotation: int, reverse: bool = False) -> None:
+        mask = _rotate(mask, rotation)
+        left, top = rotated_origin(x, y, mask.width, mask.height, rotation)
+        if reverse:
+            self._box(image, left, top, left + mask.width, top + mask.height)
+            self._paste(image, mask, left, top, color=1)
+        else:
+            self._paste(image, mask, left, top)
+
+    def _ezpl_text(self, image, line: str) -> None:
+        # A<fuente>,x,y,mul_x,mul_y,espaciado,<giro>[letras],datos
+        head, *args = line.split(",", 7)
+        if len(args) < 7:
+            return
+        x, y, mul_x, mul_y = (int(v) for v in args[:4])
+        rotation = int(args[5][:1] or 0)
+        mask = self._text_mask(args[6], _EZPL_FONTS.get(head[1], (12, 20)), mul_x or 1,
+                               mul_y or 1)
+        self._place(image, mask, x, y, rotation)
+
+    def _epl_text(self, image, line: str) -> None:
+        # A x,y,giro,fuente,mul_h,mul_v,N|R,"datos"
+        head, _, quoted = line.partition('"')
+        args = head[1:].split(",")
+        if len(args) < 7:
+            return
+        x, y, rotation = int(args[0]), int(args[1]), int(args[2])
+        text = _QUOTED.match('"' + quoted)
+        text = text.group(1).replace('\\"', '"') if text else ""
+        mask = self._text_mask(text, _EPL_FONTS.get(args[3], (10, 16)), int(args[4] or 1),
+                               int(args[5] or 1))
+        self._place(image, mask, x, y, rotation, reverse=args[6] == "R")
+
+    def _epl_barcode(self, image, line: str) -> None:
+        # B x,y,giro,tipo,estrecha,ancha,alto,B|N,"datos"; solo Code 128 (tipo 1)
+        head, _, quoted = line.partition('"')
+        args = head[1:].split(",")
+        if len(args) < 8:
+            return
+        x, y, rotation, narrow, height = (int(args[i]) for i in (0, 1, 2, 4, 6))
+        data = quoted.rstrip('"')
+        _check_module(narrow)
+        _check_size(MAX_DOTS, height, "Código de barras")
+        if args[3] != "1":
+            self._box(image, x, y, x + 8 * len(data) * narrow, y + height)
+            return
+        from barcode.errors import BarcodeError
+
+        try:
+            bars = _bitmap_mask(self.rasterizer.barcode(data, "code128", narrow, height))
+        except BarcodeError as e:
+            raise InvalidCommand(f"Code 128 no válido {data!r}: {e}")
+        self._place(image, bars, x, y, rotation)
+        if args[7] == "B":
+            self._place(image, self._text_mask(data, _EPL_FONTS["1"], 1, 1),
+                        x, y + height + 4, rotation)
+
+    def _qr(self, image, line: str, data: str) -> None:
+        from qrcode.exceptions import DataOverflowError
+
+        try:
+            # W x,y,modo,tipo,corrección,máscara,módulo,longitud,giro
+            args = line[1:].split(",")
+            x, y, module = int(args[0]), int(args[1]), int(args[6])
+            _check_module(module)
+            error_correction = args[4] if args[4] in ("L", "M", "Q", "H") else "M"
+            qr = _bitmap_mask(self.rasterizer.qr(data, module, error_correction))
+            self._place(image, qr, x, y, int(args[8]) if len(args) > 8 else 0)
+        except InvalidCommand:
+            raise
+        except DataOverflowError:
+            raise InvalidCommand(f"QR de {len(data)} caracteres: no cabe en un código QR")
+        except (ValueError, IndexError) as e:
+            raise InvalidCommand(f"Comando no válido {line[:40]!r}: {e}")
+
+    def _recall(self, image, x: int, y: int, name: str) -> None:
+        from PIL import ImageDraw
+
+        graphic = self.graphics.get(name)
+        if graphic is not None:
+            self._paste(image, graphic, x, y)
+            return
+        # Gráfico que solo está en la impresora: recuadro con el nombre
+        mask = self._text_mask(name, _EPL_FONTS["1"], 1, 1)
+        ImageDraw.Draw(image).rectangle((x, y, x + mask.width + 3, y + mask.height + 3),
+                                        outline=0)
+        self._paste(image, mask, x + 2, y + 2)
+
+
+def to_png(image) -> bytes:
+    out = io.BytesIO()
+    image.save(out, "PNG", optimize=False, dpi=(203, 203))
+    return out.getvalue()
+
+
+class TemplatePreview:
+    """Vista previa cacheada de una plantilla de ticket (ver ticket_template.py)"""
+
+    def __init__(self, source: str, setup: str = "", renderer: Optional[LabelRenderer] = None,
+                 max_entries: int = 256):
+        self.renderer = renderer or LabelRenderer()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._setup = setup
+        static: List[str] = []
+        dynamic: List[str] = []
+        lines = [ln.strip() for ln in source.split("\n") if ln.strip()]
+        i = 0
+        while i < len(lines):
+            # Un QR va con su línea de datos
+            is_qr = lines[i][:1] == "W" and lines[i][1:2].isdigit()
+            unit = lines[i:i + 2] if is_qr else lines[i:i + 1]
+            i += len(unit)
+            (dynamic if any("{" in ln for ln in unit) else static).extend(unit)
+        self._static = CompiledTemplate("\n".join(static)).render({})
+        self._dynamic = CompiledTemplate("\n".join(dynamic))
+        self.fields = self._dynamic.fields
+        self._base = None
+        self._cache: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _base_image(self):
+        base = self._base
+        if base is None:
+            setup = CompiledTemplate(self._setup).render({})
+            labels = self.renderer.render(setup + self._static)
+            base = self._base = labels[0][0]
+        return base
+
+    def render(self, values: Mapping[str, str]) -> bytes:
+        """PNG de la etiqueta con esos valores"""
+        key = tuple(str(values[field]) for field in self.fields)
+        with self._lock:
+            png = self._cache.get(key)
+            if png is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return png
+            self.misses += 1
+        image = self.renderer.draw(self._base_image().copy(), self._dynamic.render(values))
+        png = to_png(image)
+        with self._lock:
+            self._cache[key] = png
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return png
+
+    def invalidate(self) -> None:
+        """Descarta la base y los PNG (p. ej. al cambiar un gráfico guardado)"""
+        with self._lock:
+            self._base = None
+            self._cache.clear()
+
+
+def render_png(payload: bytes, graphics: Optional[Dict[str, object]] = None) -> List[bytes]:
+    """PNG de cada etiqueta distinta que imprime el flujo"""
+    return [to_png(image) for image, _ in LabelRenderer(graphics).render(payload)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vista previa de un flujo EZPL/EPL")
+    parser.add_argument("payload", help="archivo con los comandos enviados a la impresora")
+    parser.add_argument("output", help="PNG de salida; con varias etiquetas se numeran")
+    args = parser.parse_args()
+    with open(args.payload, "rb") as f:
+        pngs = render_png(f.read())
+    for n, png in enumerate(pngs):
+        path = args.output if len(pngs) == 1 else args.output.replace(".png", f"-{n + 1}.png")
+        with open(path, "wb") as f:
+            f.write(png)
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
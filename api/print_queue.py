@@ -0,0 +1,364 @@
+"""Cola de trabajos de impresión en proceso.
+
+Los endpoints encolan el trabajo y devuelven su ID de inmediato; los workers
+drenan la cola y esperan al transporte, o ejecutan el envío bloqueante
+(spooler, serial) en un pool de hilos para no congelar el event loop de uvicorn.
+
+Con un `JobJournal`, cada trabajo se registra en disco antes de aceptarse y
+antes de enviarse, y al arrancar se reencolan los que no se confirmaron.
+
+Cada trabajo alimenta las métricas de espera en cola, latencia total y
+etiquetas/bytes/errores por impresora. Con `trace=True` además guarda en
+`spans` la duración de cada etapa (diario, cola, envío).
+
+Con un `AdmissionController`, `accept` rechaza (Overloaded) los trabajos que
+la impresora no terminaría dentro del SLA (ver admission.py). Con `printers`,
+rechaza (UnknownPrinter) los dirigidos a una impresora que no existe, antes de
+que su nombre llegue al diario, a la admisión o al transporte.
+
+`add_listener` recibe cada cambio de estado de un trabajo (queued, sending,
+sent, failed, cancelled); es lo que publica events.py y lo que mantiene el
+índice de job_tracker.py. Mientras se envía un trabajo, `current_job` lo
+identifica para que el transporte asocie el ID que le dé el dispositivo.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from admission import AdmissionController
+from job_journal import STATE_SENT, JobJournal
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_PRINTING = "printing"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+# Trabajo que se está enviando en este contexto (None fuera de un worker)
+current_job: "contextvars.ContextVar[Optional[PrintJob]]" = contextvars.ContextVar(
+    "current_job", default=None)
+
+QUEUE_WAIT = Histogram("print_queue_wait_seconds",
+                       "Tiempo desde que se acepta un trabajo hasta que un worker lo toma")
+JOB_SECONDS = Histogram("print_job_seconds",
+                        "Latencia de extremo a extremo de un trabajo (aceptado a terminado)",
+                        ["status"])
+LABELS_TOTAL = Counter("print_labels_total", "Etiquetas enviadas", ["printer"])
+BYTES_TOTAL = Counter("print_bytes_total", "Bytes enviados", ["printer"])
+ERRORS_TOTAL = Counter("print_errors_total", "Trabajos fallidos", ["printer"])
+
+
+class UnknownPrinter(LookupError):
+    """La impresora no está configurada ni existe en el spooler"""
+
+
+class PrintJob:
+    __slots__ = ("job_id", "printer_name", "device", "payload", "labels", "status", "error",
+                 "created_at", "started_at", "finished_at", "printed_at", "replayed", "spans")
+
+    def __init__(self, printer_name: str, payload: Any, job_id: Optional[str] = None,
+                 labels: int = 1):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.printer_name = printer_name
+        # Impresora que imprimió el trabajo cuando printer_name es un grupo
+        self.device: Optional[str] = None
+        self.payload = payload
+        self.labels = labels
+        self.status = JOB_QUEUED
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Cuando la impresora se vio en reposo tras el envío (ver events.py)
+        self.printed_at: Optional[float] = None
+        # Reencolado desde el diario tras un reinicio
+        self.replayed = False
+        # Segundos por etapa, solo si la cola traza los trabajos
+        self.spans: Optional[Dict[str, float]] = None
+
+    def to_dict(self) -> Dict:
+        data = {
+            "job_id": self.job_id,
+            "printer_name": self.printer_name,
+            "device": self.device,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "printed_at": self.printed_at,
+            "labels": self.labels,
+            "replayed": self.replayed,
+        }
+        if self.spans is not None:
+            data["spans"] = self.spans
+        return data
+
+
+class PrintQueue:
+    """Cola asíncrona con workers dedicados que llaman a `sender(payload, printer_name)`
+
+    `sender` puede ser una corrutina o una función bloqueante; esta última se
+    ejecuta en un pool de hilos. Si devuelve un nombre, se guarda como la
+    impresora que imprimió el trabajo.
+    """
+
+    def __init__(self, sender: Callable[[Any, str], Union[Optional[str], Awaitable[Optional[str]]]],
+                 workers: int = 2, max_finished: int = 10000,
+                 journal: Optional[JobJournal] = None, trace: bool = False,
+                 admission: Optional[AdmissionController] = None,
+                 printers: Optional[Callable[[str], Awaitable[bool]]] = None):
+        self._sender = sender
+        self.journal = journal
+        self.trace = trace
+        self.admission = admission
+        # `await printers(nombre)` dice si la impresora existe
+        self.printers = printers
+        self._async_sender = asyncio.iscoroutinefunction(sender)
+        self._workers = max(1, workers)
+        self._max_finished = max_finished
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._jobs: "OrderedDict[str, PrintJob]" = OrderedDict()
+        self._finished: Deque[str] = deque()
+        # Cancelados que siguen en la asyncio.Queue hasta que un worker los salte
+        self._skipped = 0
+        self._listeners: List[Callable[[str, PrintJob], None]] = []
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        if not self._async_sender:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers,
+                                                thread_name_prefix="print-worker")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+        logger.info(f"Cola de impresión iniciada con {self._workers} worker(s)")
+        if self.journal is not None:
+            self._replay(self.journal.open())
+
+    def _replay(self, entries) -> None:
+        for entry in entries:
+            if entry.state == STATE_SENT:
+                logger.warning(f"Reenviando trabajo {entry.job_id}: pudo imprimirse "
+                               "antes de la interrupción")
+            job = PrintJob(entry.printer_name, entry.payload, entry.job_id, entry.labels)
+            job.created_at = entry.created_at
+            job.replayed = True
+            if self.admission is not None:
+                self.admission.reserve(job.printer_name, job.labels)
+            self._enqueue(job)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self.journal is not None:
+            self.journal.close()
+
+    def add_listener(self, listener: Callable[[str, PrintJob], None]) -> None:
+        """Registra `listener(evento, trabajo)`: queued, sending, sent, failed o cancelled"""
+        self._listeners.append(listener)
+
+    def _notify(self, event: str, job: PrintJob) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event, job)
+            except Exception as e:
+                logger.error(f"Error notificando {event} del trabajo {job.job_id}: {e}")
+
+    def submit(self, payload: Any, printer_name: str, labels: int = 1) -> PrintJob:
+        """Encola sin pasar por el diario"""
+        if self._queue is None:
+            raise RuntimeError("La cola de impresión no está iniciada")
+        if self.admission is not None:
+            self.admission.reserve(printer_name, labels)
+        return self._enqueue(self._new_job(printer_name, payload, labels))
+
+    def _new_job(self, printer_name: str, payload: Any, labels: int) -> PrintJob:
+        job = PrintJob(printer_name, payload, labels=labels)
+        if self.trace:
+            job.spans = {}
+        return job
+
+    async def accept(self, payload: bytes, printer_name: str,
+                     idempotency_key: Optional[str] = None,
+                     labels: int = 1) -> Tuple[PrintJob, bool]:
+        """Registra el trabajo en el diario y lo encola; devuelve `(trabajo, nuevo)`.
+
+        Si la clave de idempotencia ya se usó no se encola nada y se devuelve
+        el trabajo original (o uno con su ID si ya no está en memoria) con
+        `nuevo=False`. Con control de admisión puede lanzar Overloaded, y
+        UnknownPrinter si `printers` no conoce la impresora.
+        """
+        if self._queue is None:
+            raise RuntimeError("La cola de impresión no está iniciada")
+        if self.printers is not None and not await self.printers(printer_name):
+            raise UnknownPrinter(f"Impresora desconocida: {printer_name}")
+        if self.journal is not None and idempotency_key is not None:
+            existing = self.journal.lookup(idempotency_key)
+            if existing is not None:
+                return self._duplicate(existing, printer_name), False
+        if self.admission is None:
+            return await self._accept(self._new_job(printer_name, payload, labels),
+                                      idempotency_key)
+        await self.admission.admit(printer_name, labels)
+        try:
+            job, new = await self._accept(self._new_job(printer_name, payload, labels),
+                                          idempotency_key)
+        except BaseException:
+            self.admission.release(printer_name, labels)
+            raise
+        if not new:
+            self.admission.release(printer_name, labels)
+        return job, new
+
+    async def _accept(self, job: PrintJob,
+                      idempotency_key: Optional[str]) -> Tuple[PrintJob, bool]:
+        if self.journal is None:
+            return self._enqueue(job), True
+        if idempotency_key is not None:
+            existing = self.journal.reserve(idempotency_key, job.job_id)
+            if existing is not None:
+                return self._duplicate(existing, job.printer_name), False
+        started = time.perf_counter()
+        await self.journal.accepted(job.job_id, job.printer_name, job.payload, idempotency_key,
+                                    job.labels)
+        if job.spans is not None:
+            job.spans["journal_accepted"] = time.perf_counter() - started
+        return self._enqueue(job), True
+
+    def _duplicate(self, job_id: str, printer_name: str) -> PrintJob:
+        return self._jobs.get(job_id) or PrintJob(printer_name, None, job_id)
+
+    def _enqueue(self, job: PrintJob) -> PrintJob:
+        self._jobs[job.job_id] = job
+        self._queue.put_nowait(job)
+        self._notify("queued", job)
+        return job
+
+    def get(self, job_id: str) -> Optional[PrintJob]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job: Union[str, PrintJob], reason: str = "Cancelado") -> PrintJob:
+        """Cancela un trabajo (o su ID) que ningún worker tomó todavía; el worker lo saltará.
+
+        Un trabajo ya enviado (done) también se puede cancelar: quien llama
+        ya lo quitó de donde esperaba (el spooler) y aquí solo se registra.
+        LookupError si no existe y ValueError si se está enviando o ya terminó.
+        """
+        if isinstance(job, str):
+            job_id, job = job, self._jobs.get(job)
+            if job is None:
+                raise LookupError(f"Trabajo desconocido: {job_id}")
+        if job.status not in (JOB_QUEUED, JOB_DONE):
+            raise ValueError(f"El trabajo {job.job_id} no se puede cancelar ({job.status})")
+        if job.status == JOB_QUEUED:
+            self._skipped += 1
+            if self.admission is not None:
+                self.admission.release(job.printer_name, job.labels)
+            job.payload = None
+        job.status = JOB_CANCELLED
+        job.error = reason
+        job.finished_at = time.time()
+        if self.journal is not None:
+            # Un cancelado no se reenvía al arrancar
+            self.journal.failed(job.job_id, reason)
+        self._notify("cancelled", job)
+        return job
+
+    async def join(self) -> None:
+        """Espera a que se procesen todos los trabajos encolados"""
+        await self._queue.join()
+
+    def depth(self) -> int:
+        return self._queue.qsize() - self._skipped if self._queue is not None else 0
+
+    async def wait_for_room(self, max_depth: int, poll: float = 0.01) -> None:
+        """Espera a que haya menos de `max_depth` trabajos encolados (importaciones masivas)"""
+        while self.depth() >= max_depth:
+            await asyncio.sleep(poll)
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            if job.status == JOB_CANCELLED:
+                self._skipped -= 1
+                self._queue.task_done()
+                self._retire(job.job_id)
+                continue
+            job.status = JOB_PRINTING
+            job.started_at = time.time()
+            QUEUE_WAIT.observe(job.started_at - job.created_at)
+            spans = job.spans
+            if spans is not None:
+                spans["queue_wait"] = job.started_at - job.created_at
+            self._notify("sending", job)
+            send_started = 0.0
+            try:
+                if self.journal is not None:
+                    started = time.perf_counter()
+                    await self.journal.sent(job.job_id)
+                    if spans is not None:
+                        spans["journal_sent"] = time.perf_counter() - started
+                started = time.perf_counter()
+                send_started = time.monotonic()
+                token = current_job.set(job)
+                try:
+                    if self._async_sender:
+                        device = await self._sender(job.payload, job.printer_name)
+                    else:
+                        # run_in_executor no copia el contexto (ni current_job) al hilo
+                        device = await loop.run_in_executor(
+                            self._executor, functools.partial(contextvars.copy_context().run,
+                                                              self._sender, job.payload,
+                                                              job.printer_name))
+                finally:
+                    current_job.reset(token)
+                if spans is not None:
+                    spans["send"] = time.perf_counter() - started
+                job.device = device if isinstance(device, str) else job.printer_name
+                job.status = JOB_DONE
+                LABELS_TOTAL.labels(job.device).inc(job.labels)
+                BYTES_TOTAL.labels(job.device).inc(len(job.payload))
+                if self.journal is not None:
+                    self.journal.confirmed(job.job_id)
+            except Exception as e:
+                job.status = JOB_FAILED
+                job.error = str(e)
+                ERRORS_TOTAL.labels(job.printer_name).inc()
+                logger.error(f"Error imprimiendo trabajo {job.job_id}: {e}")
+                if self.journal is not None:
+                    self.journal.failed(job.job_id, job.error)
+            finally:
+                if self.admission is not None:
+                    self.admission.finished(job.printer_name, job.labels, send_started,
+                                            ok=job.status == JOB_DONE)
+                job.finished_at = time.time()
+                JOB_SECONDS.labels(job.status).observe(job.finished_at - job.created_at)
+                job.payload = None
+                if job.status != JOB_PRINTING:  # no si se canceló al parar la cola
+                    self._notify("sent" if job.status == JOB_DONE else "failed", job)
+                self._queue.task_done()
+                self._retire(job.job_id)
+
+    def _retire(self, job_id: str) -> None:
+        """Conserva solo los últimos `max_finished` trabajos terminados"""
+        self._finished.append(job_id)
+        while len(self._finished) > self._max_finished:
+            self._jobs.pop(self._finished.popleft(), None)
@@ -0,0 +1,281 @@
+"""Estado estructurado de las impresoras con caché y sondeo en segundo plano.
+
+Decodifica las respuestas de status de Godex y las banderas del spooler de
+Windows a un `PrinterStatus`. `StatusMonitor` refresca el estado de cada
+impresora vigilada desde una tarea en segundo plano, de modo que los endpoints
+solo leen la caché y nunca tocan el hardware.
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Códigos de ~S,STATUS de Godex (manual EZPL)
+GODEX_STATUS_CODES = {
+    0: "Lista",
+    1: "Sin papel o atasco",
+    2: "Sin papel o atasco",
+    3: "Sin ribbon",
+    4: "Cabezal abierto",
+    5: "Rebobinador lleno",
+    6: "Sistema de archivos lleno",
+    7: "Archivo no encontrado",
+    8: "Nombre duplicado",
+    9: "Error de sintaxis",
+    10: "Atasco de cortador",
+    11: "Memoria extendida no encontrada",
+    20: "Pausada",
+    21: "En modo configuración",
+    22: "En modo teclado",
+    50: "Imprimiendo",
+    60: "Procesando datos",
+}
+
+# Banderas PRINTER_INFO_2.Status (winspool.h); se definen aquí para poder
+# decodificarlas sin win32print
+PRINTER_STATUS_PAUSED = 0x00000001
+PRINTER_STATUS_ERROR = 0x00000002
+PRINTER_STATUS_PENDING_DELETION = 0x00000004
+PRINTER_STATUS_PAPER_JAM = 0x00000008
+PRINTER_STATUS_PAPER_OUT = 0x00000010
+PRINTER_STATUS_PAPER_PROBLEM = 0x00000040
+PRINTER_STATUS_OFFLINE = 0x00000080
+PRINTER_STATUS_BUSY = 0x00000200
+PRINTER_STATUS_PRINTING = 0x00000400
+PRINTER_STATUS_OUTPUT_BIN_FULL = 0x00000800
+PRINTER_STATUS_NOT_AVAILABLE = 0x00001000
+PRINTER_STATUS_PROCESSING = 0x00004000
+PRINTER_STATUS_USER_INTERVENTION = 0x00100000
+PRINTER_STATUS_OUT_OF_MEMORY = 0x00200000
+PRINTER_STATUS_DOOR_OPEN = 0x00400000
+PRINTER_STATUS_SERVER_UNKNOWN = 0x00800000
+
+# Solo estas banderas impiden imprimir; el resto (BUSY, PRINTING, PROCESSING,
+# WARMING_UP, TONER_LOW...) describen una impresora que trabaja o avisa
+_SPOOLER_NOT_READY = (PRINTER_STATUS_PAUSED | PRINTER_STATUS_ERROR
+                      | PRINTER_STATUS_PENDING_DELETION | PRINTER_STATUS_PAPER_JAM
+                      | PRINTER_STATUS_PAPER_OUT | PRINTER_STATUS_PAPER_PROBLEM
+                      | PRINTER_STATUS_OFFLINE | PRINTER_STATUS_OUTPUT_BIN_FULL
+                      | PRINTER_STATUS_NOT_AVAILABLE | PRINTER_STATUS_USER_INTERVENTION
+                      | PRINTER_STATUS_OUT_OF_MEMORY | PRINTER_STATUS_DOOR_OPEN
+                      | PRINTER_STATUS_SERVER_UNKNOWN)
+
+# Banderas JOB_INFO_1.Status de un trabajo del spooler (winspool.h)
+JOB_STATUS_PAUSED = 0x00000001
+JOB_STATUS_ERROR = 0x00000002
+JOB_STATUS_DELETING = 0x00000004
+JOB_STATUS_SPOOLING = 0x00000008
+JOB_STATUS_PRINTING = 0x00000010
+JOB_STATUS_OFFLINE = 0x00000020
+JOB_STATUS_PAPEROUT = 0x00000040
+JOB_STATUS_PRINTED = 0x00000080
+JOB_STATUS_DELETED = 0x00000100
+JOB_STATUS_BLOCKED_DEVQ = 0x00000200
+JOB_STATUS_USER_INTERVENTION = 0x00000400
+JOB_STATUS_RESTART = 0x00000800
+
+_JOB_STATUS_MESSAGES = (
+    (JOB_STATUS_PAUSED, "Pausado"),
+    (JOB_STATUS_ERROR, "Error en trabajo"),
+    (JOB_STATUS_DELETING, "Eliminando"),
+    (JOB_STATUS_SPOOLING, "En spool"),
+    (JOB_STATUS_PRINTING, "Imprimiendo"),
+    (JOB_STATUS_OFFLINE, "Impresora offline"),
+    (JOB_STATUS_PAPEROUT, "Sin papel"),
+    (JOB_STATUS_PRINTED, "Impreso"),
+    (JOB_STATUS_DELETED, "Eliminado"),
+    (JOB_STATUS_BLOCKED_DEVQ, "Bloqueado"),
+    (JOB_STATUS_USER_INTERVENTION, "Requiere intervención"),
+    (JOB_STATUS_RESTART, "Reiniciando"),
+)
+
+_STATUS_CODE = re.compile(rb"(\d{2})")
+
+
+class PrinterStatus:
+    __slots__ = ("printer_name", "ready", "paper_out", "ribbon_out", "head_open",
+                 "paused", "offline", "error", "printing", "queue_depth", "message", "raw",
+                 "updated_at")
+
+    def __init__(self, printer_name: str = "", ready: bool = False, paper_out: bool = False,
+                 ribbon_out: bool = False, head_open: bool = False, paused: bool = False,
+                 offline: bool = False, error: bool = False, printing: bool = False,
+                 queue_depth: Optional[int] = None, message: str = "",
+                 raw: Optional[str] = None):
+        self.printer_name = printer_name
+        self.ready = ready
+        self.paper_out = paper_out
+        self.ribbon_out = ribbon_out
+        self.head_open = head_open
+        self.paused = paused
+        self.offline = offline
+        self.error = error
+        # Lista pero aún imprimiendo o procesando datos recibidos
+        self.printing = printing
+        self.queue_depth = queue_depth
+        self.message = message
+        self.raw = raw
+        self.updated_at = time.time()
+
+    @property
+    def usable(self) -> bool:
+        """False si la impresora no puede imprimir y conviene enviar a otra"""
+        return not (self.paper_out or self.ribbon_out or self.head_open
+                    or self.paused or self.offline or self.error)
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def offline_status(printer_name: str, message: str) -> PrinterStatus:
+    return PrinterStatus(printer_name, offline=True, message=message)
+
+
+def decode_godex_status(printer_name: str, response: bytes) -> PrinterStatus:
+    """Decodifica la respuesta de status de una Godex (p. ej. b"00\\r\\n")"""
+    raw = response.hex()
+    if not response:
+        return offline_status(printer_name, "Sin respuesta")
+    match = _STATUS_CODE.search(response)
+    if match is None:
+        return PrinterStatus(printer_name, error=True, raw=raw,
+                             message="Respuesta de status no reconocida")
+
+    code = int(match.group(1))
+    message = GODEX_STATUS_CODES.get(code, f"Código {code:02d}")
+    status = PrinterStatus(printer_name, message=message, raw=raw)
+    if code in (0, 50, 60):
+        status.ready = True
+        status.printing = code != 0
+    elif code in (1, 2):
+        status.paper_out = True
+    elif code == 3:
+        status.ribbon_out = True
+    elif code == 4:
+        status.head_open = True
+    elif code in (20, 21, 22):
+        status.paused = True
+    else:
+        status.error = True
+    return status
+
+
+def decode_spooler_status(printer_name: str, flags: int,
+                          queue_depth: Optional[int] = None) -> PrinterStatus:
+    """Decodifica PRINTER_INFO_2.Status y el número de trabajos en cola (cJobs)"""
+    status = PrinterStatus(printer_name, queue_depth=queue_depth, raw=f"0x{flags:08x}")
+    status.paused = bool(flags & PRINTER_STATUS_PAUSED)
+    status.paper_out = bool(flags & (PRINTER_STATUS_PAPER_OUT | PRINTER_STATUS_PAPER_JAM
+                                     | PRINTER_STATUS_PAPER_PROBLEM))
+    status.head_open = bool(flags & PRINTER_STATUS_DOOR_OPEN)
+    status.offline = bool(flags & (PRINTER_STATUS_OFFLINE | PRINTER_STATUS_NOT_AVAILABLE
+                                   | PRINTER_STATUS_SERVER_UNKNOWN))
+    status.error = bool(flags & (PRINTER_STATUS_ERROR | PRINTER_STATUS_PENDING_DELETION
+                                 | PRINTER_STATUS_OUTPUT_BIN_FULL
+                                 | PRINTER_STATUS_USER_INTERVENTION
+                                 | PRINTER_STATUS_OUT_OF_MEMORY))
+    status.ready = not flags & _SPOOLER_NOT_READY
+
+    messages = []
+    if status.paused:
+        messages.append("Pausada")
+    if flags & PRINTER_STATUS_ERROR:
+        messages.append("Error genérico")
+    if flags & PRINTER_STATUS_PENDING_DELETION:
+        messages.append("Eliminando")
+    if flags & PRINTER_STATUS_PAPER_JAM:
+        messages.append("Atasco papel")
+    if flags & PRINTER_STATUS_PAPER_OUT:
+        messages.append("Sin papel")
+    if flags & PRINTER_STATUS_PAPER_PROBLEM:
+        messages.append("Problema de papel")
+    if flags & PRINTER_STATUS_OUTPUT_BIN_FULL:
+        messages.append("Bandeja de salida llena")
+    if flags & PRINTER_STATUS_USER_INTERVENTION:
+        messages.append("Requiere intervención")
+    if flags & PRINTER_STATUS_OUT_OF_MEMORY:
+        messages.append("Sin memoria")
+    if status.head_open:
+        messages.append("Cabezal abierto")
+    if status.offline:
+        messages.append("Offline")
+    if not messages and flags & (PRINTER_STATUS_BUSY | PRINTER_STATUS_PRINTING
+                                 | PRINTER_STATUS_PROCESSING):
+        messages.append("Imprimiendo")
+    status.message = ", ".join(messages) if messages else "Lista"
+    return status
+
+
+def decode_job_status(flags: int) -> str:
+    """Texto de las banderas de un trabajo del spooler ("En cola" si no hay ninguna)"""
+    messages = [message for flag, message in _JOB_STATUS_MESSAGES if flags & flag]
+    return ", ".join(messages) if messages else "En cola"
+
+
+class StatusMonitor:
+    """Caché de estados refrescada por un sondeo periódico en segundo plano"""
+
+    def __init__(self, probe: Callable[[str], Awaitable[PrinterStatus]],
+                 interval: float = 2.0, ttl: float = 10.0, probe_timeout: float = 5.0):
+        self._probe = probe
+        self.interval = interval
+        self.ttl = ttl
+        self.probe_timeout = probe_timeout
+        self._printers: Set[str] = set()
+        self._cache: Dict[str, PrinterStatus] = {}
+        self._listeners: List[Callable[[Optional[PrinterStatus], PrinterStatus], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def watch(self, printers: Iterable[str]) -> None:
+        self._printers.update(printers)
+
+    def watched(self) -> List[str]:
+        return sorted(self._printers)
+
+    def add_listener(self, listener: Callable[[Optional[PrinterStatus], PrinterStatus], None]) -> None:
+        """Registra `listener(anterior, nuevo)`, llamado en cada refresco"""
+        self._listeners.append(listener)
+
+    def get(self, printer_name: str) -> Optional[PrinterStatus]:
+        """Último estado conocido; no consulta la impresora"""
+        return self._cache.get(printer_name)
+
+    def is_stale(self, status: PrinterStatus) -> bool:
+        return time.time() - status.updated_at > self.ttl
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def refresh(self, printer_name: Optional[str] = None) -> None:
+        names = [printer_name] if printer_name else list(self._printers)
+        await asyncio.gather(*(self._refresh(name) for name in names))
+
+    async def _refresh(self, printer_name: str) -> None:
+        try:
+            status = await asyncio.wait_for(self._probe(printer_name), self.probe_timeout)
+        except asyncio.TimeoutError:
+            status = offline_status(printer_name, "Tiempo de espera agotado")
+        except Exception as e:
+            status = offline_status(printer_name, f"Error obteniendo estado: {e}")
+        previous = self._cache.get(printer_name)
+        self._cache[printer_name] = status
+        for listener in self._listeners:
+            try:
+                listener(previous, status)
+            except Exception as e:
+                logger.error(f"Error notificando estado de {printer_name}: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,162 @@
+"""Balanceo de carga y failover entre grupos de impresoras.
+
+Una petición puede apuntar a un grupo (p. ej. "gate-A") en lugar de a una
+impresora. El grupo se resuelve al despachar el trabajo: se elige la
+impresora sana con menor tiempo estimado de finalización, calculado con los
+trabajos en curso y la duración media observada (EWMA) de cada impresora.
+Si el envío falla, la impresora se marca caída durante `retry_after` segundos.
+El trabajo solo se reintenta en la siguiente del grupo si el transporte
+avisa (NotSent) de que no llegó a escribir nada; un fallo a mitad de la
+escritura deja el trabajo fallido, porque reenviarlo podría imprimirlo dos
+veces.
+"""
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from connections import NotSent
+
+logger = logging.getLogger(__name__)
+
+
+class NoPrinterAvailable(RuntimeError):
+    pass
+
+
+class PrinterStats:
+    __slots__ = ("name", "outstanding", "avg_job_seconds", "jobs", "errors",
+                 "down_until", "last_error")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.outstanding = 0
+        self.avg_job_seconds: Optional[float] = None
+        self.jobs = 0
+        self.errors = 0
+        self.down_until = 0.0
+        self.last_error: Optional[str] = None
+
+    def is_up(self, now: float) -> bool:
+        return now >= self.down_until
+
+    def estimated_wait(self) -> float:
+        # Sin mediciones todavía se prefiere la impresora para medirla
+        return (self.outstanding + 1) * (self.avg_job_seconds or 0.0)
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "outstanding": self.outstanding,
+            "avg_job_seconds": self.avg_job_seconds,
+            "labels_per_second": 1 / self.avg_job_seconds if self.avg_job_seconds else None,
+            "jobs": self.jobs,
+            "errors": self.errors,
+            "up": self.is_up(time.monotonic()),
+            "last_error": self.last_error,
+        }
+
+
+class PrinterScheduler:
+    def __init__(self, send: Callable[[bytes, str], Awaitable[None]],
+                 retry_after: float = 30.0, alpha: float = 0.2):
+        self._send = send
+        self._retry_after = retry_after
+        self._alpha = alpha
+        self.groups: Dict[str, List[str]] = {}
+        self._stats: Dict[str, PrinterStats] = {}
+
+    def configure_group(self, group: str, printers: List[str]) -> None:
+        if not printers:
+            raise ValueError(f"El grupo {group} no tiene impresoras")
+        self.groups[group] = list(printers)
+        for name in printers:
+            self.stats(name)
+
+    def load(self, spec: str) -> None:
+        """Carga grupos `grupo=imp1,imp2;grupo2=imp3` (p. ej. de PRINTER_GROUPS)"""
+        for entry in filter(None, (e.strip() for e in spec.split(";"))):
+            group, sep, members = entry.partition("=")
+            printers = [m.strip() for m in members.split(",") if m.strip()]
+            if not sep or not group.strip():
+                raise ValueError(f"Grupo de impresoras inválido: {entry!r}")
+            self.configure_group(group.strip(), printers)
+
+    def stats(self, printer_name: str) -> PrinterStats:
+        stats = self._stats.get(printer_name)
+        if stats is None:
+            stats = self._stats[printer_name] = PrinterStats(printer_name)
+        return stats
+
+    def all_stats(self) -> List[PrinterStats]:
+        return list(self._stats.values())
+
+    def printer_count(self) -> int:
+        return len(self._stats)
+
+    def mark_down(self, printer_name: str, reason: str,
+                  retry_after: Optional[float] = None) -> None:
+        stats = self.stats(printer_name)
+        stats.down_until = time.monotonic() + (self._retry_after if retry_after is None
+                                               else retry_after)
+        stats.last_error = reason
+
+    def mark_up(self, printer_name: str) -> None:
+        self.stats(printer_name).down_until = 0.0
+
+    def pick(self, group: str, exclude: Optional[set] = None) -> str:
+        now = time.monotonic()
+        candidates = [self.stats(name) for name in self.groups[group]
+                      if not exclude or name not in exclude]
+        healthy = [s for s in candidates if s.is_up(now)]
+        if not healthy:
+            raise NoPrinterAvailable(f"No hay impresoras disponibles en el grupo {group}")
+        return min(healthy, key=PrinterStats.estimated_wait).name
+
+    async def send(self, data: bytes, target: str) -> str:
+        """Envía a una impresora o a un grupo; devuelve la impresora que imprimió"""
+        if target not in self.groups:
+            await self._send_to(data, target)
+            return target
+
+        tried: set = set()
+        last_error: Optional[Exception] = None
+        while True:
+            try:
+                printer_name = self.pick(target, tried)
+            except NoPrinterAvailable:
+                if last_error is not None:
+                    raise last_error
+                raise
+            tried.add(printer_name)
+            try:
+                await self._send_to(data, printer_name)
+                return printer_name
+            except NotSent as e:
+                last_error = e
+                self.mark_down(printer_name, str(e))
+                logger.warning(f"Impresora {printer_name} falló ({e}); "
+                               f"reintentando en otra del grupo {target}")
+            except Exception as e:
+                self.mark_down(printer_name, str(e))
+                logger.error(f"Impresora {printer_name} falló a mitad del envío ({e}); "
+                             "no se reintenta para no imprimir dos veces")
+                raise
+
+    async def _send_to(self, data: bytes, printer_name: str) -> None:
+        stats = self.stats(printer_name)
+        stats.outstanding += 1
+        started = time.monotonic()
+        try:
+            await self._send(data, printer_name)
+        except Exception as e:
+            stats.errors += 1
+            stats.last_error = str(e)
+            raise
+        finally:
+            stats.outstanding -= 1
+        elapsed = time.monotonic() - started
+        stats.jobs += 1
+        if stats.avg_job_seconds is None:
+            stats.avg_job_seconds = elapsed
+        else:
+            stats.avg_job_seconds += self._alpha * (elapsed - stats.avg_job_seconds)
@@ -0,0 +1,116 @@
+"""Servidor de producción: varios workers de la API y un único despachador.
+
+Uso (desde el directorio api/):
+    python serve.py --workers 4 --port 8000
+
+El proceso despachador importa la configuración de app.py (transportes,
+grupos, diario, formularios guardados) y es el único que abre las impresoras;
+los N workers de uvicorn atienden HTTP, generan los tickets y le pasan los
+trabajos por IPC (ver dispatcher.py). Los items van a ITEMS_DB, que todos los
+workers comparten.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import platform
+import signal
+from typing import Optional
+
+from dispatcher import DispatcherServer, default_address
+
+logger = logging.getLogger(__name__)
+
+
+async def _dispatch(address: str, ready=None) -> None:
+    import app
+
+    await app.print_queue.start()
+    await app.printer_status.start()
+    # Aquí no se renderiza, pero recargar las plantillas registra sus
+    # formularios nuevos: las invocaciones que llegan los necesitan
+    await app.ticket_templates.start()
+    server = DispatcherServer(app.print_queue, app.printer_status,
+                              app.printer_discovery.printers, address, events=app.event_bus,
+                              tracker=app.job_tracker)
+    await server.start()
+    loop = asyncio.get_running_loop()
+    if app.DISCOVERY_WARMUP:
+        loop.run_in_executor(None, app.printer_discovery.printers)
+    stop = asyncio.Event()
+    if platform.system() != "Windows":
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+    if ready is not None:
+        ready.set()
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        await app.ticket_templates.stop()
+        await app.printer_status.stop()
+        # Al parar la cola se escribe lo pendiente del diario
+        await app.print_queue.stop()
+        await app.printer_transports.close()
+        app.printer_connections.close()
+        logger.info("Despachador detenido")
+
+
+def run_dispatcher(address: str, ready=None) -> None:
+    """Punto de entrada del proceso despachador"""
+    logging.basicConfig(level=logging.INFO)
+    # Este proceso es el despachador, no un cliente de sí mismo
+    os.environ.pop("PRINT_DISPATCHER", None)
+    try:
+        asyncio.run(_dispatch(address, ready))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_dispatcher(address: str, timeout: float = 30.0) -> multiprocessing.Process:
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=run_dispatcher, args=(address, ready),
+                                      name="print-dispatcher")
+    process.start()
+    if not ready.wait(timeout):
+        process.terminate()
+        raise RuntimeError(f"El despachador no arrancó en {timeout} s")
+    return process
+
+
+def stop_dispatcher(process: multiprocessing.Process, timeout: float = 30.0) -> None:
+    process.terminate()
+    process.join(timeout)
+    if process.is_alive():
+        logger.error("El despachador no terminó a tiempo; se mata")
+        process.kill()
+
+
+def serve(workers: int, host: str = "0.0.0.0", port: int = 8000,
+          address: Optional[str] = None) -> None:
+    import uvicorn
+
+    address = address or default_address()
+    dispatcher = start_dispatcher(address)
+    # Lo heredan los workers de uvicorn
+    os.environ["PRINT_DISPATCHER"] = address
+    try:
+        uvicorn.run("app:app", host=host, port=port, workers=workers)
+    finally:
+        stop_dispatcher(dispatcher)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API de impresión con varios workers")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--dispatcher", default=os.getenv("PRINT_DISPATCHER_ADDRESS"),
+                        help=f"dirección IPC del despachador (por defecto {default_address()})")
+    args = parser.parse_args()
+    serve(args.workers, args.host, args.port, args.dispatcher)
+
+
+if __name__ == "__main__":
+    main()
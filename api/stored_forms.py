@@ -0,0 +1,308 @@
+"""Formularios almacenados en la impresora.
+
+Una plantilla se descarga una sola vez a la memoria de la impresora como
+formulario con variables; a partir de ahí cada etiqueta solo envía el nombre
+del formulario y los valores de los campos, en lugar de repetir todo el layout
+(gráficos `Y`, QR, líneas y textos fijos).
+
+`FormRegistry` recuerda qué versión (hash de la descarga) tiene cada
+impresora y la vuelve a descargar cuando cambia la plantilla o cuando se
+invalida el estado de la impresora (reinicio, error de envío, status
+distinto de "lista").
+
+Sintaxis por lenguaje:
+
+    EPL   FK"nombre"  FS"nombre" Vnn,... Cn,... <layout> FE     guardar
+          N  FR"nombre"  ?  <un valor por línea>  P<n>,<copias>  imprimir
+    EZPL  ~MDELF,nombre  ~MSAVEF,nombre Vnn,... Cn,... <layout> ~MEND
+          ~MRUNF,nombre  <un valor por línea>  ^P<n> ^C<copias>  E  ^P1 ^C1
+
+Los campos declarados como contadores (`Cn`) los numera la propia impresora:
+se envía el valor inicial y cada una de las `n` etiquetas lleva el siguiente,
+así que una fila de asientos consecutivos es una sola invocación corta.
+"""
+import asyncio
+import hashlib
+import re
+import string
+import threading
+from typing import Awaitable, Callable, Dict, List, Mapping, Optional
+
+from ticket_template import adaptar_codigo
+
+_formatter = string.Formatter()
+# Invocación de un formulario dentro de un trabajo: ~MRUNF,nombre o FR"nombre"
+_RECALL = re.compile(rb'^(?:~MRUNF,(\S+)|FR"([^"]*)")\r?$', re.MULTILINE)
+
+
+def _encode(value: str) -> bytes:
+    return value.encode("ascii", errors="ignore")
+
+
+class FormDialect:
+    # Largo máximo del nombre de un formulario en la impresora
+    max_name = 8
+
+    def keeps(self, line: str) -> bool:
+        """False para comandos del layout que no se guardan en el formulario"""
+        return True
+
+    def delete(self, name: str) -> str:
+        raise NotImplementedError
+
+    def begin(self, name: str) -> str:
+        raise NotImplementedError
+
+    def end(self) -> str:
+        raise NotImplementedError
+
+    def variable(self, var: str, field: str, max_length: int) -> str:
+        raise NotImplementedError
+
+    def counter(self, var: str, field: str, digits: int) -> str:
+        """Contador que suma 1 en cada etiqueta de una misma invocación"""
+        raise NotImplementedError
+
+    def reference(self, line: str, variables: Mapping[str, str]) -> str:
+        """Sustituye cada `{campo}` de la línea por su variable"""
+        out = []
+        for literal, name, _, _ in _formatter.parse(line):
+            out.append(literal)
+            if name is not None:
+                out.append(variables[name])
+        return "".join(out)
+
+    def recall_header(self, name: str) -> str:
+        raise NotImplementedError
+
+    def recall_footer(self, labels: int = 1, copies: int = 1) -> str:
+        """Cierre de la invocación: `labels` etiquetas, `copies` copias de cada una"""
+        raise NotImplementedError
+
+
+class EplDialect(FormDialect):
+    _NOT_STORED = re.compile(r"^\s*(N|P\d+(,\d+)?)\s*$")
+
+    def keeps(self, line: str) -> bool:
+        # N (borrar el búfer) y P (imprimir) van en cada invocación, no en el formulario
+        return not self._NOT_STORED.match(line)
+
+    def delete(self, name: str) -> str:
+        return f'FK"{name}"'
+
+    def begin(self, name: str) -> str:
+        return f'FS"{name}"'
+
+    def end(self) -> str:
+        return "FE"
+
+    def variable(self, var: str, field: str, max_length: int) -> str:
+        return f'{var},{max_length},N,"{field}"'
+
+    def counter(self, var: str, field: str, digits: int) -> str:
+        return f'{var},{digits},N,+1,"{field}"'
+
+    def reference(self, line: str, variables: Mapping[str, str]) -> str:
+        # Dentro de comillas la variable se concatena: "Precio: $"V00
+        out = []
+        quoted = False
+        for literal, name, _, _ in _formatter.parse(line):
+            out.append(literal)
+            quoted ^= literal.count('"') % 2 == 1
+            if name is not None:
+                var = variables[name]
+                out.append(f'"{var}"' if quoted else var)
+        return "".join(out).replace('""', "")
+
+    def recall_header(self, name: str) -> str:
+        return f'N\nFR"{name}"\n?'
+
+    def recall_footer(self, labels: int = 1, copies: int = 1) -> str:
+        return f"P{labels}" if copies == 1 else f"P{labels},{copies}"
+
+
+class EzplDialect(FormDialect):
+    max_name = 16
+
+    def delete(self, name: str) -> str:
+        return f"~MDELF,{name}"
+
+    def begin(self, name: str) -> str:
+        return f"~MSAVEF,{name}"
+
+    def end(self) -> str:
+        return "~MEND"
+
+    def variable(self, var: str, field: str, max_length: int) -> str:
+        return f"{var},{max_length},N,{field}"
+
+    def counter(self, var: str, field: str, digits: int) -> str:
+        return f"{var},{digits},N,+1,{field}"
+
+    def recall_header(self, name: str) -> str:
+        return f"~MRUNF,{name}"
+
+    def recall_footer(self, labels: int = 1, copies: int = 1) -> str:
+        if labels == 1 and copies == 1:
+            return "E"
+        # ^P y ^C quedan configurados en la impresora: se restauran al terminar
+        return f"^P{labels}\n^C{copies}\nE\n^P1\n^C1"
+
+
+EPL = EplDialect()
+EZPL = EzplDialect()
+
+
+class StoredForm:
+    """Plantilla `str.format` convertida en formulario con variables V00, V01...
+
+    Los campos de `counters` (campo -> dígitos) son contadores C0, C1... que
+    la impresora incrementa en cada etiqueta; su valor es el de la primera.
+    """
+
+    def __init__(self, name: str, source: str, dialect: FormDialect, setup: str = "",
+                 max_length: int = 64, counters: Optional[Mapping[str, int]] = None):
+        if not name or len(name) > dialect.max_name:
+            raise ValueError(f"Nombre de formulario inválido: {name!r} "
+                             f"(1 a {dialect.max_name} caracteres)")
+        self.name = name
+        self.dialect = dialect
+        self.max_length = max_length
+        self.counters = dict(counters or {})
+
+        fields: List[str] = []
+        for line in source.split("\n"):
+            for _, field, spec, conversion in _formatter.parse(line):
+                if field is None:
+                    continue
+                if not field.isidentifier() or spec or conversion:
+                    raise ValueError(f"Campo de plantilla no soportado: {{{field}}}")
+                if field not in fields:
+                    fields.append(field)
+        unknown = set(self.counters) - set(fields)
+        if unknown:
+            raise ValueError(f"Contadores sin campo en la plantilla: {sorted(unknown)}")
+        # Primero las variables y luego los contadores: es el orden de los valores
+        plain = [f for f in fields if f not in self.counters]
+        self.fields = tuple(plain + [f for f in fields if f in self.counters])
+        variables = {field: f"V{i:02d}" for i, field in enumerate(plain)}
+        variables.update((field, f"C{i}") for i, field in
+                         enumerate(f for f in fields if f in self.counters))
+
+        body = "\n".join(dialect.reference(line, variables)
+                         for line in source.split("\n") if dialect.keeps(line))
+        download = "\n".join([
+            setup,
+            dialect.delete(name),
+            dialect.begin(name),
+            *(dialect.variable(variables[f], f, max_length) for f in plain),
+            *(dialect.counter(variables[f], f, digits) for f, digits in self.counters.items()),
+            body,
+            dialect.end(),
+        ])
+        self.download = _encode(adaptar_codigo(download))
+        self.digest = hashlib.sha1(self.download).hexdigest()[:12]
+        self.recall_prefix = _encode(adaptar_codigo(dialect.recall_header(name)))
+        self._footer = _encode(adaptar_codigo(dialect.recall_footer()))
+
+    def fits(self, values: Mapping[str, str]) -> bool:
+        """False si algún valor no cabe en su variable (hay que enviar el layout completo)"""
+        for field in self.fields:
+            value = str(values[field])
+            limit = self.counters.get(field, self.max_length)
+            if len(value) > limit or "\n" in value or "\r" in value:
+                return False
+        return True
+
+    def recall(self, values: Mapping[str, str], labels: int = 1, copies: int = 1) -> bytes:
+        """Invocación con los valores; imprime `labels` etiquetas (contadores
+        incluidos) y `copies` copias de cada una"""
+        lines = [_encode(str(values[field])) + b"\r\n" for field in self.fields]
+        if labels == 1 and copies == 1:
+            footer = self._footer
+        else:
+            footer = _encode(adaptar_codigo(self.dialect.recall_footer(labels, copies)))
+        return self.recall_prefix + b"".join(lines) + footer
+
+
+class FormRegistry:
+    """Qué formularios (y en qué versión) tiene descargados cada impresora"""
+
+    def __init__(self, enabled: bool = False, refresh: Optional[Callable[[], object]] = None):
+        self.enabled = enabled
+        # Se llama cuando un trabajo invoca un formulario desconocido (p. ej.
+        # otro proceso ya cargó una versión nueva de la plantilla)
+        self.refresh = refresh
+        self._forms: Dict[str, StoredForm] = {}
+        self._loaded: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+        self._download_locks: Dict[str, asyncio.Lock] = {}
+
+    def register(self, form: StoredForm) -> StoredForm:
+        # Las versiones anteriores quedan registradas: un trabajo renderizado
+        # antes de cambiar la plantilla invoca su propio nombre y necesita esa descarga
+        self._forms[form.name] = form
+        return form
+
+    def get(self, name: str) -> Optional[StoredForm]:
+        return self._forms.get(name)
+
+    def match(self, payload: bytes) -> List[StoredForm]:
+        """Formularios que invoca el trabajo (ninguno si solo lleva layouts completos)"""
+        names = dict.fromkeys((m.group(1) or m.group(2)).decode("ascii", errors="replace")
+                              for m in _RECALL.finditer(payload))
+        if self.refresh is not None and any(name not in self._forms for name in names):
+            self.refresh()
+        return [self._forms[name] for name in names if name in self._forms]
+
+    def is_loaded(self, device: str, form: StoredForm) -> bool:
+        with self._lock:
+            return self._loaded.get(device, {}).get(form.name) == form.digest
+
+    def mark_loaded(self, device: str, form: StoredForm) -> None:
+        with self._lock:
+            self._loaded.setdefault(device, {})[form.name] = form.digest
+
+    def invalidate(self, device: Optional[str] = None) -> None:
+        """Olvida lo descargado en una impresora (o en todas); se redescarga al usarlo"""
+        with self._lock:
+            if device is None:
+                self._loaded.clear()
+            else:
+                self._loaded.pop(device, None)
+
+    def _missing(self, device: str, forms: List[StoredForm]) -> List[StoredForm]:
+        return [form for form in forms if not self.is_loaded(device, form)]
+
+    def prepare(self, device: str, payload: bytes) -> bytes:
+        """Antepone la descarga de los formularios que la impresora no tiene"""
+        missing = self._missing(device, self.match(payload))
+        return b"".join(form.download for form in missing) + payload
+
+    async def send(self, device: str, payload: bytes,
+                   send: Callable[[bytes], Awaitable[None]]) -> None:
+        """Envía el trabajo descargando antes el formulario una sola vez por impresora.
+
+        Los trabajos concurrentes a una impresora sin el formulario esperan a que
+        termine la descarga en lugar de invocar un formulario que aún no existe.
+        """
+        forms = self.match(payload)
+        try:
+            if not self._missing(device, forms):
+                await send(payload)
+                return
+            lock = self._download_locks.get(device)
+            if lock is None:
+                lock = self._download_locks[device] = asyncio.Lock()
+            async with lock:
+                missing = self._missing(device, forms)
+                if missing:
+                    await send(b"".join(form.download for form in missing) + payload)
+                    for form in missing:
+                        self.mark_loaded(device, form)
+                    return
+            await send(payload)
+        except BaseException:
+            # La impresora puede haberse reiniciado y perdido sus formularios
+            self.invalidate(device)
+            raise
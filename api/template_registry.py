@@ -0,0 +1,251 @@
+"""Plantillas de etiqueta cargadas de un directorio, con recarga en caliente.
+
+Cada archivo `<nombre>.ezpl` o `<nombre>.epl` del directorio es una plantilla
+(el lenguaje sale de la extensión). Puede empezar con una cabecera de claves
+`clave: valor` terminada en `---`:
+
+    setup: ticket_setup     plantilla sin campos que se envía antes de las etiquetas
+    form: TICKET            nombre del formulario almacenado en la impresora
+    seats_form: SEATS       formulario donde la impresora numera el `asiento`
+    ---
+    ^L
+    VD,67,376,1,1,0,3E,{precio}
+    E
+
+Todas las claves quedan en `meta`, también las que solo usa quien renderiza
+la plantilla.
+
+Al cargar, cada plantilla se valida y se compila (`CompiledTemplate` y, si
+declara `form` o `seats_form`, sus `StoredForm`); una plantilla inválida no
+sustituye a la versión anterior. El nombre de un formulario en la impresora
+lleva la versión de la plantilla (`TICKET` -> `TICKET3FA2`): cada proceso que
+carga el directorio llega al mismo nombre, y un trabajo encolado antes de un
+cambio sigue invocando el formulario con el que se renderizó. Con `forms`, el
+registro da de alta en ese `FormRegistry` los formularios de cada versión
+nueva, así que cualquier proceso que envíe trabajos (también el despachador,
+que no renderiza) sabe qué descarga necesita cada invocación. `reload` vuelve a leer el directorio solo si cambió algún
+archivo y reemplaza el diccionario entero de una vez, así que `get` es una
+consulta a un dict y los trabajos ya renderizados no se ven afectados.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from stored_forms import EPL, EZPL, FormDialect, FormRegistry, StoredForm
+from ticket_template import CompiledTemplate
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+DIALECTS: Dict[str, FormDialect] = {".ezpl": EZPL, ".epl": EPL}
+
+_HEADER_END = "---"
+
+# Campo que numera la impresora en una fila de asientos (`seats_form`)
+SEAT_FIELD = "asiento"
+SEAT_DIGITS = 4
+# Caracteres de la versión que se agregan al nombre de cada formulario
+_FORM_VERSION_CHARS = 4
+
+
+def form_name(name: str, version: str, dialect: FormDialect) -> str:
+    """Nombre del formulario `name` para esa versión de la plantilla"""
+    suffix = version[:_FORM_VERSION_CHARS].upper()
+    return name[:dialect.max_name - len(suffix)] + suffix
+
+
+class LabelTemplate:
+    """Una versión compilada de un archivo de plantilla"""
+
+    def __init__(self, name: str, dialect: FormDialect, source: str,
+                 setup: Optional["LabelTemplate"] = None,
+                 meta: Optional[Mapping[str, str]] = None, path: str = ""):
+        self.name = name
+        self.dialect = dialect
+        self.source = source
+        self.meta = dict(meta or {})
+        self.path = path
+        try:
+            source.encode("ascii")
+        except UnicodeEncodeError as e:
+            raise ValueError(f"Carácter no ASCII en la posición {e.start}") from None
+        self.compiled = CompiledTemplate(source)
+        self.fields = self.compiled.fields
+        # Prueba de render: un campo mal formado falla aquí y no con un trabajo
+        self.compiled.render({field: "0" for field in self.fields})
+
+        self.setup_source = ""
+        self.header = b""
+        if setup is not None:
+            if setup.fields:
+                raise ValueError(f"El setup {setup.name} no puede tener campos")
+            self.setup_source = setup.source
+            self.header = setup.compiled.render({})
+
+        self.version = hashlib.sha1(
+            (self.setup_source + "\0" + source + "\0" + repr(sorted(self.meta.items()))).encode()
+        ).hexdigest()[:12]
+        self.form: Optional[StoredForm] = None
+        if self.meta.get("form"):
+            self.form = StoredForm(form_name(self.meta["form"], self.version, dialect),
+                                   source, dialect, setup=self.setup_source)
+        # Una fila de asientos es una sola invocación cuyo asiento es un
+        # contador (solo existen en formularios guardados)
+        self.seats_form: Optional[StoredForm] = None
+        if self.meta.get("seats_form") and SEAT_FIELD in self.fields:
+            self.seats_form = StoredForm(form_name(self.meta["seats_form"], self.version, dialect),
+                                         source, dialect, setup=self.setup_source,
+                                         counters={SEAT_FIELD: SEAT_DIGITS})
+
+    @property
+    def forms(self) -> List[StoredForm]:
+        return [form for form in (self.form, self.seats_form) if form is not None]
+
+    def render(self, values: Mapping[str, str]) -> bytes:
+        """Comandos de la etiqueta con esos valores (sin el setup)"""
+        return self.compiled.render(values)
+
+
+def parse_template_file(text: str) -> Tuple[Dict[str, str], str]:
+    """Separa la cabecera `clave: valor` (si la hay) del cuerpo de la plantilla"""
+    lines = text.replace("\r\n", "\n").split("\n")
+    stripped = [line.strip() for line in lines]
+    if _HEADER_END not in stripped:
+        return {}, text
+    end = stripped.index(_HEADER_END)
+    meta: Dict[str, str] = {}
+    for number, line in enumerate(stripped[:end], 1):
+        if not line:
+            continue
+        key, sep, value = line.partition(":")
+        if not sep or not key.strip().isidentifier():
+            raise ValueError(f"Cabecera inválida en la línea {number}: {line!r}")
+        meta[key.strip()] = value.strip()
+    return meta, "\n".join(lines[end + 1:])
+
+
+class TemplateRegistry:
+    def __init__(self, directory: str = DEFAULT_DIRECTORY, reload_interval: float = 2.0,
+                 forms: Optional[FormRegistry] = None):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.forms = forms
+        self._templates: Dict[str, LabelTemplate] = {}
+        self._signature: Optional[Tuple] = None
+        # Archivo -> último error de validación (el archivo sigue con su versión anterior)
+        self.errors: Dict[str, str] = {}
+        self.reloads = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, name: str) -> Optional[LabelTemplate]:
+        return self._templates.get(name)
+
+    def __getitem__(self, name: str) -> LabelTemplate:
+        template = self._templates.get(name)
+        if template is None:
+            raise KeyError(f"Plantilla desconocida: {name} (disponibles: {', '.join(self.names())})")
+        return template
+
+    def names(self) -> List[str]:
+        return sorted(self._templates)
+
+    def _scan(self) -> Dict[str, str]:
+        """Nombre -> ruta de los archivos de plantilla del directorio"""
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                name, ext = os.path.splitext(entry.name)
+                if ext in DIALECTS and entry.is_file():
+                    files[name] = entry.path
+        return files
+
+    def reload(self) -> bool:
+        """Relee el directorio si cambió algún archivo; True si hubo cambios"""
+        files = self._scan()
+        stats = {name: os.stat(path) for name, path in files.items()}
+        signature = tuple(sorted((name, st.st_mtime_ns, st.st_size) for name, st in stats.items()))
+        if signature == self._signature:
+            return False
+
+        sources: Dict[str, Tuple[Dict[str, str], str]] = {}
+        errors: Dict[str, str] = {}
+        for name, path in files.items():
+            try:
+                with open(path, encoding="utf-8") as f:
+                    sources[name] = parse_template_file(f.read())
+            except (OSError, UnicodeDecodeError, ValueError) as e:
+                errors[name] = str(e)
+
+        templates: Dict[str, LabelTemplate] = {}
+
+        def build(name: str, chain: Tuple[str, ...] = ()) -> LabelTemplate:
+            if name in templates:
+                return templates[name]
+            if name in chain:
+                raise ValueError(f"Setup circular: {' -> '.join(chain + (name,))}")
+            if name not in sources:
+                raise ValueError(errors.get(name) or f"No existe la plantilla {name}")
+            meta, body = sources[name]
+            setup_name = meta.get("setup")
+            setup = build(setup_name, chain + (name,)) if setup_name else None
+            template = LabelTemplate(name, DIALECTS[os.path.splitext(files[name])[1]], body,
+                                     setup=setup, meta=meta, path=files[name])
+            previous = self._templates.get(name)
+            # Sin cambios se conserva el mismo objeto (y lo que se haya derivado de él)
+            if previous is not None and previous.version == template.version:
+                template = previous
+            templates[name] = template
+            return template
+
+        for name in sources:
+            try:
+                build(name)
+            except ValueError as e:
+                errors[name] = str(e)
+        # Una plantilla inválida (o borrada a medias) mantiene la versión anterior
+        for name in errors:
+            previous = self._templates.get(name)
+            if previous is not None and name in files:
+                templates[name] = previous
+
+        changed = [name for name, t in templates.items() if self._templates.get(name) is not t]
+        removed = [name for name in self._templates if name not in templates]
+        if self.forms is not None:
+            # Antes de publicar las plantillas: lo que se renderice con ellas
+            # ya encuentra su formulario
+            for name in changed:
+                for form in templates[name].forms:
+                    self.forms.register(form)
+        self._templates = templates
+        self._signature = signature
+        self.errors = errors
+        self.reloads += 1
+        for name, error in errors.items():
+            logger.error(f"Plantilla {name} inválida: {error}")
+        if changed or removed:
+            logger.info(f"Plantillas cargadas de {self.directory}: "
+                        f"{len(changed)} nuevas o cambiadas, {len(removed)} eliminadas")
+        return True
+
+    async def start(self) -> None:
+        """Vigila el directorio y recarga las plantillas cuando cambia"""
+        if self._task is None and self.reload_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await loop.run_in_executor(None, self.reload)
+            except OSError as e:
+                logger.error(f"No se pudo leer el directorio de plantillas {self.directory}: {e}")
@@ -0,0 +1,212 @@
+import asyncio
+import struct
+import threading
+
+import pytest
+
+from admission import AdmissionController, Overloaded
+from dispatcher import DispatcherClient, DispatcherError, DispatcherServer
+from events import EventBus
+from job_tracker import JobNotCancellable, JobNotFound, JobTracker
+from print_queue import PrintQueue, UnknownPrinter
+from printer_status import PrinterStatus, StatusMonitor
+
+# Bytes que no son UTF-8 ni JSON: el cuerpo viaja sin codificar
+PAYLOAD = b"N\r\n\x00\xff\xfe GW10,10,2,2,\x80\x81\r\nP1\r\n"
+
+
+class Dispatcher:
+    """Despachador con cola, estado, eventos y tracker reales en un socket Unix"""
+
+    def __init__(self, address, tracker=True, admission=None):
+        self.sent = []
+        self.release = asyncio.Event()
+        self.release.set()
+        # La detección de impresoras (bloqueante) espera a este evento
+        self.discovered = threading.Event()
+        self.discovered.set()
+
+        async def send(payload, printer_name):
+            await self.release.wait()
+            self.sent.append((printer_name, payload))
+
+        async def printers(name):
+            return name != "NOEXISTE"
+
+        async def probe(name):
+            return PrinterStatus(name, ready=True, message="Lista")
+
+        def discover(refresh):
+            self.discovered.wait()
+            return {"BP500": {}}
+
+        self.queue = PrintQueue(send, printers=printers, admission=admission)
+        self.status = StatusMonitor(probe)
+        self.events = EventBus()
+        self.tracker = JobTracker(self.queue) if tracker else None
+        if self.tracker is not None:
+            self.queue.add_listener(self.tracker.job)
+        self.server = DispatcherServer(self.queue, self.status, discover, address,
+                                       events=self.events, tracker=self.tracker)
+
+    async def __aenter__(self):
+        await self.queue.start()
+        await self.server.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release.set()
+        self.discovered.set()
+        await self.server.stop()
+        await self.queue.stop()
+
+
+@pytest.fixture
+def address(tmp_path):
+    return f"unix:{tmp_path}/dispatcher.sock"
+
+
+def _run(address, test, **options):
+    async def run():
+        async with Dispatcher(address, **options) as dispatcher:
+            client = DispatcherClient(address, timeout=5)
+            await client.start()
+            try:
+                return await test(dispatcher, client)
+            finally:
+                await client.stop()
+
+    return asyncio.run(run())
+
+
+def test_job_round_trip(address):
+    async def test(dispatcher, client):
+        job, new = await client.accept(PAYLOAD, "BP500", labels=2)
+        assert new
+        await dispatcher.queue.join()
+        remote = await client.get(job.job_id)
+        assert remote.to_dict()["job_id"] == job.job_id
+        assert remote.to_dict()["labels"] == 2
+        assert await client.get("no-existe") is None
+        assert await client.depth() == 0
+        return dispatcher.sent
+
+    assert _run(address, test) == [("BP500", PAYLOAD)]
+
+
+def test_requests_are_multiplexed_on_one_connection(address):
+    async def test(dispatcher, client):
+        dispatcher.release.clear()
+        accepted = await asyncio.gather(*(client.accept(b"%d" % i, "BP500")
+                                          for i in range(50)))
+        # Ninguna respuesta esperó a que se imprimiera el trabajo anterior
+        assert dispatcher.sent == []
+        assert await client.depth() > 0
+        dispatcher.release.set()
+        await dispatcher.queue.join()
+        return [job.job_id for job, _ in accepted], dispatcher.sent
+
+    job_ids, sent = _run(address, test)
+    assert len(set(job_ids)) == 50
+    assert sorted(payload for _, payload in sent) == sorted(b"%d" % i for i in range(50))
+
+
+def test_errors_keep_their_type(address):
+    async def test(dispatcher, client):
+        with pytest.raises(UnknownPrinter, match="NOEXISTE"):
+            await client.accept(PAYLOAD, "NOEXISTE")
+        with pytest.raises(JobNotFound):
+            await client.cancel("no-existe")
+        with pytest.raises(DispatcherError, match="Operación desconocida"):
+            await client._call("reiniciar")
+        # La conexión sigue sirviendo después de los errores
+        assert await client.depth() == 0
+
+    _run(address, test)
+
+
+def test_cancel_without_tracker_is_refused(address):
+    async def test(dispatcher, client):
+        with pytest.raises(JobNotCancellable):
+            await client.cancel("cualquiera")
+        assert await client.pending_jobs() == ([], None)
+
+    _run(address, test, tracker=False)
+
+
+def test_overloaded_crosses_with_its_retry_after(address):
+    async def test(dispatcher, client):
+        dispatcher.release.clear()
+        # Con la impresora libre se admite siempre; el siguiente ya no cabe en el SLA
+        await client.accept(PAYLOAD, "BP500", labels=100)
+        with pytest.raises(Overloaded) as error:
+            await client.accept(PAYLOAD, "BP500", labels=100)
+        assert error.value.printer_name == "BP500"
+        assert error.value.retry_after > 0
+        assert len(dispatcher.tracker) == 1
+
+    _run(address, test, admission=AdmissionController(sla=1, default_rate=1))
+
+
+def test_status_printers_and_metrics(address):
+    async def test(dispatcher, client):
+        assert await client.printer_status("BP500") is None
+        await dispatcher.status.refresh("BP500")
+        status = await client.printer_status("BP500")
+        assert (status["ready"], status["stale"]) == (True, False)
+        assert await client.printers(refresh=True) == {"BP500": {}}
+        assert "# TYPE" in await client.metrics()
+
+    _run(address, test)
+
+
+def test_events_are_forwarded(address):
+    async def test(dispatcher, client):
+        bus = EventBus()
+        subscription = bus.subscribe()
+        await client.forward_events(bus)
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+            if len(dispatcher.events):
+                break
+        dispatcher.events.publish("prueba", {"n": 1}, ("BP500",), "job-1")
+        events = await asyncio.wait_for(subscription.get(), timeout=5)
+        return [(e.seq, e.type, e.printers, e.job_id) for e in events]
+
+    assert _run(address, test) == [(1, "prueba", ("BP500",), "job-1")]
+
+
+def test_lost_dispatcher_fails_pending_calls(address):
+    async def test(dispatcher, client):
+        dispatcher.discovered.clear()
+        call = asyncio.ensure_future(client.printers())
+        await asyncio.sleep(0.05)
+        assert not call.done()
+        await dispatcher.server.stop()
+        # Cierra también la conexión ya abierta
+        client._writer.transport.abort()
+        with pytest.raises(DispatcherError, match="perdida"):
+            await asyncio.wait_for(call, timeout=5)
+        with pytest.raises(DispatcherError, match="no disponible"):
+            await client.depth()
+
+    _run(address, test)
+
+
+def test_oversized_frame_closes_the_connection(address):
+    async def test(dispatcher, client):
+        reader, writer = await asyncio.open_unix_connection(address[len("unix:"):])
+        writer.write(struct.pack("!II", 16, 1 << 30))
+        await writer.drain()
+        assert await asyncio.wait_for(reader.read(), timeout=5) == b""
+        writer.close()
+        # Los demás clientes siguen atendidos
+        assert await client.depth() == 0
+
+    _run(address, test)
+
+
+def test_unreachable_dispatcher(tmp_path):
+    client = DispatcherClient(f"unix:{tmp_path}/nadie.sock")
+    with pytest.raises(DispatcherError, match="no disponible"):
+        asyncio.run(client.start())
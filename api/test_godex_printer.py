@@ -0,0 +1,22 @@
+import pytest
+
+from GodexPrinter import _with_copies
+
+LAYOUT = "N\nA10,10,0,3,1,1,N,\"P1,1\"\nP1,1\n"
+
+
+def test_copies_replace_the_final_print_command():
+    assert _with_copies(LAYOUT, 3) == "N\nA10,10,0,3,1,1,N,\"P1,1\"\nP1,3\n"
+    assert _with_copies(LAYOUT.encode("ascii"), 12) == \
+        b"N\nA10,10,0,3,1,1,N,\"P1,1\"\nP1,12\n"
+    assert _with_copies("N\r\nP1,1\r\n", 2) == "N\r\nP1,2\r\n"
+    assert _with_copies(LAYOUT, 1) is LAYOUT
+
+
+@pytest.mark.parametrize("layout", ["N\nA10,10,0,3,1,1,N,\"X\"\n", "N\nP1\n", "N\nP1,10\n",
+                                    b"N\nGW0,0,1,1,\x00\n"])
+def test_layout_without_a_single_copy_command_is_refused(layout):
+    # No se antepone ni se añade otro P: el layout se imprimiría de más
+    with pytest.raises(ValueError, match="P1,1"):
+        _with_copies(layout, 3)
+    assert _with_copies(layout, 1) is layout
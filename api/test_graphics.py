@@ -0,0 +1,67 @@
+import io
+import struct
+import zlib
+
+import pytest
+
+pytest.importorskip("PIL")
+pytest.importorskip("numpy")
+from PIL import Image  # noqa: E402
+
+import app  # noqa: E402
+from graphics import ImageTooLarge, InvalidImage, image_bitmap  # noqa: E402
+
+
+def _png(width: int, height: int, mode: str = "1", color: int = 1) -> bytes:
+    buf = io.BytesIO()
+    Image.new(mode, (width, height), color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _declared_size(png: bytes, width: int, height: int) -> bytes:
+    """El mismo PNG con otras dimensiones en la cabecera (y su CRC corregido)"""
+    ihdr = b"IHDR" + struct.pack(">II", width, height) + png[24:29]
+    return png[:12] + ihdr + struct.pack(">I", zlib.crc32(ihdr)) + png[33:]
+
+
+def test_converts_to_a_one_bit_bitmap():
+    bitmap = image_bitmap(_png(16, 8, "L", color=0), max_size=(456, 1120))
+    assert (bitmap.width, bitmap.height) == (16, 8)
+    assert bitmap.data == b"\xff\xff" * 8
+
+
+def test_pixel_cap_is_checked_before_decoding():
+    # Unos pocos KB que, decodificados, ocuparían 25 MP
+    data = _png(5000, 5000)
+    assert len(data) < 64 * 1024
+    with pytest.raises(ImageTooLarge, match="5000x5000"):
+        image_bitmap(data, max_pixels=4096 * 4096)
+
+
+def test_decompression_bomb_is_too_large():
+    # Más del doble de Image.MAX_IMAGE_PIXELS: Pillow lo rechaza al abrirlo
+    bomb = _declared_size(_png(8, 8), 100_000, 100_000)
+    with pytest.raises(ImageTooLarge):
+        image_bitmap(bomb, max_pixels=10 ** 12)
+
+
+@pytest.mark.parametrize("data", [b"no es una imagen", _png(64, 64, "L")[:60]],
+                         ids=["basura", "truncada"])
+def test_unreadable_image(data):
+    with pytest.raises(InvalidImage):
+        image_bitmap(data)
+
+
+@pytest.mark.parametrize("data, status", [
+    (_png(5000, 5000), 413),
+    (_declared_size(_png(8, 8), 100_000, 100_000), 413),
+    (b"no es una imagen", 422),
+    (_png(64, 64, "L")[:60], 422),
+], ids=["grande", "bomba", "basura", "truncada"])
+def test_upload_rejects_bad_images_without_a_500(data, status):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app.app) as client:
+        r = client.put("/printers/BP500/graphics/LOGO", content=data)
+    assert r.status_code == status
+    assert "LOGO" not in app._preview_renderer.graphics
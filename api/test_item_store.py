@@ -0,0 +1,130 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from item_store import MAX_ID, MIN_ID, InvalidCursor, ItemExists, ItemStore, _encode_cursor
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ItemStore(f"sqlite:///{tmp_path}/items.db")
+    yield store
+    store.close()
+
+
+def _pages(store, limit, prefix=None):
+    pages, cursor = [], None
+    while True:
+        items, cursor = store.list(limit, cursor, prefix)
+        pages.append([item["id"] for item in items])
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_every_item_once(store):
+    store.insert_many({"id": i, "name": f"item {i}"} for i in (5, MIN_ID, 1, MAX_ID, -3))
+    assert _pages(store, 2) == [[MIN_ID, -3], [1, 5], [MAX_ID]]
+    assert _pages(store, 5) == [[MIN_ID, -3, 1, 5, MAX_ID]]
+
+
+def test_prefix_pages_follow_name_then_id(store):
+    names = {1: "ab", 2: "abc", 3: "ab", 4: "b", 5: "a", 6: "abz", 7: "ac"}
+    store.insert_many({"id": i, "name": n} for i, n in names.items())
+    assert _pages(store, 2, "ab") == [[1, 3], [2, 6]]
+    assert _pages(store, 10, "a") == [[5, 1, 3, 2, 6, 7]]
+
+
+@pytest.mark.parametrize("prefix", ["\U0010ffff", "x\U0010ffff", "\ud7ff"])
+def test_prefix_at_the_top_of_unicode(store, prefix):
+    store.insert_many([{"id": 1, "name": prefix}, {"id": 2, "name": prefix + "a"},
+                       {"id": 3, "name": prefix[:-1]}, {"id": 4, "name": ""}])
+    assert _pages(store, 1, prefix) == [[1], [2]]
+
+
+@pytest.mark.parametrize("cursor, prefix", [
+    (_encode_cursor(MAX_ID + 1), None),
+    (_encode_cursor(MIN_ID - 1), None),
+    (_encode_cursor(1.5), None),
+    (_encode_cursor(True), None),
+    (_encode_cursor("3"), None),
+    (_encode_cursor(["a", 1]), None),
+    (_encode_cursor(3), "a"),
+    (_encode_cursor(["a"]), "a"),
+    (_encode_cursor([1, 2]), "a"),
+    (_encode_cursor(["a", "2"]), "a"),
+    (_encode_cursor(["a", 2 ** 70]), "a"),
+    (_encode_cursor(["\ud800", 1]), "a"),
+    ("no es base64!", None),
+], ids=["mayor", "menor", "float", "bool", "texto", "lista", "entero", "corto", "nombre",
+        "id-texto", "id-enorme", "surrogate", "basura"])
+def test_invalid_cursor(store, cursor, prefix):
+    with pytest.raises(InvalidCursor):
+        store.list(10, cursor, prefix)
+
+
+def test_bulk_insert_is_all_or_nothing(store):
+    store.create({"id": 2, "name": "dos"})
+    with pytest.raises(ItemExists):
+        store.insert_many([{"id": 1, "name": "uno"}, {"id": 2, "name": "otro"}])
+    assert store.get(1) is None
+    assert store.upsert_many([{"id": 1, "name": "uno"}, {"id": 2, "name": "otro"}]) == 2
+    assert [store.get(i)["name"] for i in (1, 2)] == ["uno", "otro"]
+
+
+def test_items_endpoints_round_trip():
+    import app
+
+    items = [{"id": 7_000_000 + i, "name": f"listado-{i}", "description": None}
+             for i in range(5)]
+    with TestClient(app.app) as client:
+        assert client.post("/items/bulk", json=items).json() == {"inserted": 5}
+        assert client.post("/items/bulk", json=items[:1]).status_code == 400
+        seen, cursor = [], None
+        while True:
+            params = {"prefix": "listado-", "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = client.get("/items", params=params)
+            assert response.status_code == 200
+            seen += response.json()
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        assert seen == items
+        assert client.put("/items/bulk", json=[{**items[0], "name": "otro"}]).status_code == 200
+        assert client.get(f"/items/{items[0]['id']}").json()["name"] == "otro"
+
+
+@pytest.mark.parametrize("method, url, body", [
+    ("post", "/items", {"id": 2 ** 70, "name": "x"}),
+    ("post", "/items/bulk", [{"id": -(2 ** 63) - 1, "name": "x"}]),
+    ("put", "/items/bulk", [{"id": 2 ** 63, "name": "x"}]),
+    ("get", f"/items/{2 ** 63}", None),
+    ("delete", f"/items/{2 ** 70}", None),
+], ids=["crear", "bulk", "upsert", "leer", "borrar"])
+def test_ids_beyond_64_bits_are_refused(method, url, body):
+    import app
+
+    with TestClient(app.app) as client:
+        kwargs = {} if body is None else {"json": body}
+        assert client.request(method, url, **kwargs).status_code == 422
+
+
+@pytest.mark.parametrize("params", [
+    {"cursor": _encode_cursor(2 ** 64)},
+    {"cursor": _encode_cursor([1, "a"]), "prefix": "a"},
+    {"cursor": "%%%"},
+])
+def test_bad_cursors_are_400(params):
+    import app
+
+    with TestClient(app.app) as client:
+        assert client.get("/items", params=params).status_code == 400
+
+
+def test_last_code_point_prefix_is_listed():
+    import app
+
+    with TestClient(app.app) as client:
+        response = client.get("/items", params={"prefix": "\U0010ffff"})
+    assert response.status_code == 200
+    assert response.json() == []
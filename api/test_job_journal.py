@@ -0,0 +1,139 @@
+import asyncio
+import sqlite3
+from concurrent.futures import Future
+
+from admission import AdmissionController
+from job_journal import JobJournal, _resolve
+from print_queue import PrintQueue
+
+
+def _accept(path, *jobs):
+    async def run():
+        journal = JobJournal(path)
+        journal.open()
+        try:
+            for job_id, labels in jobs:
+                await journal.accepted(job_id, "P", b"N\nP5\n", labels=labels)
+        finally:
+            journal.close()
+
+    asyncio.run(run())
+
+
+def test_replayed_job_keeps_its_labels(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    _accept(path, ("cinco", 5), ("una", 1))
+
+    async def run():
+        release = asyncio.Event()
+
+        async def send(payload, printer_name):
+            await release.wait()
+
+        queue = PrintQueue(send, journal=JobJournal(path),
+                           admission=AdmissionController(60, default_rate=1))
+        await queue.start()
+        try:
+            jobs = [queue.get("cinco"), queue.get("una")]
+            backlog = queue.admission.load("P").backlog
+            release.set()
+            await queue.join()
+        finally:
+            await queue.stop()
+        return jobs, backlog
+
+    jobs, backlog = asyncio.run(run())
+    assert [(job.labels, job.replayed) for job in jobs] == [(5, True), (1, True)]
+    # La admisión reserva lo que de verdad falta imprimir
+    assert backlog == 6
+
+
+def test_journal_without_labels_column_is_migrated(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE jobs (job_id TEXT PRIMARY KEY, idempotency_key TEXT UNIQUE,
+                           printer_name TEXT NOT NULL, payload BLOB, state TEXT NOT NULL,
+                           error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL);
+        INSERT INTO jobs VALUES ('viejo', NULL, 'P', x'00', 'accepted', NULL, 1, 1);
+    """)
+    conn.close()
+
+    journal = JobJournal(path)
+    try:
+        entries = journal.open()
+    finally:
+        journal.close()
+    assert [(e.job_id, e.labels) for e in entries] == [("viejo", 1)]
+    _accept(path, ("nuevo", 3))
+    journal = JobJournal(path)
+    try:
+        assert {e.job_id: e.labels for e in journal.open()} == {"viejo": 1, "nuevo": 3}
+    finally:
+        journal.close()
+
+
+def test_expired_jobs_and_keys_are_pruned_while_running(tmp_path):
+    path = str(tmp_path / "jobs.db")
+
+    async def run():
+        journal = JobJournal(path, retention=0.2, prune_interval=0)
+        journal.open()
+        try:
+            for i in range(3):
+                assert journal.reserve(f"clave-{i}", f"job-{i}") is None
+                await journal.accepted(f"job-{i}", "P", b"x", idempotency_key=f"clave-{i}")
+            journal.confirmed("job-0")
+            journal.failed("job-1", "sin papel")
+            await asyncio.sleep(0.3)
+            # Cualquier escritura posterior limpia lo caducado
+            await journal.sent("job-2")
+            return [journal.lookup(f"clave-{i}") for i in range(3)]
+        finally:
+            journal.close()
+
+    assert asyncio.run(run()) == [None, None, "job-2"]
+    conn = sqlite3.connect(path)
+    try:
+        assert [row[0] for row in conn.execute("SELECT job_id FROM jobs")] == ["job-2"]
+    finally:
+        conn.close()
+
+
+def test_cancelled_waiters_do_not_stop_the_writer(tmp_path):
+    path = str(tmp_path / "jobs.db")
+
+    async def run():
+        journal = JobJournal(path)
+        journal.open()
+        try:
+            # Se cancelan las esperas mientras el hilo escritor resuelve sus lotes
+            for round_ in range(20):
+                tasks = [asyncio.ensure_future(journal.accepted(f"job-{round_}-{i}", "P", b"x"))
+                         for i in range(50)]
+                await asyncio.sleep(0)
+                for task in tasks[::2]:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            # El hilo sigue vivo: una escritura posterior termina
+            await asyncio.wait_for(journal.accepted("despues", "P", b"x"), timeout=5)
+        finally:
+            journal.close()
+
+    asyncio.run(run())
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM jobs WHERE job_id = 'despues'").fetchone() == (1,)
+    finally:
+        conn.close()
+
+
+def test_resolve_ignores_a_cancelled_future():
+    cancelled = Future()
+    cancelled.cancel()
+    _resolve(cancelled)
+    assert cancelled.cancelled()
+
+    failed = Future()
+    _resolve(failed, RuntimeError("disco lleno"))
+    assert str(failed.exception()) == "disco lleno"
@@ -0,0 +1,186 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import backends
+from emulator import FakeWin32Print
+
+TICKET = {"seccion": "GENERAL", "orden": "1A2B3C4D", "precio": "300", "tipo": "PREVENTA",
+          "fila": "1", "printer_name": "BP500"}
+
+
+@pytest.fixture
+def spooler():
+    """Spooler simulado que imprime un trabajo por hora: todo lo enviado espera en él"""
+    previous = backends.load("spooler")
+    fake = FakeWin32Print(open_cost=0, job_cost=0, bytes_per_sec=1e12, print_cost=3600)
+    backends.install("spooler", fake)
+    app.printer_connections.close()
+    interval, app.printer_status.interval = app.printer_status.interval, 3600
+    yield fake
+    app.printer_status.interval = interval
+    app.printer_connections.close()
+    backends.install("spooler", previous)
+
+
+@pytest.fixture
+def client(spooler):
+    with TestClient(app.app) as client:
+        yield client
+
+
+def _post(client, count, start=0):
+    ids = []
+    for i in range(count):
+        r = client.post("/print", json={**TICKET, "asiento": str(start + i)})
+        assert r.status_code == 202
+        ids.append(r.json()["job_id"])
+    return ids
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timeout"
+        time.sleep(0.01)
+
+
+def _walk(client, **params):
+    jobs, pages, cursor = [], 0, None
+    while True:
+        r = client.get("/api/printer/jobs",
+                       params={**params, **({"cursor": cursor} if cursor else {})})
+        assert r.status_code == 200
+        jobs.extend(r.json())
+        pages += 1
+        cursor = r.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return jobs, pages
+
+
+def test_lists_spooled_jobs_in_pages_without_enumerating(client, spooler):
+    ids = _post(client, 25)
+    _wait(lambda: spooler.jobs == 25)
+    _wait(lambda: all(app.job_tracker.get(job_id)["state"] == "spooled" for job_id in ids))
+    enumerations = spooler.enumerations
+
+    jobs, pages = _walk(client, printer="BP500", limit=10)
+    assert pages == 3
+    assert [job["job_id"] for job in jobs] == ids
+    assert all(job["state"] == "spooled" and job["device"] == "BP500" for job in jobs)
+    assert len({spool_id for job in jobs for spool_id in job["spool_job_ids"]}) == 25
+    assert spooler.enumerations == enumerations
+
+    queued = client.get("/api/printer/jobs", params={"state": "queued", "printer": "BP500"})
+    assert queued.json() == []
+    assert client.get("/api/printer/jobs", params={"printer": "OTRA"}).json() == []
+    assert client.get("/api/printer/jobs", params={"state": "nope"}).status_code == 400
+    assert client.get("/api/printer/jobs", params={"cursor": "x"}).status_code == 400
+
+
+def test_poll_refreshes_position_and_drops_printed_jobs(client, spooler):
+    ids = _post(client, 5)
+    _wait(lambda: spooler.jobs == 5)
+    _wait(lambda: app.job_tracker.get(ids[-1])["state"] == "spooled")
+    app._spooler_status("BP500")
+    assert [app.job_tracker.get(job_id)["position"] for job_id in ids] == [1, 2, 3, 4, 5]
+    assert app.job_tracker.get(ids[0])["spool_status"]
+
+    # Se imprimen los dos primeros: la siguiente enumeración ya no los ve
+    with spooler._lock:
+        for _ in range(2):
+            spooler.queue.popitem(last=False)
+    app._spooler_status("BP500")
+    assert [app.job_tracker.get(job_id) for job_id in ids[:2]] == [None, None]
+    assert [app.job_tracker.get(job_id)["position"] for job_id in ids[2:]] == [1, 2, 3]
+
+
+def test_cancel_deletes_from_the_spooler(client, spooler):
+    ids = _post(client, 3)
+    _wait(lambda: spooler.jobs == 3)
+    _wait(lambda: app.job_tracker.get(ids[1])["state"] == "spooled")
+    spool_ids = app.job_tracker.get(ids[1])["spool_job_ids"]
+
+    r = client.delete(f"/api/printer/jobs/{ids[1]}")
+    assert r.status_code == 200
+    assert r.json()["status"] == "cancelled"
+    assert spooler.deleted == 1
+    assert not set(spool_ids) & set(spooler.queue)
+    assert app.job_tracker.get(ids[1]) is None
+    assert client.get(f"/jobs/{ids[1]}").json()["status"] == "cancelled"
+    # Los demás siguen en el spooler
+    assert [job["job_id"] for job in _walk(client, printer="BP500")[0]] == [ids[0], ids[2]]
+
+    assert client.delete(f"/api/printer/jobs/{ids[1]}").status_code == 409
+    assert client.delete("/api/printer/jobs/no-existe").status_code == 404
+
+
+def test_cancel_queued_job_never_reaches_the_spooler(client, spooler):
+    # Cada envío tarda: los últimos trabajos siguen en nuestra cola
+    spooler.job_cost = 0.2
+    ids = _post(client, 6)
+    queued = [job["job_id"] for job in
+              client.get("/api/printer/jobs", params={"state": "queued"}).json()]
+    assert ids[-1] in queued
+    r = client.delete(f"/api/printer/jobs/{ids[-1]}")
+    assert r.status_code == 200
+    assert r.json()["status"] == "cancelled"
+    _wait(lambda: spooler.jobs == 5, timeout=10)
+    time.sleep(0.3)
+    assert spooler.jobs == 5
+    assert spooler.deleted == 0
+
+
+def test_sending_job_is_not_cancellable(client, spooler):
+    spooler.job_cost = 0.5
+    job_id = _post(client, 1)[0]
+    _wait(lambda: app.job_tracker.get(job_id)["state"] == "sending")
+    r = client.delete(f"/api/printer/jobs/{job_id}")
+    assert r.status_code == 409
+
+
+def test_check_last_job_looks_up_its_own_job(spooler, caplog):
+    from GodexPrinter import GodexPrinterManager
+
+    manager = GodexPrinterManager(verify_status=False)
+    try:
+        assert manager.connect_windows_printer("BP500")
+        assert manager.send_epl_command("N\nP1\n")
+        first = manager.last_job_id
+        # Otros trabajos detrás en la cola: se revisa el nuestro, no el último
+        for _ in range(3):
+            spooler.StartDocPrinter("BP500", 1, ("Otro", None, "RAW"))
+        with caplog.at_level("INFO", logger="GodexPrinter"):
+            manager.check_last_job()
+        assert f"Trabajo {first} 'Etiqueta EPL' sigue en cola (posición 1)" in caplog.text
+
+        with spooler._lock:
+            del spooler.queue[first]
+        caplog.clear()
+        with caplog.at_level("INFO", logger="GodexPrinter"):
+            manager.check_last_job()
+        assert f"El trabajo {first} salió de la cola" in caplog.text
+    finally:
+        manager.disconnect()
+
+
+def test_failed_write_discards_the_spooled_job(spooler):
+    from connections import SpoolerConnection
+
+    def broken_write(handle, data):
+        raise OSError("WritePrinter: el dispositivo no está listo")
+
+    conn = SpoolerConnection("BP500", spooler)
+    conn.open()
+    try:
+        conn.write(b"N\nP1\n")
+        spooler.WritePrinter = broken_write
+        with pytest.raises(OSError):
+            conn.write(b"N\nP1\n")
+    finally:
+        conn.close()
+    # El trabajo a medias no queda en cola para imprimirse cortado
+    assert list(spooler.queue) == [1]
+    assert spooler.aborted == 1
@@ -0,0 +1,120 @@
+import re
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from metrics import CONTENT_TYPE, Counter, Gauge, Histogram, Registry, merge
+
+
+def test_concurrent_updates_are_not_lost():
+    registry = Registry()
+    counter = Counter("trabajos_total", "Trabajos", ["printer"], registry=registry)
+    histogram = Histogram("duracion_seconds", "Duración", buckets=(1.0,), registry=registry)
+    threads, per_thread = 8, 20_000
+
+    def work():
+        child = counter.labels("BP500")
+        for _ in range(per_thread):
+            child.inc()
+            histogram.observe(0.5)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert counter.labels("BP500").value == threads * per_thread
+    counts, total = histogram.labels().snapshot()
+    assert counts == [threads * per_thread, 0]
+    assert total == threads * per_thread * 0.5
+
+
+def test_counter_and_gauge_exposition():
+    registry = Registry()
+    jobs = Counter("jobs_total", "Trabajos \\ impresos\nen total", ["printer"], registry=registry)
+    jobs.labels('BP "500"\n').inc(2)
+    jobs.labels("ZT\\410").inc(0.25)
+    Gauge("depth", "Trabajos en cola", registry=registry).set(3)
+    Gauge("temperature", "Temperatura", ["printer", "sensor"], registry=registry,
+          function=lambda: {("BP500", "cabezal"): float("nan"), ("ZT410", "motor"): -1e20})
+    Gauge("ready", "Lista", ["printer"], registry=registry, function=lambda: {"BP500": 1})
+    Counter("unused_total", "Sin series", ["printer"], registry=registry)
+
+    assert registry.render({"worker": "7"}) == (
+        '# HELP jobs_total Trabajos \\\\ impresos\\nen total\n'
+        '# TYPE jobs_total counter\n'
+        'jobs_total{worker="7",printer="BP \\"500\\"\\n"} 2\n'
+        'jobs_total{worker="7",printer="ZT\\\\410"} 0.25\n'
+        '# HELP depth Trabajos en cola\n'
+        '# TYPE depth gauge\n'
+        'depth{worker="7"} 3\n'
+        '# HELP temperature Temperatura\n'
+        '# TYPE temperature gauge\n'
+        'temperature{worker="7",printer="BP500",sensor="cabezal"} NaN\n'
+        'temperature{worker="7",printer="ZT410",sensor="motor"} -1e+20\n'
+        '# HELP ready Lista\n'
+        '# TYPE ready gauge\n'
+        'ready{worker="7",printer="BP500"} 1\n')
+
+
+def test_histogram_exposition():
+    registry = Registry()
+    latency = Histogram("latency_seconds", "Latencia", ["printer"], buckets=(0.5, 0.1, 1.0),
+                        registry=registry)
+    Histogram("idle_seconds", "Sin observaciones", registry=registry)
+    for value in (0.1, 0.3, 0.7, 5.0, float("inf")):
+        latency.labels("BP500").observe(value)
+
+    assert registry.render() == (
+        '# HELP latency_seconds Latencia\n'
+        '# TYPE latency_seconds histogram\n'
+        'latency_seconds_bucket{printer="BP500",le="0.1"} 1\n'
+        'latency_seconds_bucket{printer="BP500",le="0.5"} 2\n'
+        'latency_seconds_bucket{printer="BP500",le="1"} 3\n'
+        'latency_seconds_bucket{printer="BP500",le="+Inf"} 5\n'
+        'latency_seconds_sum{printer="BP500"} +Inf\n'
+        'latency_seconds_count{printer="BP500"} 5\n')
+    assert Registry().render() == ""
+
+
+def test_label_count_is_checked_and_names_are_unique():
+    registry = Registry()
+    counter = Counter("jobs_total", "Trabajos", ["printer"], registry=registry)
+    with pytest.raises(ValueError):
+        counter.labels("BP500", "sobra")
+    with pytest.raises(ValueError, match="duplicada"):
+        Gauge("jobs_total", "Otra", registry=registry)
+
+
+def test_merge_keeps_one_help_and_type_per_family():
+    dispatcher, worker = Registry(), Registry()
+    for registry in (dispatcher, worker):
+        Counter("jobs_total", "Trabajos", registry=registry).inc()
+    Gauge("depth", "Cola", registry=dispatcher).set(4)
+
+    assert merge(dispatcher.render(), worker.render({"worker": "7"}), "") == (
+        '# HELP jobs_total Trabajos\n'
+        '# TYPE jobs_total counter\n'
+        'jobs_total 1\n'
+        'jobs_total{worker="7"} 1\n'
+        '# HELP depth Cola\n'
+        '# TYPE depth gauge\n'
+        'depth 4\n')
+    assert merge("", "") == ""
+
+
+def test_metrics_endpoint_is_valid_exposition():
+    import app
+
+    with TestClient(app.app) as client:
+        response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == CONTENT_TYPE
+    types = [line.split()[2] for line in response.text.splitlines()
+             if line.startswith("# TYPE ")]
+    assert types and len(types) == len(set(types))
+    sample = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_]\w*="([^"\\]|\\.)*",?)*\})? '
+                        r'(NaN|[+-]Inf|-?[0-9.e+-]+)$')
+    for line in response.text.splitlines():
+        assert line.startswith("# ") or sample.match(line), line
@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from ndjson_import import NdjsonImport, iter_lines
+
+
+class Row(BaseModel):
+    id: int
+
+
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def _lines(*chunks, max_line=1 << 20):
+    async def run():
+        return [line async for line in iter_lines(_chunks(*chunks), max_line)]
+
+    return asyncio.run(run())
+
+
+def _import(body_chunks, write, chunk_size=2, max_line=1 << 20):
+    importer = NdjsonImport(Row.model_validate_json, write, chunk_size=chunk_size,
+                            max_line=max_line)
+
+    async def run():
+        return b"".join([out async for out in importer.run(_chunks(*body_chunks))])
+
+    return [json.loads(line) for line in asyncio.run(run()).splitlines()]
+
+
+async def _write_ids(rows):
+    return [{"id": row.id} for row in rows]
+
+
+def test_lines_split_across_chunks():
+    assert _lines(b'{"id"', b': 1}\r\n\n  \n{"id": 2}', b"\n", b'{"id": 3}') == [
+        (1, b'{"id": 1}'), (4, b'{"id": 2}'), (5, b'{"id": 3}')]
+
+
+def test_long_line_is_skipped_and_reading_goes_on():
+    long = b"x" * 20
+    assert _lines(long[:12], long[12:] + b"\nok\n" + long, max_line=10) == [
+        (1, None), (2, b"ok"), (3, None)]
+
+
+def test_every_line_gets_a_result_in_order():
+    body = b'{"id": 1}\nno es json\n{"id": "dos"}\n{"id": 4}\n{}\n\xff\xfe\n' + b"[" * 5000
+    results = _import([body], _write_ids)
+    assert [(r.get("line"), r.get("ok")) for r in results[:-1]] == [
+        (1, True), (2, False), (3, False), (4, True), (5, False), (6, False), (7, False)]
+    assert results[0] == {"line": 1, "ok": True, "id": 1}
+    assert results[2]["error"].startswith("id: ")
+    assert results[4]["error"].startswith("id: ")
+    assert results[-1] == {"summary": {"lines": 7, "ok": 2, "errors": 5}}
+
+
+def test_failed_block_only_fails_its_own_rows():
+    blocks = []
+
+    async def write(rows):
+        blocks.append([row.id for row in rows])
+        if len(blocks) == 1:
+            raise RuntimeError("base de datos caída")
+        return [{} for _ in rows]
+
+    results = _import([b"".join(b'{"id": %d}\n' % i for i in range(1, 5))], write)
+    assert blocks == [[1, 2], [3, 4]]
+    assert [r.get("ok") for r in results[:-1]] == [False, False, True, True]
+    assert results[0]["error"] == "base de datos caída"
+    assert results[-1] == {"summary": {"lines": 4, "ok": 2, "errors": 2}}
+
+
+def test_write_can_fail_single_rows():
+    async def write(rows):
+        return [ValueError("duplicado") if row.id == 2 else {"id": row.id} for row in rows]
+
+    results = _import([b'{"id": 1}\n{"id": 2}\n{"id": 3}\n'], write, chunk_size=10)
+    assert [r.get("error") for r in results[:-1]] == [None, "duplicado", None]
+
+
+def test_block_of_only_invalid_lines_is_not_written():
+    calls = []
+
+    async def write(rows):
+        calls.append(rows)
+        return [{} for _ in rows]
+
+    results = _import([b"x\n" + b"y" * 50 + b"\n"], write, max_line=10)
+    assert calls == []
+    assert results[1]["error"] == "Línea de más de 10 bytes"
+    assert results[-1] == {"summary": {"lines": 2, "ok": 0, "errors": 2}}
+
+
+def test_empty_body_only_has_the_summary():
+    assert _import([b"", b"\n\n"], _write_ids) == [{"summary": {"lines": 0, "ok": 0,
+                                                                "errors": 0}}]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+def test_items_import_endpoint(chunk_size, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "IMPORT_CHUNK_SIZE", chunk_size)
+    body = (b'{"id": 8000001, "name": "importado"}\n'
+            b'{"id": 8000002}\n'
+            b'{"id": 99999999999999999999, "name": "enorme"}\n'
+            b'{"id": 8000003, "name": "otro", "description": "d"}')
+    with TestClient(app.app) as client:
+        response = client.post("/items/import", content=body)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        results = [json.loads(line) for line in response.text.splitlines()]
+        assert [(r.get("line"), r.get("ok")) for r in results[:-1]] == [
+            (1, True), (2, False), (3, False), (4, True)]
+        assert results[1]["error"] == "name: Field required"
+        assert results[-1] == {"summary": {"lines": 4, "ok": 2, "errors": 2}}
+        assert client.get("/items/8000003").json()["description"] == "d"
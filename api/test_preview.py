@@ -0,0 +1,152 @@
+import io
+import json
+import os
+
+import pytest
+
+pytest.importorskip("PIL")
+from PIL import Image  # noqa: E402
+
+import app  # noqa: E402
+from emulator import PrinterEngine  # noqa: E402
+from GodexPrinter import GodexPrinterManager  # noqa: E402
+from preview import InvalidCommand, LabelRenderer, TemplatePreview, to_png  # noqa: E402
+
+# Imágenes de referencia de la vista previa. Se regeneran con
+#     UPDATE_GOLDEN=1 python -m pytest api/test_preview.py
+# y se revisan a ojo antes de subirlas.
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+# Las fuentes y los códigos salen de estas bibliotecas: con otras versiones el
+# dibujo puede variar sin que haya cambiado el renderer
+GOLDEN_LIBRARIES = ("Pillow", "qrcode", "python-barcode")
+
+TICKET = {"seccion": "GENERAL", "orden": "1A2B3C4D", "precio": "300", "tipo": "PREVENTA",
+          "fila": "12", "asiento": "7"}
+PRODUCT = {"name": "Agua mineral", "price": "10.00", "barcode": "750100000001",
+           "sku": "AG-500", "date": "17/10/2026"}
+STYLES = ("standard", "compact", "barcode_top", "minimal")
+
+
+def _versions():
+    from importlib.metadata import version
+
+    return {name: version(name) for name in GOLDEN_LIBRARIES}
+
+
+def _check_golden(name: str, image) -> None:
+    path = os.path.join(GOLDEN_DIR, f"{name}.png")
+    versions_path = os.path.join(GOLDEN_DIR, "versions.json")
+    if os.getenv("UPDATE_GOLDEN") == "1":
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        image.save(path, "PNG")
+        with open(versions_path, "w") as f:
+            json.dump(_versions(), f, indent=2, sort_keys=True)
+        return
+    with open(versions_path) as f:
+        recorded = json.load(f)
+    if recorded != _versions():
+        pytest.skip(f"imágenes de referencia generadas con {recorded}")
+    with Image.open(path) as golden:
+        expected = golden.convert("1")
+    assert image.size == expected.size
+    assert image.convert("1").tobytes() == expected.tobytes(), \
+        f"{name} no coincide con {path} (UPDATE_GOLDEN=1 para regenerarla)"
+
+
+def _ticket_payload(**values) -> bytes:
+    return app._build_ticket(app.PrintRequest(**{**TICKET, **values}))
+
+
+def _single(labels):
+    assert len(labels) == 1
+    image, copies = labels[0]
+    assert copies == 1
+    return image
+
+
+def test_ticket_golden():
+    image = _single(LabelRenderer().render(_ticket_payload()))
+    assert image.size == (456, 1120)
+    _check_golden("ticket", image)
+
+
+@pytest.mark.parametrize("style", STYLES)
+def test_57x70_golden(style):
+    manager = GodexPrinterManager(verify_status=False, templates=app.ticket_templates)
+    epl = manager.create_57x70_ticket_layout(PRODUCT, style).encode("ascii")
+    image = _single(LabelRenderer().render(epl))
+    assert image.size == (456, 560)
+    _check_golden(f"57x70_{style}", image)
+
+
+def test_emulator_prints_what_the_preview_shows():
+    payloads = [_ticket_payload(asiento=str(seat)) for seat in range(3)]
+    engine = PrinterEngine(labels_per_second=1000, capture=True)
+    try:
+        for payload in payloads:
+            engine.feed(payload)
+        printed = engine.render_labels()
+    finally:
+        engine.stop()
+    expected = [image for payload in payloads for image, _ in LabelRenderer().render(payload)]
+    assert [image.tobytes() for image, _ in printed] == [image.tobytes() for image in expected]
+
+
+def test_copies_are_counted_not_drawn():
+    labels = LabelRenderer().render(_ticket_payload())
+    copies = LabelRenderer().render(app._build_ticket(app.PrintRequest(**TICKET, copies=3)))
+    assert [c for _, c in copies] == [3]
+    assert copies[0][0].tobytes() == labels[0][0].tobytes()
+
+
+def test_cached_template_preview_matches_full_render():
+    layout = app._ticket_layout("ticket")
+    preview = TemplatePreview(layout.template.source, layout.template.setup_source)
+    values = app._ticket_values(app.TicketFields(**TICKET))
+    with Image.open(io.BytesIO(preview.render(values))) as png:
+        cached = png.convert("1").tobytes()
+    full = _single(LabelRenderer().render(_ticket_payload()))
+    assert cached == full.tobytes()
+    preview.render(values)
+    assert (preview.hits, preview.misses) == (1, 1)
+
+
+def test_preview_endpoint():
+    from fastapi.testclient import TestClient
+
+    with TestClient(app.app) as client:
+        r = client.get("/print/preview", params=TICKET)
+        assert r.status_code == 200
+        assert r.headers["content-type"] == "image/png"
+        full = _single(LabelRenderer().render(_ticket_payload()))
+        assert r.content == to_png(full)
+        r = client.get("/print/preview", params={**TICKET, "template": "nope"})
+        assert r.status_code == 422
+
+
+@pytest.mark.parametrize("payload", [
+    b"^L\r\nLo,a,b,c,d\r\nE\r\n",
+    b"^L\r\nQ1,1,99999,99999\r\n" + b"\x00" * 64 + b"\r\nE\r\n",
+    b"N\r\nGW0,0,99999,99999," + b"\x00" * 64 + b"\r\nP1\r\n",
+    b"^Q99999,3\r\n^L\r\nE\r\n",
+    b"^L\r\nAA,0,0,9999,9999,0,0,X\r\nE\r\n",
+    b"N\r\nB0,0,0,1,999,6,80,N,\"1\"\r\nP1\r\n",
+    b"^L\r\nW0,0,5,2,M,8,5,9999,0\r\n" + b"x" * 9999 + b"\r\nE\r\n",
+    b"^L\r\nW0,0,5,2,M,8,999,1,0\r\nx\r\nE\r\n",
+], ids=["numeros", "grafico", "gw", "etiqueta", "texto", "barras", "qr", "modulo"])
+def test_malformed_or_oversized_commands_are_refused(payload):
+    with pytest.raises(InvalidCommand):
+        LabelRenderer().render(payload)
+
+
+@pytest.mark.parametrize("field, value", [
+    ("seccion", "x\nLo,a,b,c,d"),
+    ("seccion", "x\nQ1,1,99999,99999"),
+    ("qr", "x" * 5000),
+])
+def test_preview_refuses_bad_input_with_a_4xx(field, value):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app.app) as client:
+        r = client.get("/print/preview", params={**TICKET, field: value})
+    assert r.status_code == 422
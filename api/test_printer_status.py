@@ -0,0 +1,40 @@
+import pytest
+
+from printer_status import (PRINTER_STATUS_BUSY, PRINTER_STATUS_DOOR_OPEN, PRINTER_STATUS_ERROR,
+                            PRINTER_STATUS_OFFLINE, PRINTER_STATUS_PAPER_OUT,
+                            PRINTER_STATUS_PAUSED, PRINTER_STATUS_PRINTING,
+                            PRINTER_STATUS_PROCESSING, PRINTER_STATUS_USER_INTERVENTION,
+                            decode_spooler_status)
+
+# Banderas que no son un fallo: WARMING_UP, TONER_LOW, POWER_SAVE
+_WARMING_UP, _TONER_LOW, _POWER_SAVE = 0x00010000, 0x00020000, 0x01000000
+
+
+@pytest.mark.parametrize("flags", [0, PRINTER_STATUS_BUSY, PRINTER_STATUS_PRINTING,
+                                   PRINTER_STATUS_PROCESSING | PRINTER_STATUS_PRINTING,
+                                   _WARMING_UP, _TONER_LOW, _POWER_SAVE])
+def test_busy_printer_is_ready(flags):
+    status = decode_spooler_status("BP500", flags, queue_depth=3)
+    assert status.ready
+    assert not (status.paused or status.paper_out or status.offline or status.error)
+
+
+@pytest.mark.parametrize("flags, field", [
+    (PRINTER_STATUS_PAUSED, "paused"),
+    (PRINTER_STATUS_ERROR, "error"),
+    (PRINTER_STATUS_USER_INTERVENTION, "error"),
+    (PRINTER_STATUS_OFFLINE, "offline"),
+    (PRINTER_STATUS_PAPER_OUT | PRINTER_STATUS_PRINTING, "paper_out"),
+    (PRINTER_STATUS_DOOR_OPEN, "head_open"),
+])
+def test_fault_makes_printer_not_ready(flags, field):
+    status = decode_spooler_status("BP500", flags)
+    assert not status.ready
+    assert getattr(status, field)
+
+
+def test_messages():
+    assert decode_spooler_status("BP500", 0).message == "Lista"
+    assert decode_spooler_status("BP500", PRINTER_STATUS_PRINTING).message == "Imprimiendo"
+    status = decode_spooler_status("BP500", PRINTER_STATUS_PAPER_OUT | PRINTER_STATUS_BUSY)
+    assert status.message == "Sin papel"
@@ -0,0 +1,82 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from connections import NotSent
+from emulator import PrinterEngine, TcpPrinterEmulator
+from scheduler import NoPrinterAvailable, PrinterScheduler
+from transports import TransportRegistry
+
+LABEL = b"^L\r\nAA,10,10,1,1,0,0,PRUEBA\r\nE\r\n"
+
+
+def _scheduler(failures):
+    """Grupo "G" de A y B; `failures` dice qué excepción lanza cada impresora"""
+    sent = []
+
+    async def send(data, printer_name):
+        sent.append(printer_name)
+        error = failures.get(printer_name)
+        if error is not None:
+            raise error
+
+    scheduler = PrinterScheduler(send, retry_after=60)
+    scheduler.configure_group("G", ["A", "B"])
+    return scheduler, sent
+
+
+def test_fails_over_when_nothing_was_sent():
+    scheduler, sent = _scheduler({"A": NotSent("Sin conexión")})
+    # Sin mediciones, A y B empatan: se prueba A primero
+    assert asyncio.run(scheduler.send(b"x", "G")) == "B"
+    assert sent == ["A", "B"]
+    assert not scheduler.stats("A").is_up(time.monotonic())
+    assert scheduler.stats("A").last_error == "Sin conexión"
+
+
+@pytest.mark.parametrize("error", [asyncio.TimeoutError(), ConnectionResetError("reset"),
+                                   RuntimeError("WritePrinter")])
+def test_partial_write_is_not_resent(error):
+    scheduler, sent = _scheduler({"A": error})
+    with pytest.raises(type(error)):
+        asyncio.run(scheduler.send(b"x", "G"))
+    # B no recibe el trabajo: A pudo imprimir una parte (o todo)
+    assert sent == ["A"]
+
+
+def test_every_member_unreachable_raises_the_last_error():
+    scheduler, sent = _scheduler({"A": NotSent("A caída"), "B": NotSent("B caída")})
+    with pytest.raises(NotSent, match="B caída"):
+        asyncio.run(scheduler.send(b"x", "G"))
+    with pytest.raises(NoPrinterAvailable):
+        asyncio.run(scheduler.send(b"x", "G"))
+
+
+def test_tcp_group_prints_once_on_the_reachable_member():
+    emulator = TcpPrinterEmulator(PrinterEngine(labels_per_second=1000, capture=True))
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        closed_port = s.getsockname()[1]
+    registry = TransportRegistry(lambda name: None)
+    registry.load(f"CAIDA=tcp://127.0.0.1:{closed_port}?connect_timeout=1,VIVA={emulator.uri}")
+
+    async def send(data, printer_name):
+        await registry.get(printer_name).send(data)
+
+    scheduler = PrinterScheduler(send)
+    scheduler.configure_group("G", ["CAIDA", "VIVA"])
+
+    async def run():
+        try:
+            return await scheduler.send(LABEL, "G")
+        finally:
+            await registry.close()
+
+    try:
+        assert asyncio.run(run()) == "VIVA"
+        assert emulator.engine.wait_printed(1, timeout=5)
+        assert bytes(emulator.engine.captured) == LABEL
+    finally:
+        emulator.close()
@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+import pytest
+
+serial = pytest.importorskip("serial")
+pytest.importorskip("pty")
+
+from connections import STATUS_REQUEST, STATUS_TERMINATOR, read_serial_response  # noqa: E402
+from emulator import PrinterEngine, SerialPrinterEmulator  # noqa: E402
+from GodexPrinter import GodexPrinterManager  # noqa: E402
+from transports import BlockingTransport, TransportRegistry  # noqa: E402
+
+LABEL = "N\nA10,10,0,3,1,1,N,\"PRUEBA\"\nP1\n"
+
+
+def _emulator(**engine_options) -> SerialPrinterEmulator:
+    options = {"labels_per_second": 1000, **engine_options}
+    return SerialPrinterEmulator(PrinterEngine(**options))
+
+
+@pytest.fixture
+def printer():
+    emulator = _emulator()
+    yield emulator
+    emulator.close()
+
+
+@pytest.fixture
+def slow_printer():
+    # Contesta el status 0.3 s después de recibirlo
+    emulator = _emulator(reply_delay=0.3)
+    yield emulator
+    emulator.close()
+
+
+def _manager(emulator, **options) -> GodexPrinterManager:
+    manager = GodexPrinterManager(**options)
+    assert manager.connect_serial(emulator.port)
+    return manager
+
+
+def test_status_is_read_as_soon_as_it_arrives(slow_printer):
+    port = serial.Serial(slow_printer.port, timeout=5)
+    try:
+        port.write(STATUS_REQUEST)
+        started = time.monotonic()
+        response = read_serial_response(port, 32, timeout=3, terminator=STATUS_TERMINATOR)
+        elapsed = time.monotonic() - started
+    finally:
+        port.close()
+    assert response == b"00\r\n"
+    assert 0.25 < elapsed < 1.0
+
+
+def test_silent_printer_times_out():
+    emulator = _emulator(status_code=None)
+    port = serial.Serial(emulator.port, timeout=5)
+    try:
+        port.write(STATUS_REQUEST)
+        started = time.monotonic()
+        assert read_serial_response(port, 32, timeout=0.3) == b""
+        assert time.monotonic() - started < 1.0
+        # Devuelve el timeout que tenía el puerto
+        assert port.timeout == 5
+    finally:
+        port.close()
+        emulator.close()
+
+
+def test_get_status_decodes_the_reply(slow_printer):
+    manager = _manager(slow_printer, verify_status=False)
+    try:
+        started = time.monotonic()
+        status = manager.get_status()
+        assert time.monotonic() - started < 1.0
+    finally:
+        manager.disconnect()
+    assert status.ready and not status.error
+
+
+def test_send_does_not_wait_for_the_status(slow_printer):
+    # Sin esperas fijas: 10 trabajos con verificación en segundo plano no
+    # cuestan 10 x 0.5 s ni 10 x la demora de la respuesta
+    manager = _manager(slow_printer, verify_status=True, async_verify=True)
+    try:
+        started = time.monotonic()
+        for _ in range(10):
+            assert manager.send_epl_command(LABEL)
+        elapsed = time.monotonic() - started
+        assert slow_printer.engine.wait_printed(10, timeout=5)
+    finally:
+        manager.disconnect()
+    assert elapsed < 1.0
+    # Las verificaciones pendientes se juntan en lugar de encolarse una por trabajo
+    assert 1 <= slow_printer.engine.status_requests < 10
+
+
+def test_synchronous_verification_waits_only_for_the_reply(slow_printer):
+    manager = _manager(slow_printer, verify_status=True, async_verify=False)
+    try:
+        started = time.monotonic()
+        assert manager.send_epl_command(LABEL)
+        elapsed = time.monotonic() - started
+    finally:
+        manager.disconnect()
+    assert slow_printer.engine.status_requests == 1
+    assert 0.25 < elapsed < 1.0
+
+
+def test_serial_transport_sends_and_probes(printer):
+    registry = TransportRegistry(lambda name: BlockingTransport(lambda data: None))
+    registry.configure("COM", f"{printer.uri}?baudrate=115200")
+
+    async def run():
+        transport = registry.get("COM")
+        try:
+            await transport.send(LABEL.encode("ascii") * 3)
+            return await transport.probe("COM")
+        finally:
+            await registry.close()
+
+    status = asyncio.run(run())
+    assert printer.engine.wait_printed(3, timeout=5)
+    assert status.ready
+    assert status.printer_name == "COM"
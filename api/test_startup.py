@@ -0,0 +1,106 @@
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import pytest
+
+import backends
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+# Los mismos presupuestos que `python bench.py startup`
+IMPORT_BUDGET = float(os.getenv("STARTUP_IMPORT_BUDGET", "1.0"))
+COLD_START_BUDGET = float(os.getenv("STARTUP_COLD_START_BUDGET", "2.0"))
+# Backends de impresora y dependencias que solo usan algunos endpoints
+LAZY_MODULES = ("serial", "win32print", "win32api", "numpy", "PIL", "qrcode", "barcode")
+
+_PROBE = """
+import json, logging, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"seconds": elapsed,
+                   "loaded": [m for m in {lazy!r} if m in sys.modules],
+                   "root_handlers": len(logging.getLogger().handlers)}}))
+"""
+
+
+@pytest.fixture(scope="module")
+def env(tmp_path_factory):
+    data = tmp_path_factory.mktemp("startup")
+    return {**os.environ, "DISCOVERY_WARMUP": "0",
+            "JOB_JOURNAL": str(data / "print_jobs.db"),
+            "ITEMS_DB": f"sqlite:///{data / 'items.db'}"}
+
+
+def _import(module: str, env) -> dict:
+    run = subprocess.run([sys.executable, "-c", _PROBE.format(module=module, lazy=LAZY_MODULES)],
+                         cwd=API_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(run.stdout)
+
+
+def test_app_import_loads_no_backend_and_fits_the_budget(env):
+    runs = [_import("app", env) for _ in range(3)]
+    assert [r["loaded"] for r in runs] == [[], [], []]
+    assert statistics.median(r["seconds"] for r in runs) <= IMPORT_BUDGET
+
+
+def test_godex_import_loads_no_backend_nor_configures_logging(env):
+    result = _import("GodexPrinter", env)
+    assert result["loaded"] == []
+    assert result["root_handlers"] == 0
+
+
+def test_cold_start_first_response(env):
+    pytest.importorskip("uvicorn")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--port", str(port),
+                               "--log-level", "warning"],
+                              cwd=API_DIR, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        elapsed = None
+        while time.perf_counter() - started < 30 and server.poll() is None:
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=1) as sock:
+                    sock.sendall(b"GET /openapi.json HTTP/1.1\r\nHost: test\r\n\r\n")
+                    if sock.recv(12).startswith(b"HTTP/1.1 200"):
+                        elapsed = time.perf_counter() - started
+                        break
+            except OSError:
+                time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait(30)
+    assert elapsed is not None, "la API no respondió"
+    assert elapsed <= COLD_START_BUDGET
+
+
+@pytest.mark.skipif(platform.system() == "Windows", reason="win32print existe en Windows")
+def test_spooler_backend_is_optional_off_windows():
+    assert backends.load("spooler") is None
+    with pytest.raises(RuntimeError, match="win32print"):
+        backends.require("spooler")
+
+
+def test_install_replaces_a_backend():
+    previous = backends.load("spooler")
+    fake = object()
+    try:
+        backends.install("spooler", fake)
+        assert backends.require("spooler") is fake
+        assert "spooler" in backends.loaded()
+    finally:
+        backends.install("spooler", previous)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        backends.load("parallel")
@@ -0,0 +1,93 @@
+import os
+import shutil
+
+import pytest
+
+from stored_forms import FormRegistry
+from template_registry import DEFAULT_DIRECTORY, TemplateRegistry
+
+VALUES = {"seccion": "GENERAL", "orden": "1A2B3C4D", "precio": "300", "tipo": "PREVENTA",
+          "fila": "1", "asiento": "1", "qr": "https://eventonist.com/checkin/?id=1", "qr_len": "39"}
+
+
+@pytest.fixture
+def directory(tmp_path):
+    path = tmp_path / "templates"
+    shutil.copytree(DEFAULT_DIRECTORY, path)
+    return path
+
+
+def _edit(path, old, new):
+    text = path.read_text().replace(old, new)
+    path.write_text(text)
+    # Otro tamaño o mtime: la firma del directorio cambia aunque sea en el mismo ns
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+
+def test_load_registers_every_form(directory):
+    forms = FormRegistry()
+    templates = TemplateRegistry(str(directory), forms=forms)
+    templates.reload()
+    ticket = templates["ticket"]
+    assert ticket.form.name.startswith("TICKET")
+    assert ticket.seats_form.name.startswith("SEATS")
+    for name in templates.names():
+        for form in templates[name].forms:
+            assert forms.get(form.name) is form
+            assert len(form.name) <= form.dialect.max_name
+
+
+def test_sender_without_renderer_finds_the_download(directory):
+    # El despachador carga el mismo directorio pero nunca renderiza un ticket
+    renderer = TemplateRegistry(str(directory), forms=FormRegistry())
+    renderer.reload()
+    dispatcher_forms = FormRegistry()
+    TemplateRegistry(str(directory), forms=dispatcher_forms).reload()
+
+    seats = renderer["ticket"].seats_form
+    payload = seats.recall(VALUES, labels=4)
+    assert dispatcher_forms.match(payload) == [dispatcher_forms.get(seats.name)]
+    prepared = dispatcher_forms.prepare("EMU", payload)
+    assert prepared == seats.download + payload
+
+
+def test_reload_versions_the_form_name(directory):
+    forms = FormRegistry()
+    templates = TemplateRegistry(str(directory), forms=forms)
+    templates.reload()
+    old = templates["ticket"].form
+    queued = old.recall(VALUES)
+
+    _edit(directory / "ticket.ezpl", "VD,", "VC,")
+    assert templates.reload()
+    new = templates["ticket"].form
+    assert new.name != old.name
+    assert new.name.startswith("TICKET")
+    # Lo encolado antes del cambio sigue llevando la descarga de su versión
+    assert forms.match(queued) == [old]
+    assert forms.match(new.recall(VALUES)) == [new]
+
+
+def test_same_version_keeps_the_name(directory):
+    first = TemplateRegistry(str(directory))
+    first.reload()
+    second = TemplateRegistry(str(directory))
+    second.reload()
+    assert first["ticket"].form.name == second["ticket"].form.name
+    assert first["57x70_standard"].form.name == second["57x70_standard"].form.name
+
+
+def test_unknown_recall_refreshes_the_registry(directory):
+    # Un worker ya cargó la versión nueva; el despachador todavía no
+    dispatcher_forms = FormRegistry()
+    dispatcher = TemplateRegistry(str(directory), forms=dispatcher_forms)
+    dispatcher_forms.refresh = dispatcher.reload
+    dispatcher.reload()
+
+    _edit(directory / "ticket.ezpl", "VD,", "VC,")
+    worker = TemplateRegistry(str(directory))
+    worker.reload()
+    form = worker["ticket"].form
+    assert dispatcher_forms.get(form.name) is None
+    assert [f.name for f in dispatcher_forms.match(form.recall(VALUES))] == [form.name]
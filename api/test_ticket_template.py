@@ -0,0 +1,161 @@
+import json
+
+import pytest
+from pydantic import ValidationError
+
+import app
+from ticket_template import CompiledTemplate, adaptar_codigo
+
+
+def _adaptar_codigo(codigo_original: str) -> str:
+    lineas = codigo_original.strip().split("\n")
+    return "".join(f"{ln.strip()}\r\n" for ln in lineas if ln.strip())
+
+
+def _legacy_ticket(pr) -> bytes:
+    """El f-string de app.py antes de las plantillas, con el envío de entonces"""
+    raw = f"""
+^Q140,0,0
+^W57
+^H5
+^P1
+^S2
+^AD
+^C1
+^R0
+~Q+0
+^O0
+^D0
+^E12
+~R255
+^XSET,ROTATION,0
+^L
+Dy2-me-dd
+Th:m:s
+Y192,464,WindowText25-14
+Y46,286,WindowText22-5
+Y143,315,WindowText20-33
+Y210,264,WindowText18-68
+Y267,335,WindowText16-10
+Y334,269,WindowText14-76
+Y69,466,WindowText12-94
+Y166,489,WindowText11-37
+Y45,934,WindowText10-2
+Y142,963,WindowText9-96
+Y209,912,WindowText8-9
+Y266,983,WindowText7-8
+Y333,917,WindowText6-7
+W213,212,5,2,M,8,5,55,3
+https://eventonist.com/checkin/?id=MTMzNS0xMzIxLTUxN1Qw
+VD,67,376,1,1,0,3E,{pr.precio}
+VD,169,396,1,1,0,3E,{pr.orden}
+VD,234,397,1,1,0,3E,{pr.seccion}
+VD,291,397,1,1,0,3E,{pr.fila}
+VD,358,397,1,1,0,3E,{pr.asiento}
+VD,66,1024,1,1,0,3E,{pr.precio}
+VD,168,1044,1,1,0,3E,{pr.orden}
+VD,233,1045,1,1,0,3E,{pr.seccion}
+VD,290,1045,1,1,0,3E,{pr.fila}
+VD,357,1045,1,1,0,3E,{pr.asiento}
+Lo,4,864,452,875
+E
+"""
+    return _adaptar_codigo(raw).encode("ascii", errors="ignore")
+
+
+TICKET = {"seccion": "GENERAL", "orden": "1A2B3C4D", "precio": "300", "tipo": "PREVENTA",
+          "fila": "1", "asiento": "1"}
+
+# Comillas, acentos, vacíos, espacios en los bordes y llaves
+TRICKY = ['"', 'Fila "A"', "'", "", " ", "  300 ", "é", " ñ ", "SECCIÓN ÑANDÚ",
+          "{}", "{precio}", "€ 1.500"]
+# Partirían la línea y añadirían comandos a la impresora
+LINE_BREAKS = ["a\nb", "x\r", "\n", "1\r\n~MDELF", "\r\n^C9999\r\n"]
+FIELDS = ["seccion", "orden", "precio", "tipo", "fila", "asiento"]
+
+
+def test_build_ticket_matches_legacy():
+    pr = app.PrintRequest(**TICKET)
+    assert app._build_ticket(pr) == _legacy_ticket(pr)
+
+
+@pytest.mark.parametrize("field", FIELDS)
+@pytest.mark.parametrize("value", TRICKY)
+def test_build_ticket_matches_legacy_tricky(field, value):
+    pr = app.PrintRequest(**{**TICKET, field: value})
+    assert app._build_ticket(pr) == _legacy_ticket(pr)
+
+
+def test_build_ticket_matches_legacy_all_empty():
+    pr = app.PrintRequest(**{field: "" for field in FIELDS})
+    assert app._build_ticket(pr) == _legacy_ticket(pr)
+
+
+@pytest.mark.parametrize("field", FIELDS + ["qr", "template"])
+@pytest.mark.parametrize("value", LINE_BREAKS + ["\t1A", "\x00", "\x1b", "\x7f"])
+def test_control_characters_are_refused(field, value):
+    with pytest.raises(ValidationError, match="control characters"):
+        app.PrintRequest(**{**TICKET, field: value})
+
+
+@pytest.mark.parametrize("field", FIELDS)
+def test_field_length_is_bounded(field):
+    with pytest.raises(ValidationError):
+        app.PrintRequest(**{**TICKET, field: "9" * 41})
+
+
+def test_print_endpoints_refuse_injected_commands():
+    from fastapi.testclient import TestClient
+
+    injected = {**TICKET, "seccion": "GENERAL\r\n~MDELF"}
+    with TestClient(app.app) as client:
+        assert client.post("/print", json=injected).status_code == 422
+        assert client.post("/print/batch", json={"tickets": [TICKET, injected]}).status_code == 422
+        r = client.post("/print/import", content=json.dumps(injected) + "\n",
+                        headers={"Content-Type": "application/x-ndjson"})
+        summary = json.loads(r.text.splitlines()[-1])["summary"]
+        assert (summary["ok"], summary["errors"]) == (0, 1)
+
+
+@pytest.mark.parametrize("value", TRICKY + ["\t1A\t", " \t"])
+def test_compiled_template_matches_format(value):
+    template = app.ticket_templates["ticket"]
+    source = template.setup_source + template.source
+    compiled = CompiledTemplate(source)
+    values = {**app._ticket_values(app.TicketFields(**TICKET)), "precio": value, "qr": value}
+    expected = adaptar_codigo(source.format_map(values)).encode("ascii", errors="ignore")
+    assert compiled.render(values) == expected
+
+
+@pytest.mark.parametrize("value", LINE_BREAKS)
+def test_compiled_template_refuses_line_breaks(value):
+    template = app.ticket_templates["ticket"]
+    compiled = CompiledTemplate(template.source)
+    values = app._ticket_values(app.TicketFields(**TICKET))
+    for field in ("precio", "qr"):
+        with pytest.raises(ValueError, match="Salto de línea"):
+            compiled.render({**values, field: value})
+
+
+def test_qr_length_is_bounded():
+    longest = "x" * app.QR_MAX_LENGTH
+    assert app.PrintRequest(**TICKET, qr=longest).qr == longest
+    with pytest.raises(ValidationError):
+        app.PrintRequest(**TICKET, qr=longest + "x")
+
+
+def test_longest_qr_can_be_rasterized():
+    pytest.importorskip("qrcode")
+    from graphics import qr_modules
+
+    for level in "LMQH":
+        assert len(qr_modules("é" * app.QR_MAX_LENGTH, level)) <= 4 * 40 + 17
+
+
+def test_over_long_qr_is_a_422():
+    from fastapi.testclient import TestClient
+
+    with TestClient(app.app) as client:
+        qr = "x" * 5000
+        assert client.post("/print", json={**TICKET, "qr": qr}).status_code == 422
+        assert client.get("/print/preview", params={**TICKET, "qr": qr}).status_code == 422
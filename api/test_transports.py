@@ -0,0 +1,240 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from connections import NotSent
+from emulator import PrinterEngine, TcpPrinterEmulator
+from transports import BlockingTransport, TcpTransport, TransportRegistry
+
+LABEL = b"^L\r\nAA,10,10,1,1,0,0,PRUEBA\r\nE\r\n"
+
+
+@pytest.fixture
+def printer():
+    emulator = TcpPrinterEmulator(PrinterEngine(labels_per_second=1000, capture=True))
+    yield emulator
+    emulator.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_send_reaches_the_printer_unchanged(printer):
+    async def run():
+        transport = TcpTransport(printer.host, printer.port)
+        try:
+            for _ in range(3):
+                await transport.send(LABEL)
+        finally:
+            await transport.close()
+
+    asyncio.run(run())
+    assert printer.engine.wait_printed(3, timeout=5)
+    assert bytes(printer.engine.captured) == LABEL * 3
+    assert printer.engine.labels_received == 3
+
+
+def test_one_connection_for_many_jobs(printer):
+    async def run():
+        transport = TcpTransport(printer.host, printer.port)
+        try:
+            await asyncio.gather(*(transport.send(LABEL) for _ in range(20)))
+        finally:
+            await transport.close()
+
+    asyncio.run(run())
+    assert printer.engine.wait_printed(20, timeout=5)
+    # Los envíos concurrentes no se intercalan: cada etiqueta llega entera
+    assert bytes(printer.engine.captured) == LABEL * 20
+    assert len(printer._clients) == 1
+
+
+def test_probe_does_not_wait_for_a_send(printer):
+    async def run():
+        transport = TcpTransport(printer.host, printer.port)
+        try:
+            await transport.send(LABEL)
+            # Un envío atascado tiene el lock de la conexión: el sondeo no lo espera
+            async with transport._lock:
+                status = await asyncio.wait_for(transport.probe("RED"), 1)
+            await transport.send(LABEL)
+            return status
+        finally:
+            await transport.close()
+
+    status = asyncio.run(run())
+    assert status.ready
+    assert printer.engine.wait_printed(2, timeout=5)
+    assert bytes(printer.engine.captured) == LABEL + b"\x02" + LABEL
+
+
+def test_late_status_reply_is_not_read_by_the_next_probe():
+    engine = PrinterEngine(labels_per_second=1000, reply_delay=0.5)
+    emulator = TcpPrinterEmulator(engine)
+
+    async def run():
+        transport = TcpTransport(emulator.host, emulator.port, probe_timeout=0.2)
+        late = await transport.probe("RED")
+        # Impresora con papel agotado: el siguiente sondeo debe verlo, no el "00" tardío
+        engine.reply_delay, engine.status_code = 0, "02"
+        fresh = await transport.probe("RED")
+        probe = asyncio.create_task(transport.probe("RED"))
+        await asyncio.sleep(0)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        return late, fresh
+
+    try:
+        late, fresh = asyncio.run(run())
+    finally:
+        emulator.close()
+    assert late.message == "Sin respuesta de status"
+    assert fresh.paper_out and not fresh.ready
+    assert engine.status_requests >= 2
+
+
+def test_reconnects_after_the_printer_closes(printer):
+    async def run():
+        transport = TcpTransport(printer.host, printer.port)
+        try:
+            await transport.send(LABEL)
+            assert printer.engine.wait_printed(1, timeout=5)
+            for client in printer._clients:
+                client.shutdown(socket.SHUT_RDWR)
+            # El cierre llega como EOF al lector de la conexión
+            for _ in range(100):
+                if not transport._is_connected():
+                    break
+                await asyncio.sleep(0.01)
+            await transport.send(LABEL)
+        finally:
+            await transport.close()
+
+    asyncio.run(run())
+    assert printer.engine.wait_printed(2, timeout=5)
+    assert len(printer._clients) == 2
+
+
+def test_unreachable_printer_raises():
+    async def run():
+        transport = TcpTransport("127.0.0.1", _free_port(), connect_timeout=1)
+        # Nada llegó a escribirse: se puede reintentar en otra impresora
+        with pytest.raises(NotSent):
+            await transport.send(LABEL)
+        assert transport._writer is None
+
+    asyncio.run(run())
+
+
+def test_connect_timeout():
+    async def run():
+        # 192.0.2.0/24 (TEST-NET-1) no responde: el connect no termina
+        transport = TcpTransport("192.0.2.1", 9100, connect_timeout=0.2)
+        started = time.monotonic()
+        with pytest.raises(NotSent):
+            await transport.send(LABEL)
+        assert time.monotonic() - started < 2
+
+    asyncio.run(run())
+
+
+def test_nodelay_is_set(printer):
+    async def run():
+        transport = TcpTransport(printer.host, printer.port)
+        try:
+            await transport.send(LABEL)
+            sock = transport._writer.get_extra_info("socket")
+            return sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        finally:
+            await transport.close()
+
+    assert asyncio.run(run())
+
+
+def test_registry_selects_transport_by_uri():
+    registry = TransportRegistry(lambda name: BlockingTransport(lambda data: None))
+    registry.load("RED=tcp://10.0.0.21:9101?connect_timeout=2&write_timeout=3&probe_timeout=1, "
+                  "OTRA=tcp://10.0.0.22")
+    red = registry.get("RED")
+    assert isinstance(red, TcpTransport)
+    assert (red.host, red.port, red.connect_timeout, red.write_timeout, red.probe_timeout) == \
+        ("10.0.0.21", 9101, 2, 3, 1)
+    assert registry.get("OTRA").port == 9100
+    assert registry.get("RED") is red
+    # Sin URI: el transporte por defecto (spooler)
+    assert isinstance(registry.get("BP500"), BlockingTransport)
+    assert sorted(registry.printers()) == ["OTRA", "RED"]
+    with pytest.raises(ValueError):
+        registry.load("MALA")
+    registry.configure("X", "ftp://host")
+    with pytest.raises(ValueError):
+        registry.get("X")
+
+
+def test_godex_manager_prints_over_the_network(printer):
+    from GodexPrinter import GodexPrinterManager
+
+    manager = GodexPrinterManager(verify_status=False)
+    try:
+        assert manager.connect_network(printer.host, printer.port)
+        assert manager.print_57x70_ticket({"name": "Agua", "price": "10.00"}, "compact")
+        assert printer.engine.wait_printed(1, timeout=5)
+        assert b"Agua" in bytes(printer.engine.captured)
+    finally:
+        manager.disconnect()
+
+
+def test_print_endpoint_sends_over_tcp(printer):
+    from fastapi.testclient import TestClient
+
+    import app
+
+    app.printer_transports.configure("RED", printer.uri)
+    with TestClient(app.app) as client:
+        r = client.post("/print", json={"seccion": "GENERAL", "orden": "1A2B3C4D", "precio": "300",
+                                        "tipo": "PREVENTA", "fila": "1", "asiento": "7",
+                                        "printer_name": "RED"})
+        assert r.status_code == 202
+        job_id = r.json()["job_id"]
+        assert printer.engine.wait_printed(1, timeout=10)
+        for _ in range(100):
+            if client.get(f"/jobs/{job_id}").json()["status"] == "done":
+                break
+            time.sleep(0.05)
+        assert client.get(f"/jobs/{job_id}").json()["status"] == "done"
+    assert bytes(printer.engine.captured) == app._build_ticket(
+        app.PrintRequest(seccion="GENERAL", orden="1A2B3C4D", precio="300", tipo="PREVENTA",
+                         fila="1", asiento="7"))
+
+
+def test_unknown_printer_is_refused_before_queueing():
+    from fastapi.testclient import TestClient
+
+    import app
+    from admission import AdmissionController
+
+    ticket = {"seccion": "GENERAL", "orden": "1A2B3C4D", "precio": "300", "tipo": "PREVENTA",
+              "fila": "1", "asiento": "7"}
+    app.print_queue.admission = AdmissionController(60, default_rate=10)
+    try:
+        with TestClient(app.app) as client:
+            watched = app.printer_status.watched()
+            for i in range(3):
+                r = client.post("/print", json={**ticket, "printer_name": f"NOPE-{i}"})
+                assert r.status_code == 404
+            r = client.post("/print/batch", json={"tickets": [ticket], "printer_name": "NOPE"})
+            assert r.status_code == 404
+            # Ni el sondeo de estado, ni los transportes, ni la admisión ven los nombres
+            assert app.printer_status.watched() == watched
+            assert not [name for name in app.printer_transports._transports
+                        if name.startswith("NOPE")]
+            assert list(app.print_queue.admission.all_loads()) == []
+            assert app.print_queue.depth() == 0
+    finally:
+        app.print_queue.admission = None
@@ -0,0 +1,146 @@
+"""Plantillas EZPL/EPL precompiladas.
+
+La plantilla se normaliza (como `adaptar_codigo`) y se codifica a ASCII una
+sola vez; renderizar un ticket solo codifica los valores de los campos y los
+intercala entre los segmentos ya codificados con un único `b"".join`.
+
+Los campos se escriben como en `str.format` (`{precio}`); `{{` y `}}` son
+llaves literales. El resultado es idéntico byte a byte a
+`adaptar_codigo(plantilla.format(**valores)).encode("ascii", errors="ignore")`.
+
+Un valor con CR o LF se rechaza (ValueError): cada línea es un comando de la
+impresora, así que partirla añadiría comandos que no están en la plantilla.
+"""
+import string
+from typing import Any, List, Mapping, Optional, Tuple
+
+_formatter = string.Formatter()
+
+# Cómo recortar el valor de un campo que toca el borde de su línea
+_STRIP_NONE = 0
+_STRIP_LEFT = 1
+_STRIP_RIGHT = 2
+_STRIP_BOTH = 3
+
+
+def adaptar_codigo(codigo_original: str) -> str:
+    """Recorta cada línea, descarta las vacías y termina cada una en CRLF"""
+    lineas = codigo_original.strip().split("\n")
+    return "".join(f"{ln.strip()}\r\n" for ln in lineas if ln.strip())
+
+
+def _encode(value: str) -> bytes:
+    return value.encode("ascii", errors="ignore")
+
+
+def _line_break(field: str) -> ValueError:
+    return ValueError(f"Salto de línea en el valor de {field}")
+
+
+class CompiledTemplate:
+    def __init__(self, source: str):
+        self.source = source
+        # Partes del resultado: bytes fijos, o None donde va un valor
+        self._parts: List[Optional[bytes]] = []
+        # (índice en _parts, campo, recorte) para líneas con texto fijo a los lados;
+        # (índice, None, (línea, campos)) para líneas que hay que formatear y recortar enteras
+        self._slots: List[Tuple[int, Optional[str], Any]] = []
+        fields = []
+
+        for line in source.split("\n"):
+            pieces = self._parse_line(line)
+            names = [p[1] for p in pieces if p[0] == "field"]
+            for name in names:
+                if name not in fields:
+                    fields.append(name)
+            if not names:
+                text = line.strip()
+                if text:
+                    self._append_static(_encode(text) + b"\r\n")
+            elif self._has_fixed_edges(pieces):
+                self._compile_line(pieces)
+            else:
+                self._slots.append((len(self._parts), None, (line, tuple(names))))
+                self._parts.append(None)
+
+        self.fields: Tuple[str, ...] = tuple(fields)
+
+    @staticmethod
+    def _parse_line(line: str) -> List[Tuple[str, str]]:
+        pieces = []
+        for literal, name, spec, conversion in _formatter.parse(line):
+            if literal:
+                pieces.append(("text", literal))
+            if name is not None:
+                if not name.isidentifier() or spec or conversion:
+                    raise ValueError(f"Campo de plantilla no soportado: {{{name}}}")
+                pieces.append(("field", name))
+        # Los blancos fijos de los bordes siempre se recortan
+        if pieces and pieces[0][0] == "text":
+            pieces[0] = ("text", pieces[0][1].lstrip())
+        if pieces and pieces[-1][0] == "text":
+            pieces[-1] = ("text", pieces[-1][1].rstrip())
+        return [p for p in pieces if p[1]]
+
+    @staticmethod
+    def _has_fixed_edges(pieces: List[Tuple[str, str]]) -> bool:
+        """True si recortar la línea solo puede afectar a los campos de los bordes.
+
+        Un campo en un borde debe ir pegado a texto fijo que no acabe en blanco;
+        si no, un valor vacío dejaría expuestos blancos fijos que `strip` quitaría.
+        """
+        texts = [p[1] for p in pieces if p[0] == "text"]
+        if not any(t.strip() for t in texts):
+            return False
+        if pieces[0][0] == "field":
+            if len(pieces) < 2 or pieces[1][0] != "text" or pieces[1][1][:1].isspace():
+                return False
+        if pieces[-1][0] == "field":
+            if len(pieces) < 2 or pieces[-2][0] != "text" or pieces[-2][1][-1:].isspace():
+                return False
+        return True
+
+    def _compile_line(self, pieces: List[Tuple[str, str]]) -> None:
+        last = len(pieces) - 1
+        for i, (kind, value) in enumerate(pieces):
+            if kind == "text":
+                self._append_static(_encode(value))
+            else:
+                strip = _STRIP_NONE
+                if i == 0:
+                    strip |= _STRIP_LEFT
+                if i == last:
+                    strip |= _STRIP_RIGHT
+                self._slots.append((len(self._parts), value, strip))
+                self._parts.append(None)
+        self._append_static(b"\r\n")
+
+    def _append_static(self, data: bytes) -> None:
+        if self._parts and self._parts[-1] is not None:
+            self._parts[-1] += data
+        elif data:
+            self._parts.append(data)
+
+    def render(self, values: Mapping[str, Any]) -> bytes:
+        parts = self._parts[:]
+        for index, name, mode in self._slots:
+            if name is None:
+                line, names = mode
+                for field in names:
+                    value = str(values[field])
+                    if "\n" in value or "\r" in value:
+                        raise _line_break(field)
+                text = line.format_map(values).strip()
+                parts[index] = _encode(text) + b"\r\n" if text else b""
+                continue
+            value = str(values[name])
+            if "\n" in value or "\r" in value:
+                raise _line_break(name)
+            if mode == _STRIP_RIGHT:
+                value = value.rstrip()
+            elif mode == _STRIP_LEFT:
+                value = value.lstrip()
+            elif mode == _STRIP_BOTH:
+                value = value.strip()
+            parts[index] = _encode(value)
+        return b"".join(parts)
@@ -0,0 +1,230 @@
+"""Capa de transporte seleccionable por impresora.
+
+Cada impresora se asocia a una URI de transporte:
+
+    tcp://10.0.0.21:9100          socket RAW (JetDirect) con asyncio
+    serial:///dev/ttyUSB0?baudrate=9600&flow=rtscts
+    serial:COM3?flow=xonxoff&write_timeout=60
+    spooler:BP500                 spooler de Windows (win32print)
+
+Las impresoras sin URI configurada usan el transporte por defecto (spooler),
+así que los nombres existentes como "BP500" siguen funcionando. En serial,
+`flow` elige el control de flujo (none, rtscts o xonxoff; ver
+connections.SerialConnection). En tcp, `probe_timeout` acota la espera de la
+respuesta de status (2 s por defecto).
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import socket
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from connections import (STATUS_REQUEST, STATUS_TERMINATOR, ConnectionPool, NotSent,
+                         SerialConnection)
+from printer_status import PrinterStatus, decode_godex_status, offline_status
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RAW_PORT = 9100
+
+
+class Transport:
+    async def send(self, data: bytes) -> None:
+        raise NotImplementedError
+
+    async def probe(self, printer_name: str) -> PrinterStatus:
+        """Consulta el estado real de la impresora (lo usa el sondeo de estado)"""
+        return PrinterStatus(printer_name, message="Estado no disponible para este transporte")
+
+    async def close(self) -> None:
+        pass
+
+
+class BlockingTransport(Transport):
+    """Ejecuta un envío bloqueante (spooler, serial) en un hilo del executor.
+
+    El envío corre con el contexto de quien llama (p. ej. `print_queue.current_job`).
+    """
+
+    def __init__(self, write: Callable[[bytes], None],
+                 probe: Optional[Callable[[str], PrinterStatus]] = None):
+        self._write = write
+        self._probe = probe
+
+    async def send(self, data: bytes) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, functools.partial(contextvars.copy_context().run, self._write, data))
+
+    async def probe(self, printer_name: str) -> PrinterStatus:
+        if self._probe is None:
+            return await super().probe(printer_name)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._probe, printer_name)
+
+
+class TcpTransport(Transport):
+    """Conexión RAW persistente al puerto 9100, con timeouts y TCP_NODELAY"""
+
+    def __init__(self, host: str, port: int = DEFAULT_RAW_PORT,
+                 connect_timeout: float = 5.0, write_timeout: float = 10.0,
+                 probe_timeout: float = 2.0):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.write_timeout = write_timeout
+        self.probe_timeout = probe_timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.connect_timeout
+        )
+        sock = self._writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        logger.info(f"Conectado a impresora de red {self.host}:{self.port}")
+
+    def _is_connected(self) -> bool:
+        return (self._writer is not None and not self._writer.is_closing()
+                and not self._reader.at_eof())
+
+    async def send(self, data: bytes) -> None:
+        """Escribe `data`; NotSent si no se pudo conectar (no se escribió nada)"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._is_connected():
+                await self._drop()
+                try:
+                    await self._connect()
+                except (OSError, asyncio.TimeoutError) as e:
+                    raise NotSent(f"Sin conexión con {self.host}:{self.port}: {e!r}") from e
+            try:
+                self._writer.write(data)
+                await asyncio.wait_for(self._writer.drain(), self.write_timeout)
+            except BaseException:
+                await self._drop()
+                raise
+
+    async def probe(self, printer_name: str) -> PrinterStatus:
+        """Pide el status por una conexión aparte, sin esperar a los envíos.
+
+        La conexión se cierra siempre (también si se cancela), así que una
+        respuesta tardía nunca se lee como la del siguiente sondeo.
+        """
+        writer = None
+        try:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port),
+                    min(self.connect_timeout, self.probe_timeout)
+                )
+                writer.write(STATUS_REQUEST)
+                await asyncio.wait_for(writer.drain(), self.probe_timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                if self._is_connected():
+                    # Hay impresoras que solo atienden una conexión: la del envío
+                    return PrinterStatus(printer_name, message="Sin respuesta de status")
+                return offline_status(printer_name, f"Sin conexión: {e}")
+            try:
+                response = await asyncio.wait_for(reader.readuntil(STATUS_TERMINATOR),
+                                                  self.probe_timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError):
+                return PrinterStatus(printer_name, message="Sin respuesta de status")
+        finally:
+            if writer is not None:
+                writer.close()
+        return decode_godex_status(printer_name, response)
+
+    async def _drop(self) -> None:
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def close(self) -> None:
+        await self._drop()
+
+
+class TransportRegistry:
+    """Resuelve el transporte de cada impresora a partir de su URI"""
+
+    def __init__(self, default_factory: Callable[[str], Transport]):
+        self._default_factory = default_factory
+        self._uris: Dict[str, str] = {}
+        self._transports: Dict[str, Transport] = {}
+        self._serial_pool = ConnectionPool(self._open_serial)
+        self._serial_options: Dict[str, Dict] = {}
+
+    def configure(self, printer_name: str, uri: str) -> None:
+        self._uris[printer_name] = uri
+        self._transports.pop(printer_name, None)
+
+    def load(self, spec: str) -> None:
+        """Carga asignaciones `nombre=uri` separadas por comas (p. ej. de PRINTER_TRANSPORTS)"""
+        for entry in filter(None, (e.strip() for e in spec.split(","))):
+            name, sep, uri = entry.partition("=")
+            if not sep or not name.strip() or not uri.strip():
+                raise ValueError(f"Entrada de transporte inválida: {entry!r}")
+            self.configure(name.strip(), uri.strip())
+
+    def get(self, printer_name: str) -> Transport:
+        transport = self._transports.get(printer_name)
+        if transport is None:
+            transport = self._create(printer_name)
+            self._transports[printer_name] = transport
+        return transport
+
+    def _create(self, printer_name: str) -> Transport:
+        uri = self._uris.get(printer_name)
+        if uri is None:
+            return self._default_factory(printer_name)
+
+        parts = urlsplit(uri)
+        options = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        if parts.scheme == "tcp":
+            return TcpTransport(
+                parts.hostname,
+                parts.port or DEFAULT_RAW_PORT,
+                connect_timeout=float(options.get("connect_timeout", 5.0)),
+                write_timeout=float(options.get("write_timeout", 10.0)),
+                probe_timeout=float(options.get("probe_timeout", 2.0)),
+            )
+        if parts.scheme == "serial":
+            port = parts.path or parts.netloc
+            self._serial_options[port] = options
+            return BlockingTransport(lambda data: self._serial_pool.write(port, data),
+                                     lambda name: self._probe_serial(name, port))
+        if parts.scheme == "spooler":
+            return self._default_factory(parts.netloc or parts.path)
+        raise ValueError(f"Transporte no soportado para {printer_name}: {uri}")
+
+    def printers(self) -> List[str]:
+        """Impresoras con transporte configurado explícitamente"""
+        return list(self._uris)
+
+    def _probe_serial(self, printer_name: str, port: str) -> PrinterStatus:
+        with self._serial_pool.connection(port) as conn:
+            return decode_godex_status(printer_name, conn.request_status())
+
+    def _open_serial(self, port: str) -> SerialConnection:
+        options = self._serial_options.get(port, {})
+        write_timeout = options.get("write_timeout")
+        return SerialConnection(port, baudrate=int(options.get("baudrate", 9600)),
+                                flow_control=options.get("flow", "none"),
+                                write_timeout=float(write_timeout) if write_timeout else None)
+
+    async def close(self) -> None:
+        for transport in self._transports.values():
+            await transport.close()
+        self._transports.clear()
+        self._serial_pool.close()